@@ -1,30 +1,80 @@
+import base64
+import binascii
+import csv
+import hashlib
+import io
+import json
+import math
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Sequence
+
 import pandas
-from fastapi.encoders import jsonable_encoder
+import pyarrow
+import pyarrow.parquet
+from fastapi import status
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.datastructures import URL
+
+from app.api.config import HISTORICAL_INGEST_BATCH_SIZE, HISTORICAL_MAX_PAGE_SIZE
 
+from app.api.db.crud import PCT_CHANGE_COLUMN_NAME
 from app.api.db.models import HistoricalData
-from app.api.schemas import PostHistoricalDataRequest
+from app.api.schemas import GetHistoricalBatchLayout, GetHistoricalDataGranularity, GetHistoricalDataOutputType, \
+    PostHistoricalDataRequest
+
+HISTORICAL_DATA_COLUMN_NAMES = [
+    HistoricalData.date.name,
+    HistoricalData.ticker_id.name,
+    HistoricalData.low.name,
+    HistoricalData.high.name,
+    HistoricalData.open.name,
+    HistoricalData.close.name,
+    HistoricalData.volume.name
+]
+CLOSE_COLUMN_INDEX = HISTORICAL_DATA_COLUMN_NAMES.index(HistoricalData.close.name)
+TICKER_COLUMN_NAME = 'ticker'
+HISTORICAL_MEDIA_TYPES = {
+    GetHistoricalDataOutputType.csv_format: 'text/csv',
+    GetHistoricalDataOutputType.json_format: 'application/json',
+    GetHistoricalDataOutputType.arrow_format: 'application/vnd.apache.arrow.stream',
+    GetHistoricalDataOutputType.parquet_format: 'application/vnd.apache.parquet'
+}
+HISTORICAL_STREAM_MEDIA_TYPES = {
+    GetHistoricalDataOutputType.csv_format: 'text/csv',
+    GetHistoricalDataOutputType.json_format: 'application/x-ndjson'
+}
+# Columns of a row of a POST /historical/ingest/ body, which are validated like the fields of a CandleStickRecord
+HISTORICAL_INGEST_COLUMN_NAMES = [
+    HistoricalData.date.name,
+    HistoricalData.low.name,
+    HistoricalData.high.name,
+    HistoricalData.open.name,
+    HistoricalData.close.name,
+    HistoricalData.volume.name
+]
 
 
-def process_historical_records_to_df(historical_data: list[HistoricalData]) -> pandas.DataFrame:
+def process_historical_records_to_df(historical_data: Iterable[tuple]) -> pandas.DataFrame:
     """
-    Given a list of database records (which adhere to the HistoricalData model), generate a pandas.DataFrame
+    Given historical data rows (date, ticker_id, low, high, open, close, volume), generate a pandas.DataFrame
+
+    :param historical_data: Iterable of historical data rows, as selected by crud.HISTORICAL_DATA_COLUMNS
+    :return: pandas.DataFrame representation of the aforementioned database rows
+    """
+    return pandas.DataFrame.from_records(data=historical_data, columns=HISTORICAL_DATA_COLUMN_NAMES)
+
 
-    :param historical_data: List of database records (which adhere to the HistoricalData model)
-    :return: pandas.DataFrame representation of the aforementioned database records
+def process_historical_records_with_pct_change_to_df(historical_data: Iterable[tuple]) -> pandas.DataFrame:
     """
-    records = [jsonable_encoder(record) for record in historical_data]
+    Given historical data rows with the percentage change appended, generate a pandas.DataFrame
 
+    :param historical_data: Iterable of historical data rows, as selected by crud.HISTORICAL_DATA_COLUMNS followed by
+    the percentage change
+    :return: pandas.DataFrame representation of the aforementioned database rows
+    """
     return pandas.DataFrame.from_records(
-        data=records,
-        columns=[
-            HistoricalData.date.name,
-            HistoricalData.ticker_id.name,
-            HistoricalData.low.name,
-            HistoricalData.high.name,
-            HistoricalData.open.name,
-            HistoricalData.close.name,
-            HistoricalData.volume.name
-        ]
+        data=historical_data, columns=HISTORICAL_DATA_COLUMN_NAMES + [PCT_CHANGE_COLUMN_NAME]
     )
 
 
@@ -35,34 +85,619 @@ def add_pct_change(df: pandas.DataFrame, column_name: str):
     :param df: The pandas.DataFrame that is to be modified
     :param column_name: Column name to base the computation of % change on
     """
-    df['% change'] = df[column_name].pct_change() * 100
+    df[PCT_CHANGE_COLUMN_NAME] = df[column_name].pct_change() * 100
+    df.fillna(value=0.00, inplace=True)
+
+
+def add_pct_change_by_ticker(df: pandas.DataFrame, column_name: str):
+    """
+    Add a percentage change column to a pandas.DataFrame of the historical data of several tickers (ordered by ticker
+    and date), computed separately for every ticker - the first row of each ticker gets 0, as with add_pct_change
+
+    :param df: The pandas.DataFrame that is to be modified
+    :param column_name: Column name to base the computation of % change on
+    """
+    df[PCT_CHANGE_COLUMN_NAME] = df.groupby(HistoricalData.ticker_id.name)[column_name].pct_change() * 100
     df.fillna(value=0.00, inplace=True)
 
 
-def generate_historical_data_records(
+def pivot_historical_df(df: pandas.DataFrame, ticker_names: list[str]) -> pandas.DataFrame:
+    """
+    Given a pandas.DataFrame of the historical data of several tickers with a ticker column, pivot it to one row per
+    date with the columns of every ticker side by side, named "<ticker> <column>" - dates some tickers have no data for
+    are left empty (NaN)
+
+    :param df: pandas.DataFrame of historical data with a ticker column
+    :param ticker_names: Names of the tickers, in the order their columns should appear
+    :return: The pivoted pandas.DataFrame, with a date column
+    """
+    value_column_names = [
+        column_name for column_name in df.columns
+        if column_name not in (HistoricalData.date.name, HistoricalData.ticker_id.name, TICKER_COLUMN_NAME)
+    ]
+    wide_df = df.pivot(
+        index=HistoricalData.date.name, columns=TICKER_COLUMN_NAME, values=value_column_names
+    ).swaplevel(axis=1)
+    wide_df = wide_df[[
+        (ticker_name, column_name) for ticker_name in ticker_names for column_name in value_column_names
+        if (ticker_name, column_name) in wide_df.columns
+    ]]
+    wide_df.columns = [f'{ticker_name} {column_name}' for ticker_name, column_name in wide_df.columns]
+    return wide_df.reset_index()
+
+
+def build_historical_batch_response(
+        df: pandas.DataFrame,
+        ticker_names: dict[int, str],
+        layout: GetHistoricalBatchLayout,
+        data_format: GetHistoricalDataOutputType
+) -> Response:
+    """
+    Given a pandas.DataFrame of the historical data of several tickers, a layout and an output format, serialize the
+    data into a response
+
+    :param df: pandas.DataFrame of historical data, ordered by ticker and date, with the percentage change column
+    :param ticker_names: Names of the tickers by id, in the order their columns should appear in the wide layout
+    :param layout: Enum - long (a ticker column is added after ticker_id) or wide (see pivot_historical_df)
+    :param data_format: Enum - json, csv, arrow (Arrow IPC stream) or parquet
+    :return: The response, with the media type of the output format
+    """
+    ticker_id_index = df.columns.get_loc(HistoricalData.ticker_id.name)
+    df.insert(ticker_id_index + 1, TICKER_COLUMN_NAME, df[HistoricalData.ticker_id.name].map(ticker_names))
+    if layout == GetHistoricalBatchLayout.wide:
+        df = pivot_historical_df(df=df, ticker_names=list(ticker_names.values()))
+    return build_historical_response(df=df, data_format=data_format)
+
+
+def historical_df_to_arrow_table(df: pandas.DataFrame) -> pyarrow.Table:
+    """
+    Given a pandas.DataFrame of historical data, convert it to a pyarrow.Table - the numeric columns are wrapped
+    without copying and the ISO date strings become a date32 column
+
+    :param df: pandas.DataFrame of historical data
+    :return: The pyarrow.Table
+    """
+    return _cast_arrow_date_column(table=pyarrow.Table.from_pandas(df=df, preserve_index=False))
+
+
+def historical_rows_to_arrow_table(rows: list[tuple], extra_column_names: Sequence[str] = ()) -> pyarrow.Table:
+    """
+    Given historical data rows with the percentage change appended, convert them column by column to a pyarrow.Table
+
+    :param rows: Historical data rows with the percentage change appended
+    :param extra_column_names: Names of the columns appended after the percentage change (example indicators)
+    :return: The pyarrow.Table
+    """
+    columns = [pyarrow.array(column) for column in zip(*rows)]
+    # Typed explicitly, as the values of an appended column may all be None (example an indicator with a long window)
+    columns[len(HISTORICAL_DATA_COLUMN_NAMES) + 1:] = [
+        column.cast(pyarrow.float64()) for column in columns[len(HISTORICAL_DATA_COLUMN_NAMES) + 1:]
+    ]
+    return _cast_arrow_date_column(
+        table=pyarrow.Table.from_arrays(columns, names=get_historical_column_names(extra_column_names))
+    )
+
+
+def _cast_arrow_date_column(table: pyarrow.Table) -> pyarrow.Table:
+    date_index = table.schema.get_field_index(HistoricalData.date.name)
+    return table.set_column(
+        date_index, HistoricalData.date.name, table.column(date_index).cast(pyarrow.date32())
+    )
+
+
+def _build_arrow_table_response(table: pyarrow.Table, data_format: GetHistoricalDataOutputType) -> Response:
+    sink = pyarrow.BufferOutputStream()
+    if data_format == GetHistoricalDataOutputType.arrow_format:
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pyarrow.parquet.write_table(table, sink)
+    return Response(content=sink.getvalue().to_pybytes(), media_type=HISTORICAL_MEDIA_TYPES[data_format])
+
+
+def build_historical_response(df: pandas.DataFrame, data_format: GetHistoricalDataOutputType) -> Response:
+    """
+    Given a pandas.DataFrame of historical data and an output format, serialize the data into a response
+
+    :param df: pandas.DataFrame of historical data
+    :param data_format: Enum - json, csv, arrow (Arrow IPC stream) or parquet
+    :return: The response, with the media type of the output format
+    """
+    if data_format == GetHistoricalDataOutputType.csv_format:
+        return PlainTextResponse(content=df.to_csv(), media_type=HISTORICAL_MEDIA_TYPES[data_format])
+    if data_format == GetHistoricalDataOutputType.json_format:
+        if df.isna().values.any():
+            # JSON has no NaN - missing values (example the dates a ticker has no data for) become null
+            df = df.astype(object).where(df.notna(), None)
+        return JSONResponse(content=df.to_dict(orient='records'))
+    return _build_arrow_table_response(table=historical_df_to_arrow_table(df=df), data_format=data_format)
+
+
+def build_historical_rows_response(
+        rows: list[tuple],
+        data_format: GetHistoricalDataOutputType,
+        extra_column_names: Sequence[str] = ()
+) -> Response:
+    """
+    Given historical data rows with the percentage change appended and an output format, serialize the rows into a
+    response without building a pandas.DataFrame - the output is identical to build_historical_response
+
+    :param rows: Historical data rows with the percentage change appended
+    :param data_format: Enum - json, csv, arrow (Arrow IPC stream) or parquet
+    :param extra_column_names: Names of the columns appended after the percentage change (example indicators)
+    :return: The response, with the media type of the output format
+    """
+    if data_format == GetHistoricalDataOutputType.csv_format:
+        return PlainTextResponse(
+            content=format_historical_header(
+                data_format=data_format, extra_column_names=extra_column_names
+            ) + format_historical_rows(
+                rows=rows, data_format=data_format, first_index=0, extra_column_names=extra_column_names
+            ),
+            media_type=HISTORICAL_MEDIA_TYPES[data_format]
+        )
+    if data_format == GetHistoricalDataOutputType.json_format:
+        column_names = get_historical_column_names(extra_column_names)
+        return JSONResponse(content=[dict(zip(column_names, row)) for row in rows])
+    return _build_arrow_table_response(
+        table=historical_rows_to_arrow_table(rows=rows, extra_column_names=extra_column_names), data_format=data_format
+    )
+
+
+def get_historical_column_names(extra_column_names: Sequence[str] = ()) -> list[str]:
+    """
+    Given the names of the columns appended to historical data rows after the percentage change, get the names of all
+    the columns of the rows
+
+    :param extra_column_names: Names of the appended columns (example indicators)
+    :return: The column names
+    """
+    return [*HISTORICAL_DATA_COLUMN_NAMES, PCT_CHANGE_COLUMN_NAME, *extra_column_names]
+
+
+def add_pct_change_to_rows(rows: Iterable[tuple], previous_close: Optional[float]) -> tuple[list[tuple], float]:
+    """
+    Given historical data rows (as selected by crud.HISTORICAL_DATA_COLUMNS) and the close of the row preceding them,
+    append the percentage change of the close to every row - the same values add_pct_change computes over a whole
+    pandas.DataFrame, but one batch at a time
+
+    :param rows: Historical data rows, ordered by date
+    :param previous_close: The close of the row preceding the first row, None if there is no such row
+    :return: Tuple of (rows with the percentage change appended, close of the last row)
+    """
+    rows_with_pct_change = []
+    for row in rows:
+        close = row[CLOSE_COLUMN_INDEX]
+        pct_change = (close / previous_close - 1) * 100 if previous_close else 0.00
+        rows_with_pct_change.append((*row, pct_change))
+        previous_close = close
+    return rows_with_pct_change, previous_close
+
+
+def format_historical_rows(
+        rows: list[tuple],
+        data_format: GetHistoricalDataOutputType,
+        first_index: int,
+        extra_column_names: Sequence[str] = ()
+) -> str:
+    """
+    Given historical data rows with the percentage change appended, format them as CSV lines (in the same layout as
+    pandas.DataFrame.to_csv, including the index) or as newline-delimited JSON records
+
+    :param rows: Historical data rows with the percentage change appended
+    :param data_format: Enum - either csv or json
+    :param first_index: The index of the first row within the whole response
+    :param extra_column_names: Names of the columns appended after the percentage change (example indicators)
+    :return: The formatted rows
+    """
+    column_names = get_historical_column_names(extra_column_names)
+    if data_format == GetHistoricalDataOutputType.csv_format:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(
+            (index, *row) for index, row in enumerate(rows, start=first_index)
+        )
+        return buffer.getvalue()
+    return ''.join(json.dumps(dict(zip(column_names, row))) + '\n' for row in rows)
+
+
+def format_historical_header(data_format: GetHistoricalDataOutputType, extra_column_names: Sequence[str] = ()) -> str:
+    """
+    Given a data format, get the text which precedes the formatted rows
+
+    :param data_format: Enum - either csv or json
+    :param extra_column_names: Names of the columns appended after the percentage change (example indicators)
+    :return: The CSV header line, or an empty string for newline-delimited JSON
+    """
+    if data_format == GetHistoricalDataOutputType.csv_format:
+        return ',' + ','.join(get_historical_column_names(extra_column_names)) + '\n'
+    return ''
+
+
+def stream_historical_records(
+        batches: Iterable[list[tuple]],
+        data_format: GetHistoricalDataOutputType
+) -> Iterator[str]:
+    """
+    Given batches of historical data rows ordered by date, lazily format them as CSV or newline-delimited JSON chunks,
+    carrying the percentage change computation across batch boundaries
+
+    :param batches: Iterable of batches of historical data rows, as selected by crud.HISTORICAL_DATA_COLUMNS
+    :param data_format: Enum - either csv or json
+    :return: Iterator of formatted chunks, one per batch
+    """
+    yield format_historical_header(data_format=data_format)
+    previous_close, index = None, 0
+    for batch in batches:
+        rows, previous_close = add_pct_change_to_rows(rows=batch, previous_close=previous_close)
+        yield format_historical_rows(rows=rows, data_format=data_format, first_index=index)
+        index += len(rows)
+
+
+async def async_stream_historical_records(
+        batches: AsyncIterable[list[tuple]],
+        data_format: GetHistoricalDataOutputType
+) -> AsyncIterator[str]:
+    """
+    Async counterpart of stream_historical_records
+
+    :param batches: Async iterable of batches of historical data rows, as selected by crud.HISTORICAL_DATA_COLUMNS
+    :param data_format: Enum - either csv or json
+    :return: Async iterator of formatted chunks, one per batch
+    """
+    yield format_historical_header(data_format=data_format)
+    previous_close, index = None, 0
+    async for batch in batches:
+        rows, previous_close = add_pct_change_to_rows(rows=batch, previous_close=previous_close)
+        yield format_historical_rows(rows=rows, data_format=data_format, first_index=index)
+        index += len(rows)
+
+
+def get_ingest_format(content_type: Optional[str]) -> Optional[GetHistoricalDataOutputType]:
+    """
+    Given the Content-Type header of a POST /historical/ingest/ request, get the format of its body
+
+    :param content_type: The Content-Type header, None if there is none
+    :return: Enum - either csv (text/csv) or json (application/x-ndjson), None for any other media type
+    """
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    for data_format, stream_media_type in HISTORICAL_STREAM_MEDIA_TYPES.items():
+        if media_type == stream_media_type:
+            return data_format
+    return None
+
+
+async def split_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    Given the chunks of a request body as they arrive, lazily split them into lines - only the line which is not
+    complete yet is held back
+
+    :param chunks: Async iterable of the chunks of the body
+    :return: Async iterator of the lines, without their line endings
+    """
+    remainder = b''
+    async for chunk in chunks:
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line.rstrip(b'\r')
+    if remainder.strip():
+        yield remainder.rstrip(b'\r')
+
+
+def parse_ingest_record(values: dict, ticker_id: int) -> dict:
+    """
+    Given the values of a row of a POST /historical/ingest/ body, validate them and build the parameters of one row of
+    the historical database table
+
+    :param values: Dictionary which maps the HISTORICAL_INGEST_COLUMN_NAMES (and possibly other ignored columns) to
+    values - ISO date strings and numbers, or strings of numbers
+    :param ticker_id: The ticker id associated with the data
+    :return: Dictionary which maps the historical database table column names to values
+    :raise: ValueError if a value is missing or invalid - not a finite number, or prices out of the low to high range,
+    or a negative volume
+    """
+    try:
+        record = {
+            'date': date.fromisoformat(values[HistoricalData.date.name]),
+            'ticker_id': ticker_id
+        }
+        for column_name in HISTORICAL_INGEST_COLUMN_NAMES[1:]:
+            record[column_name] = float(values[column_name])
+            # float accepts "nan", "inf" and "-inf", which are no prices nor volumes
+            if not math.isfinite(record[column_name]):
+                raise ValueError(f'{column_name} is not a finite number')
+    except KeyError as error:
+        raise ValueError(f'missing column {error}') from error
+    except TypeError as error:
+        raise ValueError(str(error)) from error
+    low, high = record[HistoricalData.low.name], record[HistoricalData.high.name]
+    for column_name in (HistoricalData.open.name, HistoricalData.close.name):
+        if not low <= record[column_name] <= high:
+            raise ValueError(f'{column_name} {record[column_name]} is not between low {low} and high {high}')
+    if record[HistoricalData.volume.name] < 0:
+        raise ValueError(f'volume {record[HistoricalData.volume.name]} is negative')
+    return record
+
+
+async def parse_historical_ingest(
+        chunks: AsyncIterable[bytes],
+        data_format: GetHistoricalDataOutputType,
+        ticker_id: int,
+        batch_size: int = HISTORICAL_INGEST_BATCH_SIZE
+) -> AsyncIterator[list[dict]]:
+    """
+    Given the chunks of a POST /historical/ingest/ body as they arrive - newline-delimited JSON objects, or CSV with a
+    header row - lazily parse and validate them into batches of rows, so that only one batch is held in memory at a
+    time however large the body is
+
+    :param chunks: Async iterable of the chunks of the body
+    :param data_format: Enum - either csv or json
+    :param ticker_id: The ticker id associated with the data
+    :param batch_size: Maximum number of rows per batch
+    :return: Async iterator of lists of dicts which map the historical database table column names to values
+    :raise: ValueError (with the line number) at the first line which is not a valid row
+    """
+    batch, header, line_number = [], None, 0
+    async for line in split_lines(chunks=chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            text = line.decode()
+            if data_format == GetHistoricalDataOutputType.csv_format:
+                values = next(csv.reader([text]))
+                if header is None:
+                    header = values
+                    missing_column_names = set(HISTORICAL_INGEST_COLUMN_NAMES) - set(header)
+                    if missing_column_names:
+                        raise ValueError(f'missing columns {sorted(missing_column_names)} in the header')
+                    continue
+                if len(values) != len(header):
+                    raise ValueError(f'{len(values)} values for {len(header)} columns')
+                values = dict(zip(header, values))
+            else:
+                values = json.loads(text)
+                if not isinstance(values, dict):
+                    raise ValueError('not a JSON object')
+            batch.append(parse_ingest_record(values=values, ticker_id=ticker_id))
+        except ValueError as error:
+            raise ValueError(f'Invalid line {line_number}: {error}') from error
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate_historical_data_params(
         ticker_id: int,
         post_historical_request: PostHistoricalDataRequest
-) -> list[HistoricalData]:
+) -> Iterator[dict]:
     """
     Given a ticker id and a PostHistoricalDataRequest (contains list[CandlestickRecord] - which in turn contain all
-    relevant data (date, low, high, open, close etc.), generate a list of objects (adhering to the
-    HistoricalData database model) which can then be written to a database table
+    relevant data (date, low, high, open, close etc.), lazily generate the parameters of one row of the historical
+    database table per candlestick, ready to be bulk inserted without building HistoricalData objects
 
     :param ticker_id: The ticker id associated with the data
     :param post_historical_request: A Pydantic model which guarantees that the input data adheres to a certain standard
-    :return: List of objects which are ready to be written to a database table
+    :return: Iterator of dicts which map the historical database table column names to values
     """
-    records = []
-
     for record in post_historical_request.candlestick_records:
-        historical_data = HistoricalData()
-        historical_data.date = record.date
-        historical_data.ticker_id = ticker_id
-        historical_data.low = record.low
-        historical_data.high = record.high
-        historical_data.open = record.open
-        historical_data.close = record.close
-        historical_data.volume = record.volume
-        records.append(historical_data)
-
-    return records
+        yield {
+            'date': record.date,
+            'ticker_id': ticker_id,
+            'low': record.low,
+            'high': record.high,
+            'open': record.open,
+            'close': record.close,
+            'volume': record.volume
+        }
+
+
+def encode_historical_data_params(records: Iterable[dict]) -> list[dict]:
+    """
+    Given historical database table rows (example from generate_historical_data_params), make them JSON serializable -
+    only the dates need converting, so the rows are not walked value by value like jsonable_encoder does
+
+    :param records: Iterable of dicts which map the historical database table column names to values
+    :return: List of the dicts, with the dates as ISO strings
+    """
+    return [{**record, 'date': record['date'].isoformat()} for record in records]
+
+
+def get_bucket_range(
+        start: date,
+        end: date,
+        granularity: GetHistoricalDataGranularity,
+        bucket_days: Optional[int] = None
+) -> tuple[date, date]:
+    """
+    Given a date range, widen it to whole buckets - from the start of the bucket the start date falls in to the end of
+    the bucket the end date falls in, so that the first and last buckets are not aggregated from part of their days
+
+    :param start: The start date
+    :param end: The end date
+    :param granularity: Calendar period of the buckets, ignored if bucket_days is set
+    :param bucket_days: Number of days of the buckets, counted from the start date
+    :return: Tuple of (start of the first bucket, end of the last bucket)
+    """
+    if bucket_days:
+        return start, start + timedelta(days=((end - start).days // bucket_days + 1) * bucket_days - 1)
+    if granularity == GetHistoricalDataGranularity.week:
+        return start - timedelta(days=start.weekday()), end + timedelta(days=6 - end.weekday())
+    if granularity == GetHistoricalDataGranularity.month:
+        next_month = (end.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return start.replace(day=1), next_month - timedelta(days=1)
+    if granularity == GetHistoricalDataGranularity.year:
+        return date(start.year, 1, 1), date(end.year, 12, 31)
+    return start, end
+
+
+def has_historical_gaps(extent: tuple) -> bool:
+    """
+    Given the extent of the daily historical data of a ticker, tell whether some days between its first and last dates
+    are missing - in which case the gaps are worth looking for
+
+    :param extent: Tuple of (first date, last date, number of rows), see crud.retrieve_historical_extent_by_ticker_id
+    :return: True if there are fewer rows than days from the first date to the last one
+    """
+    first_date, last_date, records = extent
+    if not records:
+        return False
+    return records < (date.fromisoformat(last_date) - date.fromisoformat(first_date)).days + 1
+
+
+def format_historical_coverage(extent: tuple, gaps: Iterable[tuple]) -> dict:
+    """
+    Given the extent of the daily historical data of a ticker and its gaps, describe which dates are stored
+
+    :param extent: Tuple of (first date, last date, number of rows), see crud.retrieve_historical_extent_by_ticker_id
+    :param gaps: Tuples of (date before a gap, date after it), see crud.retrieve_historical_gaps_by_ticker_id
+    :return: Dictionary with the first and last dates (None if there is no data), the number of rows and the missing
+    date ranges between the first and last dates (as dictionaries of start and end dates, both included)
+    """
+    first_date, last_date, records = extent
+    return {
+        'first_date': first_date,
+        'last_date': last_date,
+        'records': records,
+        'gaps': [
+            {
+                'start': (date.fromisoformat(previous_date) + timedelta(days=1)).isoformat(),
+                'end': (date.fromisoformat(next_date) - timedelta(days=1)).isoformat()
+            }
+            for previous_date, next_date in gaps
+        ]
+    }
+
+
+def get_page_size(limit: Optional[int]) -> int:
+    """
+    Given the limit asked for by the client, get the number of rows of a page of historical data
+
+    :param limit: The limit query parameter, None if there is none
+    :return: The limit, capped to HISTORICAL_MAX_PAGE_SIZE
+    """
+    return min(limit or HISTORICAL_MAX_PAGE_SIZE, HISTORICAL_MAX_PAGE_SIZE)
+
+
+def encode_cursor(last_date: str) -> str:
+    """
+    Given the date of the last row of a page, build the opaque cursor which points to the next page
+
+    :param last_date: The ISO date of the last row of the page
+    :return: The cursor
+    """
+    return base64.urlsafe_b64encode(last_date.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> date:
+    """
+    Given a cursor built by encode_cursor, get the date of the last row of the previous page
+
+    :param cursor: The cursor query parameter
+    :return: The date
+    :raise: ValueError if the cursor is malformed
+    """
+    try:
+        return date.fromisoformat(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError(f'Malformed cursor {cursor}') from error
+
+
+def slice_historical_page(
+        rows: list[tuple],
+        cursor_date: Optional[date],
+        page_size: int
+) -> tuple[slice, Optional[str]]:
+    """
+    Given the rows fetched for a page of historical data - the last row of the previous page (which seeds the % change
+    of the first row of the page) if there is a cursor, then up to page_size + 1 rows - find the rows of the page
+
+    :param rows: The rows, ordered by date, starting from the cursor date
+    :param cursor_date: The date decoded from the cursor, None for the first page
+    :param page_size: Number of rows of a page
+    :return: The slice of the rows (or of a DataFrame built from them) which makes up the page, and the cursor of the
+    next page (None if this is the last one)
+    """
+    first_index = 1 if cursor_date and rows and str(rows[0][0]) == cursor_date.isoformat() else 0
+    end_index = first_index + page_size
+    next_cursor = encode_cursor(last_date=str(rows[end_index - 1][0])) if len(rows) > end_index else None
+    return slice(first_index, end_index), next_cursor
+
+
+def build_next_page_link(url: URL, next_cursor: str) -> str:
+    """
+    Given the URL of a request for a page and the cursor of the next page, build the Link response header pointing to
+    the next page - relative, so that it does not depend on the host the request was sent to
+
+    :param url: The URL of the request
+    :param next_cursor: The cursor of the next page
+    :return: The value of the Link header
+    """
+    return f'<{url.path}?{url.include_query_params(cursor=next_cursor).query}>; rel="next"'
+
+
+def build_etag(*parts) -> str:
+    """
+    Given the values which identify a representation (example data versions, query parameters and format), build a
+    strong entity tag for it
+
+    :param parts: The values, converted to strings
+    :return: The quoted entity tag
+    """
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def build_validator_headers(etag: str, last_modified: Optional[datetime] = None) -> dict[str, str]:
+    """
+    Given an entity tag and the time of the last change in UTC, build the ETag and Last-Modified response headers
+
+    :param etag: The quoted entity tag
+    :param last_modified: Naive UTC time of the last change, None if unknown
+    :return: Dictionary of headers
+    """
+    headers = {'ETag': etag}
+    if last_modified:
+        headers['Last-Modified'] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def is_not_modified(
+        validator_headers: dict[str, str],
+        if_none_match: Optional[str],
+        if_modified_since: Optional[str]
+) -> bool:
+    """
+    Given the validator headers of the current representation and the conditional headers of a GET request, check
+    whether the client already has the current representation - If-Modified-Since is only considered when there is no
+    If-None-Match, as per RFC 7232
+
+    :param validator_headers: Headers built by build_validator_headers
+    :param if_none_match: The If-None-Match request header
+    :param if_modified_since: The If-Modified-Since request header
+    :return: True if a 304 Not Modified response can be sent instead of the representation
+    """
+    if if_none_match is not None:
+        etag = validator_headers['ETag']
+        client_etags = {client_etag.strip() for client_etag in if_none_match.split(',')}
+        return '*' in client_etags or etag in client_etags or f'W/{etag}' in client_etags
+
+    last_modified = validator_headers.get('Last-Modified')
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def build_not_modified_response(validator_headers: dict[str, str]) -> Response:
+    """
+    Given the validator headers of the current representation, build a 304 Not Modified response
+
+    :param validator_headers: Headers built by build_validator_headers
+    :return: The response, without a body
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers)
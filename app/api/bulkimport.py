@@ -0,0 +1,193 @@
+import tempfile
+from datetime import date
+from itertools import chain
+from typing import AsyncIterator, BinaryIO, Iterator, Optional
+
+import numpy
+import pyarrow
+import pyarrow.compute
+import pyarrow.csv
+import pyarrow.parquet
+
+from app.api.apiutils import HISTORICAL_MEDIA_TYPES, TICKER_COLUMN_NAME
+from app.api.config import HISTORICAL_IMPORT_ROWS_PER_STATEMENT, HISTORICAL_IMPORT_SPOOL_MAX_BYTES
+from app.api.db.crud import HISTORICAL_IMPORT_COLUMN_NAMES
+from app.api.db.models import HistoricalData
+from app.api.schemas import GetHistoricalDataOutputType
+
+# Media types of the files of POST /historical/import/ by format
+IMPORT_MEDIA_TYPES = {
+    data_format: HISTORICAL_MEDIA_TYPES[data_format]
+    for data_format in [GetHistoricalDataOutputType.csv_format, GetHistoricalDataOutputType.parquet_format]
+}
+# Types the columns of an imported file are converted to - every other column of the file is ignored
+IMPORT_COLUMN_TYPES = {
+    TICKER_COLUMN_NAME: pyarrow.string(),
+    HistoricalData.date.name: pyarrow.date32(),
+    HistoricalData.low.name: pyarrow.float64(),
+    HistoricalData.high.name: pyarrow.float64(),
+    HistoricalData.open.name: pyarrow.float64(),
+    HistoricalData.close.name: pyarrow.float64(),
+    HistoricalData.volume.name: pyarrow.float64()
+}
+# Column of the row numbers, used to find the last of the rows of the same ticker and date
+_ROW_COLUMN_NAME = 'row'
+
+
+def get_import_format(content_type: Optional[str]) -> Optional[GetHistoricalDataOutputType]:
+    """
+    Given the Content-Type header of a POST /historical/import/ request, get the format of its file
+
+    :param content_type: The Content-Type header, None if there is none
+    :return: Enum - either csv (text/csv) or parquet (application/vnd.apache.parquet), None for any other media type
+    """
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    for data_format, import_media_type in IMPORT_MEDIA_TYPES.items():
+        if media_type == import_media_type:
+            return data_format
+    return None
+
+
+async def spool_body(
+        chunks: AsyncIterator[bytes],
+        max_size: int = HISTORICAL_IMPORT_SPOOL_MAX_BYTES
+) -> tempfile.SpooledTemporaryFile:
+    """
+    Given the chunks of a request body, write them to a temporary file which is kept in memory up to max_size bytes and
+    moved to disk beyond - so that the file can be read (and seeked, which Parquet needs) however large it is
+
+    :param chunks: Async iterator over the chunks of the body (example Request.stream())
+    :param max_size: Size in bytes above which the file is written to disk
+    :return: The file, positioned at its start - to be closed by the caller
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    async for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def read_historical_import(
+        source: BinaryIO,
+        data_format: GetHistoricalDataOutputType,
+        ticker_name: Optional[str] = None
+) -> pyarrow.Table:
+    """
+    Given a CSV (with a header row) or Parquet file of historical data, read it into columns with pyarrow - without
+    building an object per row - and validate them: every row has a date (ISO for CSV files), a low, a high, an open,
+    a close and a volume, and a ticker unless the file is of a single ticker. Of the rows of the same ticker and date,
+    only the last one is kept (see drop_duplicate_rows)
+
+    :param source: The file
+    :param data_format: Enum - either csv or parquet
+    :param ticker_name: The ticker of the rows of a file which has no ticker column, None if every row has a ticker
+    :return: pyarrow.Table with the IMPORT_COLUMN_TYPES columns
+    :raise: ValueError if the file cannot be read, has no rows, a column is missing or a value is missing or invalid
+    """
+    try:
+        if data_format == GetHistoricalDataOutputType.csv_format:
+            table = pyarrow.csv.read_csv(source, convert_options=pyarrow.csv.ConvertOptions(
+                column_types=IMPORT_COLUMN_TYPES, strings_can_be_null=True
+            ))
+        else:
+            parquet_file = pyarrow.parquet.ParquetFile(source)
+            table = parquet_file.read(
+                columns=[name for name in parquet_file.schema_arrow.names if name in IMPORT_COLUMN_TYPES]
+            )
+        if TICKER_COLUMN_NAME not in table.column_names and ticker_name is not None:
+            table = table.append_column(TICKER_COLUMN_NAME, pyarrow.repeat(ticker_name, table.num_rows))
+        missing_column_names = [name for name in IMPORT_COLUMN_TYPES if name not in table.column_names]
+        if missing_column_names:
+            raise ValueError(f'Columns missing from the file: {", ".join(missing_column_names)}')
+        table = table.select(list(IMPORT_COLUMN_TYPES)).cast(pyarrow.schema(IMPORT_COLUMN_TYPES.items()))
+    except pyarrow.ArrowException as error:
+        raise ValueError(f'The file cannot be imported: {error}') from error
+
+    if not table.num_rows:
+        raise ValueError('The file has no rows')
+    for name in IMPORT_COLUMN_TYPES:
+        if table.column(name).null_count:
+            raise ValueError(f'{table.column(name).null_count} rows have no {name}')
+    return drop_duplicate_rows(table=table)
+
+
+def drop_duplicate_rows(table: pyarrow.Table) -> pyarrow.Table:
+    """
+    Given imported historical data, keep only the last row of every ticker and date - the one which upserting the rows
+    in order would leave stored - so that crud.import_historical, which counts the rows it receives, counts every
+    candlestick once
+
+    :param table: The historical data, with the IMPORT_COLUMN_TYPES columns
+    :return: The historical data without duplicates, in the order of the rows which are kept - the table itself if it
+    has none
+    """
+    key_column_names = [TICKER_COLUMN_NAME, HistoricalData.date.name]
+    last_rows = table.select(key_column_names).append_column(
+        _ROW_COLUMN_NAME, pyarrow.array(numpy.arange(table.num_rows))
+    ).group_by(key_column_names).aggregate([(_ROW_COLUMN_NAME, 'max')]).column(f'{_ROW_COLUMN_NAME}_max')
+    if len(last_rows) == table.num_rows:
+        return table
+    return table.take(numpy.sort(last_rows.to_numpy()))
+
+
+def get_ticker_names(table: pyarrow.Table) -> list[str]:
+    """
+    Given imported historical data (see read_historical_import), get its tickers
+
+    :param table: The historical data
+    :return: The names of the tickers, in the order they first appear
+    """
+    return pyarrow.compute.unique(table.column(TICKER_COLUMN_NAME)).to_pylist()
+
+
+def get_dates_by_ticker(table: pyarrow.Table) -> dict[str, list[date]]:
+    """
+    Given imported historical data (see read_historical_import), get the dates of every ticker
+
+    :param table: The historical data
+    :return: The dates by ticker name, in the order of the rows of every ticker
+    """
+    # Several times faster than pyarrow's distinct aggregation - the dates are deduplicated by the cache anyway
+    tickers = pyarrow.compute.dictionary_encode(table.column(TICKER_COLUMN_NAME)).combine_chunks()
+    indices = tickers.indices.to_numpy(zero_copy_only=False)
+    order = numpy.argsort(indices, kind='stable')
+    indices, dates = indices[order], table.column(HistoricalData.date.name).to_numpy()[order]
+    boundaries = numpy.flatnonzero(numpy.diff(indices)) + 1
+    ticker_names = tickers.dictionary.to_pylist()
+    return {
+        ticker_names[ticker_indices[0]]: ticker_dates.tolist()
+        for ticker_indices, ticker_dates in zip(numpy.split(indices, boundaries), numpy.split(dates, boundaries))
+    }
+
+
+def build_import_row_groups(
+        table: pyarrow.Table,
+        ticker_ids: dict[str, int],
+        rows_per_statement: int = HISTORICAL_IMPORT_ROWS_PER_STATEMENT
+) -> Iterator[tuple]:
+    """
+    Given imported historical data (see read_historical_import) and the ids of its tickers, build the parameters of
+    crud.import_historical from slices of whole columns, without building a row at a time - one group at a time, so
+    that only the Python objects of the group being inserted exist at once
+
+    :param table: The historical data
+    :param ticker_ids: The ticker ids by ticker name
+    :param rows_per_statement: Number of rows per group
+    :return: Iterator over the parameters of groups of rows_per_statement consecutive rows (the last group may have
+    fewer rows): the values of the rows of every crud.HISTORICAL_IMPORT_COLUMN_NAMES column, column after column
+    """
+    tickers = pyarrow.compute.dictionary_encode(table.column(TICKER_COLUMN_NAME)).combine_chunks()
+    ids_of_tickers = numpy.array([ticker_ids[name] for name in tickers.dictionary.to_pylist()], dtype=numpy.int64)
+    columns = []
+    for column_name in HISTORICAL_IMPORT_COLUMN_NAMES:
+        if column_name == HistoricalData.ticker_id.name:
+            columns.append(ids_of_tickers[tickers.indices.to_numpy(zero_copy_only=False)])
+        elif column_name == HistoricalData.date.name:
+            # Stored as ISO strings, like the dates of SQLAlchemy's Date type
+            columns.append(table.column(column_name).cast(pyarrow.string()).to_numpy())
+        else:
+            columns.append(table.column(column_name).to_numpy())
+    for first_row in range(0, table.num_rows, rows_per_statement):
+        yield tuple(chain.from_iterable(
+            column[first_row:first_row + rows_per_statement].tolist() for column in columns
+        ))
@@ -0,0 +1,350 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from fastapi.responses import Response
+
+from app.api import compression
+from app.api.config import HISTORICAL_BUCKET_CACHE_MAX_ENTRIES, HISTORICAL_CACHE_MAX_BYTES, HISTORICAL_CACHE_TTL
+from app.api.schemas import GetHistoricalDataGranularity, GetHistoricalDataOutputType
+
+# Headers of a response which are replayed along with its cached body - the validators and the link to the next page
+CACHED_HEADER_NAMES = ('ETag', 'Last-Modified', 'Link')
+
+
+class HistoricalCacheKey(NamedTuple):
+    ticker_name: str
+    start: date
+    end: date
+    data_format: GetHistoricalDataOutputType
+    # Number of rows and cursor of a page, None if the whole range is asked for
+    page_size: Optional[int] = None
+    cursor: Optional[date] = None
+    granularity: GetHistoricalDataGranularity = GetHistoricalDataGranularity.day
+    bucket_days: Optional[int] = None
+    # Technical indicators (indicators.IndicatorSpec), computed from history which may precede the start date
+    indicators: tuple = ()
+
+
+class _CacheEntry(NamedTuple):
+    body: bytes
+    media_type: str
+    headers: dict[str, str]
+    # Data versions of the ticker read before the response data, as returned by crud.retrieve_historical_data_versions
+    data_versions: tuple
+    expires_at: Optional[float]
+    # Compressed copies of the body by content encoding, made the first time they are asked for
+    encoded_bodies: dict[str, bytes]
+
+
+class HistoricalResponseCache:
+    """
+    Thread-safe in-process LRU cache of encoded GET /historical/ response bodies, bounded by the total size of the
+    bodies (and of their compressed copies) and optionally expiring entries after a TTL
+
+    Every entry holds the data versions of its ticker, and a hit is only served if they are still the current ones, so
+    that writes handled by another process (which cannot invalidate this cache) are never served stale. Writes handled
+    by this process also invalidate the entries of a ticker whose date range contains one of the written dates, to free
+    their memory early. To avoid caching a response which was read before such a write but stored after it, callers
+    take a generation before reading from the database and hand it back to put, which discards the response if the
+    ticker has been written to in the meantime
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 0, clock: Callable[[], float] = time.monotonic):
+        """
+        :param max_bytes: Maximum total size of the cached bodies - 0 disables the cache
+        :param ttl: Number of seconds after which an entry expires - 0 means entries only leave the cache when they are
+        evicted or invalidated
+        :param clock: Monotonic clock, in seconds
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[HistoricalCacheKey, _CacheEntry] = OrderedDict()
+        self._keys_by_ticker: dict[str, set[HistoricalCacheKey]] = {}
+        self._generations: dict[str, int] = {}
+        self._epoch = 0
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, key: HistoricalCacheKey, data_versions: tuple, encoding: Optional[str] = None) -> Optional[Response]:
+        """
+        Given a cache key and the current data versions of its ticker, get the cached response and mark it as the most
+        recently used one - compressed with the given content encoding if the body is worth compressing, in which case
+        the compressed body is cached as well
+
+        :param key: The cache key
+        :param data_versions: The current data versions of the ticker, as returned by
+        crud.retrieve_historical_data_versions - an entry cached with other versions is dropped
+        :param encoding: Content encoding negotiated with the client, None to get the uncompressed body
+        :return: A new response with the cached body, media type and headers (ETag, Last-Modified, Link), None if the
+        key is not cached (or has expired, or the ticker has been written to since)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.expires_at is not None and entry.expires_at <= self._clock():
+                self._remove(key=key)
+                self._expirations += 1
+                entry = None
+            elif entry and entry.data_versions != data_versions:
+                self._remove(key=key)
+                self._invalidations += 1
+                entry = None
+            if not entry:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            encoded_body = entry.encoded_bodies.get(encoding)
+
+        if not encoding or not compression.is_compressible(media_type=entry.media_type, size=len(entry.body)):
+            return Response(content=entry.body, media_type=entry.media_type, headers=entry.headers)
+        if encoded_body is None:
+            # Compressed without holding the lock - concurrent misses may compress the same body twice
+            encoded_body = compression.compress(body=entry.body, encoding=encoding)
+            with self._lock:
+                if self._entries.get(key) is entry and encoding not in entry.encoded_bodies:
+                    entry.encoded_bodies[encoding] = encoded_body
+                    self._size += len(encoded_body)
+                    self._evict()
+        return compression.build_encoded_response(
+            body=encoded_body, media_type=entry.media_type, headers=entry.headers, encoding=encoding
+        )
+
+    def generation(self, ticker_name: str) -> tuple[int, int]:
+        """
+        Given a ticker name, get its current generation - to be taken before the data is read from the database
+
+        :param ticker_name: The ticker name
+        :return: The generation, which changes whenever the ticker is invalidated or the cache is cleared
+        """
+        with self._lock:
+            return self._epoch, self._generations.get(ticker_name, 0)
+
+    def put(
+        self, key: HistoricalCacheKey, response: Response, data_versions: tuple, generation: tuple[int, int]
+    ) -> bool:
+        """
+        Given a cache key and an encoded response, cache the body of the response, evicting the least recently used
+        entries until the cache fits in its maximum size
+
+        :param key: The cache key
+        :param response: The response, with its body already rendered
+        :param data_versions: The data versions of the ticker read before the response data
+        :param generation: The generation of the ticker taken before the response data was read from the database
+        :return: True if the response has been cached, False if it is too large or the ticker has changed since
+        """
+        body = response.body
+        if not self.max_bytes or len(body) > self.max_bytes:
+            return False
+
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(key.ticker_name, 0)):
+                return False
+            if key in self._entries:
+                self._remove(key=key)
+            expires_at = self._clock() + self.ttl if self.ttl else None
+            self._entries[key] = _CacheEntry(
+                body=body,
+                media_type=response.media_type,
+                headers={name: response.headers[name] for name in CACHED_HEADER_NAMES if name in response.headers},
+                data_versions=data_versions,
+                expires_at=expires_at,
+                encoded_bodies={}
+            )
+            self._keys_by_ticker.setdefault(key.ticker_name, set()).add(key)
+            self._size += len(body)
+            self._evict()
+        return True
+
+    def invalidate(self, ticker_name: str, dates: Iterable[date]) -> int:
+        """
+        Given a ticker name and the dates of its candles which have been written, drop the cached responses of that
+        ticker whose date range contains at least one of the dates - or precedes it, for the responses with technical
+        indicators, which depend on the history before their start date
+
+        :param ticker_name: The ticker name
+        :param dates: The dates of the written candles
+        :return: Number of entries which have been dropped
+        """
+        sorted_dates = sorted(set(dates))
+        if not sorted_dates:
+            return 0
+
+        with self._lock:
+            self._generations[ticker_name] = self._generations.get(ticker_name, 0) + 1
+            stale_keys = []
+            for key in self._keys_by_ticker.get(ticker_name, ()):
+                index = bisect.bisect_left(sorted_dates, date.min if key.indicators else key.start)
+                if index < len(sorted_dates) and sorted_dates[index] <= key.end:
+                    stale_keys.append(key)
+            for key in stale_keys:
+                self._remove(key=key)
+            self._invalidations += len(stale_keys)
+        return len(stale_keys)
+
+    def clear(self) -> int:
+        """
+        Drop all the cached responses
+
+        :return: Number of entries which have been dropped
+        """
+        with self._lock:
+            num_entries = len(self._entries)
+            self._entries.clear()
+            self._keys_by_ticker.clear()
+            self._generations.clear()
+            self._epoch += 1
+            self._size = 0
+            self._invalidations += num_entries
+        return num_entries
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the cache, to help size it
+
+        :return: Dictionary with the number of hits, misses, evictions (to make room), expirations, invalidations,
+        entries and cached bytes
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl
+            }
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            self._remove(key=next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key: HistoricalCacheKey):
+        entry = self._entries.pop(key)
+        self._size -= len(entry.body) + sum(len(encoded_body) for encoded_body in entry.encoded_bodies.values())
+        ticker_keys = self._keys_by_ticker[key.ticker_name]
+        ticker_keys.discard(key)
+        if not ticker_keys:
+            del self._keys_by_ticker[key.ticker_name]
+
+
+class HistoricalBucketKey(NamedTuple):
+    ticker_id: int
+    granularity: GetHistoricalDataGranularity
+
+
+class HistoricalBucketSeries(NamedTuple):
+    """
+    The whole historical data of a ticker aggregated into buckets, ordered by date
+    """
+    dates: list[str]
+    rows: list[tuple]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> 'HistoricalBucketSeries':
+        """
+        :param rows: Bucket rows (date, ticker_id, low, high, open, close, volume), ordered by date
+        :return: The series
+        """
+        rows = [tuple(row) for row in rows]
+        return cls(dates=[row[0] for row in rows], rows=rows)
+
+    def slice(self, start: date, end: date) -> list[tuple]:
+        """
+        Given a date range, get the buckets which start in it
+
+        :param start: The start date
+        :param end: The end date
+        :return: The bucket rows, ordered by date
+        """
+        first_index = bisect.bisect_left(self.dates, start.isoformat())
+        end_index = bisect.bisect_right(self.dates, end.isoformat())
+        return self.rows[first_index:end_index]
+
+
+class HistoricalBucketCache:
+    """
+    Thread-safe in-process LRU cache of the whole bucketed (example weekly) series of tickers, so that bucketed requests
+    for any date range are served by slicing a series which has been aggregated once, rather than by aggregating the
+    daily rows of the range again
+
+    A series is labelled with the data versions of the ticker it has been read with and is only served for the same
+    versions - any write to the ticker makes the next request aggregate the series again, whichever worker handled it
+    """
+
+    def __init__(self, max_entries: int):
+        """
+        :param max_entries: Maximum number of series - 0 disables the cache
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[HistoricalBucketKey, tuple[tuple, HistoricalBucketSeries]] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: HistoricalBucketKey, data_versions: tuple) -> Optional[HistoricalBucketSeries]:
+        """
+        Given a cache key and the current data versions of the ticker, get the cached series and mark it as the most
+        recently used one
+
+        :param key: The cache key
+        :param data_versions: The data versions of the ticker, as returned by crud.retrieve_historical_data_versions
+        :return: The series, None if it is not cached or has been read with other data versions
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry[0] != data_versions:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: HistoricalBucketKey, data_versions: tuple, series: HistoricalBucketSeries):
+        """
+        Given a cache key, cache a series, evicting the least recently used series if the cache is full
+
+        :param key: The cache key
+        :param data_versions: The data versions of the ticker read before the series
+        :param series: The series
+        """
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (data_versions, series)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop all the cached series
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the cache
+
+        :return: Dictionary with the number of hits, misses and entries
+        """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'entries': len(self._entries)}
+
+
+historical_response_cache = HistoricalResponseCache(max_bytes=HISTORICAL_CACHE_MAX_BYTES, ttl=HISTORICAL_CACHE_TTL)
+historical_bucket_cache = HistoricalBucketCache(max_entries=HISTORICAL_BUCKET_CACHE_MAX_ENTRIES)
@@ -0,0 +1,363 @@
+import gzip
+import zlib
+from typing import Optional
+
+from fastapi import status
+from fastapi.responses import PlainTextResponse, Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.api.config import COMPRESSION_MINIMUM_SIZE, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_LEVEL, \
+    COMPRESSION_ZSTD_LEVEL, COMPRESSION_MAX_DECOMPRESSED_BYTES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_ENCODING = 'gzip'
+BROTLI_ENCODING = 'br'
+ZSTD_ENCODING = 'zstd'
+# Encodings which can be produced, in order of preference when the client accepts several of them equally
+SUPPORTED_ENCODINGS = [
+    encoding for encoding, module in ((ZSTD_ENCODING, zstandard), (BROTLI_ENCODING, brotli), (GZIP_ENCODING, gzip))
+    if module
+]
+# Media types whose content is already compressed
+INCOMPRESSIBLE_MEDIA_TYPES = {'application/vnd.apache.parquet', 'application/zip', 'application/gzip'}
+# Upper bound of the number of bytes a byte of zstd input inflates to - a 128 KiB block repeating a single byte (RLE)
+# takes 4 bytes
+_ZSTD_MAX_EXPANSION = 32 * 1024
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Given the Accept-Encoding header of a request, pick the encoding of the response - the supported encoding with the
+    highest quality value, ties being broken by SUPPORTED_ENCODINGS order
+
+    :param accept_encoding: The Accept-Encoding request header
+    :return: The encoding, None if the response should not be compressed
+    """
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, _, parameters = coding.partition(';')
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            key, _, value = parameter.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    best_encoding, best_quality = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+    return best_encoding
+
+
+def is_compressible(media_type: Optional[str], size: int, minimum_size: int = COMPRESSION_MINIMUM_SIZE) -> bool:
+    """
+    Given the media type and the size of a response body, check whether it is worth compressing
+
+    :param media_type: The media type (Content-Type without parameters is fine too)
+    :param size: The size of the body in bytes
+    :param minimum_size: Bodies smaller than this are sent as they are
+    :return: True if the body should be compressed
+    """
+    base_media_type = (media_type or '').split(';')[0].strip().lower()
+    return size >= minimum_size and base_media_type not in INCOMPRESSIBLE_MEDIA_TYPES
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """
+    Given a body and an encoding, compress the whole body at the configured level
+
+    :param body: The body
+    :param encoding: One of SUPPORTED_ENCODINGS
+    :return: The compressed body
+    """
+    if encoding == GZIP_ENCODING:
+        # Without a timestamp, so that identical bodies compress to identical bytes
+        return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+    if encoding == BROTLI_ENCODING:
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_LEVEL)
+    return zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compress(body)
+
+
+def set_encoding_headers(headers: MutableHeaders, encoding: str, content_length: Optional[int]):
+    """
+    Given the headers of a response which is being compressed, set Content-Encoding and Content-Length, and weaken the
+    ETag - the compressed bytes differ from the ones the strong tag was computed for, but are semantically equivalent
+
+    :param headers: The response headers, updated in place
+    :param encoding: The encoding of the body
+    :param content_length: The size of the compressed body, None if it is streamed
+    """
+    headers['Content-Encoding'] = encoding
+    if content_length is None:
+        if 'Content-Length' in headers:
+            del headers['Content-Length']
+    else:
+        headers['Content-Length'] = str(content_length)
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+
+
+def build_encoded_response(body: bytes, media_type: str, headers: dict[str, str], encoding: str) -> Response:
+    """
+    Given a body which has already been compressed (example by the response cache), build the response the
+    CompressionMiddleware would have sent for the uncompressed body
+
+    :param body: The compressed body
+    :param media_type: The media type of the uncompressed body
+    :param headers: The headers of the uncompressed response (example ETag)
+    :param encoding: The encoding of the body
+    :return: The response - passed through as it is by the middleware
+    """
+    response = Response(content=body, media_type=media_type, headers=headers)
+    set_encoding_headers(headers=response.headers, encoding=encoding, content_length=len(body))
+    response.headers.add_vary_header('Accept-Encoding')
+    return response
+
+
+class _StreamCompressor:
+    """
+    Incremental compressor which flushes after every chunk, so that streamed rows reach the client as they are produced
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == GZIP_ENCODING:
+            self._compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == BROTLI_ENCODING:
+            self._compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_LEVEL)
+        else:
+            self._compressor = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == GZIP_ENCODING:
+            return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == BROTLI_ENCODING:
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == BROTLI_ENCODING:
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class RequestBodyTooLarge(Exception):
+    """
+    Raised while a request body is received, once its decompressed size exceeds the limit - the request is answered
+    with 413 whatever the endpoint makes of the error
+    """
+
+
+class _StreamDecompressor:
+    """
+    Incremental decompressor of request bodies which never inflates much more than the bytes left of its limit, so that
+    a small compressed body cannot fill the memory (decompression bomb)
+    """
+
+    def __init__(self, encoding: str, max_size: int):
+        self.encoding = encoding
+        self.remaining = max_size
+        self.exceeded = False
+        if encoding == GZIP_ENCODING:
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == BROTLI_ENCODING:
+            self._decompressor = brotli.Decompressor()
+        else:
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    @staticmethod
+    def is_supported(encoding: str) -> bool:
+        return encoding == GZIP_ENCODING or (encoding == BROTLI_ENCODING and brotli is not None) or (
+            encoding == ZSTD_ENCODING and zstandard is not None
+        )
+
+    def decompress(self, chunk: bytes) -> bytes:
+        if self.encoding == GZIP_ENCODING:
+            return self._count(self._decompressor.decompress(chunk, self.remaining + 1))
+        if self.encoding == BROTLI_ENCODING:
+            return self._count(self._decompressor.process(chunk, output_buffer_limit=self.remaining + 1))
+        # zstd cannot bound its output, so the input is fed in slices which cannot inflate to much more than the limit
+        parts = []
+        start = 0
+        while start < len(chunk):
+            end = start + max(16, self.remaining // _ZSTD_MAX_EXPANSION)
+            parts.append(self._count(self._decompressor.decompress(chunk[start:end])))
+            start = end
+        return b''.join(parts)
+
+    def flush(self) -> bytes:
+        if self.encoding == GZIP_ENCODING:
+            return self._count(self._decompressor.flush())
+        return b''
+
+    def _count(self, body: bytes) -> bytes:
+        self.remaining -= len(body)
+        if self.remaining < 0:
+            self.exceeded = True
+            raise RequestBodyTooLarge('The decompressed request body is larger than the limit')
+        return body
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware which compresses response bodies according to the Accept-Encoding request header (whole bodies at
+    once, streamed bodies chunk by chunk) and decompresses request bodies sent with a Content-Encoding as they are
+    received - up to max_decompressed_size bytes, beyond which the request is answered with 413. Responses which
+    already have a Content-Encoding (example cached compressed bodies) are passed through
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+            max_decompressed_size: int = COMPRESSION_MAX_DECOMPRESSED_BYTES
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.max_decompressed_size = max_decompressed_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        encoding = negotiate_encoding(accept_encoding=request_headers.get('Accept-Encoding'))
+        content_encoding = request_headers.get('Content-Encoding', '').strip().lower()
+        if not content_encoding or content_encoding == 'identity':
+            await self.app(scope, receive, self._compress_response(send=send, encoding=encoding))
+            return
+
+        if not _StreamDecompressor.is_supported(encoding=content_encoding):
+            response = PlainTextResponse(
+                content=f'Unsupported Content-Encoding {content_encoding}.',
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+            await response(scope, receive, send)
+            return
+        decompressor = _StreamDecompressor(encoding=content_encoding, max_size=self.max_decompressed_size)
+        decompressed_scope, decompressed_receive = self._decompress_request(
+            scope=scope, receive=receive, decompressor=decompressor
+        )
+        send_compressed = self._compress_response(send=send, encoding=encoding)
+        response_started, replaced = False, False
+
+        async def send_unless_too_large(message: Message):
+            nonlocal response_started, replaced
+            if message['type'] == 'http.response.start':
+                response_started = True
+                # Endpoints answer bodies they fail to read with 400 (or 500) - replaced by 413 when that is why
+                replaced = decompressor.exceeded
+                if replaced:
+                    await self._send_too_large(scope=scope, receive=receive, send=send)
+                    return
+            if not replaced:
+                await send_compressed(message)
+
+        try:
+            await self.app(decompressed_scope, decompressed_receive, send_unless_too_large)
+        except RequestBodyTooLarge:
+            if replaced:
+                return
+            if response_started:
+                raise
+            await self._send_too_large(scope=scope, receive=receive, send=send)
+
+    def _send_too_large(self, scope: Scope, receive: Receive, send: Send):
+        response = PlainTextResponse(
+            content=f'The decompressed request body is larger than {self.max_decompressed_size} bytes.',
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        return response(scope, receive, send)
+
+    @staticmethod
+    def _decompress_request(
+            scope: Scope,
+            receive: Receive,
+            decompressor: _StreamDecompressor
+    ) -> tuple[Scope, Receive]:
+        headers = MutableHeaders(scope={**scope, 'headers': list(scope['headers'])})
+        del headers['Content-Encoding']
+        if 'Content-Length' in headers:
+            del headers['Content-Length']
+
+        async def receive_decompressed() -> Message:
+            message = await receive()
+            if message['type'] == 'http.request':
+                body = decompressor.decompress(message.get('body', b''))
+                if not message.get('more_body', False):
+                    body += decompressor.flush()
+                message = {**message, 'body': body}
+            return message
+
+        return {**scope, 'headers': headers.raw}, receive_decompressed
+
+    def _compress_response(self, send: Send, encoding: Optional[str]) -> Send:
+        start_message: Optional[Message] = None
+        stream_compressor: Optional[_StreamCompressor] = None
+
+        async def send_compressed(message: Message):
+            nonlocal start_message, stream_compressor
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(raw=message['headers'])
+                if 'Content-Encoding' in headers or message['status'] == status.HTTP_304_NOT_MODIFIED:
+                    await send(message)
+                else:
+                    headers.add_vary_header('Accept-Encoding')
+                    # Held back until the first body chunk tells whether the body is worth compressing
+                    start_message = message
+                return
+
+            if message['type'] != 'http.response.body' or start_message is None:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start_message['headers'])
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if stream_compressor is None:
+                # A streamed body is compressed whatever the size of its first chunk
+                size = self.minimum_size if more_body else len(body)
+                if not encoding or not is_compressible(
+                    media_type=headers.get('Content-Type'), size=size, minimum_size=self.minimum_size
+                ):
+                    await send(start_message)
+                    start_message = None
+                    await send(message)
+                    return
+                if not more_body:
+                    compressed_body = compress(body=body, encoding=encoding)
+                    set_encoding_headers(headers=headers, encoding=encoding, content_length=len(compressed_body))
+                    await send(start_message)
+                    start_message = None
+                    await send({'type': 'http.response.body', 'body': compressed_body})
+                    return
+                stream_compressor = _StreamCompressor(encoding=encoding)
+                set_encoding_headers(headers=headers, encoding=encoding, content_length=None)
+                await send(start_message)
+
+            chunk = stream_compressor.compress(body)
+            if not more_body:
+                chunk += stream_compressor.finish()
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
+
+        return send_compressed
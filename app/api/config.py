@@ -1,3 +1,5 @@
+import os
+
 CUSTOM_DOCS_DESCRIPTION = '''
 Simple API made possible by FastAPI.
 
@@ -14,6 +16,10 @@ You can retrieve such data for a specific date range and ticker. Supports day ti
 ## Database
 
 You can **clear all cryptocurrency historical data and tickers**.
+
+## Cache
+
+You can **inspect the counters of the historical data response cache**.
 '''
 
 CUSTOM_DOCS_TAGS_METADATA = [
@@ -28,9 +34,96 @@ CUSTOM_DOCS_TAGS_METADATA = [
     {
         'name': 'Database',
         'description': 'Clear all historical data and tickers.'
+    },
+    {
+        'name': 'Cache',
+        'description': 'Inspect the historical data response cache.'
     }
 ]
 
 API_HISTORICAL_ENDPOINT = '/historical/'
+API_HISTORICAL_BATCH_ENDPOINT = '/historical/batch/'
+API_HISTORICAL_STATS_ENDPOINT = '/historical/stats/'
+API_HISTORICAL_LATEST_ENDPOINT = '/historical/latest/'
+API_HISTORICAL_INGEST_ENDPOINT = '/historical/ingest/'
+API_HISTORICAL_IMPORT_ENDPOINT = '/historical/import/'
+API_HISTORICAL_JOBS_ENDPOINT = '/historical/jobs/'
 API_TICKERS_ENDPOINT = '/tickers/'
 API_CLEAR_ENDPOINT = '/clear/'
+API_CACHE_ENDPOINT = '/cache/'
+
+SQLALCHEMY_DATABASE_URL = os.getenv('SQLALCHEMY_DATABASE_URL', 'sqlite:///./crypto.db')
+SQLALCHEMY_ASYNC_DATABASE_URL = os.getenv(
+    'SQLALCHEMY_ASYNC_DATABASE_URL', SQLALCHEMY_DATABASE_URL.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+)
+# Serve the tickers and historical data endpoints with async handlers running on the async engine
+API_ASYNC_MODE = os.getenv('API_ASYNC_MODE', 'false').lower() == 'true'
+# Connection pool sizing - every request checks out its own connection, so the pool bounds the number of requests that
+# can talk to the database at the same time
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '20'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# How long (in seconds) SQLite waits for a lock held by another writer before giving up
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '15'))
+# Number of rows sent to the database per executemany call when historical data is inserted in bulk
+HISTORICAL_INSERT_CHUNK_SIZE = int(os.getenv('HISTORICAL_INSERT_CHUNK_SIZE', '10000'))
+# Number of historical data rows fetched from the database cursor and sent per chunk of a streamed response
+HISTORICAL_STREAM_BATCH_SIZE = int(os.getenv('HISTORICAL_STREAM_BATCH_SIZE', '5000'))
+# Number of rows of a POST /historical/ingest/ body which are validated and committed at a time
+HISTORICAL_INGEST_BATCH_SIZE = int(os.getenv('HISTORICAL_INGEST_BATCH_SIZE', '10000'))
+# Number of rows inserted by every statement of a POST /historical/import/ (at most 4681 - 7 parameters per row, and
+# SQLite allows up to 32766 parameters per statement)
+HISTORICAL_IMPORT_ROWS_PER_STATEMENT = int(os.getenv('HISTORICAL_IMPORT_ROWS_PER_STATEMENT', '100'))
+# Number of those statements sent to the database per executemany call
+HISTORICAL_IMPORT_STATEMENTS_PER_CALL = int(os.getenv('HISTORICAL_IMPORT_STATEMENTS_PER_CALL', '100'))
+# Size (in bytes) above which the file of a POST /historical/import/ is spooled to disk rather than kept in memory
+HISTORICAL_IMPORT_SPOOL_MAX_BYTES = int(os.getenv('HISTORICAL_IMPORT_SPOOL_MAX_BYTES', str(64 * 1024 * 1024)))
+# Maximum number of POST /historical/?background=true jobs waiting to be written, and of their candlesticks - requests
+# beyond either are rejected with a 503 until the writer catches up
+HISTORICAL_JOB_QUEUE_MAX_JOBS = int(os.getenv('HISTORICAL_JOB_QUEUE_MAX_JOBS', '1000'))
+HISTORICAL_JOB_QUEUE_MAX_RECORDS = int(os.getenv('HISTORICAL_JOB_QUEUE_MAX_RECORDS', '500000'))
+# Maximum number of candlesticks of the queued jobs written in one transaction - a larger job is written on its own
+HISTORICAL_JOB_BATCH_MAX_RECORDS = int(os.getenv('HISTORICAL_JOB_BATCH_MAX_RECORDS', '50000'))
+# Number of seconds the writer waits for more jobs once one is queued, so that jobs arriving one at a time are written
+# together - the clients have been answered already
+HISTORICAL_JOB_BATCH_LINGER = float(os.getenv('HISTORICAL_JOB_BATCH_LINGER', '0.05'))
+# Number of seconds a client whose job is rejected because the queue is full is told to wait (Retry-After)
+HISTORICAL_JOB_RETRY_AFTER = int(os.getenv('HISTORICAL_JOB_RETRY_AFTER', '1'))
+# Number of finished jobs whose status is kept for GET /historical/jobs/
+HISTORICAL_JOB_MAX_FINISHED = int(os.getenv('HISTORICAL_JOB_MAX_FINISHED', '10000'))
+# Compute the % change of GET /historical/ in the database with a window function (True) or with pandas (False)
+HISTORICAL_PCT_CHANGE_IN_DATABASE = os.getenv('HISTORICAL_PCT_CHANGE_IN_DATABASE', 'true').lower() == 'true'
+# Maximum number of tickers of a GET /historical/batch/ request
+HISTORICAL_BATCH_MAX_TICKERS = int(os.getenv('HISTORICAL_BATCH_MAX_TICKERS', '500'))
+# Maximum number of rows of a page of GET /historical/ - larger limits are capped to it
+HISTORICAL_MAX_PAGE_SIZE = int(os.getenv('HISTORICAL_MAX_PAGE_SIZE', '10000'))
+# Maximum window of the technical indicators of GET /historical/
+INDICATOR_MAX_WINDOW = int(os.getenv('INDICATOR_MAX_WINDOW', '500'))
+# Number of windows of history read before the range for the exponentially smoothed indicators (EMA, RSI) - the weight
+# of the older history left out is below exp(-factor) for the RSI and exp(-2 * factor) for the EMA
+INDICATOR_WARMUP_FACTOR = int(os.getenv('INDICATOR_WARMUP_FACTOR', '10'))
+# Number of standard deviations between the middle and the outer Bollinger bands
+INDICATOR_BOLLINGER_NUM_STD = float(os.getenv('INDICATOR_BOLLINGER_NUM_STD', '2'))
+# Maximum total size (in bytes) of the encoded GET /historical/ responses kept in memory - 0 disables the cache
+HISTORICAL_CACHE_MAX_BYTES = int(os.getenv('HISTORICAL_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Number of seconds after which a cached GET /historical/ response expires - 0 means it never does (a cached response
+# is only served while the data versions of its ticker are unchanged, whichever worker wrote to it)
+HISTORICAL_CACHE_TTL = float(os.getenv('HISTORICAL_CACHE_TTL', '0'))
+# Number of seconds the in-memory ticker registry is trusted before its version is checked against the database again -
+# bounds how long a ticker deleted by another worker may still be seen by this one
+TICKER_REGISTRY_CHECK_INTERVAL = float(os.getenv('TICKER_REGISTRY_CHECK_INTERVAL', '1'))
+# Maximum number of whole bucketed (weekly, monthly, yearly) series of tickers kept in memory to serve aggregated
+# GET /historical/ requests for any date range - 0 disables the cache
+HISTORICAL_BUCKET_CACHE_MAX_ENTRIES = int(os.getenv('HISTORICAL_BUCKET_CACHE_MAX_ENTRIES', '256'))
+# Number of tickers whose range statistics index (prefix sums and sparse tables) is kept in memory to serve
+# GET /historical/stats/ - 0 builds the index for every request
+HISTORICAL_STATS_INDEX_MAX_TICKERS = int(os.getenv('HISTORICAL_STATS_INDEX_MAX_TICKERS', '256'))
+# Responses smaller than this (in bytes) are sent uncompressed, whatever the Accept-Encoding of the request
+COMPRESSION_MINIMUM_SIZE = int(os.getenv('COMPRESSION_MINIMUM_SIZE', '1024'))
+# Compression levels of the response encodings - gzip 1-9, brotli 0-11, zstd 1-22
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_LEVEL = int(os.getenv('COMPRESSION_BROTLI_LEVEL', '4'))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', '3'))
+# Maximum size (in bytes) a compressed request body may inflate to - larger ones are rejected with a 413, so that a
+# small compressed body cannot fill the memory
+COMPRESSION_MAX_DECOMPRESSED_BYTES = int(os.getenv('COMPRESSION_MAX_DECOMPRESSED_BYTES', str(256 * 1024 * 1024)))
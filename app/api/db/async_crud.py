@@ -0,0 +1,510 @@
+from datetime import date, datetime
+from itertools import groupby, islice
+from typing import AsyncIterator, Iterable, Optional, Sequence
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.config import HISTORICAL_IMPORT_STATEMENTS_PER_CALL, HISTORICAL_INSERT_CHUNK_SIZE, \
+    HISTORICAL_STREAM_BATCH_SIZE
+from app.api.db.crud import HISTORICAL_DATA_VERSION_KEY, TICKERS_DATA_VERSION_KEY, parse_historical_data_versions, \
+    build_bump_data_version_statement, build_data_version_statement, build_data_versions_statement, \
+    build_historical_batch_statement, build_historical_batch_with_pct_change_statement, \
+    build_historical_buckets_statement, build_historical_buckets_with_pct_change_statement, \
+    build_historical_count_statement, build_historical_data_version_key, build_historical_extent_statement, \
+    build_historical_gaps_statement, build_historical_lookback_statement, build_historical_range_statement, \
+    build_historical_range_with_pct_change_statement, build_historical_upsert_statement, \
+    build_historical_import_statement, build_historical_tickers_count_statement, build_tickers_insert_statement, \
+    deduplicate_historical_records, HISTORICAL_IMPORT_COLUMN_NAMES
+from app.api.db.models import Ticker, HistoricalData
+from app.api.db.registry import ticker_registry
+from app.api.schemas import GetHistoricalDataGranularity, PostHistoricalDataConflictAction
+
+
+async def retrieve_data_version(db: AsyncSession, key: str) -> int:
+    """
+    Given a data version key, get the version
+
+    :param db: Async database session
+    :param key: Data version key
+    :return: The version, 0 if the data has never been written to
+    """
+    result = await db.execute(build_data_version_statement(key=key))
+    return result.scalar() or 0
+
+
+async def bump_data_version(db: AsyncSession, key: str) -> int:
+    """
+    Given a data version key, increment the version as part of the current transaction - which the caller commits along
+    with the write the version stands for
+
+    :param db: Async database session
+    :param key: Data version key
+    :return: The incremented version
+    """
+    await db.execute(build_bump_data_version_statement(key=key))
+    return await retrieve_data_version(db=db, key=key)
+
+
+async def retrieve_historical_data_versions(
+        db: AsyncSession,
+        ticker_id: int
+) -> tuple[tuple[int, int], Optional[datetime]]:
+    """
+    Given a ticker id, get the versions which identify the state of its historical data, without reading the data
+
+    :param db: Async database session
+    :param ticker_id: Ticker id
+    :return: Tuple of ((version of all the historical data, version of the historical data of the ticker), time of the
+    last change in UTC - None if the data has not been written to since versions were introduced)
+    """
+    keys = [HISTORICAL_DATA_VERSION_KEY, build_historical_data_version_key(ticker_id=ticker_id)]
+    result = await db.execute(build_data_versions_statement(keys=keys))
+    return parse_historical_data_versions(keys=keys, versions={row.key: row for row in result})
+
+
+async def load_ticker_registry(db: AsyncSession):
+    """
+    Load all the tickers into the ticker registry, unless it is already up-to-date with the tickers data version
+
+    :param db: Async database session
+    """
+    # The version is read before the tickers - if a write commits in between, the registry ends up labelled with the
+    # older version and is reloaded on the next check
+    version = await retrieve_data_version(db=db, key=TICKERS_DATA_VERSION_KEY)
+    if not ticker_registry.confirm(version=version):
+        result = await db.execute(select(Ticker.ticker, Ticker.id))
+        ticker_registry.replace(version=version, tickers=result.all())
+
+
+async def retrieve_ticker_by_name(db: AsyncSession, ticker_name: str, verify: bool = False) -> Optional[Ticker]:
+    """
+    Given a ticker_name name (unique), get a ticker_name record from the ticker registry - the database is only queried
+    for the tickers data version when the registry has not been checked recently, when the ticker is missing from it or
+    when verify is set
+
+    :param db: Async database session
+    :param ticker_name: Name of the ticker_name
+    :param verify: Check the registry against the database even if it has been checked recently (before writes)
+    :return: Ticker record (not attached to the session) if it exists, None otherwise
+    """
+    ticker_id, is_fresh = ticker_registry.lookup(ticker_name=ticker_name)
+    if ticker_id is None or not is_fresh or verify:
+        await load_ticker_registry(db=db)
+        ticker_id, _ = ticker_registry.lookup(ticker_name=ticker_name)
+    return Ticker(id=ticker_id, ticker=ticker_name) if ticker_id is not None else None
+
+
+async def retrieve_tickers_by_names(db: AsyncSession, ticker_names: list[str]) -> list[Ticker]:
+    """
+    Given several ticker names, get the ticker records of those which exist from the ticker registry - the database is
+    queried at most once, for the tickers data version, as with retrieve_ticker_by_name
+
+    :param db: Async database session
+    :param ticker_names: Names of the tickers
+    :return: Ticker records (not attached to the session) of the tickers which exist, in the order of the names
+    """
+    lookups = [ticker_registry.lookup(ticker_name=ticker_name) for ticker_name in ticker_names]
+    if any(ticker_id is None or not is_fresh for ticker_id, is_fresh in lookups):
+        await load_ticker_registry(db=db)
+        lookups = [ticker_registry.lookup(ticker_name=ticker_name) for ticker_name in ticker_names]
+    return [
+        Ticker(id=ticker_id, ticker=ticker_name)
+        for ticker_name, (ticker_id, _) in zip(ticker_names, lookups) if ticker_id is not None
+    ]
+
+
+async def retrieve_historical_by_date_range_and_ticker_id(
+        db: AsyncSession,
+        start: date,
+        end: date,
+        ticker_id: int,
+        limit: Optional[int] = None
+) -> list[Row]:
+    """
+    Given a date range and a ticker_name id, get all relevant historical data according to those details, ordered by
+    date
+
+    :param db: Async database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the earliest ones), None for all of them
+    :return: List of (date, ticker_id, low, high, open, close, volume) rows that meet the criteria
+    """
+    result = await db.execute(build_historical_range_statement(start=start, end=end, ticker_id=ticker_id, limit=limit))
+    return result.all()
+
+
+async def retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+        db: AsyncSession,
+        start: date,
+        end: date,
+        ticker_id: int,
+        limit: Optional[int] = None
+) -> list[Row]:
+    """
+    Given a date range and a ticker_name id, get all relevant historical data according to those details, ordered by
+    date, with the percentage change of the close already computed by the database
+
+    :param db: Async database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the earliest ones), None for all of them
+    :return: List of (date, ticker_id, low, high, open, close, volume, % change) rows that meet the criteria
+    """
+    result = await db.execute(
+        build_historical_range_with_pct_change_statement(start=start, end=end, ticker_id=ticker_id, limit=limit)
+    )
+    return result.all()
+
+
+async def retrieve_historical_before_date_and_ticker_id(
+        db: AsyncSession,
+        before: date,
+        ticker_id: int,
+        limit: int
+) -> list[Row]:
+    """
+    Given a date and a ticker id, get the historical data which immediately precedes the date (example the history
+    technical indicators are warmed up with), ordered by date
+
+    :param db: Async database session
+    :param before: The date, excluded
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the latest ones)
+    :return: List of at most limit (date, ticker_id, low, high, open, close, volume) rows
+    """
+    if limit <= 0:
+        return []
+    result = await db.execute(build_historical_lookback_statement(before=before, ticker_id=ticker_id, limit=limit))
+    return result.all()[::-1]
+
+
+async def retrieve_historical_extent_by_ticker_id(db: AsyncSession, ticker_id: int) -> Row:
+    """
+    Given a ticker id, get the first and last dates of its historical data and its number of rows
+
+    :param db: Async database session
+    :param ticker_id: Ticker id
+    :return: Row of (first date, last date, number of rows) - the dates are None if there is no historical data
+    """
+    result = await db.execute(build_historical_extent_statement(ticker_id=ticker_id))
+    return result.one()
+
+
+async def retrieve_historical_gaps_by_ticker_id(db: AsyncSession, ticker_id: int) -> list[Row]:
+    """
+    Given a ticker id, get the gaps in its daily historical data
+
+    :param db: Async database session
+    :param ticker_id: Ticker id
+    :return: Rows of (the date before a gap, the date after it), ordered by date
+    """
+    result = await db.execute(build_historical_gaps_statement(ticker_id=ticker_id))
+    return result.all()
+
+
+async def retrieve_historical_buckets_by_date_range_and_ticker_id(
+        db: AsyncSession,
+        start: date,
+        end: date,
+        ticker_id: int,
+        granularity: GetHistoricalDataGranularity,
+        bucket_days: Optional[int] = None
+) -> list[Row]:
+    """
+    Given a date range and a ticker_name id, get the historical data of that ticker in the range aggregated into
+    buckets, ordered by date
+
+    :param db: Async database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param granularity: Calendar period of the buckets, ignored if bucket_days is set
+    :param bucket_days: Number of days of the buckets, counted from the start date
+    :return: List of (date, ticker_id, low, high, open, close, volume) rows, one per bucket
+    """
+    result = await db.execute(build_historical_buckets_statement(
+        start=start, end=end, ticker_id=ticker_id, granularity=granularity, bucket_days=bucket_days
+    ))
+    return result.all()
+
+
+async def retrieve_historical_buckets_with_pct_change_by_date_range_and_ticker_id(
+        db: AsyncSession,
+        start: date,
+        end: date,
+        ticker_id: int,
+        granularity: GetHistoricalDataGranularity,
+        bucket_days: Optional[int] = None
+) -> list[Row]:
+    """
+    Given a date range and a ticker_name id, get the historical data of that ticker in the range aggregated into
+    buckets, ordered by date, with the percentage change of the close of the buckets already computed by the database
+
+    :param db: Async database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param granularity: Calendar period of the buckets, ignored if bucket_days is set
+    :param bucket_days: Number of days of the buckets, counted from the start date
+    :return: List of (date, ticker_id, low, high, open, close, volume, % change) rows, one per bucket
+    """
+    result = await db.execute(build_historical_buckets_with_pct_change_statement(
+        start=start, end=end, ticker_id=ticker_id, granularity=granularity, bucket_days=bucket_days
+    ))
+    return result.all()
+
+
+async def retrieve_historical_by_date_range_and_ticker_ids(
+        db: AsyncSession,
+        start: date,
+        end: date,
+        ticker_ids: list[int]
+) -> list[Row]:
+    """
+    Given a date range and several ticker ids, get all relevant historical data of those tickers in a single query,
+    ordered by ticker id and date
+
+    :param db: Async database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_ids: Ticker ids
+    :return: List of (date, ticker_id, low, high, open, close, volume) rows that meet the criteria
+    """
+    result = await db.execute(build_historical_batch_statement(start=start, end=end, ticker_ids=ticker_ids))
+    return result.all()
+
+
+async def retrieve_historical_with_pct_change_by_date_range_and_ticker_ids(
+        db: AsyncSession,
+        start: date,
+        end: date,
+        ticker_ids: list[int]
+) -> list[Row]:
+    """
+    Given a date range and several ticker ids, get all relevant historical data of those tickers in a single query,
+    ordered by ticker id and date, with the percentage change of the close of each ticker computed by the database
+
+    :param db: Async database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_ids: Ticker ids
+    :return: List of (date, ticker_id, low, high, open, close, volume, % change) rows that meet the criteria
+    """
+    result = await db.execute(
+        build_historical_batch_with_pct_change_statement(start=start, end=end, ticker_ids=ticker_ids)
+    )
+    return result.all()
+
+
+async def stream_historical_by_date_range_and_ticker_id(
+        db: AsyncSession,
+        start: date,
+        end: date,
+        ticker_id: int,
+        batch_size: int = HISTORICAL_STREAM_BATCH_SIZE
+) -> AsyncIterator[list[Row]]:
+    """
+    Given a date range and a ticker_name id, lazily fetch all relevant historical data from the database cursor in
+    batches, ordered by date
+
+    :param db: Async database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param batch_size: The maximum number of rows per batch
+    :return: Async iterator of batches of (date, ticker_id, low, high, open, close, volume) rows that meet the criteria
+    """
+    statement = build_historical_range_statement(start=start, end=end, ticker_id=ticker_id)
+    result = await db.stream(statement.execution_options(yield_per=batch_size))
+    async for batch in result.partitions(batch_size):
+        yield batch
+
+
+async def create_ticker(db: AsyncSession, ticker_name: str) -> Ticker:
+    """
+    Given a ticker_name name, create a ticker_name record and insert it into the database
+
+    :param db: Async database session
+    :param ticker_name: The name of the ticker_name
+    :return: Ticker record that was written to the database
+    """
+    ticker_record = Ticker()
+    ticker_record.ticker = ticker_name
+    db.add(ticker_record)
+    await db.flush()
+    version = await bump_data_version(db=db, key=TICKERS_DATA_VERSION_KEY)
+    await db.commit()
+    await db.refresh(ticker_record)
+    ticker_registry.add(ticker_name=ticker_name, ticker_id=ticker_record.id, version=version)
+    return ticker_record
+
+
+async def create_historical(
+        db: AsyncSession,
+        records: Iterable[dict],
+        chunk_size: int = HISTORICAL_INSERT_CHUNK_SIZE
+) -> int:
+    """
+    Given historical data rows, bulk insert them into the database in chunks (one executemany per chunk) within a
+    single transaction
+
+    :param db: Async database session
+    :param records: Iterable of dicts which map the historical database table column names to values
+    :param chunk_size: The maximum number of rows sent to the database per executemany call
+    :return: The number of historical data rows which were inserted
+    """
+    statement = insert(HistoricalData.__table__)
+    num_inserted = 0
+    ticker_ids = set()
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        await db.execute(statement, chunk)
+        num_inserted += len(chunk)
+        ticker_ids.update(record['ticker_id'] for record in chunk)
+    for ticker_id in sorted(ticker_ids):
+        await bump_data_version(db=db, key=build_historical_data_version_key(ticker_id=ticker_id))
+    await db.commit()
+    return num_inserted
+
+
+async def upsert_historical(
+        db: AsyncSession,
+        ticker_id: int,
+        records: Iterable[dict],
+        on_conflict: PostHistoricalDataConflictAction,
+        chunk_size: int = HISTORICAL_INSERT_CHUNK_SIZE
+) -> tuple[int, int, int]:
+    """
+    Given historical data rows of a ticker, bulk insert them into the database in chunks within a single transaction,
+    either updating or skipping the candlesticks which are already stored
+
+    :param db: Async database session
+    :param ticker_id: The ticker id associated with the data
+    :param records: Iterable of dicts which map the historical database table column names to values - of the rows of
+    the same date within a chunk, only the last one is written and counted
+    :param on_conflict: What to do with candlesticks which are already stored
+    :param chunk_size: The maximum number of rows sent to the database per executemany call
+    :return: Tuple of (number of inserted rows, number of updated rows, number of skipped rows)
+    """
+    statement = build_historical_upsert_statement(on_conflict=on_conflict)
+    num_inserted, num_existing = 0, 0
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        chunk = deduplicate_historical_records(records=chunk)
+        count_statement = build_historical_count_statement(
+            ticker_id=ticker_id,
+            start=min(record['date'] for record in chunk),
+            end=max(record['date'] for record in chunk)
+        )
+        count_before = (await db.execute(count_statement)).scalar()
+        await db.execute(statement, chunk)
+        chunk_inserted = (await db.execute(count_statement)).scalar() - count_before
+        num_inserted += chunk_inserted
+        num_existing += len(chunk) - chunk_inserted
+    if num_inserted or (num_existing and on_conflict == PostHistoricalDataConflictAction.update):
+        await bump_data_version(db=db, key=build_historical_data_version_key(ticker_id=ticker_id))
+    await db.commit()
+
+    if on_conflict == PostHistoricalDataConflictAction.update:
+        return num_inserted, num_existing, 0
+    return num_inserted, 0, num_existing
+
+
+async def create_tickers(db: AsyncSession, ticker_names: list[str]) -> tuple[dict[str, int], int]:
+    """
+    Given ticker names, insert those which do not exist yet as part of the current transaction - which the caller
+    commits along with the historical data of the tickers
+
+    :param db: Async database session
+    :param ticker_names: Names of the tickers
+    :return: Tuple of (ticker ids by name of all the tickers, number of inserted tickers)
+    """
+    num_created = (await db.execute(
+        build_tickers_insert_statement(), [{Ticker.ticker.name: ticker_name} for ticker_name in ticker_names]
+    )).rowcount
+    if num_created:
+        # The registry is reloaded once the new tickers are looked up, after the commit
+        await bump_data_version(db=db, key=TICKERS_DATA_VERSION_KEY)
+    ticker_ids = dict((await db.execute(
+        select(Ticker.ticker, Ticker.id).where(Ticker.ticker.in_(ticker_names))
+    )).all())
+    return ticker_ids, num_created
+
+
+async def import_historical(
+        db: AsyncSession,
+        row_groups: Iterable[Sequence],
+        ticker_ids: Iterable[int],
+        on_conflict: PostHistoricalDataConflictAction,
+        statements_per_call: int = HISTORICAL_IMPORT_STATEMENTS_PER_CALL
+) -> tuple[int, int, int]:
+    """
+    Given the historical data rows of tickers in groups (example from bulkimport.build_import_row_groups), bulk insert
+    them into the database with one multi-row statement per group (see crud.build_historical_import_statement),
+    several statements per executemany call, and commit them - along with whatever the transaction holds already
+    (example the tickers of create_tickers)
+
+    :param db: Async database session
+    :param row_groups: Parameters of groups of consecutive rows: the values of the rows of every
+    HISTORICAL_IMPORT_COLUMN_NAMES column, column after column - the groups of the same number of rows share their
+    statement. Every ticker and date appears at most once (see bulkimport.drop_duplicate_rows), as every row which is
+    not inserted is counted as an updated or skipped one
+    :param ticker_ids: The ids of the tickers of the rows
+    :param on_conflict: What to do with candlesticks which are already stored
+    :param statements_per_call: The maximum number of statements sent to the database per executemany call
+    :return: Tuple of (number of inserted rows, number of updated rows, number of skipped rows)
+    """
+    ticker_ids = sorted(set(ticker_ids))
+    count_statement = build_historical_tickers_count_statement(ticker_ids=ticker_ids)
+    count_before = (await db.execute(count_statement)).scalar()
+    connection = await db.connection()
+    num_received = 0
+    for num_params, groups in groupby(row_groups, key=len):
+        sql = build_historical_import_statement(
+            on_conflict=on_conflict, num_rows=num_params // len(HISTORICAL_IMPORT_COLUMN_NAMES)
+        )
+        while chunk := list(islice(groups, statements_per_call)):
+            await connection.exec_driver_sql(sql, chunk)
+            num_received += len(chunk) * num_params // len(HISTORICAL_IMPORT_COLUMN_NAMES)
+    num_inserted = (await db.execute(count_statement)).scalar() - count_before
+    num_existing = num_received - num_inserted
+    if num_inserted or (num_existing and on_conflict == PostHistoricalDataConflictAction.update):
+        for ticker_id in ticker_ids:
+            await bump_data_version(db=db, key=build_historical_data_version_key(ticker_id=ticker_id))
+    await db.commit()
+
+    if on_conflict == PostHistoricalDataConflictAction.update:
+        return num_inserted, num_existing, 0
+    return num_inserted, 0, num_existing
+
+
+async def delete_all_ticker_records(db: AsyncSession) -> int:
+    """
+    Delete all ticker_name records
+
+    :param db: Async database session
+    :return: The number of deleted ticker records
+    """
+    result = await db.execute(delete(Ticker))
+    version = await bump_data_version(db=db, key=TICKERS_DATA_VERSION_KEY)
+    await db.commit()
+    ticker_registry.clear(version=version)
+    return result.rowcount
+
+
+async def delete_all_historical_records(db: AsyncSession) -> int:
+    """
+    Delete all historical data records
+
+    :param db: Async database session
+    :return: The number of deleted historical data records
+    """
+    result = await db.execute(delete(HistoricalData))
+    await bump_data_version(db=db, key=HISTORICAL_DATA_VERSION_KEY)
+    await db.commit()
+    return result.rowcount
@@ -1,78 +1,900 @@
-from datetime import date
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import groupby, islice
+from typing import Iterable, Iterator, Optional, Sequence
 
-from app.api.db.database import SessionLocal
-from app.api.db.models import Ticker, HistoricalData
+from sqlalchemy import Float, Integer, String, and_, bindparam, cast, func, insert, select, type_coerce
+from sqlalchemy.engine import Row
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql import Insert, Select
+from sqlalchemy.orm import Session, aliased
 
-db = SessionLocal()
+from app.api.config import HISTORICAL_IMPORT_STATEMENTS_PER_CALL, HISTORICAL_INSERT_CHUNK_SIZE, \
+    HISTORICAL_STREAM_BATCH_SIZE
 
+from app.api.db.models import DataVersion, Ticker, HistoricalData
+from app.api.db.registry import ticker_registry
+from app.api.schemas import GetHistoricalDataGranularity, PostHistoricalDataConflictAction
 
-def retrieve_ticker_by_name(ticker_name: str) -> Ticker:
+
+# Selected as plain values rather than ORM objects - dates as the ISO strings SQLite stores them as and prices cast to
+# floats (SQLite's NUMERIC affinity stores whole numbers as integers, which would otherwise come back as ints)
+HISTORICAL_DATA_COLUMNS = (
+    type_coerce(HistoricalData.date, String).label(HistoricalData.date.name),
+    HistoricalData.ticker_id,
+    cast(HistoricalData.low, Float).label(HistoricalData.low.name),
+    cast(HistoricalData.high, Float).label(HistoricalData.high.name),
+    cast(HistoricalData.open, Float).label(HistoricalData.open.name),
+    cast(HistoricalData.close, Float).label(HistoricalData.close.name),
+    cast(HistoricalData.volume, Float).label(HistoricalData.volume.name)
+)
+PCT_CHANGE_COLUMN_NAME = '% change'
+# Columns of the rows of a bulk import, in the order of their parameters (see build_historical_import_statement)
+HISTORICAL_IMPORT_COLUMN_NAMES = [
+    HistoricalData.date.name,
+    HistoricalData.ticker_id.name,
+    HistoricalData.low.name,
+    HistoricalData.high.name,
+    HistoricalData.open.name,
+    HistoricalData.close.name,
+    HistoricalData.volume.name
+]
+# Data version which is incremented by every write to the tickers table
+TICKERS_DATA_VERSION_KEY = 'tickers'
+# Data version which is incremented when all the historical data is deleted - the historical data of a ticker also has a
+# version of its own (see build_historical_data_version_key)
+HISTORICAL_DATA_VERSION_KEY = 'historical'
+
+
+def build_historical_range_statement(start: date, end: date, ticker_id: int, limit: Optional[int] = None) -> Select:
+    """
+    Given a date range and a ticker id, build a statement which selects the historical data columns of that ticker in
+    the range, ordered by date - served by the (ticker_id, date) index
+
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the earliest ones), None for all of them
+    :return: The statement
+    """
+    statement = select(*HISTORICAL_DATA_COLUMNS).where(
+        HistoricalData.ticker_id == ticker_id, HistoricalData.date >= start, HistoricalData.date <= end
+    ).order_by(HistoricalData.date)
+    return statement.limit(limit) if limit else statement
+
+
+def build_historical_range_with_pct_change_statement(
+        start: date,
+        end: date,
+        ticker_id: int,
+        limit: Optional[int] = None
+) -> Select:
+    """
+    Given a date range and a ticker id, build a statement which selects the historical data columns of that ticker in
+    the range, ordered by date, followed by the percentage change of the close computed by the database with
+    LAG(close) OVER (PARTITION BY ticker_id ORDER BY date) - 0 for the first row, as with apiutils.add_pct_change
+
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the earliest ones), None for all of them
+    :return: The statement
+    """
+    if limit:
+        # The window is computed over the limited rows only - applied to the whole range, it would have to scan every
+        # row up to the end date before the limit could be applied
+        return _select_with_pct_change(
+            statement=build_historical_range_statement(start=start, end=end, ticker_id=ticker_id, limit=limit)
+        )
+
+    return select(*HISTORICAL_DATA_COLUMNS, _build_pct_change_column()).where(
+        HistoricalData.ticker_id == ticker_id, HistoricalData.date >= start, HistoricalData.date <= end
+    ).order_by(HistoricalData.date)
+
+
+def build_historical_lookback_statement(before: date, ticker_id: int, limit: int) -> Select:
+    """
+    Given a date and a ticker id, build a statement which selects the historical data columns of the rows of that
+    ticker which precede the date, latest first - a backward range scan of the (ticker_id, date) index
+
+    :param before: The date, excluded
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the latest ones)
+    :return: The statement
+    """
+    return select(*HISTORICAL_DATA_COLUMNS).where(
+        HistoricalData.ticker_id == ticker_id, HistoricalData.date < before
+    ).order_by(HistoricalData.date.desc()).limit(limit)
+
+
+def build_historical_extent_statement(ticker_id: int) -> Select:
+    """
+    Given a ticker id, build a statement which selects the first and last dates of the historical data of that ticker
+    and its number of rows - a scan of the (ticker_id, date) index only
+
+    :param ticker_id: Ticker id
+    :return: The statement
+    """
+    return select(
+        type_coerce(func.min(HistoricalData.date), String).label('first_date'),
+        type_coerce(func.max(HistoricalData.date), String).label('last_date'),
+        func.count().label('records')
+    ).where(HistoricalData.ticker_id == ticker_id)
+
+
+def build_historical_gaps_statement(ticker_id: int) -> Select:
+    """
+    Given a ticker id, build a statement which selects the gaps in the daily historical data of that ticker - the
+    pairs of consecutive dates (the one before the gap and the one after it) which are more than a day apart, ordered
+    by date, found with LAG(date) OVER (ORDER BY date)
+
+    :param ticker_id: Ticker id
+    :return: The statement
+    """
+    dates = select(
+        HistoricalData.date.label('date'),
+        func.lag(HistoricalData.date).over(order_by=HistoricalData.date).label('previous_date')
+    ).where(HistoricalData.ticker_id == ticker_id).subquery()
+    return select(
+        type_coerce(dates.c.previous_date, String).label('previous_date'),
+        type_coerce(dates.c.date, String).label('date')
+    ).where(func.julianday(dates.c.date) - func.julianday(dates.c.previous_date) > 1).order_by(dates.c.date)
+
+
+def build_historical_batch_statement(start: date, end: date, ticker_ids: list[int]) -> Select:
+    """
+    Given a date range and several ticker ids, build a statement which selects the historical data columns of all those
+    tickers in the range, ordered by ticker id and date - one range scan of the (ticker_id, date) index per ticker
+
+    :param start: Start date
+    :param end: End date
+    :param ticker_ids: Ticker ids
+    :return: The statement
+    """
+    return select(*HISTORICAL_DATA_COLUMNS).where(
+        HistoricalData.ticker_id.in_(ticker_ids), HistoricalData.date >= start, HistoricalData.date <= end
+    ).order_by(HistoricalData.ticker_id, HistoricalData.date)
+
+
+def build_historical_batch_with_pct_change_statement(start: date, end: date, ticker_ids: list[int]) -> Select:
+    """
+    Given a date range and several ticker ids, build a statement which selects the historical data columns of all those
+    tickers in the range, ordered by ticker id and date, followed by the percentage change of the close of each ticker
+    computed by the database
+
+    :param start: Start date
+    :param end: End date
+    :param ticker_ids: Ticker ids
+    :return: The statement
+    """
+    return select(*HISTORICAL_DATA_COLUMNS, _build_pct_change_column()).where(
+        HistoricalData.ticker_id.in_(ticker_ids), HistoricalData.date >= start, HistoricalData.date <= end
+    ).order_by(HistoricalData.ticker_id, HistoricalData.date)
+
+
+def build_historical_buckets_statement(
+        start: date,
+        end: date,
+        ticker_id: int,
+        granularity: GetHistoricalDataGranularity,
+        bucket_days: Optional[int] = None
+) -> Select:
+    """
+    Given a date range and a ticker id, build a statement which aggregates the historical data of that ticker in the
+    range into buckets (first open, max high, min low, last close, sum of the volumes), ordered by date - the date of a
+    bucket is the date it starts on, so the range should be made of whole buckets (see apiutils.get_bucket_range)
+
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param granularity: Calendar period of the buckets, ignored if bucket_days is set
+    :param bucket_days: Number of days of the buckets, counted from the start date
+    :return: The statement, which selects the same columns as build_historical_range_statement
+    """
+    if bucket_days:
+        days_since_start = cast(func.julianday(HistoricalData.date) - func.julianday(start.isoformat()), Integer)
+        bucket_index = days_since_start / bucket_days
+        bucket_start = func.date(start.isoformat(), func.printf('+%d days', bucket_index * bucket_days))
+    elif granularity == GetHistoricalDataGranularity.week:
+        bucket_start = func.date(HistoricalData.date, 'weekday 0', '-6 days')
+    elif granularity == GetHistoricalDataGranularity.month:
+        bucket_start = func.strftime('%Y-%m-01', HistoricalData.date)
+    elif granularity == GetHistoricalDataGranularity.year:
+        bucket_start = func.strftime('%Y-01-01', HistoricalData.date)
+    else:
+        return build_historical_range_statement(start=start, end=end, ticker_id=ticker_id)
+
+    buckets = select(
+        type_coerce(bucket_start, String).label(HistoricalData.date.name),
+        HistoricalData.ticker_id,
+        func.min(HistoricalData.date).label('first_date'),
+        func.max(HistoricalData.date).label('last_date'),
+        func.min(cast(HistoricalData.low, Float)).label(HistoricalData.low.name),
+        func.max(cast(HistoricalData.high, Float)).label(HistoricalData.high.name),
+        func.sum(cast(HistoricalData.volume, Float)).label(HistoricalData.volume.name)
+    ).where(
+        HistoricalData.ticker_id == ticker_id, HistoricalData.date >= start, HistoricalData.date <= end
+    ).group_by(bucket_start).subquery()
+    # The open and close of a bucket are those of its first and last days, looked up with the (ticker_id, date) index
+    first_day, last_day = aliased(HistoricalData), aliased(HistoricalData)
+    return select(
+        buckets.c.date,
+        buckets.c.ticker_id,
+        buckets.c.low,
+        buckets.c.high,
+        cast(first_day.open, Float).label(HistoricalData.open.name),
+        cast(last_day.close, Float).label(HistoricalData.close.name),
+        buckets.c.volume
+    ).join(
+        first_day, and_(first_day.ticker_id == buckets.c.ticker_id, first_day.date == buckets.c.first_date)
+    ).join(
+        last_day, and_(last_day.ticker_id == buckets.c.ticker_id, last_day.date == buckets.c.last_date)
+    ).order_by(buckets.c.date)
+
+
+def build_historical_buckets_with_pct_change_statement(
+        start: date,
+        end: date,
+        ticker_id: int,
+        granularity: GetHistoricalDataGranularity,
+        bucket_days: Optional[int] = None
+) -> Select:
+    """
+    Given a date range and a ticker id, build a statement which aggregates the historical data of that ticker in the
+    range into buckets as with build_historical_buckets_statement, followed by the percentage change of the close of the
+    buckets computed by the database - 0 for the first bucket
+
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param granularity: Calendar period of the buckets, ignored if bucket_days is set
+    :param bucket_days: Number of days of the buckets, counted from the start date
+    :return: The statement
+    """
+    return _select_with_pct_change(statement=build_historical_buckets_statement(
+        start=start, end=end, ticker_id=ticker_id, granularity=granularity, bucket_days=bucket_days
+    ))
+
+
+def _select_with_pct_change(statement: Select) -> Select:
+    rows = statement.subquery()
+    close = rows.c[HistoricalData.close.name]
+    pct_change = func.coalesce((close / func.lag(close).over(order_by=rows.c.date) - 1) * 100, 0.0)
+    return select(*rows.c, pct_change.label(PCT_CHANGE_COLUMN_NAME)).order_by(rows.c.date)
+
+
+def _build_pct_change_column():
+    close = cast(HistoricalData.close, Float)
+    previous_close = func.lag(close).over(partition_by=HistoricalData.ticker_id, order_by=HistoricalData.date)
+    return func.coalesce((close / previous_close - 1) * 100, 0.0).label(PCT_CHANGE_COLUMN_NAME)
+
+
+def build_data_version_statement(key: str) -> Select:
+    """
+    Given a data version key, build a statement which selects the version
+
+    :param key: Data version key
+    :return: The statement
+    """
+    return select(DataVersion.version).where(DataVersion.key == key)
+
+
+def build_bump_data_version_statement(key: str) -> Insert:
+    """
+    Given a data version key, build a statement which increments the version (starting from 1 if there is none yet)
+
+    :param key: Data version key
+    :return: The statement
+    """
+    updated_at = datetime.utcnow()
+    return sqlite_insert(DataVersion).values(key=key, version=1, updated_at=updated_at).on_conflict_do_update(
+        index_elements=[DataVersion.key], set_={'version': DataVersion.version + 1, 'updated_at': updated_at}
+    )
+
+
+def build_data_versions_statement(keys: list[str]) -> Select:
+    """
+    Given data version keys, build a statement which selects their keys, versions and update times
+
+    :param keys: Data version keys
+    :return: The statement
+    """
+    return select(DataVersion.key, DataVersion.version, DataVersion.updated_at).where(DataVersion.key.in_(keys))
+
+
+def build_historical_data_version_key(ticker_id: int) -> str:
+    """
+    Given a ticker id, get the key of the data version of its historical data
+
+    :param ticker_id: Ticker id
+    :return: The data version key
+    """
+    return f'{HISTORICAL_DATA_VERSION_KEY}:{ticker_id}'
+
+
+def retrieve_data_version(db: Session, key: str) -> int:
+    """
+    Given a data version key, get the version
+
+    :param db: Database session
+    :param key: Data version key
+    :return: The version, 0 if the data has never been written to
+    """
+    return db.execute(build_data_version_statement(key=key)).scalar() or 0
+
+
+def bump_data_version(db: Session, key: str) -> int:
+    """
+    Given a data version key, increment the version as part of the current transaction - which the caller commits along
+    with the write the version stands for
+
+    :param db: Database session
+    :param key: Data version key
+    :return: The incremented version
+    """
+    db.execute(build_bump_data_version_statement(key=key))
+    return retrieve_data_version(db=db, key=key)
+
+
+def retrieve_historical_data_versions(db: Session, ticker_id: int) -> tuple[tuple[int, int], Optional[datetime]]:
+    """
+    Given a ticker id, get the versions which identify the state of its historical data, without reading the data
+
+    :param db: Database session
+    :param ticker_id: Ticker id
+    :return: Tuple of ((version of all the historical data, version of the historical data of the ticker), time of the
+    last change in UTC - None if the data has not been written to since versions were introduced)
+    """
+    keys = [HISTORICAL_DATA_VERSION_KEY, build_historical_data_version_key(ticker_id=ticker_id)]
+    versions = {row.key: row for row in db.execute(build_data_versions_statement(keys=keys))}
+    return parse_historical_data_versions(keys=keys, versions=versions)
+
+
+def parse_historical_data_versions(keys: list[str], versions: dict) -> tuple[tuple[int, int], Optional[datetime]]:
+    """
+    Given data version keys and the rows selected for them by key, get the versions in the order of the keys (0 for the
+    keys which have no row yet) and the latest update time
+
+    :param keys: Data version keys
+    :param versions: Rows of build_data_versions_statement by key
+    :return: Tuple of (versions, latest update time - None if none of the keys has a row)
+    """
+    updated_at = [versions[key].updated_at for key in keys if key in versions]
+    return tuple(versions[key].version if key in versions else 0 for key in keys), max(updated_at, default=None)
+
+
+def load_ticker_registry(db: Session):
+    """
+    Load all the tickers into the ticker registry, unless it is already up-to-date with the tickers data version
+
+    :param db: Database session
+    """
+    # The version is read before the tickers - if a write commits in between, the registry ends up labelled with the
+    # older version and is reloaded on the next check
+    version = retrieve_data_version(db=db, key=TICKERS_DATA_VERSION_KEY)
+    if not ticker_registry.confirm(version=version):
+        ticker_registry.replace(version=version, tickers=db.execute(select(Ticker.ticker, Ticker.id)).all())
+
+
+def retrieve_ticker_by_name(db: Session, ticker_name: str, verify: bool = False) -> Optional[Ticker]:
     """
-    Given a ticker_name name (unique), get a ticker_name record
+    Given a ticker_name name (unique), get a ticker_name record from the ticker registry - the database is only queried
+    for the tickers data version when the registry has not been checked recently, when the ticker is missing from it or
+    when verify is set
 
+    :param db: Database session
     :param ticker_name: Name of the ticker_name
-    :return: Ticker record if it exists, None otherwise
+    :param verify: Check the registry against the database even if it has been checked recently (before writes)
+    :return: Ticker record (not attached to the session) if it exists, None otherwise
     """
-    return db.query(Ticker).filter(Ticker.ticker == ticker_name).first()
+    ticker_id, is_fresh = ticker_registry.lookup(ticker_name=ticker_name)
+    if ticker_id is None or not is_fresh or verify:
+        load_ticker_registry(db=db)
+        ticker_id, _ = ticker_registry.lookup(ticker_name=ticker_name)
+    return Ticker(id=ticker_id, ticker=ticker_name) if ticker_id is not None else None
 
 
-def retrieve_historical_by_date_range_and_ticker_id(start: date, end: date, ticker_id: int) -> list[HistoricalData]:
+def retrieve_tickers_by_names(db: Session, ticker_names: list[str]) -> list[Ticker]:
     """
-    Given a date range and a ticker_name id, get all relevant historical data according to those details
+    Given several ticker names, get the ticker records of those which exist from the ticker registry - the database is
+    queried at most once, for the tickers data version, as with retrieve_ticker_by_name
 
+    :param db: Database session
+    :param ticker_names: Names of the tickers
+    :return: Ticker records (not attached to the session) of the tickers which exist, in the order of the names
+    """
+    lookups = [ticker_registry.lookup(ticker_name=ticker_name) for ticker_name in ticker_names]
+    if any(ticker_id is None or not is_fresh for ticker_id, is_fresh in lookups):
+        load_ticker_registry(db=db)
+        lookups = [ticker_registry.lookup(ticker_name=ticker_name) for ticker_name in ticker_names]
+    return [
+        Ticker(id=ticker_id, ticker=ticker_name)
+        for ticker_name, (ticker_id, _) in zip(ticker_names, lookups) if ticker_id is not None
+    ]
+
+
+def retrieve_historical_by_date_range_and_ticker_id(
+        db: Session,
+        start: date,
+        end: date,
+        ticker_id: int,
+        limit: Optional[int] = None
+) -> list[Row]:
+    """
+    Given a date range and a ticker_name id, get all relevant historical data according to those details, ordered by
+    date
+
+    :param db: Database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the earliest ones), None for all of them
+    :return: List of (date, ticker_id, low, high, open, close, volume) rows that meet the criteria
+    """
+    return db.execute(build_historical_range_statement(start=start, end=end, ticker_id=ticker_id, limit=limit)).all()
+
+
+def retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+        db: Session,
+        start: date,
+        end: date,
+        ticker_id: int,
+        limit: Optional[int] = None
+) -> list[Row]:
+    """
+    Given a date range and a ticker_name id, get all relevant historical data according to those details, ordered by
+    date, with the percentage change of the close already computed by the database
+
+    :param db: Database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the earliest ones), None for all of them
+    :return: List of (date, ticker_id, low, high, open, close, volume, % change) rows that meet the criteria
+    """
+    return db.execute(
+        build_historical_range_with_pct_change_statement(start=start, end=end, ticker_id=ticker_id, limit=limit)
+    ).all()
+
+
+def retrieve_historical_before_date_and_ticker_id(db: Session, before: date, ticker_id: int, limit: int) -> list[Row]:
+    """
+    Given a date and a ticker id, get the historical data which immediately precedes the date (example the history
+    technical indicators are warmed up with), ordered by date
+
+    :param db: Database session
+    :param before: The date, excluded
+    :param ticker_id: Ticker id
+    :param limit: Maximum number of rows (the latest ones)
+    :return: List of at most limit (date, ticker_id, low, high, open, close, volume) rows
+    """
+    if limit <= 0:
+        return []
+    rows = db.execute(build_historical_lookback_statement(before=before, ticker_id=ticker_id, limit=limit)).all()
+    return rows[::-1]
+
+
+def retrieve_historical_extent_by_ticker_id(db: Session, ticker_id: int) -> Row:
+    """
+    Given a ticker id, get the first and last dates of its historical data and its number of rows
+
+    :param db: Database session
+    :param ticker_id: Ticker id
+    :return: Row of (first date, last date, number of rows) - the dates are None if there is no historical data
+    """
+    return db.execute(build_historical_extent_statement(ticker_id=ticker_id)).one()
+
+
+def retrieve_historical_gaps_by_ticker_id(db: Session, ticker_id: int) -> list[Row]:
+    """
+    Given a ticker id, get the gaps in its daily historical data
+
+    :param db: Database session
+    :param ticker_id: Ticker id
+    :return: Rows of (the date before a gap, the date after it), ordered by date
+    """
+    return db.execute(build_historical_gaps_statement(ticker_id=ticker_id)).all()
+
+
+def retrieve_historical_buckets_by_date_range_and_ticker_id(
+        db: Session,
+        start: date,
+        end: date,
+        ticker_id: int,
+        granularity: GetHistoricalDataGranularity,
+        bucket_days: Optional[int] = None
+) -> list[Row]:
+    """
+    Given a date range and a ticker_name id, get the historical data of that ticker in the range aggregated into
+    buckets, ordered by date
+
+    :param db: Database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param granularity: Calendar period of the buckets, ignored if bucket_days is set
+    :param bucket_days: Number of days of the buckets, counted from the start date
+    :return: List of (date, ticker_id, low, high, open, close, volume) rows, one per bucket
+    """
+    return db.execute(build_historical_buckets_statement(
+        start=start, end=end, ticker_id=ticker_id, granularity=granularity, bucket_days=bucket_days
+    )).all()
+
+
+def retrieve_historical_buckets_with_pct_change_by_date_range_and_ticker_id(
+        db: Session,
+        start: date,
+        end: date,
+        ticker_id: int,
+        granularity: GetHistoricalDataGranularity,
+        bucket_days: Optional[int] = None
+) -> list[Row]:
+    """
+    Given a date range and a ticker_name id, get the historical data of that ticker in the range aggregated into
+    buckets, ordered by date, with the percentage change of the close of the buckets already computed by the database
+
+    :param db: Database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_id: Ticker id
+    :param granularity: Calendar period of the buckets, ignored if bucket_days is set
+    :param bucket_days: Number of days of the buckets, counted from the start date
+    :return: List of (date, ticker_id, low, high, open, close, volume, % change) rows, one per bucket
+    """
+    return db.execute(build_historical_buckets_with_pct_change_statement(
+        start=start, end=end, ticker_id=ticker_id, granularity=granularity, bucket_days=bucket_days
+    )).all()
+
+
+def retrieve_historical_by_date_range_and_ticker_ids(
+        db: Session,
+        start: date,
+        end: date,
+        ticker_ids: list[int]
+) -> list[Row]:
+    """
+    Given a date range and several ticker ids, get all relevant historical data of those tickers in a single query,
+    ordered by ticker id and date
+
+    :param db: Database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_ids: Ticker ids
+    :return: List of (date, ticker_id, low, high, open, close, volume) rows that meet the criteria
+    """
+    return db.execute(build_historical_batch_statement(start=start, end=end, ticker_ids=ticker_ids)).all()
+
+
+def retrieve_historical_with_pct_change_by_date_range_and_ticker_ids(
+        db: Session,
+        start: date,
+        end: date,
+        ticker_ids: list[int]
+) -> list[Row]:
+    """
+    Given a date range and several ticker ids, get all relevant historical data of those tickers in a single query,
+    ordered by ticker id and date, with the percentage change of the close of each ticker computed by the database
+
+    :param db: Database session
+    :param start: Start date
+    :param end: End date
+    :param ticker_ids: Ticker ids
+    :return: List of (date, ticker_id, low, high, open, close, volume, % change) rows that meet the criteria
+    """
+    return db.execute(
+        build_historical_batch_with_pct_change_statement(start=start, end=end, ticker_ids=ticker_ids)
+    ).all()
+
+
+def stream_historical_by_date_range_and_ticker_id(
+        db: Session,
+        start: date,
+        end: date,
+        ticker_id: int,
+        batch_size: int = HISTORICAL_STREAM_BATCH_SIZE
+) -> Iterator[list[Row]]:
+    """
+    Given a date range and a ticker_name id, lazily fetch all relevant historical data from the database cursor in
+    batches, ordered by date
+
+    :param db: Database session
     :param start: Start date
     :param end: End date
     :param ticker_id: Ticker id
-    :return: List of HistoricalData records that meet the criteria
+    :param batch_size: The maximum number of rows per batch
+    :return: Iterator of batches of (date, ticker_id, low, high, open, close, volume) rows that meet the criteria
     """
-    return db.query(HistoricalData).filter(HistoricalData.date >= start). \
-        filter(HistoricalData.date <= end). \
-        filter(HistoricalData.ticker_id == ticker_id)
+    statement = build_historical_range_statement(start=start, end=end, ticker_id=ticker_id)
+    # Without yield_per the ORM-enabled select buffers the whole result before the first batch is returned
+    result = db.execute(statement.execution_options(yield_per=batch_size))
+    yield from result.partitions(batch_size)
 
 
-def create_ticker(ticker_name: str) -> Ticker:
+def create_ticker(db: Session, ticker_name: str) -> Ticker:
     """
     Given a ticker_name name, create a ticker_name record and insert it into the database
 
+    :param db: Database session
     :param ticker_name: The name of the ticker_name
     :return: Ticker record that was written to the database
     """
     ticker_record = Ticker()
     ticker_record.ticker = ticker_name
     db.add(ticker_record)
+    db.flush()
+    version = bump_data_version(db=db, key=TICKERS_DATA_VERSION_KEY)
     db.commit()
     db.refresh(ticker_record)
+    ticker_registry.add(ticker_name=ticker_name, ticker_id=ticker_record.id, version=version)
     return ticker_record
 
 
-def create_historical(records: list[HistoricalData]):
+def create_historical(
+        db: Session,
+        records: Iterable[dict],
+        chunk_size: int = HISTORICAL_INSERT_CHUNK_SIZE,
+        commit: bool = True
+) -> int:
+    """
+    Given historical data rows, bulk insert them into the database in chunks (one executemany per chunk) within a
+    single transaction
+
+    :param db: Database session
+    :param records: Iterable of dicts which map the historical database table column names to values
+    :param chunk_size: The maximum number of rows sent to the database per executemany call
+    :param commit: Commit the transaction - False leaves it to the caller, which may write more in it
+    :return: The number of historical data rows which were inserted
+    """
+    statement = insert(HistoricalData.__table__)
+    num_inserted = 0
+    ticker_ids = set()
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        db.execute(statement, chunk)
+        num_inserted += len(chunk)
+        ticker_ids.update(record['ticker_id'] for record in chunk)
+    for ticker_id in sorted(ticker_ids):
+        bump_data_version(db=db, key=build_historical_data_version_key(ticker_id=ticker_id))
+    if commit:
+        db.commit()
+    return num_inserted
+
+
+def build_historical_upsert_statement(on_conflict: PostHistoricalDataConflictAction) -> Insert:
+    """
+    Given what should happen to candlesticks which are already stored, build an INSERT ... ON CONFLICT statement for the
+    historical data table
+
+    :param on_conflict: Either overwrite the stored candlestick (DO UPDATE) or keep it (DO NOTHING)
+    :return: The statement, ready to be executed with a list of row parameters
+    """
+    statement = sqlite_insert(HistoricalData.__table__)
+    conflict_columns = [HistoricalData.ticker_id.name, HistoricalData.date.name]
+    if on_conflict == PostHistoricalDataConflictAction.update:
+        return statement.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={
+                column.name: statement.excluded[column.name]
+                for column in HistoricalData.__table__.columns if column.name not in conflict_columns + ['id']
+            }
+        )
+    return statement.on_conflict_do_nothing(index_elements=conflict_columns)
+
+
+@lru_cache(maxsize=16)
+def build_historical_import_statement(on_conflict: PostHistoricalDataConflictAction, num_rows: int) -> str:
+    """
+    Given what should happen to candlesticks which are already stored and a number of rows, build the SQL of an INSERT
+    ... ON CONFLICT statement of the historical data table (see build_historical_upsert_statement) which inserts that
+    many rows at once - SQLite then binds the parameters of all of them in one go, which is several times faster than
+    executing a statement per row. Compiled once per number of rows
+
+    The parameters are numbered (?NNN) column by column, so that the parameters of consecutive rows are slices of
+    their columns put one after the other, rather than rows which have to be built value by value
+
+    :param on_conflict: Either overwrite the stored candlestick (DO UPDATE) or keep it (DO NOTHING)
+    :param num_rows: Number of rows of the statement
+    :return: The SQL - its parameters are the values of the rows of every HISTORICAL_IMPORT_COLUMN_NAMES column, column
+    after column
+    """
+    statement = build_historical_upsert_statement(on_conflict=on_conflict).values([
+        {column_name: bindparam(f'{column_name}_{row}') for column_name in HISTORICAL_IMPORT_COLUMN_NAMES}
+        for row in range(num_rows)
+    ])
+    # The compiled VALUES have a positional parameter per row and column, row after row - and the rest of the statement
+    # none, as it only refers to the excluded values
+    parts = str(statement.compile(dialect=sqlite.dialect())).split('?')
+    num_columns = len(HISTORICAL_IMPORT_COLUMN_NAMES)
+    return parts[0] + ''.join(
+        f'?{index % num_columns * num_rows + index // num_columns + 1}{part}' for index, part in enumerate(parts[1:])
+    )
+
+
+def build_historical_count_statement(ticker_id: int, start: date, end: date) -> Select:
+    """
+    Given a ticker id and a date range, build a statement which counts the stored historical data rows in that range
+
+    :param ticker_id: Ticker id
+    :param start: Start date
+    :param end: End date
+    :return: The statement
+    """
+    return select(func.count()).select_from(HistoricalData).where(
+        HistoricalData.ticker_id == ticker_id, HistoricalData.date >= start, HistoricalData.date <= end
+    )
+
+
+def deduplicate_historical_records(records: list[dict]) -> list[dict]:
+    """
+    Given historical data rows, keep only the last row of every (ticker_id, date) - the one which an upsert would leave
+    stored - so that a chunk holds each candlestick once and its counts before and after tell the inserted rows apart
+
+    :param records: List of dicts which map the historical database table column names to values
+    :return: The rows without duplicates, in the order of the first row of every (ticker_id, date)
+    """
+    unique_records = {(record['ticker_id'], record['date']): record for record in records}
+    if len(unique_records) == len(records):
+        return records
+    return list(unique_records.values())
+
+
+def build_historical_tickers_count_statement(ticker_ids: list[int]) -> Select:
+    """
+    Given ticker ids, build a statement which counts the stored historical data rows of those tickers
+
+    :param ticker_ids: Ticker ids
+    :return: The statement
+    """
+    return select(func.count()).select_from(HistoricalData).where(HistoricalData.ticker_id.in_(ticker_ids))
+
+
+def build_tickers_insert_statement() -> Insert:
+    """
+    Build an INSERT ... ON CONFLICT DO NOTHING statement of the tickers table, which inserts only the tickers which do
+    not exist yet
+
+    :return: The statement
+    """
+    return sqlite_insert(Ticker.__table__).on_conflict_do_nothing(index_elements=[Ticker.ticker.name])
+
+
+def upsert_historical(
+        db: Session,
+        ticker_id: int,
+        records: Iterable[dict],
+        on_conflict: PostHistoricalDataConflictAction,
+        chunk_size: int = HISTORICAL_INSERT_CHUNK_SIZE,
+        commit: bool = True
+) -> tuple[int, int, int]:
+    """
+    Given historical data rows of a ticker, bulk insert them into the database in chunks within a single transaction,
+    either updating or skipping the candlesticks which are already stored
+
+    :param db: Database session
+    :param ticker_id: The ticker id associated with the data
+    :param records: Iterable of dicts which map the historical database table column names to values - of the rows of
+    the same date within a chunk, only the last one is written and counted
+    :param on_conflict: What to do with candlesticks which are already stored
+    :param chunk_size: The maximum number of rows sent to the database per executemany call
+    :param commit: Commit the transaction - False leaves it to the caller, which may write more in it
+    :return: Tuple of (number of inserted rows, number of updated rows, number of skipped rows)
     """
-    Given a list of historical data records, add them to the database
+    statement = build_historical_upsert_statement(on_conflict=on_conflict)
+    num_inserted, num_existing = 0, 0
+    records = iter(records)
+    while chunk := list(islice(records, chunk_size)):
+        chunk = deduplicate_historical_records(records=chunk)
+        # The rows of the ticker within the date range of the chunk only change because of this statement, so the
+        # difference in their count is the number of newly inserted rows
+        count_statement = build_historical_count_statement(
+            ticker_id=ticker_id,
+            start=min(record['date'] for record in chunk),
+            end=max(record['date'] for record in chunk)
+        )
+        count_before = db.execute(count_statement).scalar()
+        db.execute(statement, chunk)
+        chunk_inserted = db.execute(count_statement).scalar() - count_before
+        num_inserted += chunk_inserted
+        num_existing += len(chunk) - chunk_inserted
+    if num_inserted or (num_existing and on_conflict == PostHistoricalDataConflictAction.update):
+        bump_data_version(db=db, key=build_historical_data_version_key(ticker_id=ticker_id))
+    if commit:
+        db.commit()
+
+    if on_conflict == PostHistoricalDataConflictAction.update:
+        return num_inserted, num_existing, 0
+    return num_inserted, 0, num_existing
 
-    :param records: List of historical data records
-    :return: The historical data records which were saved to the database
+
+def create_tickers(db: Session, ticker_names: list[str]) -> tuple[dict[str, int], int]:
     """
-    db.add_all(records)
+    Given ticker names, insert those which do not exist yet as part of the current transaction - which the caller
+    commits along with the historical data of the tickers
+
+    :param db: Database session
+    :param ticker_names: Names of the tickers
+    :return: Tuple of (ticker ids by name of all the tickers, number of inserted tickers)
+    """
+    num_created = db.execute(
+        build_tickers_insert_statement(), [{Ticker.ticker.name: ticker_name} for ticker_name in ticker_names]
+    ).rowcount
+    if num_created:
+        # The registry is reloaded once the new tickers are looked up, after the commit
+        bump_data_version(db=db, key=TICKERS_DATA_VERSION_KEY)
+    ticker_ids = dict(db.execute(select(Ticker.ticker, Ticker.id).where(Ticker.ticker.in_(ticker_names))).all())
+    return ticker_ids, num_created
+
+
+def import_historical(
+        db: Session,
+        row_groups: Iterable[Sequence],
+        ticker_ids: Iterable[int],
+        on_conflict: PostHistoricalDataConflictAction,
+        statements_per_call: int = HISTORICAL_IMPORT_STATEMENTS_PER_CALL
+) -> tuple[int, int, int]:
+    """
+    Given the historical data rows of tickers in groups (example from bulkimport.build_import_row_groups), bulk insert
+    them into the database with one multi-row statement per group (see build_historical_import_statement), several
+    statements per executemany call, and commit them - along with whatever the transaction holds already (example the
+    tickers of create_tickers)
+
+    :param db: Database session
+    :param row_groups: Parameters of groups of consecutive rows: the values of the rows of every
+    HISTORICAL_IMPORT_COLUMN_NAMES column, column after column - the groups of the same number of rows share their
+    statement. Every ticker and date appears at most once (see bulkimport.drop_duplicate_rows), as every row which is
+    not inserted is counted as an updated or skipped one
+    :param ticker_ids: The ids of the tickers of the rows
+    :param on_conflict: What to do with candlesticks which are already stored
+    :param statements_per_call: The maximum number of statements sent to the database per executemany call
+    :return: Tuple of (number of inserted rows, number of updated rows, number of skipped rows)
+    """
+    ticker_ids = sorted(set(ticker_ids))
+    count_statement = build_historical_tickers_count_statement(ticker_ids=ticker_ids)
+    count_before = db.execute(count_statement).scalar()
+    connection = db.connection()
+    num_received = 0
+    for num_params, groups in groupby(row_groups, key=len):
+        sql = build_historical_import_statement(
+            on_conflict=on_conflict, num_rows=num_params // len(HISTORICAL_IMPORT_COLUMN_NAMES)
+        )
+        while chunk := list(islice(groups, statements_per_call)):
+            connection.exec_driver_sql(sql, chunk)
+            num_received += len(chunk) * num_params // len(HISTORICAL_IMPORT_COLUMN_NAMES)
+    num_inserted = db.execute(count_statement).scalar() - count_before
+    num_existing = num_received - num_inserted
+    if num_inserted or (num_existing and on_conflict == PostHistoricalDataConflictAction.update):
+        for ticker_id in ticker_ids:
+            bump_data_version(db=db, key=build_historical_data_version_key(ticker_id=ticker_id))
     db.commit()
 
+    if on_conflict == PostHistoricalDataConflictAction.update:
+        return num_inserted, num_existing, 0
+    return num_inserted, 0, num_existing
+
 
-def delete_all_ticker_records() -> int:
+def delete_all_ticker_records(db: Session) -> int:
     """
     Delete all ticker_name records
 
+    :param db: Database session
     :return: The number of deleted ticker records
     """
     num_removed_tickers = db.query(Ticker).delete()
+    version = bump_data_version(db=db, key=TICKERS_DATA_VERSION_KEY)
     db.commit()
+    ticker_registry.clear(version=version)
     return num_removed_tickers
 
 
-def delete_all_historical_records() -> int:
+def delete_all_historical_records(db: Session) -> int:
     """
     Delete all historical data records
 
+    :param db: Database session
     :return: The deleted historical data records
     """
     num_removed_historical_data = db.query(HistoricalData).delete()
+    bump_data_version(db=db, key=HISTORICAL_DATA_VERSION_KEY)
     db.commit()
     return num_removed_historical_data
@@ -1,12 +1,213 @@
-from sqlalchemy import create_engine
+from typing import AsyncIterator, Iterable
+
+from sqlalchemy import Index, create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.api.config import SQLALCHEMY_DATABASE_URL, SQLALCHEMY_ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, \
+    DB_POOL_TIMEOUT, DB_BUSY_TIMEOUT
+
+
+def create_db_engine(database_url: str) -> Engine:
+    """
+    Given a database URL, create an engine backed by a connection pool which is sized according to the configuration
+
+    :param database_url: SQLAlchemy database URL
+    :return: The engine
+    """
+    db_engine = create_engine(
+        database_url,
+        connect_args={'check_same_thread': False, 'timeout': DB_BUSY_TIMEOUT},
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT
+    )
+    event.listen(db_engine, 'connect', _set_sqlite_pragmas)
+    return db_engine
+
+
+def create_unique_index(db_engine: Engine, index: Index, replaced_index_names: Iterable[str] = ()) -> int:
+    """
+    Given an engine and a unique index of a table which has an id primary key, create the index if it does not exist -
+    deleting first the rows which break it, all but the last inserted one (largest id) of every combination of its
+    columns - and then drop the indexes it replaces. create_all only creates the indexes of the tables it creates, so
+    this migrates the existing tables of databases created by earlier versions, in a single transaction
+
+    :param db_engine: The engine of the database
+    :param index: The unique index
+    :param replaced_index_names: The names of the indexes which are dropped once the index exists
+    :return: Number of rows which have been deleted
+    :raise: RuntimeError if the index does not exist after it has been created - nothing is dropped then
+    """
+    table_name = index.table.name
+    column_names = ', '.join(column.name for column in index.columns)
+    num_deleted = 0
+    with db_engine.begin() as connection:
+        if not _index_exists(connection=connection, index_name=index.name):
+            num_deleted = connection.exec_driver_sql(
+                f'DELETE FROM {table_name} WHERE id NOT IN (SELECT MAX(id) FROM {table_name} GROUP BY {column_names})'
+            ).rowcount
+            connection.exec_driver_sql(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS {index.name} ON {table_name} ({column_names})'
+            )
+        # The replaced indexes serve the reads until the index which replaces them is there
+        if not _index_exists(connection=connection, index_name=index.name):
+            raise RuntimeError(f'Index {index.name} could not be created on {table_name}')
+        for index_name in replaced_index_names:
+            connection.exec_driver_sql(f'DROP INDEX IF EXISTS {index_name}')
+    return num_deleted
+
+
+def index_exists(db_engine: Engine, index_name: str) -> bool:
+    """
+    Given an engine and the name of an index, tell whether the index exists
+
+    :param db_engine: The engine of the database
+    :param index_name: The name of the index
+    :return: True if the index exists
+    """
+    with db_engine.connect() as connection:
+        return _index_exists(connection=connection, index_name=index_name)
+
+
+def _index_exists(connection, index_name: str) -> bool:
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,)
+    ).first() is not None
+
+
+def create_async_db_engine(database_url: str) -> AsyncEngine:
+    """
+    Given an async database URL (example sqlite+aiosqlite:///./crypto.db), create an async engine backed by a
+    connection pool which is sized according to the configuration
+
+    :param database_url: SQLAlchemy async database URL
+    :return: The async engine
+    """
+    db_engine = create_async_engine(
+        database_url,
+        connect_args={'check_same_thread': False, 'timeout': DB_BUSY_TIMEOUT},
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT
+    )
+    event.listen(db_engine.sync_engine, 'connect', _set_sqlite_pragmas)
+    return db_engine
+
+
+def create_session_factories(db_engine: Engine) -> tuple[sessionmaker, sessionmaker]:
+    """
+    Given an engine, create the session factories for write and read-only sessions
+
+    :param db_engine: The engine the sessions are bound to
+    :return: Tuple of (write session factory, read-only session factory)
+    """
+    write_session_factory = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    read_only_session_factory = sessionmaker(
+        autocommit=False, autoflush=False, bind=db_engine, info={'read_only': True}
+    )
+    return write_session_factory, read_only_session_factory
+
+
+def create_async_session_factories(db_engine: AsyncEngine) -> tuple[sessionmaker, sessionmaker]:
+    """
+    Given an async engine, create the async session factories for write and read-only sessions
 
-SQLALCHEMY_DATABASE_URL = 'sqlite:///./crypto.db'
+    :param db_engine: The async engine the sessions are bound to
+    :return: Tuple of (write session factory, read-only session factory)
+    """
+    write_session_factory = sessionmaker(
+        bind=db_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False
+    )
+    read_only_session_factory = sessionmaker(
+        bind=db_engine, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False,
+        info={'read_only': True}
+    )
+    return write_session_factory, read_only_session_factory
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread': False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Switch every new SQLite connection to WAL mode so that readers do not block the writer (and vice versa)
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+@event.listens_for(Session, 'before_flush')
+def _prevent_read_only_flush(session, flush_context, instances):
+    if session.info.get('read_only'):
+        raise InvalidRequestError('Cannot flush changes through a read-only session.')
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _prevent_read_only_write(orm_execute_state):
+    if orm_execute_state.session.info.get('read_only') and not orm_execute_state.is_select:
+        raise InvalidRequestError('Cannot execute a write statement through a read-only session.')
+
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal, ReadOnlySessionLocal = create_session_factories(engine)
+async_engine = create_async_db_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+AsyncSessionLocal, AsyncReadOnlySessionLocal = create_async_session_factories(async_engine)
 
 Base = declarative_base()
+
+
+async def get_db() -> AsyncIterator[Session]:
+    """
+    FastAPI dependency which provides a request-scoped session that is allowed to write to the database
+
+    Declared as async (even though the session is sync) so that the session is closed on the event loop: a sync
+    generator would need a free threadpool thread to close the session, and under load every thread can end up
+    waiting on the connection pool for connections which are only released by those pending closes
+
+    :return: Session which is closed (and rolled back if not committed) once the request has been handled
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_read_only_db() -> AsyncIterator[Session]:
+    """
+    FastAPI dependency which provides a request-scoped session that is only allowed to read from the database
+    (declared as async for the same reason as get_db)
+
+    :return: Session which is closed once the request has been handled
+    """
+    db = ReadOnlySessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """
+    FastAPI dependency which provides a request-scoped async session that is allowed to write to the database
+
+    :return: AsyncSession which is closed (and rolled back if not committed) once the request has been handled
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_only_db() -> AsyncIterator[AsyncSession]:
+    """
+    FastAPI dependency which provides a request-scoped async session that is only allowed to read from the database
+
+    :return: AsyncSession which is closed once the request has been handled
+    """
+    async with AsyncReadOnlySessionLocal() as db:
+        yield db
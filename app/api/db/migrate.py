@@ -0,0 +1,61 @@
+"""
+Migrate a database created by earlier versions of the API: delete the duplicate (ticker_id, date) historical rows - all
+but the last inserted one of every ticker and date - create the (ticker_id, date) unique index which upserts need, and
+drop the indexes it replaces. Databases created by this version need no migration, and migrated ones are left as they
+are, so that it can run before every start of the API.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 -m app.api.db.migrate
+"""
+import logging
+from logging.config import dictConfig
+
+from sqlalchemy.engine import Engine
+
+from app.api.db.database import Base, create_unique_index, engine, index_exists
+from app.api.db.models import DROPPED_INDEX_NAMES, HISTORICAL_TICKER_ID_DATE_INDEX
+from app.logging.logconfig import LogConfig
+
+logger = logging.getLogger("logger")
+
+
+def is_migrated(db_engine: Engine) -> bool:
+    """
+    Given an engine, tell whether its database has the (ticker_id, date) unique index of the historical table
+
+    :param db_engine: The engine of the database
+    :return: True if the database needs no migration
+    """
+    return index_exists(db_engine=db_engine, index_name=HISTORICAL_TICKER_ID_DATE_INDEX.name)
+
+
+def migrate(db_engine: Engine) -> int:
+    """
+    Given an engine, create the tables which do not exist yet and migrate the historical table (see
+    database.create_unique_index), in a single transaction
+
+    :param db_engine: The engine of the database
+    :return: Number of duplicate historical rows which have been deleted
+    :raise: RuntimeError if the unique index could not be created - nothing is changed then
+    """
+    Base.metadata.create_all(bind=db_engine)
+    if is_migrated(db_engine=db_engine):
+        logger.info('The database is up-to-date.')
+        return 0
+    num_deleted = create_unique_index(
+        db_engine=db_engine, index=HISTORICAL_TICKER_ID_DATE_INDEX, replaced_index_names=DROPPED_INDEX_NAMES
+    )
+    logger.warning(
+        f'Migrated the database: deleted {num_deleted} duplicate historical rows (the last inserted row of every '
+        f'ticker and date is kept) and created the {HISTORICAL_TICKER_ID_DATE_INDEX.name} unique index.'
+    )
+    return num_deleted
+
+
+def main():
+    dictConfig(LogConfig().dict())
+    migrate(db_engine=engine)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, Numeric, String, Date
+from sqlalchemy import Column, ForeignKey, Index, Integer, Numeric, String, Date, DateTime
 from sqlalchemy.orm import relationship
 
 from app.api.db.database import Base
@@ -15,17 +15,48 @@ class Ticker(Base):
     historical_prices = relationship('HistoricalData')
 
 
+# Indexes of earlier versions of the historical table which no query uses (every query of the table goes through
+# ix_historical_ticker_id_date, and the primary key is the rowid already) but which every write has to update - they
+# are dropped from existing databases, once ix_historical_ticker_id_date has been created - see
+# database.create_unique_index and app/api/db/migrate.py
+DROPPED_INDEX_NAMES = ['ix_historical_id', 'ix_historical_date']
+
+
 class HistoricalData(Base):
     """
     Defines the historical database table
     """
     __tablename__ = "historical"
+    __table_args__ = (
+        # A ticker has at most one candle per date
+        Index('ix_historical_ticker_id_date', 'ticker_id', 'date', unique=True),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    date = Column(Date, unique=False, index=True)
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, unique=False)
     ticker_id = Column(Integer, ForeignKey('tickers.id'))
     low = Column(Numeric, unique=False)
     high = Column(Numeric, unique=False)
     open = Column(Numeric, unique=False)
     close = Column(Numeric, unique=False)
     volume = Column(Numeric, unique=False)
+
+
+# The (ticker_id, date) unique index, which historical tables of earlier versions do not have - see
+# database.create_unique_index and app/api/db/migrate.py
+HISTORICAL_TICKER_ID_DATE_INDEX = next(
+    index for index in HistoricalData.__table__.indexes if index.name == 'ix_historical_ticker_id_date'
+)
+
+
+class DataVersion(Base):
+    """
+    Defines the data versions database table - a counter per dataset (example the tickers table) which is incremented in
+    the same transaction as every write to that dataset, so that in-memory copies can cheaply tell whether they are
+    stale
+    """
+    __tablename__ = "data_versions"
+
+    key = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
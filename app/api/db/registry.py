@@ -0,0 +1,110 @@
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from app.api.config import TICKER_REGISTRY_CHECK_INTERVAL
+
+
+class TickerRegistry:
+    """
+    Thread-safe in-memory map of ticker names to ticker ids, so that looking up a ticker does not cost a query on the
+    tickers table
+
+    Every write to the tickers table increments the tickers data version in the same transaction. The registry
+    remembers the version its contents correspond to, and is considered fresh for check_interval seconds after that
+    version has last been confirmed against the database - misses are always confirmed, so that tickers which have just
+    been added by another worker are found straight away
+    """
+
+    def __init__(self, check_interval: float, clock: Callable[[], float] = time.monotonic):
+        """
+        :param check_interval: Number of seconds during which the registry is trusted without checking the data version
+        :param clock: Monotonic clock, in seconds
+        """
+        self.check_interval = check_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ticker_ids: dict[str, int] = {}
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+
+    def lookup(self, ticker_name: str) -> tuple[Optional[int], bool]:
+        """
+        Given a ticker name, get its id from the registry
+
+        :param ticker_name: The ticker name
+        :return: Tuple of (ticker id, None if the ticker is not in the registry, whether the registry is fresh)
+        """
+        with self._lock:
+            is_fresh = self._version is not None and self._clock() - self._checked_at < self.check_interval
+            return self._ticker_ids.get(ticker_name), is_fresh
+
+    def confirm(self, version: int) -> bool:
+        """
+        Given the tickers data version read from the database, check whether the registry is up-to-date with it (and if
+        so, consider it fresh again)
+
+        :param version: The tickers data version
+        :return: True if the registry corresponds to the version, False if it has to be reloaded
+        """
+        with self._lock:
+            if version != self._version:
+                return False
+            self._checked_at = self._clock()
+            return True
+
+    def replace(self, version: int, tickers: Iterable[tuple[str, int]]):
+        """
+        Given a tickers data version and all the tickers at that version, replace the contents of the registry - unless
+        it already corresponds to a later version
+
+        :param version: The tickers data version
+        :param tickers: (ticker name, ticker id) pairs
+        """
+        ticker_ids = dict(tickers)
+        with self._lock:
+            if self._version is None or version >= self._version:
+                self._ticker_ids = ticker_ids
+                self._version = version
+                self._checked_at = self._clock()
+
+    def add(self, ticker_name: str, ticker_id: int, version: int):
+        """
+        Given a ticker which has just been created and the tickers data version its creation committed, add it to the
+        registry - if the registry was not up-to-date with the previous version, it is reloaded on the next lookup
+        instead
+
+        :param ticker_name: The ticker name
+        :param ticker_id: The ticker id
+        :param version: The tickers data version after the ticker has been created
+        """
+        with self._lock:
+            if self._version == version - 1:
+                self._ticker_ids[ticker_name] = ticker_id
+                self._version = version
+                self._checked_at = self._clock()
+            else:
+                self._version = None
+
+    def clear(self, version: int):
+        """
+        Given the tickers data version after all the tickers have been deleted, empty the registry
+
+        :param version: The tickers data version after the deletion
+        """
+        with self._lock:
+            self._ticker_ids = {}
+            self._version = version
+            self._checked_at = self._clock()
+
+    def reset(self):
+        """
+        Forget the contents of the registry, so that it is reloaded on the next lookup (example when switching to
+        another database)
+        """
+        with self._lock:
+            self._ticker_ids = {}
+            self._version = None
+
+
+ticker_registry = TickerRegistry(check_interval=TICKER_REGISTRY_CHECK_INTERVAL)
@@ -0,0 +1,252 @@
+import math
+from typing import Iterable, NamedTuple
+
+import numpy
+import pandas
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.api.config import INDICATOR_BOLLINGER_NUM_STD, INDICATOR_MAX_WINDOW, INDICATOR_WARMUP_FACTOR
+from app.api.db.models import HistoricalData
+
+SMA_INDICATOR = 'sma'
+EMA_INDICATOR = 'ema'
+RSI_INDICATOR = 'rsi'
+VWAP_INDICATOR = 'vwap'
+BOLLINGER_INDICATOR = 'bollinger'
+# Window of the indicators which are requested without one
+DEFAULT_WINDOWS = {
+    SMA_INDICATOR: 20,
+    EMA_INDICATOR: 20,
+    RSI_INDICATOR: 14,
+    VWAP_INDICATOR: 20,
+    BOLLINGER_INDICATOR: 20
+}
+# Indicators whose value depends on the whole series before it (exponential smoothing) rather than on a fixed window
+RECURSIVE_INDICATORS = {EMA_INDICATOR, RSI_INDICATOR}
+# Columns the indicators are computed from - the third to seventh of crud.HISTORICAL_DATA_COLUMNS
+_VALUE_COLUMN_NAMES = [
+    HistoricalData.low.name,
+    HistoricalData.high.name,
+    HistoricalData.open.name,
+    HistoricalData.close.name,
+    HistoricalData.volume.name
+]
+
+
+class IndicatorSpec(NamedTuple):
+    name: str
+    window: int
+
+    def column_names(self) -> list[str]:
+        """
+        :return: Names of the columns the indicator adds to the historical data
+        """
+        column_name = f'{self.name}_{self.window}'
+        if self.name == BOLLINGER_INDICATOR:
+            return [f'{column_name}_lower', f'{column_name}_middle', f'{column_name}_upper']
+        return [column_name]
+
+    def lookback(self) -> int:
+        """
+        :return: Number of rows preceding a row which the value of the indicator for that row depends on - for the
+        recursive indicators, the number of rows after which the contribution of the earlier ones becomes negligible
+        """
+        if self.name in RECURSIVE_INDICATORS:
+            return self.window * INDICATOR_WARMUP_FACTOR
+        return self.window - 1
+
+
+def parse_indicators(values: Iterable[str]) -> list[IndicatorSpec]:
+    """
+    Given the indicators query parameters, parse the indicators they request - comma separated names, each optionally
+    followed by an underscore and a window (example sma_50,rsi,bollinger_20)
+
+    :param values: The indicators query parameters
+    :return: The indicators, without duplicates, in the order they are requested
+    :raise: ValueError if an indicator is unknown or its window is not a number between 2 and INDICATOR_MAX_WINDOW
+    """
+    specs = []
+    for value in values:
+        for token in filter(None, (token.strip().lower() for token in value.split(','))):
+            name, _, window = token.partition('_')
+            if name not in DEFAULT_WINDOWS:
+                raise ValueError(f'Unknown indicator {name} - expected one of {", ".join(DEFAULT_WINDOWS)}')
+            if window and not window.isdigit():
+                raise ValueError(f'Invalid window {window} of indicator {name}')
+            spec = IndicatorSpec(name=name, window=int(window) if window else DEFAULT_WINDOWS[name])
+            if not 2 <= spec.window <= INDICATOR_MAX_WINDOW:
+                raise ValueError(f'The window of indicator {name} must be between 2 and {INDICATOR_MAX_WINDOW}')
+            if spec not in specs:
+                specs.append(spec)
+    return specs
+
+
+def get_lookback(specs: Iterable[IndicatorSpec]) -> int:
+    """
+    Given indicators, get the number of rows to read before the first row of a range for them to be correct from the
+    first row on
+
+    :param specs: The indicators
+    :return: Number of rows
+    """
+    return max((spec.lookback() for spec in specs), default=0)
+
+
+def get_column_names(specs: Iterable[IndicatorSpec]) -> list[str]:
+    """
+    Given indicators, get the names of the columns they add to the historical data
+
+    :param specs: The indicators
+    :return: The column names, in the order of the indicators
+    """
+    return [column_name for spec in specs for column_name in spec.column_names()]
+
+
+def sma(values: numpy.ndarray, window: int) -> numpy.ndarray:
+    """
+    Simple moving average, from the differences of the cumulative sum
+
+    :param values: The series
+    :param window: Number of values averaged
+    :return: The averages - NaN for the first window - 1 values
+    """
+    result = numpy.full(len(values), numpy.nan)
+    if len(values) >= window:
+        cumulative_sum = numpy.cumsum(numpy.insert(values, 0, 0.0))
+        result[window - 1:] = (cumulative_sum[window:] - cumulative_sum[:-window]) / window
+    return result
+
+
+def ema(values: numpy.ndarray, window: int) -> numpy.ndarray:
+    """
+    Exponential moving average with a smoothing factor of 2 / (window + 1), seeded with the first value
+
+    :param values: The series
+    :param window: Span of the average
+    :return: The averages
+    """
+    return pandas.Series(values).ewm(span=window, adjust=False).mean().to_numpy()
+
+
+def rsi(close: numpy.ndarray, window: int) -> numpy.ndarray:
+    """
+    Relative strength index, with Wilder's smoothing (a smoothing factor of 1 / window) of the gains and losses
+
+    :param close: The closes
+    :param window: Smoothing period
+    :return: The indices, between 0 and 100 - NaN for the first value, which has no change
+    """
+    changes = numpy.diff(close, prepend=numpy.nan)
+    gains = pandas.Series(numpy.clip(changes, 0.0, None)).ewm(alpha=1 / window, adjust=False).mean().to_numpy()
+    losses = pandas.Series(numpy.clip(-changes, 0.0, None)).ewm(alpha=1 / window, adjust=False).mean().to_numpy()
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result = 100 - 100 / (1 + gains / losses)
+    # Only gains (or no change at all) over the period
+    result[(losses == 0) & (gains > 0)] = 100.0
+    result[(losses == 0) & (gains == 0)] = 50.0
+    return result
+
+
+def vwap(
+        high: numpy.ndarray,
+        low: numpy.ndarray,
+        close: numpy.ndarray,
+        volume: numpy.ndarray,
+        window: int
+) -> numpy.ndarray:
+    """
+    Rolling volume weighted average price of the typical price (high + low + close) / 3
+
+    :param high: The highs
+    :param low: The lows
+    :param close: The closes
+    :param volume: The volumes
+    :param window: Number of candles averaged
+    :return: The averages - NaN for the first window - 1 values, and where there is no volume in the window
+    """
+    traded_value = sma(values=(high + low + close) / 3 * volume, window=window)
+    traded_volume = sma(values=volume, window=window)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(traded_volume > 0, traded_value / traded_volume, numpy.nan)
+
+
+def bollinger_bands(
+        close: numpy.ndarray,
+        window: int,
+        num_std: float = INDICATOR_BOLLINGER_NUM_STD
+) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Bollinger bands - the simple moving average of the closes, plus and minus a multiple of their (population)
+    standard deviation over the same window
+
+    :param close: The closes
+    :param window: Number of closes
+    :param num_std: Number of standard deviations between the middle and the outer bands
+    :return: Tuple of (lower band, middle band, upper band) - NaN for the first window - 1 values
+    """
+    middle = sma(values=close, window=window)
+    deviation = numpy.full(len(close), numpy.nan)
+    if len(close) >= window:
+        deviation[window - 1:] = sliding_window_view(close, window).std(axis=1)
+    return middle - num_std * deviation, middle, middle + num_std * deviation
+
+
+def compute_indicators(values: numpy.ndarray, specs: Iterable[IndicatorSpec]) -> list[numpy.ndarray]:
+    """
+    Given the prices and volumes of a series of candlesticks ordered by date, compute indicators over them
+
+    :param values: Array with one (low, high, open, close, volume) row per candlestick
+    :param specs: The indicators
+    :return: One array per column of the indicators (see get_column_names), with one value per candlestick
+    """
+    low, high, close, volume = values[:, 0], values[:, 1], values[:, 3], values[:, 4]
+    columns = []
+    for spec in specs:
+        if spec.name == SMA_INDICATOR:
+            columns.append(sma(values=close, window=spec.window))
+        elif spec.name == EMA_INDICATOR:
+            columns.append(ema(values=close, window=spec.window))
+        elif spec.name == RSI_INDICATOR:
+            columns.append(rsi(close=close, window=spec.window))
+        elif spec.name == VWAP_INDICATOR:
+            columns.append(vwap(high=high, low=low, close=close, volume=volume, window=spec.window))
+        else:
+            columns.extend(bollinger_bands(close=close, window=spec.window))
+    return columns
+
+
+def add_indicators_to_rows(rows: list[tuple], warmup_rows: list[tuple], specs: list[IndicatorSpec]) -> list[tuple]:
+    """
+    Given historical data rows, the rows which precede them (see get_lookback) and indicators, append the values of
+    the indicators to every row - the values which cannot be computed (not enough history) are None
+
+    :param rows: Historical data rows ordered by date, optionally with the percentage change appended
+    :param warmup_rows: The rows preceding the first row, ordered by date
+    :param specs: The indicators
+    :return: The rows with the values of the indicators appended, in the order of get_column_names
+    """
+    columns = compute_indicators(values=_rows_to_values(rows=[*warmup_rows, *rows]), specs=specs)
+    indicator_values = numpy.column_stack(columns)[len(warmup_rows):]
+    indicator_rows = indicator_values.tolist()
+    # NaN only occurs in the first rows (or where there is no volume), so only those are converted
+    for index in numpy.flatnonzero(numpy.isnan(indicator_values).any(axis=1)):
+        indicator_rows[index] = [None if math.isnan(value) else value for value in indicator_rows[index]]
+    return [(*row, *values) for row, values in zip(rows, indicator_rows)]
+
+
+def add_indicators_to_df(df: pandas.DataFrame, warmup_rows: list[tuple], specs: list[IndicatorSpec]):
+    """
+    Add the columns of indicators to a pandas.DataFrame of historical data - the values which cannot be computed (not
+    enough history) are NaN
+
+    :param df: The pandas.DataFrame that is to be modified, with the columns of crud.HISTORICAL_DATA_COLUMNS
+    :param warmup_rows: The rows preceding the first row of the pandas.DataFrame, ordered by date
+    :param specs: The indicators
+    """
+    values = numpy.concatenate([_rows_to_values(rows=warmup_rows), df[_VALUE_COLUMN_NAMES].to_numpy(dtype=float)])
+    for column_name, column in zip(get_column_names(specs=specs), compute_indicators(values=values, specs=specs)):
+        df[column_name] = column[len(warmup_rows):]
+
+
+def _rows_to_values(rows: list[tuple]) -> numpy.ndarray:
+    return numpy.array([row[2:7] for row in rows], dtype=float).reshape(-1, len(_VALUE_COLUMN_NAMES))
@@ -0,0 +1,365 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from itertools import chain, groupby
+from typing import Callable, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.api.cache import historical_response_cache
+from app.api.config import HISTORICAL_JOB_BATCH_LINGER, HISTORICAL_JOB_BATCH_MAX_RECORDS, HISTORICAL_JOB_MAX_FINISHED, \
+    HISTORICAL_JOB_QUEUE_MAX_JOBS, HISTORICAL_JOB_QUEUE_MAX_RECORDS
+from app.api.db import crud
+from app.api.db.database import SessionLocal
+from app.api.schemas import HistoricalJobStatus, PostHistoricalDataConflictAction
+
+logger = logging.getLogger("logger")
+
+
+def _to_iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat() if timestamp is not None else None
+
+
+class HistoricalJob:
+    """
+    A POST /historical/ request accepted in background mode - the rows it writes and, once written, its outcome
+    """
+
+    def __init__(
+            self,
+            ticker_name: str,
+            ticker_id: int,
+            records: list[dict],
+            on_conflict: Optional[PostHistoricalDataConflictAction],
+            submitted_at: float
+    ):
+        """
+        :param ticker_name: The ticker name
+        :param ticker_id: The ticker id associated with the data
+        :param records: List of dicts which map the historical database table column names to values
+        :param on_conflict: What to do with candlesticks which are already stored, None to fail the job if there are any
+        :param submitted_at: UNIX time at which the job has been queued
+        """
+        self.id = uuid.uuid4().hex
+        self.ticker_name = ticker_name
+        self.ticker_id = ticker_id
+        self.records = records
+        self.num_records = len(records)
+        self.on_conflict = on_conflict
+        self.status = HistoricalJobStatus.queued
+        self.submitted_at = submitted_at
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.batch_jobs = 0
+        self.counts = (0, 0, 0)
+        self.error: Optional[str] = None
+
+    def to_dict(self, jobs_ahead: Optional[int] = None) -> dict:
+        """
+        Get the status of the job
+
+        :param jobs_ahead: Number of jobs queued before this one, None if it is not queued
+        :return: Dictionary with the id, ticker, status, number of records and timestamps (ISO, UTC) of the job - and
+        once it has been written, the number of jobs written in the same transaction and the number of inserted, updated
+        and skipped records, or the error
+        """
+        num_inserted, num_updated, num_skipped = self.counts
+        return {
+            'job_id': self.id,
+            'ticker_name': self.ticker_name,
+            'status': self.status.value,
+            'on_conflict': self.on_conflict.value if self.on_conflict else None,
+            'records': self.num_records,
+            'jobs_ahead': jobs_ahead,
+            'batch_jobs': self.batch_jobs,
+            'inserted_records': num_inserted,
+            'updated_records': num_updated,
+            'skipped_records': num_skipped,
+            'error': self.error,
+            'submitted_at': _to_iso(self.submitted_at),
+            'started_at': _to_iso(self.started_at),
+            'finished_at': _to_iso(self.finished_at)
+        }
+
+
+class HistoricalJobQueue:
+    """
+    Thread-safe bounded queue of the POST /historical/ requests accepted in background mode, written by a single writer
+    thread - SQLite allows one writer at a time anyway. While the writer commits a batch, the jobs of every client
+    accumulate, and the next batch takes as many of them as fit in max_batch_records and writes them all in a single
+    transaction, so that many small requests cost one commit rather than one each - the writer waits up to batch_linger
+    seconds for more jobs before taking a batch. If a batch fails, its jobs are written again one at a time, so that
+    only the jobs which fail on their own are marked as failed
+    """
+
+    def __init__(
+            self,
+            session_factory: Callable[[], Session],
+            max_jobs: int,
+            max_records: int,
+            max_batch_records: int,
+            max_finished: int,
+            batch_linger: float = 0.0,
+            clock: Callable[[], float] = time.time
+    ):
+        """
+        :param session_factory: Function which opens a database session the writer writes with
+        :param max_jobs: Maximum number of queued jobs - more are rejected
+        :param max_records: Maximum number of records of the queued jobs - a job which does not fit is rejected, so a
+        job of more records never is
+        :param max_batch_records: Maximum number of records written in one transaction - a larger job is written alone
+        :param max_finished: Number of finished jobs whose status is kept - the oldest ones are forgotten first
+        :param batch_linger: Number of seconds the writer waits for more jobs once one is queued, unless the batch or
+        the queue is full before
+        :param clock: Current UNIX time, in seconds
+        """
+        self.max_jobs = max_jobs
+        self.max_records = max_records
+        self.max_batch_records = max_batch_records
+        self.max_finished = max_finished
+        self.batch_linger = batch_linger
+        self._session_factory = session_factory
+        self._clock = clock
+        self._changed = threading.Condition(threading.Lock())
+        self._queue: deque[HistoricalJob] = deque()
+        self._queued_records = 0
+        self._running: dict[str, HistoricalJob] = {}
+        self._finished: OrderedDict[str, HistoricalJob] = OrderedDict()
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+        self._rejected = 0
+        self._batches = 0
+        self._succeeded = 0
+        self._failed = 0
+
+    def submit(
+            self,
+            ticker_name: str,
+            ticker_id: int,
+            records: list[dict],
+            on_conflict: Optional[PostHistoricalDataConflictAction]
+    ) -> Optional[dict]:
+        """
+        Given the rows of a ticker, queue a job which writes them - starting the writer thread if it is not running
+
+        :param ticker_name: The ticker name
+        :param ticker_id: The ticker id associated with the data
+        :param records: List of dicts which map the historical database table column names to values
+        :param on_conflict: What to do with candlesticks which are already stored, None to fail the job if there are any
+        :return: The status of the job (see HistoricalJob.to_dict), None if the queue is full or closed
+        """
+        with self._changed:
+            if self._closed or len(self._queue) >= self.max_jobs or \
+                    self._queued_records + len(records) > self.max_records:
+                self._rejected += 1
+                return None
+            job = HistoricalJob(
+                ticker_name=ticker_name,
+                ticker_id=ticker_id,
+                records=records,
+                on_conflict=on_conflict,
+                submitted_at=self._clock()
+            )
+            self._queue.append(job)
+            self._queued_records += job.num_records
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name='historical-job-writer', daemon=True)
+                self._writer.start()
+            self._changed.notify_all()
+            return job.to_dict(jobs_ahead=len(self._queue) - 1)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        Given a job id, get the status of the job
+
+        :param job_id: The job id
+        :return: The status of the job (see HistoricalJob.to_dict), None if there is no such job or if it has been
+        forgotten
+        """
+        with self._changed:
+            job = self._running.get(job_id) or self._finished.get(job_id)
+            if job:
+                return job.to_dict()
+            for jobs_ahead, job in enumerate(self._queue):
+                if job.id == job_id:
+                    return job.to_dict(jobs_ahead=jobs_ahead)
+            return None
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued job has been written
+
+        :param timeout: Maximum number of seconds to wait, None to wait as long as it takes
+        :return: True if every queued job has been written, False if the timeout expired first
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._queue and not self._running, timeout=timeout)
+
+    def open(self):
+        """
+        Accept jobs again after close - the writer thread is started again by the next job
+        """
+        with self._changed:
+            self._closed = False
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Stop accepting jobs until the queue is opened again, and stop the writer thread once the queued jobs have been
+        written
+
+        :param timeout: Maximum number of seconds to wait for the writer thread, None to wait as long as it takes
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+            writer = self._writer
+        if writer:
+            writer.join(timeout=timeout)
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the queue
+
+        :return: Dictionary with the number of queued jobs and records, running jobs, finished jobs kept, rejected jobs,
+        written batches, succeeded jobs and failed jobs
+        """
+        with self._changed:
+            return {
+                'queued_jobs': len(self._queue),
+                'queued_records': self._queued_records,
+                'running_jobs': len(self._running),
+                'finished_jobs': len(self._finished),
+                'rejected': self._rejected,
+                'batches': self._batches,
+                'succeeded': self._succeeded,
+                'failed': self._failed
+            }
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    # Under the lock, so that a job submitted once the queue is opened again starts a new writer
+                    self._writer = None
+                    return
+                # The clients have been answered already, so waiting for more jobs costs them nothing - and saves the
+                # transactions of the jobs which would otherwise arrive one at a time
+                self._changed.wait_for(
+                    lambda: self._closed or len(self._queue) >= self.max_jobs
+                    or self._queued_records >= self.max_batch_records,
+                    timeout=self.batch_linger
+                )
+                jobs = self._take_batch()
+            self._write(jobs=jobs)
+
+    def _take_batch(self) -> list[HistoricalJob]:
+        jobs = [self._queue.popleft()]
+        num_records = jobs[0].num_records
+        while self._queue and num_records + self._queue[0].num_records <= self.max_batch_records:
+            jobs.append(self._queue.popleft())
+            num_records += jobs[-1].num_records
+        self._queued_records -= num_records
+        started_at = self._clock()
+        for job in jobs:
+            job.status = HistoricalJobStatus.running
+            job.started_at = started_at
+            self._running[job.id] = job
+        return jobs
+
+    def _write(self, jobs: list[HistoricalJob]):
+        try:
+            counts = self._write_batch(jobs=jobs)
+        # Any error - an exception escaping the writer thread would leave the jobs running forever
+        except Exception as error:
+            if len(jobs) == 1:
+                self._finish(jobs=jobs, error=error)
+                return
+            logger.warning(
+                msg=f'A batch of {len(jobs)} historical jobs failed ({error!r}) - writing them one at a time.'
+            )
+            for job in jobs:
+                self._write(jobs=[job])
+            return
+        self._finish(jobs=jobs, counts=counts)
+
+    def _write_batch(self, jobs: list[HistoricalJob]) -> list[tuple[int, int, int]]:
+        db = self._session_factory()
+        try:
+            counts = []
+            for on_conflict, group in groupby(jobs, key=lambda job: job.on_conflict):
+                group = list(group)
+                if on_conflict:
+                    counts.extend(
+                        crud.upsert_historical(
+                            db=db, ticker_id=job.ticker_id, records=job.records, on_conflict=on_conflict, commit=False
+                        )
+                        for job in group
+                    )
+                else:
+                    # Plain inserts either all succeed or fail the batch, so consecutive ones are sent together
+                    crud.create_historical(
+                        db=db, records=chain.from_iterable(job.records for job in group), commit=False
+                    )
+                    counts.extend((job.num_records, 0, 0) for job in group)
+            db.commit()
+            return counts
+        finally:
+            # Rolls back what has not been committed
+            db.close()
+
+    def _finish(
+            self,
+            jobs: list[HistoricalJob],
+            counts: Optional[list[tuple[int, int, int]]] = None,
+            error: Optional[Exception] = None
+    ):
+        if error is None:
+            for job, (num_inserted, num_updated, _) in zip(jobs, counts):
+                if num_inserted or num_updated:
+                    historical_response_cache.invalidate(
+                        ticker_name=job.ticker_name, dates=(record['date'] for record in job.records)
+                    )
+        else:
+            job = jobs[0]
+            if isinstance(error, IntegrityError):
+                job.error = f'Some of the {job.ticker_name} records already exist - use on_conflict to update or ' \
+                            f'skip them.'
+            else:
+                job.error = f'The {job.ticker_name} records could not be written: {error!r}'
+            logger.error(msg=f'Historical job {job.id} failed: {job.error}')
+
+        finished_at = self._clock()
+        with self._changed:
+            for index, job in enumerate(jobs):
+                job.finished_at = finished_at
+                job.batch_jobs = len(jobs)
+                # The rows are not needed anymore, only the outcome of the job
+                job.records = None
+                if error is None:
+                    job.status = HistoricalJobStatus.succeeded
+                    job.counts = counts[index]
+                    self._succeeded += 1
+                else:
+                    job.status = HistoricalJobStatus.failed
+                    self._failed += 1
+                del self._running[job.id]
+                self._finished[job.id] = job
+            while len(self._finished) > self.max_finished:
+                self._finished.popitem(last=False)
+            self._batches += 1
+            self._changed.notify_all()
+
+
+historical_job_queue = HistoricalJobQueue(
+    session_factory=SessionLocal,
+    max_jobs=HISTORICAL_JOB_QUEUE_MAX_JOBS,
+    max_records=HISTORICAL_JOB_QUEUE_MAX_RECORDS,
+    max_batch_records=HISTORICAL_JOB_BATCH_MAX_RECORDS,
+    max_finished=HISTORICAL_JOB_MAX_FINISHED,
+    batch_linger=HISTORICAL_JOB_BATCH_LINGER
+)
@@ -1,18 +1,32 @@
 import datetime
 import logging
+from itertools import chain
 from logging.config import dictConfig
+from typing import Optional
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, status
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import PlainTextResponse, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app.api import apiutils
+from app.api import apiutils, asyncroutes, bulkimport, compression, indicators
+from app.api.cache import HistoricalBucketKey, HistoricalBucketSeries, HistoricalCacheKey, historical_bucket_cache, \
+    historical_response_cache
 from app.api.config import CUSTOM_DOCS_DESCRIPTION, CUSTOM_DOCS_TAGS_METADATA, API_HISTORICAL_ENDPOINT, \
-    API_TICKERS_ENDPOINT, API_CLEAR_ENDPOINT
+    API_HISTORICAL_BATCH_ENDPOINT, API_HISTORICAL_STATS_ENDPOINT, API_HISTORICAL_LATEST_ENDPOINT, \
+    API_HISTORICAL_INGEST_ENDPOINT, API_HISTORICAL_IMPORT_ENDPOINT, API_HISTORICAL_JOBS_ENDPOINT, \
+    API_TICKERS_ENDPOINT, API_CLEAR_ENDPOINT, API_CACHE_ENDPOINT, API_ASYNC_MODE, HISTORICAL_PCT_CHANGE_IN_DATABASE, \
+    HISTORICAL_BATCH_MAX_TICKERS, HISTORICAL_JOB_RETRY_AFTER
 from app.api.db import crud
-from app.api.db.database import engine, Base
+from app.api.db import migrate
+from app.api.db.database import engine, Base, ReadOnlySessionLocal, get_db, get_read_only_db
 from app.api.db.models import HistoricalData
-from app.api.schemas import GetHistoricalDataOutputType, PostTickerRequest, PostHistoricalDataRequest
+from app.api.jobqueue import historical_job_queue
+from app.api.rangestats import HistoricalRangeStats, historical_range_stats_index
+from app.api.schemas import GetHistoricalBatchLayout, GetHistoricalDataGranularity, GetHistoricalDataOutputType, \
+    PostTickerRequest, PostHistoricalDataRequest, PostHistoricalDataConflictAction
 from app.logging.logconfig import LogConfig
 
 dictConfig(LogConfig().dict())
@@ -24,61 +38,511 @@ app = FastAPI(
     description=CUSTOM_DOCS_DESCRIPTION,
     openapi_tags=CUSTOM_DOCS_TAGS_METADATA
 )
+app.add_middleware(compression.CompressionMiddleware)
+if API_ASYNC_MODE:
+    # Routes are matched in registration order, so the async handlers take precedence over the sync ones declared below
+    # (which still document the endpoints, as their signatures are identical)
+    app.include_router(asyncroutes.router, include_in_schema=False)
+
+
+@app.on_event('startup')
+def check_database_migration():
+    """
+    Warn at startup if the database was created by an earlier version and has not been migrated - the migration deletes
+    duplicate rows, so it is never run implicitly
+    """
+    if not migrate.is_migrated(db_engine=engine):
+        logger.warning(
+            'The database has not been migrated - records cannot be updated or skipped until it is, run '
+            '"python3 -m app.api.db.migrate".'
+        )
+
+
+@app.on_event('startup')
+def warm_ticker_registry():
+    """
+    Load all the tickers into the ticker registry at startup, so that the first requests do not have to
+    """
+    db = ReadOnlySessionLocal()
+    try:
+        crud.load_ticker_registry(db=db)
+    finally:
+        db.close()
+
+
+@app.on_event('startup')
+def open_historical_job_queue():
+    """
+    Accept historical jobs, including after the queue has been closed by an earlier shutdown of the app in the same
+    process
+    """
+    historical_job_queue.open()
+
+
+@app.on_event('shutdown')
+def drain_historical_job_queue():
+    """
+    Write the queued historical jobs before shutting down, so that no accepted request is lost
+    """
+    historical_job_queue.close()
 
 
 @app.get(API_TICKERS_ENDPOINT, tags=['Tickers'])
-def get_ticker(ticker_name: str):
+def get_ticker(
+    ticker_name: str,
+    if_none_match: Optional[str] = Header(default=None),
+    db: Session = Depends(get_read_only_db)
+):
     """
     FastAPI endpoint for getting a cryptocurrency ticker_name if it exists
 
     :param ticker_name: The ticker_name of interest
-    :return: JSONResponse (status code 200) if a ticker_name record exists, HTTPException (status code 404) otherwise
+    :param if_none_match: Entity tags of the representations the client already has
+    :param db: Read-only database session
+    :return: JSONResponse (status code 200) if a ticker_name record exists (Response with status code 304 if the client
+    already has it), HTTPException (status code 404) otherwise
     """
-    ticker_record = crud.retrieve_ticker_by_name(ticker_name=ticker_name)
+    ticker_record = crud.retrieve_ticker_by_name(db=db, ticker_name=ticker_name)
     if ticker_record:
+        # The record is immutable once created, so its contents identify it
+        validator_headers = apiutils.build_validator_headers(
+            etag=apiutils.build_etag(ticker_record.id, ticker_record.ticker)
+        )
+        if apiutils.is_not_modified(
+            validator_headers=validator_headers, if_none_match=if_none_match, if_modified_since=None
+        ):
+            return apiutils.build_not_modified_response(validator_headers=validator_headers)
         ticker_json = jsonable_encoder(obj=ticker_record)
         logger.info(msg=f'Ticker record {ticker_json} has been successfully retrieved.')
-        return JSONResponse(content=ticker_json)
+        return JSONResponse(content=ticker_json, headers=validator_headers)
 
     message_ticker_missing = f'Ticker {ticker_name} does not exist.'
     logger.error(msg=message_ticker_missing)
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_ticker_missing)
 
 
+@app.get(API_HISTORICAL_BATCH_ENDPOINT, tags=['Historical Data'])
+def get_historical_batch(
+    start: datetime.date,
+    end: datetime.date,
+    data_format: GetHistoricalDataOutputType,
+    ticker_names: list[str] = Query(default=...),
+    layout: GetHistoricalBatchLayout = GetHistoricalBatchLayout.long,
+    db: Session = Depends(get_read_only_db)
+):
+    """
+    FastAPI endpoint for retrieving the historical data of several tickers over the same date range with a single
+    query, instead of one GET historical data request per ticker
+
+    :param start: The start date
+    :param end: The end date
+    :param data_format: Enum - json, csv, arrow (Arrow IPC stream) or parquet
+    :param ticker_names: The tickers for which to get the historical data (repeat the query parameter)
+    :param layout: Enum - long (one row per ticker and date, ordered by ticker and date) or wide (one row per date with
+    the columns of every ticker side by side)
+    :param db: Read-only database session
+    :return: Response in the requested format (status code 200) if there is historical data for at least one ticker
+    :raise: HTTPException (status code 404) if one of the tickers does not exist or there is no historical data tied to
+    any of them, HTTPException (status code 400) if more than HISTORICAL_BATCH_MAX_TICKERS tickers are requested
+    """
+    ticker_names = list(dict.fromkeys(ticker_names))
+    if len(ticker_names) > HISTORICAL_BATCH_MAX_TICKERS:
+        message_too_many_tickers = f'At most {HISTORICAL_BATCH_MAX_TICKERS} tickers can be requested at once.'
+        logger.error(msg=message_too_many_tickers)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message_too_many_tickers)
+
+    ticker_records = crud.retrieve_tickers_by_names(db=db, ticker_names=ticker_names)
+    if len(ticker_records) < len(ticker_names):
+        missing_ticker_names = sorted(set(ticker_names) - {ticker_record.ticker for ticker_record in ticker_records})
+        message_missing_tickers = f'Tickers {", ".join(missing_ticker_names)} do not exist.'
+        logger.error(msg=message_missing_tickers)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_missing_tickers)
+
+    ticker_ids = [ticker_record.id for ticker_record in ticker_records]
+    if HISTORICAL_PCT_CHANGE_IN_DATABASE:
+        historical_data = crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_ids(
+            db=db, start=start, end=end, ticker_ids=ticker_ids
+        )
+        records_df = apiutils.process_historical_records_with_pct_change_to_df(historical_data=historical_data)
+    else:
+        historical_data = crud.retrieve_historical_by_date_range_and_ticker_ids(
+            db=db, start=start, end=end, ticker_ids=ticker_ids
+        )
+        records_df = apiutils.process_historical_records_to_df(historical_data=historical_data)
+        apiutils.add_pct_change_by_ticker(df=records_df, column_name=HistoricalData.close.name)
+
+    if records_df.empty:
+        message_no_records_found = f'No records found for the following date range: {start} - {end}'
+        logger.error(msg=message_no_records_found)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_no_records_found)
+
+    logger.info(
+        f'Successfully retrieved {len(records_df.index)} records of {len(ticker_ids)} tickers as {data_format} '
+        f'for the following date range: {start} - {end}'
+    )
+    return apiutils.build_historical_batch_response(
+        df=records_df,
+        ticker_names={ticker_record.id: ticker_record.ticker for ticker_record in ticker_records},
+        layout=layout,
+        data_format=data_format
+    )
+
+
+@app.get(API_HISTORICAL_STATS_ENDPOINT, tags=['Historical Data'])
+def get_historical_stats(
+    ticker_name: str,
+    start: datetime.date,
+    end: datetime.date,
+    db: Session = Depends(get_read_only_db)
+):
+    """
+    FastAPI endpoint for retrieving the aggregates of the historical data of a ticker over a date range - answered
+    in constant time, however long the range, from an index of the ticker kept in memory (see rangestats)
+    rather than by reading the rows of the range
+
+    :param ticker_name: The ticker_name for which to get the aggregates
+    :param start: The start date
+    :param end: The end date
+    :param db: Read-only database session
+    :return: JSONResponse (status code 200) with the dates of the first and last candlesticks in the range, their
+    number, the first open, max high, min low, last close, total volume, average close and the % change from the first
+    open to the last close
+    :raise: HTTPException (status code 404) if such a ticker record does not exist or there is no historical data tied
+    to it in the range
+    """
+    ticker_record = crud.retrieve_ticker_by_name(db=db, ticker_name=ticker_name)
+    if ticker_record:
+        # Read before the data, so that stats built from data which is overwritten meanwhile are rebuilt next time
+        data_versions, _ = crud.retrieve_historical_data_versions(db=db, ticker_id=ticker_record.id)
+        range_stats = historical_range_stats_index.get(ticker_id=ticker_record.id, data_versions=data_versions)
+        if range_stats is None:
+            range_stats = HistoricalRangeStats(
+                rows=crud.retrieve_historical_by_date_range_and_ticker_id(
+                    db=db, start=datetime.date.min, end=datetime.date.max, ticker_id=ticker_record.id
+                )
+            )
+            historical_range_stats_index.put(ticker_id=ticker_record.id, data_versions=data_versions, stats=range_stats)
+        stats = range_stats.query(start=start, end=end)
+        if stats:
+            logger.info(f'Successfully computed {ticker_name} stats for the following date range: {start} - {end}')
+            return JSONResponse(
+                content={'ticker_name': ticker_name, 'start': start.isoformat(), 'end': end.isoformat(), **stats}
+            )
+
+        message_no_records_found = f'No {ticker_name} records found for the following date range: {start} - {end}'
+        logger.error(msg=message_no_records_found)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_no_records_found)
+
+    message_missing_ticker = f'Ticker {ticker_name} does not exist.'
+    logger.error(msg=message_missing_ticker)
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_missing_ticker)
+
+
+@app.get(API_HISTORICAL_LATEST_ENDPOINT, tags=['Historical Data'])
+def get_historical_latest(ticker_name: str, db: Session = Depends(get_read_only_db)):
+    """
+    FastAPI endpoint for retrieving which dates of the historical data of a ticker are stored - the latest one (the
+    high-water mark of incremental loads), the first one and the missing ranges in between - read from the
+    (ticker_id, date) index without reading the data
+
+    :param ticker_name: The ticker_name for which to get the stored dates
+    :param db: Read-only database session
+    :return: JSONResponse (status code 200) with the first and last dates (null if there is no historical data), the
+    number of candlesticks and the gaps - date ranges with no candlesticks between the first and last dates
+    :raise: HTTPException (status code 404) if such a ticker record does not exist
+    """
+    ticker_record = crud.retrieve_ticker_by_name(db=db, ticker_name=ticker_name)
+    if ticker_record:
+        extent = crud.retrieve_historical_extent_by_ticker_id(db=db, ticker_id=ticker_record.id)
+        # The gaps are only looked for when the number of rows shows that some days are missing
+        gaps = crud.retrieve_historical_gaps_by_ticker_id(
+            db=db, ticker_id=ticker_record.id
+        ) if apiutils.has_historical_gaps(extent=extent) else []
+        return JSONResponse(
+            content={'ticker_name': ticker_name, **apiutils.format_historical_coverage(extent=extent, gaps=gaps)}
+        )
+
+    message_missing_ticker = f'Ticker {ticker_name} does not exist.'
+    logger.error(msg=message_missing_ticker)
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_missing_ticker)
+
+
+@app.get(API_HISTORICAL_JOBS_ENDPOINT, tags=['Historical Data'])
+def get_historical_job(job_id: str):
+    """
+    FastAPI endpoint for polling a job queued by a POST /historical/ request in background mode
+
+    :param job_id: The job id returned when the job has been queued
+    :return: JSONResponse (status code 200) with the status of the job (queued, running, succeeded or failed), the
+    number of jobs queued before it, the number of inserted, updated and skipped records or the error once it has been
+    written, and its timestamps
+    :raise: HTTPException (status code 404) if there is no such job - or it has finished long ago and been forgotten
+    """
+    job_status = historical_job_queue.get(job_id=job_id)
+    if job_status:
+        return JSONResponse(content=job_status)
+
+    message_missing_job = f'Historical job {job_id} does not exist.'
+    logger.error(msg=message_missing_job)
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_missing_job)
+
+
 @app.get(API_HISTORICAL_ENDPOINT, tags=['Historical Data'])
 def get_historical(
     ticker_name: str,
     data_format: GetHistoricalDataOutputType,
     start: datetime.date,
-    end: datetime.date
+    end: datetime.date,
+    request: Request,
+    stream: bool = False,
+    limit: Optional[int] = Query(default=None, gt=0),
+    cursor: Optional[str] = None,
+    granularity: GetHistoricalDataGranularity = GetHistoricalDataGranularity.day,
+    bucket_days: Optional[int] = Query(default=None, gt=0),
+    indicator_names: Optional[list[str]] = Query(default=None, alias='indicators'),
+    if_none_match: Optional[str] = Header(default=None),
+    if_modified_since: Optional[str] = Header(default=None),
+    accept_encoding: Optional[str] = Header(default=None),
+    db: Session = Depends(get_read_only_db)
 ):
     """
     FastAPI endpoint for retrieving historical data given a ticker_name and a date range
 
     :param ticker_name:The ticker_name for which to get the historical data
-    :param data_format: Enum - either csv or json
+    :param data_format: Enum - json, csv, arrow (Arrow IPC stream) or parquet
     :param start: The start date
     :param end: The end date
+    :param request: The request, to link to the next page
+    :param stream: Stream the rows from the database cursor in batches, as CSV or newline-delimited JSON chunks
+    (csv and json formats only)
+    :param limit: Return a page of at most this many rows (capped to HISTORICAL_MAX_PAGE_SIZE) - the Link header of
+    the response points to the next page, if there is one
+    :param cursor: Cursor of the page to return, taken from the Link header of the previous page
+    :param granularity: Enum - day, week, month or year: aggregate the daily candlesticks into candlesticks of that
+    period (first open, max high, min low, last close, sum of the volumes), the % change being that of the aggregated
+    closes - the date range is widened to whole periods and the date of a candlestick is the day its period starts on
+    :param bucket_days: Aggregate the daily candlesticks into candlesticks of this many days, counted from the start
+    date
+    :param indicator_names: Technical indicators to append as columns, comma separated or repeated - sma, ema, rsi, vwap
+    or bollinger, each optionally followed by _<window> (example sma_50,rsi). They are computed from enough of the
+    history before the start date for their first values to be the same as over the whole history
+    :param if_none_match: Entity tags of the representations the client already has
+    :param if_modified_since: Time of the representation the client already has, if it sends no entity tags
+    :param accept_encoding: Content encodings the client accepts - cached responses are served compressed accordingly
+    :param db: Read-only database session
     :return: JSONResponse (status code 200) if a ticker_name record exists and there is historical data related to it
-    :raise: HTTPException (status code 404) if such a ticker record does not exist or there is no historical tied to it
+    (StreamingResponse if stream is set), Response (status code 304) if the client already has the current data
+    :raise: HTTPException (status code 404) if such a ticker record does not exist or there is no historical tied to it,
+    HTTPException (status code 400) if streaming is requested for a binary format or along with pagination or
+    aggregation, if aggregation is requested along with pagination, if both granularity and bucket_days are set, if the
+    cursor is malformed, if the indicators are invalid or if they are requested along with streaming or aggregation
     """
-    ticker_record = crud.retrieve_ticker_by_name(ticker_name=ticker_name)
+    if stream and data_format not in apiutils.HISTORICAL_STREAM_MEDIA_TYPES:
+        message_stream_unsupported = f'Streaming is only supported for the csv and json formats, not {data_format}.'
+        logger.error(msg=message_stream_unsupported)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message_stream_unsupported)
+
+    page_size, cursor_date = None, None
+    if limit is not None or cursor is not None:
+        if stream:
+            message_stream_paginated = 'Streamed responses cannot be paginated.'
+            logger.error(msg=message_stream_paginated)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message_stream_paginated)
+        page_size = apiutils.get_page_size(limit=limit)
+        if cursor:
+            try:
+                cursor_date = apiutils.decode_cursor(cursor=cursor)
+            except ValueError:
+                message_invalid_cursor = f'Invalid cursor {cursor}.'
+                logger.error(msg=message_invalid_cursor)
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message_invalid_cursor)
+
+    aggregated = granularity != GetHistoricalDataGranularity.day or bucket_days is not None
+    if aggregated:
+        if granularity != GetHistoricalDataGranularity.day and bucket_days is not None:
+            message_conflicting_buckets = 'Only one of granularity and bucket_days can be set.'
+            logger.error(msg=message_conflicting_buckets)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message_conflicting_buckets)
+        if stream or page_size:
+            message_aggregation_unsupported = 'Aggregated data cannot be streamed or paginated.'
+            logger.error(msg=message_aggregation_unsupported)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message_aggregation_unsupported)
+        start, end = apiutils.get_bucket_range(start=start, end=end, granularity=granularity, bucket_days=bucket_days)
+
+    indicator_specs = []
+    if indicator_names:
+        if stream or aggregated:
+            message_indicators_unsupported = 'Technical indicators cannot be added to streamed or aggregated data.'
+            logger.error(msg=message_indicators_unsupported)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message_indicators_unsupported)
+        try:
+            indicator_specs = indicators.parse_indicators(values=indicator_names)
+        except ValueError as error:
+            message_invalid_indicators = f'{error}.'
+            logger.error(msg=message_invalid_indicators)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message_invalid_indicators)
+
+    if not stream:
+        cache_key = HistoricalCacheKey(
+            ticker_name=ticker_name, start=start, end=end, data_format=data_format, page_size=page_size,
+            cursor=cursor_date, granularity=granularity, bucket_days=bucket_days, indicators=tuple(indicator_specs)
+        )
+        # Taken before reading, so that a response built from data which is overwritten meanwhile is not cached
+        cache_generation = historical_response_cache.generation(ticker_name=ticker_name)
+
+    ticker_record = crud.retrieve_ticker_by_name(db=db, ticker_name=ticker_name)
     if ticker_record:
-        historical_data = crud.retrieve_historical_by_date_range_and_ticker_id(
-            start=start, end=end, ticker_id=ticker_record.id
+        # Read before the data, so that a write which commits in between leaves the entity tag older than the data
+        # rather than the other way around
+        data_versions, last_modified = crud.retrieve_historical_data_versions(db=db, ticker_id=ticker_record.id)
+        validator_headers = apiutils.build_validator_headers(
+            etag=apiutils.build_etag(
+                ticker_name, ticker_record.id, *data_versions, start, end, data_format.value, stream, page_size,
+                cursor_date, granularity.value, bucket_days, indicator_specs
+            ),
+            last_modified=last_modified
         )
-        records_df = apiutils.process_historical_records_to_df(historical_data=historical_data)
-        apiutils.add_pct_change(df=records_df, column_name=HistoricalData.close.name)
+        if apiutils.is_not_modified(
+            validator_headers=validator_headers, if_none_match=if_none_match, if_modified_since=if_modified_since
+        ):
+            logger.info(f'{ticker_name} records for the following date range have not changed: {start} - {end}')
+            return apiutils.build_not_modified_response(validator_headers=validator_headers)
+        if not stream:
+            # Checked against the data versions, so that writes handled by other workers are never served stale
+            cached_response = historical_response_cache.get(
+                key=cache_key, data_versions=data_versions,
+                encoding=compression.negotiate_encoding(accept_encoding=accept_encoding)
+            )
+            if cached_response:
+                logger.info(
+                    f'Served cached {ticker_name} records as {data_format} for the following date range: '
+                    f'{start} - {end}'
+                )
+                return cached_response
 
-        if not records_df.empty:
-            logger.info(
-                f'Successfully retrieved {len(records_df.index)} {ticker_name} '
-                f'records as {data_format} for the following date range: {start} - {end}'
+        page_start, fetch_limit, next_cursor = start, None, None
+        if page_size:
+            # Keyset pagination - the page is read from the last row of the previous page onwards, which seeds the
+            # % change of its first row, plus one more row to tell whether there is a next page
+            page_start = max(start, cursor_date) if cursor_date else start
+            fetch_limit = page_size + (2 if cursor_date else 1)
+
+        if stream:
+            batches = crud.stream_historical_by_date_range_and_ticker_id(
+                db=db, start=start, end=end, ticker_id=ticker_record.id
             )
-            if data_format == GetHistoricalDataOutputType.csv_format:
-                return PlainTextResponse(content=records_df.to_csv(), media_type='text/csv')
+            # Fetch the first batch up front so that a missing range can still be answered with a 404
+            first_batch = next(batches, None)
+            if first_batch:
+                logger.info(
+                    f'Streaming {ticker_name} records as {data_format} for the following date range: {start} - {end}'
+                )
+                return StreamingResponse(
+                    content=apiutils.stream_historical_records(
+                        batches=chain([first_batch], batches), data_format=data_format
+                    ),
+                    media_type=apiutils.HISTORICAL_STREAM_MEDIA_TYPES[data_format],
+                    headers=validator_headers
+                )
+        elif aggregated:
+            if bucket_days or not historical_bucket_cache.max_entries:
+                historical_data = crud.retrieve_historical_buckets_with_pct_change_by_date_range_and_ticker_id(
+                    db=db, start=start, end=end, ticker_id=ticker_record.id, granularity=granularity,
+                    bucket_days=bucket_days
+                )
             else:
-                return JSONResponse(content=records_df.to_dict(orient='records'))
+                bucket_key = HistoricalBucketKey(ticker_id=ticker_record.id, granularity=granularity)
+                bucket_series = historical_bucket_cache.get(key=bucket_key, data_versions=data_versions)
+                if bucket_series is None:
+                    bucket_series = HistoricalBucketSeries.from_rows(
+                        rows=crud.retrieve_historical_buckets_by_date_range_and_ticker_id(
+                            db=db, start=datetime.date.min, end=datetime.date.max, ticker_id=ticker_record.id,
+                            granularity=granularity
+                        )
+                    )
+                    historical_bucket_cache.put(key=bucket_key, data_versions=data_versions, series=bucket_series)
+                historical_data, _ = apiutils.add_pct_change_to_rows(
+                    rows=bucket_series.slice(start=start, end=end), previous_close=None
+                )
+            if historical_data:
+                logger.info(
+                    f'Successfully aggregated {len(historical_data)} {ticker_name} records as {data_format} for the '
+                    f'following date range: {start} - {end}'
+                )
+                response = apiutils.build_historical_rows_response(rows=historical_data, data_format=data_format)
+                response.headers.update(validator_headers)
+                historical_response_cache.put(
+                    key=cache_key, response=response, data_versions=data_versions, generation=cache_generation
+                )
+                return response
+        elif HISTORICAL_PCT_CHANGE_IN_DATABASE:
+            historical_data = crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+                db=db, start=page_start, end=end, ticker_id=ticker_record.id, limit=fetch_limit
+            )
+            if indicator_specs and historical_data:
+                historical_data = indicators.add_indicators_to_rows(
+                    rows=historical_data,
+                    warmup_rows=crud.retrieve_historical_before_date_and_ticker_id(
+                        db=db, before=page_start, ticker_id=ticker_record.id,
+                        limit=indicators.get_lookback(specs=indicator_specs)
+                    ),
+                    specs=indicator_specs
+                )
+            if page_size:
+                page, next_cursor = apiutils.slice_historical_page(
+                    rows=historical_data, cursor_date=cursor_date, page_size=page_size
+                )
+                historical_data = historical_data[page]
+            if historical_data:
+                logger.info(
+                    f'Successfully retrieved {len(historical_data)} {ticker_name} '
+                    f'records as {data_format} for the following date range: {start} - {end}'
+                )
+                response = apiutils.build_historical_rows_response(
+                    rows=historical_data, data_format=data_format,
+                    extra_column_names=indicators.get_column_names(specs=indicator_specs)
+                )
+                response.headers.update(validator_headers)
+                if next_cursor:
+                    response.headers['Link'] = apiutils.build_next_page_link(url=request.url, next_cursor=next_cursor)
+                historical_response_cache.put(
+                    key=cache_key, response=response, data_versions=data_versions, generation=cache_generation
+                )
+                return response
+        else:
+            historical_data = crud.retrieve_historical_by_date_range_and_ticker_id(
+                db=db, start=page_start, end=end, ticker_id=ticker_record.id, limit=fetch_limit
+            )
+            records_df = apiutils.process_historical_records_to_df(historical_data=historical_data)
+            apiutils.add_pct_change(df=records_df, column_name=HistoricalData.close.name)
+            if indicator_specs and historical_data:
+                indicators.add_indicators_to_df(
+                    df=records_df,
+                    warmup_rows=crud.retrieve_historical_before_date_and_ticker_id(
+                        db=db, before=page_start, ticker_id=ticker_record.id,
+                        limit=indicators.get_lookback(specs=indicator_specs)
+                    ),
+                    specs=indicator_specs
+                )
+            if page_size:
+                page, next_cursor = apiutils.slice_historical_page(
+                    rows=historical_data, cursor_date=cursor_date, page_size=page_size
+                )
+                records_df = records_df.iloc[page].reset_index(drop=True)
+
+            if not records_df.empty:
+                logger.info(
+                    f'Successfully retrieved {len(records_df.index)} {ticker_name} '
+                    f'records as {data_format} for the following date range: {start} - {end}'
+                )
+                response = apiutils.build_historical_response(df=records_df, data_format=data_format)
+                response.headers.update(validator_headers)
+                if next_cursor:
+                    response.headers['Link'] = apiutils.build_next_page_link(url=request.url, next_cursor=next_cursor)
+                historical_response_cache.put(
+                    key=cache_key, response=response, data_versions=data_versions, generation=cache_generation
+                )
+                return response
 
         message_no_records_found = f'No {ticker_name} records found for the following date range: {start} - {end}'
         logger.error(msg=message_no_records_found)
@@ -90,17 +554,18 @@ def get_historical(
 
 
 @app.post(API_TICKERS_ENDPOINT, tags=['Tickers'])
-def add_ticker(ticker_request: PostTickerRequest):
+def add_ticker(ticker_request: PostTickerRequest, db: Session = Depends(get_db)):
     """
     FastAPI endpoint for adding a ticker_name, given a string to represent it
 
     :param ticker_request: Pydantic model with a str attribute
+    :param db: Database session
     :return: JSONResponse (status code 200) if the ticker can be added (such a ticker_name record does not yet exist)
     :raise: HTTPException (status code 400) if such a ticker already exists
     """
-    ticker_record = crud.retrieve_ticker_by_name(ticker_name=ticker_request.ticker_name)
+    ticker_record = crud.retrieve_ticker_by_name(db=db, ticker_name=ticker_request.ticker_name, verify=True)
     if not ticker_record:
-        added_ticker = crud.create_ticker(ticker_name=ticker_request.ticker_name)
+        added_ticker = crud.create_ticker(db=db, ticker_name=ticker_request.ticker_name)
         ticker_record_json = jsonable_encoder(obj=added_ticker)
         logger.info(msg=f'Ticker record {ticker_record_json} has been successfully added.')
         return JSONResponse(content=ticker_record_json)
@@ -111,24 +576,118 @@ def add_ticker(ticker_request: PostTickerRequest):
 
 
 @app.post(API_HISTORICAL_ENDPOINT, tags=['Historical Data'])
-def add_historical(post_historical_request: PostHistoricalDataRequest):
+def add_historical(
+    post_historical_request: PostHistoricalDataRequest,
+    on_conflict: Optional[PostHistoricalDataConflictAction] = None,
+    background: bool = False,
+    db: Session = Depends(get_db)
+):
     """
     FastAPI endpoint for adding historical data given a ticker_name and data associated with it
 
     :param post_historical_request: Pydantic model which has a number of attributes which define what a successful post
     request for submitting historical data should look like
-    :return: JSONResponse (status code 200) if the ticker exists and all the historical data that has been added
-    :raises: HTTPException (status code 404) if such a ticker does not exist
+    :param on_conflict: Enum - update or ignore the candlesticks which are already stored, in which case only the number
+    of inserted, updated and skipped records is returned. When omitted, adding an existing candlestick is an error
+    :param background: Queue the data to be written by the background writer, together with the data of other requests,
+    rather than writing it before responding - the job it is written by is polled with GET /historical/jobs/
+    :param db: Database session
+    :return: JSONResponse (status code 200) if the ticker exists and all the historical data that has been added -
+    JSONResponse (status code 202) with the status of the queued job and its URL in the Location header in background
+    mode
+    :raises: HTTPException (status code 404) if such a ticker does not exist, HTTPException (status code 409) if
+    on_conflict is omitted and some of the candlesticks are already stored, HTTPException (status code 503) with a
+    Retry-After header in background mode if the job queue is full, HTTPException (status code 413) in background mode
+    if there are more records than the job queue holds - they are to be sent without background mode
     """
-    ticker_record = crud.retrieve_ticker_by_name(ticker_name=post_historical_request.ticker_name)
+    ticker_record = crud.retrieve_ticker_by_name(
+        db=db, ticker_name=post_historical_request.ticker_name, verify=True
+    )
     if ticker_record:
-        records = apiutils.generate_historical_data_records(
+        records = apiutils.generate_historical_data_params(
             ticker_id=ticker_record.id,
             post_historical_request=post_historical_request
         )
-        records_json = [jsonable_encoder(obj=x) for x in records]
-        crud.create_historical(records=records)
-        logger.info(msg=f'Successfully added {len(records)} {post_historical_request.ticker_name} records.')
+        if background:
+            if len(post_historical_request.candlestick_records) > historical_job_queue.max_records:
+                message_too_large = f'The job queue holds at most {historical_job_queue.max_records} records - send ' \
+                                    f'the {len(post_historical_request.candlestick_records)} ' \
+                                    f'{post_historical_request.ticker_name} records without background mode.'
+                logger.error(msg=message_too_large)
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=message_too_large)
+            job_status = historical_job_queue.submit(
+                ticker_name=post_historical_request.ticker_name,
+                ticker_id=ticker_record.id,
+                records=list(records),
+                on_conflict=on_conflict
+            )
+            if not job_status:
+                message_queue_full = f'The historical job queue is full - the {post_historical_request.ticker_name} ' \
+                                     f'records have not been queued, retry later.'
+                logger.error(msg=message_queue_full)
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail=message_queue_full,
+                    headers={'Retry-After': str(HISTORICAL_JOB_RETRY_AFTER)}
+                )
+            logger.info(
+                msg=f'Queued {job_status["records"]} {post_historical_request.ticker_name} records as historical job '
+                    f'{job_status["job_id"]}.'
+            )
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content=job_status,
+                headers={'Location': f'{API_HISTORICAL_JOBS_ENDPOINT}?job_id={job_status["job_id"]}'}
+            )
+        if on_conflict:
+            num_inserted, num_updated, num_skipped = crud.upsert_historical(
+                db=db, ticker_id=ticker_record.id, records=records, on_conflict=on_conflict
+            )
+            if num_inserted or num_updated:
+                historical_response_cache.invalidate(
+                    ticker_name=post_historical_request.ticker_name,
+                    dates=(record.date for record in post_historical_request.candlestick_records)
+                )
+            logger.info(
+                msg=f'Successfully upserted {post_historical_request.ticker_name} records: {num_inserted} inserted, '
+                    f'{num_updated} updated, {num_skipped} skipped.'
+            )
+            return JSONResponse(
+                content={
+                    'ticker_name': post_historical_request.ticker_name,
+                    'inserted_records': num_inserted,
+                    'updated_records': num_updated,
+                    'skipped_records': num_skipped
+                }
+            )
+
+        # Kept to echo the added records without building them again
+        records = list(records)
+        try:
+            num_added = crud.create_historical(db=db, records=records)
+        except IntegrityError:
+            message_records_exist = f'Some of the {post_historical_request.ticker_name} records already exist - ' \
+                                    f'use on_conflict to update or skip them.'
+            logger.error(msg=message_records_exist)
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=message_records_exist)
+        historical_response_cache.invalidate(
+            ticker_name=post_historical_request.ticker_name,
+            dates=(record.date for record in post_historical_request.candlestick_records)
+        )
+        if ticker_record.id in historical_range_stats_index:
+            # Candlesticks are usually added after the last one, in which case the index is extended, not rebuilt
+            data_versions, _ = crud.retrieve_historical_data_versions(db=db, ticker_id=ticker_record.id)
+            historical_range_stats_index.append(
+                ticker_id=ticker_record.id,
+                data_versions=data_versions,
+                rows=[
+                    (record.date.isoformat(), ticker_record.id, record.low, record.high, record.open, record.close,
+                     record.volume)
+                    for record in post_historical_request.candlestick_records
+                ]
+            )
+        records_json = apiutils.encode_historical_data_params(records=records)
+        logger.info(msg=f'Successfully added {num_added} {post_historical_request.ticker_name} records.')
         return JSONResponse(
             content={
                 'ticker_name': post_historical_request.ticker_name, 'added_records': records_json
@@ -141,18 +700,171 @@ def add_historical(post_historical_request: PostHistoricalDataRequest):
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_missing_ticker)
 
 
+@app.post(API_HISTORICAL_INGEST_ENDPOINT, tags=['Historical Data'])
+async def ingest_historical(
+    ticker_name: str,
+    request: Request,
+    on_conflict: PostHistoricalDataConflictAction = PostHistoricalDataConflictAction.update,
+    db: Session = Depends(get_db)
+):
+    """
+    FastAPI endpoint for adding large amounts of historical data of a ticker: the body (newline-delimited JSON
+    objects or CSV with a header row, each row with the date, low, high, open, close and volume of a candlestick) is
+    parsed, validated and upserted in batches of HISTORICAL_INGEST_BATCH_SIZE rows as it arrives, every batch committed
+    on its own - so that the memory used does not depend on the size of the body, and only counts are returned
+
+    :param ticker_name: The ticker_name the data is associated with
+    :param request: The request, whose Content-Type is either application/x-ndjson or text/csv
+    :param on_conflict: Enum - update or ignore the candlesticks which are already stored
+    :param db: Database session - used from the threadpool, as the body is read on the event loop
+    :return: JSONResponse (status code 200) with the number of received, inserted, updated and skipped records and the
+    number of batches
+    :raises: HTTPException (status code 415) if the body is neither NDJSON nor CSV, HTTPException (status code 404) if
+    such a ticker does not exist, HTTPException (status code 422) at the first invalid line - the batches before it
+    have been stored
+    """
+    data_format = apiutils.get_ingest_format(content_type=request.headers.get('Content-Type'))
+    if data_format is None:
+        message_unsupported_media_type = f'Historical data can only be ingested as ' \
+                                         f'{" or ".join(apiutils.HISTORICAL_STREAM_MEDIA_TYPES.values())}.'
+        logger.error(msg=message_unsupported_media_type)
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=message_unsupported_media_type
+        )
+    ticker_record = await run_in_threadpool(
+        crud.retrieve_ticker_by_name, db=db, ticker_name=ticker_name, verify=True
+    )
+    if not ticker_record:
+        message_missing_ticker = f'Ticker {ticker_name} does not exist - the historical data could not be added.'
+        logger.error(msg=message_missing_ticker)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=message_missing_ticker)
+
+    counts = {'received_records': 0, 'inserted_records': 0, 'updated_records': 0, 'skipped_records': 0, 'batches': 0}
+    try:
+        async for batch in apiutils.parse_historical_ingest(
+                chunks=request.stream(), data_format=data_format, ticker_id=ticker_record.id
+        ):
+            num_inserted, num_updated, num_skipped = await run_in_threadpool(
+                crud.upsert_historical, db=db, ticker_id=ticker_record.id, records=batch, on_conflict=on_conflict
+            )
+            if num_inserted or num_updated:
+                historical_response_cache.invalidate(
+                    ticker_name=ticker_name, dates=(record['date'] for record in batch)
+                )
+            counts['received_records'] += len(batch)
+            counts['inserted_records'] += num_inserted
+            counts['updated_records'] += num_updated
+            counts['skipped_records'] += num_skipped
+            counts['batches'] += 1
+    except ValueError as error:
+        message_invalid_line = f'{error} - the {counts["received_records"]} {ticker_name} records before it ' \
+                               f'have been stored.'
+        logger.error(msg=message_invalid_line)
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=message_invalid_line)
+    logger.info(
+        msg=f'Successfully ingested {counts["received_records"]} {ticker_name} records in {counts["batches"]} '
+            f'batches: {counts["inserted_records"]} inserted, {counts["updated_records"]} updated, '
+            f'{counts["skipped_records"]} skipped.'
+    )
+    return JSONResponse(content={'ticker_name': ticker_name, **counts})
+
+
+@app.post(API_HISTORICAL_IMPORT_ENDPOINT, tags=['Historical Data'])
+async def import_historical(
+    request: Request,
+    ticker_name: Optional[str] = None,
+    on_conflict: PostHistoricalDataConflictAction = PostHistoricalDataConflictAction.update,
+    db: Session = Depends(get_db)
+):
+    """
+    FastAPI endpoint for importing historical datasets: the body is a CSV (with a header row) or Parquet file
+    whose rows have the ticker, date, low, high, open, close and volume of a candlestick - the ticker can be left out of
+    a file of a single ticker, given as ticker_name instead. The file is read into columns with pyarrow rather than
+    validated row by row, the tickers which do not exist yet are created and all the rows are upserted with multi-row
+    statements in a single transaction - either the whole file is imported or nothing is
+
+    :param request: The request, whose Content-Type is either text/csv or application/vnd.apache.parquet
+    :param ticker_name: The ticker of the rows of a file which has no ticker column
+    :param on_conflict: Enum - update or ignore the candlesticks which are already stored
+    :param db: Database session - used from the threadpool, as the body is read on the event loop
+    :return: JSONResponse (status code 200) with the number of tickers and created tickers and the number of received,
+    inserted, updated and skipped records
+    :raises: HTTPException (status code 415) if the body is neither CSV nor Parquet, HTTPException (status code 422) if
+    the file cannot be read, has no rows or a column or value is missing or invalid
+    """
+    data_format = bulkimport.get_import_format(content_type=request.headers.get('Content-Type'))
+    if data_format is None:
+        message_unsupported_media_type = f'Historical data can only be imported as ' \
+                                         f'{" or ".join(bulkimport.IMPORT_MEDIA_TYPES.values())}.'
+        logger.error(msg=message_unsupported_media_type)
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=message_unsupported_media_type
+        )
+    with await bulkimport.spool_body(chunks=request.stream()) as source:
+        try:
+            table = await run_in_threadpool(
+                bulkimport.read_historical_import, source=source, data_format=data_format, ticker_name=ticker_name
+            )
+        except ValueError as error:
+            message_invalid_file = f'{error} - no historical data has been imported.'
+            logger.error(msg=message_invalid_file)
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=message_invalid_file)
+
+    ticker_ids, num_created = await run_in_threadpool(
+        crud.create_tickers, db=db, ticker_names=bulkimport.get_ticker_names(table=table)
+    )
+    num_inserted, num_updated, num_skipped = await run_in_threadpool(
+        crud.import_historical,
+        db=db,
+        row_groups=bulkimport.build_import_row_groups(table=table, ticker_ids=ticker_ids),
+        ticker_ids=ticker_ids.values(),
+        on_conflict=on_conflict
+    )
+    if num_inserted or num_updated:
+        for imported_ticker_name, dates in bulkimport.get_dates_by_ticker(table=table).items():
+            historical_response_cache.invalidate(ticker_name=imported_ticker_name, dates=dates)
+    counts = {
+        'tickers': len(ticker_ids),
+        'created_tickers': num_created,
+        'received_records': table.num_rows,
+        'inserted_records': num_inserted,
+        'updated_records': num_updated,
+        'skipped_records': num_skipped
+    }
+    logger.info(
+        msg=f'Successfully imported {counts["received_records"]} records of {counts["tickers"]} tickers '
+            f'({num_created} created): {num_inserted} inserted, {num_updated} updated, {num_skipped} skipped.'
+    )
+    return JSONResponse(content=counts)
+
+
 @app.delete(API_CLEAR_ENDPOINT, tags=['Database'])
-def remove_all_records():
+def remove_all_records(db: Session = Depends(get_db)):
     """
     FastAPI endpoint for clearing all records in the tickers and historical database tables
 
+    :param db: Database session
     :return: JSONResponse (status code 200) with the number of rows that have been deleted form each table
     """
-    removed_tickers = crud.delete_all_ticker_records()
-    removed_historical_data = crud.delete_all_historical_records()
+    removed_tickers = crud.delete_all_ticker_records(db=db)
+    removed_historical_data = crud.delete_all_historical_records(db=db)
+    historical_response_cache.clear()
+    historical_bucket_cache.clear()
+    historical_range_stats_index.clear()
     message_removed_records = f'Successfully removed {removed_tickers} ticker rows and {removed_historical_data} ' \
                               f'historical data rows.'
     logger.info(msg=message_removed_records)
     return JSONResponse(
         content={'removed_ticker_rows': removed_tickers, 'removed_historical_data_rows': removed_historical_data}
     )
+
+
+@app.get(API_CACHE_ENDPOINT, tags=['Cache'])
+def get_cache_stats():
+    """
+    FastAPI endpoint for getting the counters of the historical data response cache
+
+    :return: JSONResponse (status code 200) with the number of hits, misses, evictions, expirations and invalidations,
+    as well as the current number of entries and their size
+    """
+    return JSONResponse(content=historical_response_cache.stats())
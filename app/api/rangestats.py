@@ -0,0 +1,272 @@
+import copy
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Iterable, Optional
+
+import numpy
+
+from app.api.config import HISTORICAL_STATS_INDEX_MAX_TICKERS
+
+# Position of the columns of a historical data row (as selected by crud.HISTORICAL_DATA_COLUMNS)
+_DATE_INDEX, _LOW_INDEX, _HIGH_INDEX, _OPEN_INDEX, _CLOSE_INDEX, _VOLUME_INDEX = 0, 2, 3, 4, 5, 6
+
+
+def _to_day_numbers(dates: Iterable) -> numpy.ndarray:
+    # Number of days since the epoch - the dates are ISO strings (as read from the database) or dates
+    return numpy.array([str(day) for day in dates], dtype='datetime64[D]').astype(numpy.int64)
+
+
+def _to_date_string(day_number: numpy.int64) -> str:
+    return str(day_number.astype('datetime64[D]'))
+
+
+def _build_sparse_table(values: numpy.ndarray, function) -> list[numpy.ndarray]:
+    # Level k holds function over values[i:i + 2 ** k] at position i
+    levels = [values]
+    while 2 ** len(levels) <= len(values):
+        previous, half = levels[-1], 2 ** (len(levels) - 1)
+        levels.append(function(previous[:-half], previous[half:]))
+    return levels
+
+
+def _extend_sparse_table(levels: list[numpy.ndarray], values: numpy.ndarray, function) -> list[numpy.ndarray]:
+    # Only the positions whose span reaches into the new values are computed
+    extended = [numpy.concatenate([levels[0], values])]
+    while 2 ** len(extended) <= len(extended[0]):
+        previous, half = extended[-1], 2 ** (len(extended) - 1)
+        level = len(extended)
+        old_level = levels[level] if level < len(levels) else previous[:0]
+        first_index = len(old_level)
+        tail = function(previous[first_index:len(previous) - half], previous[first_index + half:])
+        extended.append(numpy.concatenate([old_level, tail]))
+    return extended
+
+
+def _query_sparse_table(levels: list[numpy.ndarray], first_index: int, last_index: int, function) -> float:
+    # Two (possibly overlapping) spans of the same power of two length cover the range
+    level = (last_index - first_index + 1).bit_length() - 1
+    return float(function(levels[level][first_index], levels[level][last_index - 2 ** level + 1]))
+
+
+class HistoricalRangeStats:
+    """
+    Precomputed index over the historical data of one ticker which answers the aggregates of any date range in
+    constant time, however long the range: prefix sums of the volume and the close, sparse tables of the range minimum
+    of the low and the range maximum of the high, and the number of rows before every day from the first date to the
+    last one (so that the rows of a range are found without a search)
+    """
+
+    def __init__(self, rows: list[tuple]):
+        """
+        :param rows: Historical data rows, as selected by crud.HISTORICAL_DATA_COLUMNS, ordered by date
+        """
+        columns = list(zip(*rows)) if rows else [()] * (_VOLUME_INDEX + 1)
+        self._day_numbers = _to_day_numbers(dates=columns[_DATE_INDEX])
+        self._opens = numpy.array(columns[_OPEN_INDEX], dtype=float)
+        self._closes = numpy.array(columns[_CLOSE_INDEX], dtype=float)
+        self._volume_sums = numpy.concatenate([[0.0], numpy.cumsum(numpy.array(columns[_VOLUME_INDEX], dtype=float))])
+        self._close_sums = numpy.concatenate([[0.0], numpy.cumsum(self._closes)])
+        self._low_levels = _build_sparse_table(
+            values=numpy.array(columns[_LOW_INDEX], dtype=float), function=numpy.minimum
+        )
+        self._high_levels = _build_sparse_table(
+            values=numpy.array(columns[_HIGH_INDEX], dtype=float), function=numpy.maximum
+        )
+        self._rows_before_day = self._build_rows_before_day()
+
+    def __len__(self) -> int:
+        return len(self._day_numbers)
+
+    @property
+    def last_date(self) -> Optional[str]:
+        """
+        :return: The ISO date of the last row, None if there are no rows
+        """
+        return _to_date_string(day_number=self._day_numbers[-1]) if len(self) else None
+
+    def extend(self, rows: list[tuple]) -> 'HistoricalRangeStats':
+        """
+        Given historical data rows which are all later than the last row, build the index of the rows followed by them -
+        without recomputing the index over the earlier rows. The index itself is left untouched, so that it can still
+        be queried by other threads meanwhile
+
+        :param rows: Historical data rows, as selected by crud.HISTORICAL_DATA_COLUMNS, ordered by date
+        :return: The extended index
+        :raise: ValueError if a row is not later than the last row
+        """
+        if not rows:
+            return self
+        columns = list(zip(*rows))
+        day_numbers = _to_day_numbers(dates=columns[_DATE_INDEX])
+        if len(self) and day_numbers[0] <= self._day_numbers[-1] or numpy.any(numpy.diff(day_numbers) <= 0):
+            raise ValueError('Only rows later than the last row can be appended')
+        closes = numpy.array(columns[_CLOSE_INDEX], dtype=float)
+        volumes = numpy.array(columns[_VOLUME_INDEX], dtype=float)
+        extended = copy.copy(self)
+        extended._day_numbers = numpy.concatenate([self._day_numbers, day_numbers])
+        extended._opens = numpy.concatenate([self._opens, numpy.array(columns[_OPEN_INDEX], dtype=float)])
+        extended._closes = numpy.concatenate([self._closes, closes])
+        extended._volume_sums = numpy.concatenate([self._volume_sums, self._volume_sums[-1] + numpy.cumsum(volumes)])
+        extended._close_sums = numpy.concatenate([self._close_sums, self._close_sums[-1] + numpy.cumsum(closes)])
+        extended._low_levels = _extend_sparse_table(
+            levels=self._low_levels, values=numpy.array(columns[_LOW_INDEX], dtype=float), function=numpy.minimum
+        )
+        extended._high_levels = _extend_sparse_table(
+            levels=self._high_levels, values=numpy.array(columns[_HIGH_INDEX], dtype=float), function=numpy.maximum
+        )
+        if len(self):
+            new_days = numpy.arange(self._day_numbers[-1] + 2, day_numbers[-1] + 2)
+            extended._rows_before_day = numpy.concatenate([
+                self._rows_before_day, numpy.searchsorted(extended._day_numbers, new_days)
+            ])
+        else:
+            extended._rows_before_day = extended._build_rows_before_day()
+        return extended
+
+    def query(self, start: date, end: date) -> Optional[dict]:
+        """
+        Given a date range, get the aggregates of the rows in it
+
+        :param start: The start date
+        :param end: The end date
+        :return: Dictionary with the dates of the first and last rows, the number of rows, the first open, the max high,
+        the min low, the last close, the total volume, the average close and the % change from the first open to the
+        last close - None if there are no rows in the range
+        """
+        first_index = self._count_rows_before(day_number=_to_day_numbers(dates=[start])[0])
+        end_index = self._count_rows_before(day_number=_to_day_numbers(dates=[end])[0] + 1)
+        if first_index >= end_index:
+            return None
+        last_index = end_index - 1
+        first_open, last_close = float(self._opens[first_index]), float(self._closes[last_index])
+        return {
+            'first_date': _to_date_string(day_number=self._day_numbers[first_index]),
+            'last_date': _to_date_string(day_number=self._day_numbers[last_index]),
+            'records': end_index - first_index,
+            'open': first_open,
+            'high': _query_sparse_table(
+                levels=self._high_levels, first_index=first_index, last_index=last_index, function=max
+            ),
+            'low': _query_sparse_table(
+                levels=self._low_levels, first_index=first_index, last_index=last_index, function=min
+            ),
+            'close': last_close,
+            'volume': float(self._volume_sums[end_index] - self._volume_sums[first_index]),
+            'average_close': float(
+                self._close_sums[end_index] - self._close_sums[first_index]
+            ) / (end_index - first_index),
+            '% change': (last_close / first_open - 1) * 100 if first_open else 0.00
+        }
+
+    def _build_rows_before_day(self) -> numpy.ndarray:
+        if not len(self):
+            return numpy.zeros(1, dtype=numpy.int64)
+        days = numpy.arange(self._day_numbers[0], self._day_numbers[-1] + 2)
+        return numpy.searchsorted(self._day_numbers, days)
+
+    def _count_rows_before(self, day_number: int) -> int:
+        if not len(self) or day_number <= self._day_numbers[0]:
+            return 0
+        return int(self._rows_before_day[min(day_number - self._day_numbers[0], len(self._rows_before_day) - 1)])
+
+
+class HistoricalRangeStatsIndex:
+    """
+    Thread-safe in-process LRU store of the HistoricalRangeStats of tickers, labelled with the data versions of the
+    ticker they have been built from like the HistoricalBucketCache - appends made by this process extend the stats of
+    the ticker in place, any other write makes the next request build them again
+    """
+
+    def __init__(self, max_tickers: int):
+        """
+        :param max_tickers: Maximum number of tickers whose stats are kept - 0 keeps none
+        """
+        self.max_tickers = max_tickers
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[tuple, HistoricalRangeStats]] = OrderedDict()
+        self._builds = 0
+        self._appends = 0
+
+    def __contains__(self, ticker_id: int) -> bool:
+        with self._lock:
+            return ticker_id in self._entries
+
+    def get(self, ticker_id: int, data_versions: tuple) -> Optional[HistoricalRangeStats]:
+        """
+        Given a ticker id and the current data versions of the ticker, get its stats and mark them as the most recently
+        used ones
+
+        :param ticker_id: The ticker id
+        :param data_versions: The data versions of the ticker, as returned by crud.retrieve_historical_data_versions
+        :return: The stats, None if there are none or they have been built with other data versions
+        """
+        with self._lock:
+            entry = self._entries.get(ticker_id)
+            if not entry or entry[0] != data_versions:
+                return None
+            self._entries.move_to_end(ticker_id)
+            return entry[1]
+
+    def put(self, ticker_id: int, data_versions: tuple, stats: HistoricalRangeStats):
+        """
+        Given a ticker id, keep its stats, evicting the least recently used ones if the index is full
+
+        :param ticker_id: The ticker id
+        :param data_versions: The data versions of the ticker read before the rows the stats have been built from
+        :param stats: The stats
+        """
+        if not self.max_tickers:
+            return
+        with self._lock:
+            self._entries[ticker_id] = (data_versions, stats)
+            self._entries.move_to_end(ticker_id)
+            self._builds += 1
+            while len(self._entries) > self.max_tickers:
+                self._entries.popitem(last=False)
+
+    def append(self, ticker_id: int, data_versions: tuple, rows: list[tuple]) -> bool:
+        """
+        Given a ticker id, the data versions of the ticker right after rows have been inserted for it and the rows,
+        extend the stats of the ticker - if they are exactly one write behind and the rows are all later than their
+        last row, otherwise the stats are dropped
+
+        :param ticker_id: The ticker id
+        :param data_versions: The data versions of the ticker read after the insert has been committed
+        :param rows: The inserted rows, as selected by crud.HISTORICAL_DATA_COLUMNS
+        :return: True if the stats have been extended
+        """
+        rows = sorted(rows, key=lambda row: str(row[_DATE_INDEX]))
+        with self._lock:
+            entry = self._entries.get(ticker_id)
+            if not entry:
+                return False
+            (global_version, ticker_version), stats = entry
+            last_date = stats.last_date
+            if data_versions == (global_version, ticker_version + 1) and rows and (
+                    last_date is None or str(rows[0][_DATE_INDEX]) > last_date
+            ):
+                self._entries[ticker_id] = (data_versions, stats.extend(rows=rows))
+                self._appends += 1
+                return True
+            del self._entries[ticker_id]
+            return False
+
+    def clear(self):
+        """
+        Drop the stats of all the tickers
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the index
+
+        :return: Dictionary with the number of builds, appends and tickers
+        """
+        with self._lock:
+            return {'builds': self._builds, 'appends': self._appends, 'entries': len(self._entries)}
+
+
+historical_range_stats_index = HistoricalRangeStatsIndex(max_tickers=HISTORICAL_STATS_INDEX_MAX_TICKERS)
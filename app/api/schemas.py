@@ -10,6 +10,48 @@ class GetHistoricalDataOutputType(str, Enum):
     """
     json_format = 'json'
     csv_format = 'csv'
+    arrow_format = 'arrow'
+    parquet_format = 'parquet'
+
+
+class GetHistoricalDataGranularity(str, Enum):
+    """
+    Enum which clearly defines the calendar periods a GET historical data request may aggregate the daily candlesticks
+    into - weeks start on Monday
+    """
+    day = 'day'
+    week = 'week'
+    month = 'month'
+    year = 'year'
+
+
+class GetHistoricalBatchLayout(str, Enum):
+    """
+    Enum which clearly defines the layouts of a GET historical data batch request: one row per ticker and date (long) or
+    one row per date with the columns of every ticker side by side (wide)
+    """
+    long = 'long'
+    wide = 'wide'
+
+
+class PostHistoricalDataConflictAction(str, Enum):
+    """
+    Enum which clearly defines what a POST historical data request may do with candlesticks for dates which are already
+    stored for the ticker: overwrite them (upsert) or leave them untouched
+    """
+    update = 'update'
+    ignore = 'ignore'
+
+
+class HistoricalJobStatus(str, Enum):
+    """
+    Enum which clearly defines the states of a POST historical data request accepted in background mode: waiting in the
+    queue, being written, written or rejected by the database
+    """
+    queued = 'queued'
+    running = 'running'
+    succeeded = 'succeeded'
+    failed = 'failed'
 
 
 class CandleStickRecord(BaseModel):
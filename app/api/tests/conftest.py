@@ -0,0 +1,25 @@
+import pytest
+
+from app.api.cache import historical_bucket_cache, historical_response_cache
+from app.api.db.registry import ticker_registry
+from app.api.rangestats import historical_range_stats_index
+
+
+@pytest.fixture(autouse=True)
+def clear_historical_caches():
+    # The caches are process-wide, so data cached by one test must not be served to the next one
+    historical_response_cache.clear()
+    historical_bucket_cache.clear()
+    historical_range_stats_index.clear()
+    yield
+    historical_response_cache.clear()
+    historical_bucket_cache.clear()
+    historical_range_stats_index.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_ticker_registry():
+    # The registry is process-wide too, and the tests switch between databases
+    ticker_registry.reset()
+    yield
+    ticker_registry.reset()
@@ -1,4 +1,6 @@
-from datetime import date
+import asyncio
+import json
+from datetime import date, datetime
 
 import pandas
 import pytest
@@ -6,7 +8,8 @@ from fastapi.encoders import jsonable_encoder
 
 from app.api import apiutils
 from app.api.db.models import HistoricalData
-from app.api.schemas import CandleStickRecord, PostHistoricalDataRequest
+from app.api.schemas import CandleStickRecord, GetHistoricalBatchLayout, GetHistoricalDataGranularity, \
+    GetHistoricalDataOutputType, PostHistoricalDataRequest
 
 
 @pytest.fixture()
@@ -33,8 +36,11 @@ def historical_data():
     ]
 
 
-def test_process_historical_records_to_df(historical_data):
-    records = [jsonable_encoder(record) for record in historical_data]
+def test_process_historical_records_to_df():
+    rows = [
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00),
+        (date(2021, 10, 6).isoformat(), 1, 26000.00, 36000.00, 28500.00, 33000.00, 6000.00)
+    ]
 
     expected_columns = [
         HistoricalData.date.name,
@@ -50,7 +56,7 @@ def test_process_historical_records_to_df(historical_data):
         [date(2021, 10, 6).isoformat(), 1, 26000.00, 36000.00, 28500.00, 33000.00, 6000.00]
     ]
 
-    result_df = apiutils.process_historical_records_to_df(historical_data=historical_data)
+    result_df = apiutils.process_historical_records_to_df(historical_data=rows)
     expected_df = pandas.DataFrame(data=expected_data, columns=expected_columns)
     pandas.testing.assert_frame_equal(expected_df, result_df)
 
@@ -83,7 +89,7 @@ def test_add_pct_change():
     pandas.testing.assert_frame_equal(expected_df, result_df)
 
 
-def test_generate_historical_data_records(historical_data):
+def test_generate_historical_data_params(historical_data):
     candlestick_records = [
         CandleStickRecord(
             date=date(2021, 10, 5).isoformat(),
@@ -103,9 +109,250 @@ def test_generate_historical_data_records(historical_data):
         )
     ]
     post_historical_request = PostHistoricalDataRequest(ticker_name='BTC-USD', candlestick_records=candlestick_records)
-    result_historical_data = apiutils.generate_historical_data_records(
+    result_params = apiutils.generate_historical_data_params(
         ticker_id=1,
         post_historical_request=post_historical_request
     )
 
-    assert jsonable_encoder(obj=result_historical_data) == jsonable_encoder(obj=historical_data)
+    assert jsonable_encoder(obj=list(result_params)) == jsonable_encoder(obj=historical_data)
+
+
+def test_encode_historical_data_params_matches_jsonable_encoder():
+    records = [
+        {'date': date(2021, 10, day), 'ticker_id': 1, 'low': 1.0, 'high': 3.0, 'open': 2.0, 'close': 2.5, 'volume': 10.0}
+        for day in (5, 6)
+    ]
+
+    assert apiutils.encode_historical_data_params(records=records) == jsonable_encoder(obj=records)
+    assert records[0]['date'] == date(2021, 10, 5)
+
+
+@pytest.mark.parametrize('data_format', [GetHistoricalDataOutputType.csv_format, GetHistoricalDataOutputType.json_format])
+def test_stream_historical_records_matches_dataframe_output(data_format):
+    rows = [
+        (date(2021, 10, day).isoformat(), 1, 1.0, 3.0, 2.0, close, 100.0)
+        for day, close in zip(range(1, 6), [10000.0, 15000.0, 30000.0, 3000.0, 3300.0])
+    ]
+    expected_df = apiutils.process_historical_records_to_df(historical_data=rows)
+    apiutils.add_pct_change(df=expected_df, column_name=HistoricalData.close.name)
+
+    # Batch boundaries must not affect the percentage change
+    chunks = list(apiutils.stream_historical_records(batches=[rows[:2], rows[2:3], rows[3:]], data_format=data_format))
+
+    if data_format == GetHistoricalDataOutputType.csv_format:
+        assert ''.join(chunks) == expected_df.to_csv()
+    else:
+        assert [json.loads(line) for line in ''.join(chunks).splitlines()] == expected_df.to_dict(orient='records')
+
+
+@pytest.mark.parametrize('data_format', list(GetHistoricalDataOutputType))
+def test_build_historical_rows_response_matches_dataframe_response(data_format):
+    rows = [
+        (date(2021, 10, day).isoformat(), 1, 1.0, 3.0, 2.0, close, 100.0)
+        for day, close in zip(range(1, 6), [10000.0, 15000.0, 30000.0, 3000.0, 3300.0])
+    ]
+    expected_df = apiutils.process_historical_records_to_df(historical_data=rows)
+    apiutils.add_pct_change(df=expected_df, column_name=HistoricalData.close.name)
+    rows_with_pct_change, _ = apiutils.add_pct_change_to_rows(rows=rows, previous_close=None)
+
+    expected_response = apiutils.build_historical_response(df=expected_df, data_format=data_format)
+    response = apiutils.build_historical_rows_response(rows=rows_with_pct_change, data_format=data_format)
+
+    assert response.media_type == expected_response.media_type
+    if data_format in (GetHistoricalDataOutputType.arrow_format, GetHistoricalDataOutputType.parquet_format):
+        assert apiutils.historical_rows_to_arrow_table(rows=rows_with_pct_change).equals(
+            apiutils.historical_df_to_arrow_table(df=expected_df)
+        )
+    else:
+        assert response.body == expected_response.body
+
+
+@pytest.mark.parametrize('if_none_match, if_modified_since, expected', [
+    ('"abc"', None, True),
+    ('W/"abc"', None, True),
+    ('"xyz", "abc"', None, True),
+    ('*', None, True),
+    ('"xyz"', None, False),
+    # If-Modified-Since is ignored when If-None-Match is sent
+    ('"xyz"', 'Tue, 05 Oct 2021 12:30:00 GMT', False),
+    (None, 'Tue, 05 Oct 2021 12:30:00 GMT', True),
+    (None, 'Tue, 05 Oct 2021 12:29:59 GMT', False),
+    (None, 'not a date', False),
+    (None, None, False)
+])
+def test_is_not_modified(if_none_match, if_modified_since, expected):
+    validator_headers = apiutils.build_validator_headers(etag='"abc"', last_modified=datetime(2021, 10, 5, 12, 30))
+
+    assert apiutils.is_not_modified(
+        validator_headers=validator_headers, if_none_match=if_none_match, if_modified_since=if_modified_since
+    ) is expected
+
+
+def test_cursor_round_trip():
+    cursor = apiutils.encode_cursor(last_date='2021-10-05')
+
+    assert apiutils.decode_cursor(cursor=cursor) == date(2021, 10, 5)
+    with pytest.raises(ValueError):
+        apiutils.decode_cursor(cursor=apiutils.encode_cursor(last_date='yesterday'))
+
+
+@pytest.mark.parametrize('cursor_date, num_rows, expected_slice, expected_next_date', [
+    (None, 3, slice(0, 2), '2021-10-02'),
+    (None, 2, slice(0, 2), None),
+    (date(2021, 10, 1), 4, slice(1, 3), '2021-10-03'),
+    (date(2021, 10, 1), 3, slice(1, 3), None),
+    # The previous page has been deleted, there is no row to skip
+    (date(2021, 9, 30), 3, slice(0, 2), '2021-10-02')
+])
+def test_slice_historical_page(cursor_date, num_rows, expected_slice, expected_next_date):
+    rows = [(f'2021-10-0{day}', 1) for day in range(1, num_rows + 1)]
+    page, next_cursor = apiutils.slice_historical_page(rows=rows, cursor_date=cursor_date, page_size=2)
+
+    assert page == expected_slice
+    assert next_cursor == (apiutils.encode_cursor(last_date=expected_next_date) if expected_next_date else None)
+
+
+def test_add_pct_change_by_ticker():
+    rows = [
+        ('2021-10-05', 1, 1.0, 3.0, 2.0, 100.0, 10.0),
+        ('2021-10-06', 1, 1.0, 3.0, 2.0, 150.0, 10.0),
+        ('2021-10-05', 2, 1.0, 3.0, 2.0, 10.0, 10.0),
+        ('2021-10-06', 2, 1.0, 3.0, 2.0, 5.0, 10.0)
+    ]
+    df = apiutils.process_historical_records_to_df(historical_data=rows)
+    apiutils.add_pct_change_by_ticker(df=df, column_name=HistoricalData.close.name)
+
+    assert df['% change'].tolist() == [0.0, 50.0, 0.0, -50.0]
+
+
+def test_build_historical_batch_response_wide():
+    df = apiutils.process_historical_records_with_pct_change_to_df(historical_data=[
+        ('2021-10-05', 1, 1.0, 3.0, 2.0, 100.0, 10.0, 0.0),
+        ('2021-10-06', 1, 1.0, 3.0, 2.0, 150.0, 10.0, 50.0),
+        ('2021-10-06', 2, 1.0, 3.0, 2.0, 5.0, 10.0, 0.0)
+    ])
+    response = apiutils.build_historical_batch_response(
+        df=df,
+        ticker_names={2: 'ETH-USD', 1: 'BTC-USD'},
+        layout=GetHistoricalBatchLayout.wide,
+        data_format=GetHistoricalDataOutputType.json_format
+    )
+    records = json.loads(response.body)
+
+    assert list(records[0])[:3] == ['date', 'ETH-USD low', 'ETH-USD high']
+    assert [(record['date'], record['ETH-USD close'], record['BTC-USD close']) for record in records] == [
+        ('2021-10-05', None, 100.0), ('2021-10-06', 5.0, 150.0)
+    ]
+
+
+@pytest.mark.parametrize('granularity, bucket_days, expected_range', [
+    (GetHistoricalDataGranularity.day, None, (date(2021, 2, 10), date(2021, 3, 17))),
+    (GetHistoricalDataGranularity.week, None, (date(2021, 2, 8), date(2021, 3, 21))),
+    (GetHistoricalDataGranularity.month, None, (date(2021, 2, 1), date(2021, 3, 31))),
+    (GetHistoricalDataGranularity.year, None, (date(2021, 1, 1), date(2021, 12, 31))),
+    (GetHistoricalDataGranularity.day, 10, (date(2021, 2, 10), date(2021, 3, 21)))
+])
+def test_get_bucket_range(granularity, bucket_days, expected_range):
+    assert apiutils.get_bucket_range(
+        start=date(2021, 2, 10), end=date(2021, 3, 17), granularity=granularity, bucket_days=bucket_days
+    ) == expected_range
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def _parse_historical_ingest(chunks: list[bytes], data_format: GetHistoricalDataOutputType, batch_size: int) -> list:
+    async def collect():
+        return [
+            batch async for batch in apiutils.parse_historical_ingest(
+                chunks=_chunks(*chunks), data_format=data_format, ticker_id=1, batch_size=batch_size
+            )
+        ]
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize('data_format, body', [
+    (
+        GetHistoricalDataOutputType.json_format,
+        b''.join(
+            f'{{"date": "2021-10-0{day}", "low": 1, "high": 3, "open": 2, "close": 2.5, "volume": {day}}}\n'.encode()
+            for day in range(1, 6)
+        )
+    ),
+    (
+        GetHistoricalDataOutputType.csv_format,
+        b'ticker,date,low,high,open,close,volume\r\n' + b''.join(
+            f'BTC-USD,2021-10-0{day},1,3,2,2.5,{day}\r\n'.encode() for day in range(1, 6)
+        )
+    )
+])
+def test_parse_historical_ingest_in_batches_across_chunks(data_format, body):
+    # Chunks of 7 bytes split most lines in several chunks
+    chunks = [body[index:index + 7] for index in range(0, len(body), 7)]
+
+    batches = _parse_historical_ingest(chunks=chunks, data_format=data_format, batch_size=2)
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [record for batch in batches for record in batch] == [
+        {'date': date(2021, 10, day), 'ticker_id': 1, 'low': 1.0, 'high': 3.0, 'open': 2.0, 'close': 2.5,
+         'volume': float(day)}
+        for day in range(1, 6)
+    ]
+
+
+@pytest.mark.parametrize('data_format, body, expected_message', [
+    (GetHistoricalDataOutputType.json_format, b'{"date": "2021-10-01"}', "Invalid line 1: missing column 'low'"),
+    (
+        GetHistoricalDataOutputType.json_format,
+        b'\n{"date": "2021-10-32", "low": 1, "high": 3, "open": 2, "close": 2, "volume": 1}',
+        'Invalid line 2'
+    ),
+    (GetHistoricalDataOutputType.json_format, b'[1, 2, 3]', 'Invalid line 1: not a JSON object'),
+    (GetHistoricalDataOutputType.csv_format, b'date,low,high\n', 'Invalid line 1: missing columns'),
+    (
+        GetHistoricalDataOutputType.csv_format,
+        b'date,low,high,open,close,volume\n2021-10-01,1,3,2,2,1\n2021-10-02,1,3,2,two,1\n',
+        'Invalid line 3'
+    ),
+    (GetHistoricalDataOutputType.csv_format, b'date,low,high,open,close,volume\n2021-10-01,1,3\n', 'Invalid line 2'),
+    (
+        GetHistoricalDataOutputType.csv_format,
+        b'date,low,high,open,close,volume\n2021-10-01,1,3,2,2,1\n2021-10-02,1,inf,2,2,1\n',
+        'Invalid line 3: high is not a finite number'
+    ),
+    (
+        GetHistoricalDataOutputType.json_format,
+        b'{"date": "2021-10-01", "low": 1, "high": 3, "open": 2, "close": NaN, "volume": 1}',
+        'Invalid line 1: close is not a finite number'
+    ),
+    (
+        GetHistoricalDataOutputType.csv_format,
+        b'date,low,high,open,close,volume\n2021-10-01,1,3,2,4,1\n',
+        'Invalid line 2: close 4.0 is not between low 1.0 and high 3.0'
+    ),
+    (
+        GetHistoricalDataOutputType.json_format,
+        b'{"date": "2021-10-01", "low": 2, "high": 1, "open": 2, "close": 2, "volume": 1}',
+        'Invalid line 1: open 2.0 is not between low 2.0 and high 1.0'
+    ),
+    (
+        GetHistoricalDataOutputType.json_format,
+        b'{"date": "2021-10-01", "low": 1, "high": 3, "open": 2, "close": 2, "volume": -1}',
+        'Invalid line 1: volume -1.0 is negative'
+    )
+])
+def test_parse_historical_ingest_invalid_line(data_format, body, expected_message):
+    with pytest.raises(ValueError, match=expected_message):
+        _parse_historical_ingest(chunks=[body], data_format=data_format, batch_size=10)
+
+
+@pytest.mark.parametrize('content_type, expected_format', [
+    ('application/x-ndjson', GetHistoricalDataOutputType.json_format),
+    ('text/csv; charset=utf-8', GetHistoricalDataOutputType.csv_format),
+    ('application/json', None),
+    (None, None)
+])
+def test_get_ingest_format(content_type, expected_format):
+    assert apiutils.get_ingest_format(content_type=content_type) == expected_format
@@ -0,0 +1,441 @@
+import asyncio
+from datetime import date
+from unittest import mock
+
+import pandas
+import pytest
+from fastapi import FastAPI, status
+from fastapi.testclient import TestClient
+
+from app.api import asyncroutes
+from app.api.cache import historical_response_cache
+from app.api.config import API_TICKERS_ENDPOINT, API_HISTORICAL_ENDPOINT, API_HISTORICAL_BATCH_ENDPOINT, \
+    API_HISTORICAL_STATS_ENDPOINT, API_HISTORICAL_LATEST_ENDPOINT, API_HISTORICAL_INGEST_ENDPOINT, \
+    API_HISTORICAL_IMPORT_ENDPOINT
+from app.api.db.database import Base, create_async_db_engine, create_async_session_factories, get_async_db, \
+    get_async_read_only_db
+from app.api.db.models import Ticker
+from app.api.rangestats import historical_range_stats_index
+from app.etl import load
+
+
+@pytest.fixture
+def async_app():
+    async_app = FastAPI()
+    async_app.include_router(asyncroutes.router)
+    return async_app
+
+
+@pytest.fixture
+def client(async_app):
+    return TestClient(async_app)
+
+
+@pytest.fixture
+def db_client(async_app, tmp_path):
+    db_engine = create_async_db_engine(f'sqlite+aiosqlite:///{tmp_path / "test.db"}')
+    session_factory, read_only_session_factory = create_async_session_factories(db_engine)
+
+    async def create_tables():
+        async with db_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    async def override_get_async_read_only_db():
+        async with read_only_session_factory() as db:
+            yield db
+
+    asyncio.run(create_tables())
+    async_app.dependency_overrides[get_async_db] = override_get_async_db
+    async_app.dependency_overrides[get_async_read_only_db] = override_get_async_read_only_db
+    return TestClient(async_app)
+
+
+@mock.patch("app.api.db.async_crud.retrieve_ticker_by_name", autospec=True)
+def test_get_ticker_exists(mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.get(url=API_TICKERS_ENDPOINT, params={'ticker_name': 'BTC-USD'})
+
+    assert response.status_code == status.HTTP_200_OK
+
+
+@mock.patch("app.api.db.async_crud.retrieve_ticker_by_name", autospec=True)
+def test_get_ticker_does_not_exists(mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = None
+    response = client.get(url=API_TICKERS_ENDPOINT, params={'ticker_name': 'BTC-USD'})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@mock.patch("app.api.db.async_crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.jobqueue.historical_job_queue.submit", autospec=True)
+def test_add_historical_in_background(mock_submit, mock_retrieve_ticker, client):
+    json_data = {
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': '2022-02-02', 'low': 10000, 'high': 20000, 'open': 14000, 'close': 18000, 'volume': 2234444}
+        ]
+    }
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_submit.return_value = {'job_id': 'abc', 'status': 'queued', 'records': 1, 'jobs_ahead': 0}
+    response = client.post(url=API_HISTORICAL_ENDPOINT, params={'background': 'true'}, json=json_data)
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json() == mock_submit.return_value
+    assert mock_submit.call_args.kwargs['on_conflict'] is None
+
+    mock_submit.return_value = None
+    response = client.post(url=API_HISTORICAL_ENDPOINT, params={'background': 'true'}, json=json_data)
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers['retry-after'] == '1'
+
+
+@mock.patch("app.api.db.async_crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.jobqueue.historical_job_queue.submit", autospec=True)
+@mock.patch("app.api.jobqueue.historical_job_queue.max_records", 1)
+def test_add_historical_in_background_more_records_than_the_queue_holds(mock_submit, mock_retrieve_ticker, client):
+    json_data = {
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': '2022-02-02', 'low': 10000, 'high': 20000, 'open': 14000, 'close': 18000, 'volume': 2234444},
+            {'date': '2022-02-03', 'low': 10000, 'high': 20000, 'open': 14000, 'close': 18000, 'volume': 2234444}
+        ]
+    }
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.post(url=API_HISTORICAL_ENDPOINT, params={'background': 'true'}, json=json_data)
+
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert 'without background mode' in response.json()['detail']
+    mock_submit.assert_not_called()
+
+
+@mock.patch("app.api.db.async_crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.async_crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
+@mock.patch("app.api.db.async_crud.retrieve_historical_data_versions", autospec=True)
+def test_get_historical_exists_and_ticker_exists(
+    mock_retrieve_historical_data_versions, mock_retrieve_historical, mock_retrieve_ticker, client
+):
+    mock_retrieve_historical_data_versions.return_value = ((0, 1), None)
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_historical.return_value = [
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00, 0.0)
+    ]
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'json'
+    })
+
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_add_and_get_historical_round_trip(db_client):
+    ticker_response = db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    assert ticker_response.status_code == status.HTTP_200_OK
+    duplicate_response = db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    assert duplicate_response.status_code == status.HTTP_400_BAD_REQUEST
+
+    post_response = db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': '2021-10-05', 'low': 1, 'high': 3, 'open': 2, 'close': 100, 'volume': 10},
+            {'date': '2021-10-06', 'low': 1, 'high': 3, 'open': 2, 'close': 150, 'volume': 10}
+        ]
+    })
+    assert post_response.status_code == status.HTTP_200_OK
+
+    get_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'json'
+    })
+    assert get_response.status_code == status.HTTP_200_OK
+    assert [record['% change'] for record in get_response.json()] == [0.0, 50.0]
+
+    get_csv_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'csv'
+    })
+    stream_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'csv', 'stream': True
+    })
+    assert stream_response.status_code == status.HTTP_200_OK
+    assert stream_response.text == get_csv_response.text
+
+    etag = get_response.headers['etag']
+    not_modified_response = db_client.get(url=API_HISTORICAL_ENDPOINT, headers={'If-None-Match': etag}, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'json'
+    })
+    assert not_modified_response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [{'date': '2021-10-07', 'low': 1, 'high': 3, 'open': 2, 'close': 300, 'volume': 10}]
+    })
+    modified_response = db_client.get(url=API_HISTORICAL_ENDPOINT, headers={'If-None-Match': etag}, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'json'
+    })
+    assert modified_response.status_code == status.HTTP_200_OK
+    assert [record['% change'] for record in modified_response.json()] == [0.0, 50.0, 100.0]
+
+
+def test_get_historical_is_not_cached_past_a_write_of_another_worker(db_client):
+    db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [{'date': '2021-10-05', 'low': 1, 'high': 3, 'open': 2, 'close': 100, 'volume': 10}]
+    })
+    params = {'ticker_name': 'BTC-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'json'}
+    assert len(db_client.get(url=API_HISTORICAL_ENDPOINT, params=params).json()) == 1
+    assert historical_response_cache.stats()['entries'] == 1
+
+    # Another worker writes to the database - the cache of this one is not invalidated
+    with mock.patch.object(historical_response_cache, 'invalidate', autospec=True):
+        db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+            'ticker_name': 'BTC-USD',
+            'candlestick_records': [{'date': '2021-10-06', 'low': 1, 'high': 3, 'open': 2, 'close': 150, 'volume': 10}]
+        })
+    response = db_client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+
+    assert [record['% change'] for record in response.json()] == [0.0, 50.0]
+
+
+def test_get_historical_pages_join_up(db_client):
+    db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': f'2021-10-0{day}', 'low': 1, 'high': 3, 'open': 2, 'close': close, 'volume': 10}
+            for day, close in zip(range(1, 6), (100, 150, 300, 150, 75))
+        ]
+    })
+    params = {'ticker_name': 'BTC-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'json'}
+    full_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+
+    pages = [db_client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'limit': 2})]
+    while 'next' in pages[-1].links:
+        pages.append(db_client.get(url=pages[-1].links['next']['url']))
+
+    assert [len(page.json()) for page in pages] == [2, 2, 1]
+    assert [record for page in pages for record in page.json()] == full_response.json()
+    invalid_cursor_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'cursor': 'abc'})
+    assert invalid_cursor_response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_get_historical_batch_round_trip(db_client):
+    for ticker_name, closes in (('BTC-USD', (100, 150)), ('ETH-USD', (10, 5))):
+        db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': ticker_name})
+        db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+            'ticker_name': ticker_name,
+            'candlestick_records': [
+                {'date': f'2021-10-0{day}', 'low': 1, 'high': 3, 'open': 2, 'close': close, 'volume': 10}
+                for day, close in zip((5, 6), closes)
+            ]
+        })
+    params = {
+        'ticker_names': ['ETH-USD', 'BTC-USD'], 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'json'
+    }
+
+    long_response = db_client.get(url=API_HISTORICAL_BATCH_ENDPOINT, params=params)
+    wide_response = db_client.get(url=API_HISTORICAL_BATCH_ENDPOINT, params={**params, 'layout': 'wide'})
+
+    assert [(record['ticker'], record['% change']) for record in long_response.json()] == [
+        ('BTC-USD', 0.0), ('BTC-USD', 50.0), ('ETH-USD', 0.0), ('ETH-USD', -50.0)
+    ]
+    assert [(record['ETH-USD % change'], record['BTC-USD % change']) for record in wide_response.json()] == [
+        (0.0, 0.0), (-50.0, 50.0)
+    ]
+
+
+def test_get_historical_aggregated(db_client):
+    db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {
+                'date': f'2021-10-{day:02}', 'low': day, 'high': 100 + day, 'open': 10 + day, 'close': 20 + day,
+                'volume': 1
+            }
+            for day in range(1, 32)
+        ]
+    })
+    params = {'ticker_name': 'BTC-USD', 'start': '2021-10-06', 'end': '2021-10-17', 'data_format': 'json'}
+
+    weekly_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'granularity': 'week'})
+    custom_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'bucket_days': 5})
+
+    # The range is widened to the whole weeks of October 4th and 11th
+    assert weekly_response.json() == [
+        {'date': '2021-10-04', 'ticker_id': 1, 'low': 4.0, 'high': 110.0, 'open': 14.0, 'close': 30.0, 'volume': 7.0,
+         '% change': 0.0},
+        {'date': '2021-10-11', 'ticker_id': 1, 'low': 11.0, 'high': 117.0, 'open': 21.0, 'close': 37.0, 'volume': 7.0,
+         '% change': pytest.approx(100 * (37 / 30 - 1))}
+    ]
+    assert [(record['date'], record['close'], record['volume']) for record in custom_response.json()] == [
+        ('2021-10-06', 30.0, 5.0), ('2021-10-11', 35.0, 5.0), ('2021-10-16', 40.0, 5.0)
+    ]
+
+    db_client.post(url=API_HISTORICAL_ENDPOINT, params={'on_conflict': 'update'}, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [{'date': '2021-10-17', 'low': 1, 'high': 3, 'open': 2, 'close': 60, 'volume': 1}]
+    })
+    rewritten_weekly_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'granularity': 'week'})
+    assert [record['close'] for record in rewritten_weekly_response.json()] == [30.0, 60.0]
+
+
+def test_get_historical_indicators_are_warmed_up_with_earlier_history(db_client):
+    db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': f'2021-10-{day:02}', 'low': 1, 'high': 100, 'open': 2, 'close': 10 + day % 7, 'volume': day}
+            for day in range(1, 32)
+        ]
+    })
+    params = {'ticker_name': 'BTC-USD', 'end': '2021-10-31', 'data_format': 'json', 'indicators': 'sma_5,rsi_3,vwap_5'}
+
+    full_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'start': '2021-10-01'})
+    later_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'start': '2021-10-20'})
+
+    indicator_names = ['sma_5', 'rsi_3', 'vwap_5']
+    assert later_response.json()[0]['sma_5'] is not None
+    assert [[record[name] for name in indicator_names] for record in later_response.json()] == [
+        [pytest.approx(record[name]) for name in indicator_names] for record in full_response.json()[19:]
+    ]
+
+    # Rewriting a candlestick before the start date changes the indicators of the (cached) later range
+    db_client.post(url=API_HISTORICAL_ENDPOINT, params={'on_conflict': 'update'}, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [{'date': '2021-10-19', 'low': 1, 'high': 100, 'open': 2, 'close': 60, 'volume': 19}]
+    })
+    rewritten_response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'start': '2021-10-20'})
+    assert rewritten_response.json()[0]['sma_5'] > later_response.json()[0]['sma_5']
+
+
+def test_get_historical_stats_follow_appended_candlesticks(db_client):
+    # The counters of the index are process-wide, and clearing it does not reset them
+    initial_stats = historical_range_stats_index.stats()
+    db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    for days in (range(1, 11), range(11, 16)):
+        db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+            'ticker_name': 'BTC-USD',
+            'candlestick_records': [
+                {'date': f'2021-10-{day:02}', 'low': day, 'high': 10 * day, 'open': 2, 'close': day, 'volume': 1}
+                for day in days
+            ]
+        })
+        response = db_client.get(url=API_HISTORICAL_STATS_ENDPOINT, params={
+            'ticker_name': 'BTC-USD', 'start': '2021-10-03', 'end': '2021-10-31'
+        })
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.json()['records'], response.json()['high'], response.json()['close']) == (
+            days[-1] - 2, 10.0 * days[-1], float(days[-1])
+        )
+    # The second candlesticks were added after the last one, so the index has been extended rather than rebuilt
+    stats = historical_range_stats_index.stats()
+    assert (stats['builds'] - initial_stats['builds'], stats['appends'] - initial_stats['appends']) == (1, 1)
+    assert stats['entries'] == 1
+
+
+def test_get_historical_latest_follows_loaded_candlesticks(db_client):
+    db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    params = {'ticker_name': 'BTC-USD'}
+    assert db_client.get(url=API_HISTORICAL_LATEST_ENDPOINT, params=params).json() == {
+        'ticker_name': 'BTC-USD', 'first_date': None, 'last_date': None, 'records': 0, 'gaps': []
+    }
+
+    db_client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': f'2021-10-{day:02}', 'low': 1, 'high': 2, 'open': 1, 'close': 2, 'volume': 1}
+            for day in (1, 2, 5, 6, 9)
+        ]
+    })
+    response = db_client.get(url=API_HISTORICAL_LATEST_ENDPOINT, params=params)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        'ticker_name': 'BTC-USD', 'first_date': '2021-10-01', 'last_date': '2021-10-09', 'records': 5,
+        'gaps': [{'start': '2021-10-03', 'end': '2021-10-04'}, {'start': '2021-10-07', 'end': '2021-10-08'}]
+    }
+    assert db_client.get(url=API_HISTORICAL_LATEST_ENDPOINT, params={'ticker_name': 'ETH-USD'}).status_code == \
+        status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize('data_format', ['ndjson', 'csv'])
+def test_ingest_historical_streams_chunks_of_the_loader(db_client, data_format):
+    db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    chunks = [
+        pandas.DataFrame({
+            'date': [f'2021-10-{day:02}' for day in days], 'low': 1.0, 'high': 30.0, 'open': 2.0,
+            'close': [day + 0.1 for day in days], 'volume': 100.0
+        })
+        for days in (range(1, 11), range(11, 21), range(5, 25))
+    ]
+
+    # The test client is a requests.Session which sends the requests to the app
+    totals = load.api_post_historical_stream(
+        ticker='BTC-USD', chunks=chunks, data_format=data_format, session=db_client
+    )
+
+    assert totals == {
+        'received_records': 40, 'inserted_records': 24, 'updated_records': 16, 'skipped_records': 0, 'batches': 3,
+        'chunks': 3
+    }
+    response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'json'
+    })
+    assert [record['close'] for record in response.json()] == [day + 0.1 for day in range(1, 25)]
+    response = db_client.post(
+        url=API_HISTORICAL_INGEST_ENDPOINT, params={'ticker_name': 'BTC-USD', 'on_conflict': 'ignore'},
+        data='{"date": "2021-10-01", "low": 1, "high": 3, "open": 2, "close": 2, "volume": 1}\n{"date": "x"}',
+        headers={'Content-Type': 'application/x-ndjson'}
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.parametrize('file_name', ['prices.csv', 'prices.parquet'])
+def test_import_historical_file_of_the_loader(db_client, tmp_path, file_name):
+    db_client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+    df = pandas.DataFrame({
+        'ticker': ['BTC-USD'] * 3 + ['ETH-USD'] * 2,
+        'date': ['2021-10-01', '2021-10-02', '2021-10-03', '2021-10-01', '2021-10-02'],
+        'low': 1.0, 'high': 3.0, 'open': 2.0, 'close': [2.1, 2.2, 2.3, 2.4, 2.5], 'volume': 100.0
+    })
+    path = str(tmp_path / file_name)
+    if file_name.endswith('.csv'):
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path)
+
+    counts = load.api_post_historical_file(path=path, session=db_client)
+
+    assert counts == {
+        'tickers': 2, 'created_tickers': 1, 'received_records': 5, 'inserted_records': 5, 'updated_records': 0,
+        'skipped_records': 0
+    }
+    response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'ETH-USD', 'start': '2021-10-01', 'end': '2021-10-31', 'data_format': 'json'
+    })
+    assert [record['close'] for record in response.json()] == [2.4, 2.5]
+    counts = load.api_post_historical_file(path=path, on_conflict='ignore', session=db_client)
+    assert counts['skipped_records'] == 5
+
+
+def test_import_historical_counts_a_date_repeated_within_the_file_once(db_client):
+    response = db_client.post(
+        url=API_HISTORICAL_IMPORT_ENDPOINT,
+        data='ticker,date,low,high,open,close,volume\n'
+             'ETH-USD,2021-03-01,1,3,2,2.1,10\n'
+             'ETH-USD,2021-03-01,1,3,2,2.2,10\n',
+        headers={'Content-Type': 'text/csv'}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        'tickers': 1, 'created_tickers': 1, 'received_records': 1, 'inserted_records': 1, 'updated_records': 0,
+        'skipped_records': 0
+    }
+    response = db_client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'ETH-USD', 'start': '2021-03-01', 'end': '2021-03-01', 'data_format': 'json'
+    })
+    assert [record['close'] for record in response.json()] == [2.2]
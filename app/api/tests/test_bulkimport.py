@@ -0,0 +1,123 @@
+import asyncio
+import io
+from datetime import date
+
+import pandas
+import pytest
+
+from app.api import bulkimport
+from app.api.db.crud import HISTORICAL_IMPORT_COLUMN_NAMES
+from app.api.schemas import GetHistoricalDataOutputType
+
+PRICES = {'low': 1.0, 'high': 3.0, 'open': 2.0, 'close': 2.5, 'volume': 10.0}
+
+
+def _encode(df: pandas.DataFrame, data_format: GetHistoricalDataOutputType) -> io.BytesIO:
+    source = io.BytesIO()
+    if data_format == GetHistoricalDataOutputType.csv_format:
+        df.to_csv(source, index=False)
+    else:
+        df.to_parquet(source)
+    source.seek(0)
+    return source
+
+
+@pytest.mark.parametrize('data_format', bulkimport.IMPORT_MEDIA_TYPES)
+def test_read_historical_import(data_format):
+    df = pandas.DataFrame({
+        'date': ['2021-10-01', '2021-10-02', '2021-10-01'], 'ticker': ['BTC-USD', 'BTC-USD', 'ETH-USD'],
+        'unused': 'x', **PRICES
+    })
+
+    table = bulkimport.read_historical_import(source=_encode(df=df, data_format=data_format), data_format=data_format)
+
+    assert table.column_names == list(bulkimport.IMPORT_COLUMN_TYPES)
+    assert table.column('date').to_pylist() == [date(2021, 10, 1), date(2021, 10, 2), date(2021, 10, 1)]
+    assert bulkimport.get_ticker_names(table=table) == ['BTC-USD', 'ETH-USD']
+    assert bulkimport.get_dates_by_ticker(table=table) == {
+        'BTC-USD': [date(2021, 10, 1), date(2021, 10, 2)], 'ETH-USD': [date(2021, 10, 1)]
+    }
+
+
+def test_read_historical_import_of_a_single_ticker():
+    df = pandas.DataFrame({'date': ['2021-10-01', '2021-10-02'], **PRICES})
+    source = _encode(df=df, data_format=GetHistoricalDataOutputType.csv_format)
+
+    table = bulkimport.read_historical_import(
+        source=source, data_format=GetHistoricalDataOutputType.csv_format, ticker_name='BTC-USD'
+    )
+
+    assert table.column('ticker').to_pylist() == ['BTC-USD', 'BTC-USD']
+
+
+def test_read_historical_import_keeps_the_last_row_of_a_repeated_date():
+    df = pandas.DataFrame({
+        'ticker': ['ETH-USD', 'BTC-USD', 'ETH-USD'], 'date': ['2021-03-01'] * 3,
+        **{**PRICES, 'close': [2.1, 2.2, 2.3]}
+    })
+    source = _encode(df=df, data_format=GetHistoricalDataOutputType.csv_format)
+
+    table = bulkimport.read_historical_import(source=source, data_format=GetHistoricalDataOutputType.csv_format)
+
+    assert table.column('ticker').to_pylist() == ['BTC-USD', 'ETH-USD']
+    assert table.column('close').to_pylist() == [2.2, 2.3]
+
+
+@pytest.mark.parametrize('body, message', [
+    (b'date,low,high,open,close,volume\n2021-10-01,1,3,2,2.5,10\n', 'Columns missing from the file: ticker'),
+    (b'ticker,date,low,high,open,close,volume\nBTC-USD,2021-13-01,1,3,2,2.5,10\n', 'The file cannot be imported'),
+    (b'ticker,date,low,high,open,close,volume\nBTC-USD,2021-10-01,1,3,2,,10\n', '1 rows have no close'),
+    (b'ticker,date,low,high,open,close,volume\n', 'The file has no rows'),
+    (b'PAR1 not really parquet', 'The file cannot be imported')
+])
+def test_read_historical_import_invalid_file(body, message):
+    data_format = GetHistoricalDataOutputType.parquet_format if body.startswith(b'PAR1') else \
+        GetHistoricalDataOutputType.csv_format
+
+    with pytest.raises(ValueError, match=message):
+        bulkimport.read_historical_import(source=io.BytesIO(body), data_format=data_format)
+
+
+@pytest.mark.parametrize('content_type, data_format', [
+    ('text/csv', GetHistoricalDataOutputType.csv_format),
+    ('text/csv; charset=utf-8', GetHistoricalDataOutputType.csv_format),
+    ('application/vnd.apache.parquet', GetHistoricalDataOutputType.parquet_format),
+    ('application/json', None),
+    (None, None)
+])
+def test_get_import_format(content_type, data_format):
+    assert bulkimport.get_import_format(content_type=content_type) == data_format
+
+
+def test_build_import_row_groups_lays_out_parameters_column_by_column():
+    df = pandas.DataFrame({
+        'ticker': ['BTC-USD', 'ETH-USD', 'BTC-USD'], 'date': ['2021-10-01', '2021-10-01', '2021-10-02'],
+        **PRICES, 'close': [2.5, 2.6, 2.7]
+    })
+    table = bulkimport.read_historical_import(
+        source=_encode(df=df, data_format=GetHistoricalDataOutputType.parquet_format),
+        data_format=GetHistoricalDataOutputType.parquet_format
+    )
+
+    row_groups = list(bulkimport.build_import_row_groups(
+        table=table, ticker_ids={'BTC-USD': 1, 'ETH-USD': 2}, rows_per_statement=2
+    ))
+
+    assert HISTORICAL_IMPORT_COLUMN_NAMES == ['date', 'ticker_id', 'low', 'high', 'open', 'close', 'volume']
+    assert row_groups == [
+        ('2021-10-01', '2021-10-01', 1, 2, 1.0, 1.0, 3.0, 3.0, 2.0, 2.0, 2.5, 2.6, 10.0, 10.0),
+        ('2021-10-02', 1, 1.0, 3.0, 2.0, 2.7, 10.0)
+    ]
+
+
+def test_spool_body_moves_large_bodies_to_disk():
+    async def chunks():
+        for chunk in (b'ticker,date', b',low\n', b'BTC-USD,2021-10-01,1\n'):
+            yield chunk
+
+    async def spool():
+        return await bulkimport.spool_body(chunks=chunks(), max_size=8)
+
+    with asyncio.run(spool()) as source:
+        assert source._rolled
+        assert source.read() == b'ticker,date,low\nBTC-USD,2021-10-01,1\n'
@@ -0,0 +1,183 @@
+from datetime import date
+
+import pytest
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.api.cache import HistoricalBucketCache, HistoricalBucketKey, HistoricalBucketSeries, HistoricalCacheKey, \
+    HistoricalResponseCache
+from app.api.schemas import GetHistoricalDataGranularity, GetHistoricalDataOutputType
+
+DATA_VERSIONS = (0, 1)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_key(ticker_name: str = 'BTC-USD', start: date = date(2021, 9, 1), end: date = date(2021, 9, 30),
+             data_format: GetHistoricalDataOutputType = GetHistoricalDataOutputType.csv_format):
+    return HistoricalCacheKey(ticker_name=ticker_name, start=start, end=end, data_format=data_format)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return HistoricalResponseCache(max_bytes=100, ttl=0, clock=clock)
+
+
+def test_get_returns_cached_body_and_media_type(cache):
+    key = make_key(data_format=GetHistoricalDataOutputType.json_format)
+    assert cache.get(key=key, data_versions=DATA_VERSIONS) is None
+
+    assert cache.put(
+        key=key, response=JSONResponse(content=[{'close': 1.0}]),
+        data_versions=DATA_VERSIONS, generation=cache.generation('BTC-USD')
+    )
+    response = cache.get(key=key, data_versions=DATA_VERSIONS)
+
+    assert response.body == b'[{"close":1.0}]'
+    assert response.headers['content-type'] == 'application/json'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    first_key, second_key, third_key = (make_key(end=date(2021, 9, day)) for day in (10, 20, 30))
+    for key in (first_key, second_key):
+        cache.put(
+            key=key, response=PlainTextResponse(content='x' * 40),
+            data_versions=DATA_VERSIONS, generation=cache.generation('BTC-USD')
+        )
+    cache.get(key=first_key, data_versions=DATA_VERSIONS)
+
+    cache.put(
+        key=third_key, response=PlainTextResponse(content='x' * 40),
+        data_versions=DATA_VERSIONS, generation=cache.generation('BTC-USD')
+    )
+
+    assert cache.get(key=second_key, data_versions=DATA_VERSIONS) is None
+    assert cache.get(key=first_key, data_versions=DATA_VERSIONS) is not None
+    assert cache.get(key=third_key, data_versions=DATA_VERSIONS) is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size_bytes'] == 80
+
+
+def test_responses_larger_than_the_cache_are_not_cached(cache):
+    key = make_key()
+
+    assert not cache.put(
+        key=key, response=PlainTextResponse(content='x' * 101),
+        data_versions=DATA_VERSIONS, generation=cache.generation('BTC-USD')
+    )
+    assert cache.stats()['entries'] == 0
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = HistoricalResponseCache(max_bytes=100, ttl=10, clock=clock)
+    key = make_key()
+    cache.put(
+        key=key, response=PlainTextResponse(content='x'),
+        data_versions=DATA_VERSIONS, generation=cache.generation('BTC-USD')
+    )
+
+    clock.now = 9.9
+    assert cache.get(key=key, data_versions=DATA_VERSIONS) is not None
+    clock.now = 10.0
+    assert cache.get(key=key, data_versions=DATA_VERSIONS) is None
+    assert cache.stats()['expirations'] == 1
+    assert cache.stats()['entries'] == 0
+
+
+def test_invalidate_only_drops_ranges_containing_written_dates(cache):
+    september_key = make_key(start=date(2021, 9, 1), end=date(2021, 9, 30))
+    october_key = make_key(start=date(2021, 10, 1), end=date(2021, 10, 31))
+    other_ticker_key = make_key(ticker_name='ETH-USD')
+    for key in (september_key, october_key, other_ticker_key):
+        cache.put(
+            key=key, response=PlainTextResponse(content='x'),
+            data_versions=DATA_VERSIONS, generation=cache.generation(key.ticker_name)
+        )
+
+    assert cache.invalidate(ticker_name='BTC-USD', dates=[date(2021, 8, 31), date(2021, 9, 30)]) == 1
+
+    assert cache.get(key=september_key, data_versions=DATA_VERSIONS) is None
+    assert cache.get(key=october_key, data_versions=DATA_VERSIONS) is not None
+    assert cache.get(key=other_ticker_key, data_versions=DATA_VERSIONS) is not None
+
+
+def test_response_read_before_a_write_is_not_cached(cache):
+    key = make_key()
+    generation = cache.generation('BTC-USD')
+
+    cache.invalidate(ticker_name='BTC-USD', dates=[date(2021, 12, 1)])
+
+    assert not cache.put(
+        key=key, response=PlainTextResponse(content='x'), data_versions=DATA_VERSIONS, generation=generation
+    )
+    assert cache.put(
+        key=key, response=PlainTextResponse(content='x'),
+        data_versions=DATA_VERSIONS, generation=cache.generation('BTC-USD')
+    )
+
+
+def test_clear_drops_everything(cache):
+    key = make_key()
+    generation = cache.generation('BTC-USD')
+    cache.put(key=key, response=PlainTextResponse(content='x'), data_versions=DATA_VERSIONS, generation=generation)
+
+    assert cache.clear() == 1
+    assert cache.get(key=key, data_versions=DATA_VERSIONS) is None
+    assert not cache.put(
+        key=key, response=PlainTextResponse(content='x'), data_versions=DATA_VERSIONS, generation=generation
+    )
+
+
+def test_entries_of_a_ticker_written_to_since_are_dropped(cache):
+    # Written by another worker - this cache has not been invalidated, but the data versions have changed
+    key = make_key()
+    cache.put(
+        key=key, response=PlainTextResponse(content='x'), data_versions=(0, 1), generation=cache.generation('BTC-USD')
+    )
+
+    assert cache.get(key=key, data_versions=(0, 1)) is not None
+    assert cache.get(key=key, data_versions=(0, 2)) is None
+    assert cache.get(key=key, data_versions=(0, 1)) is None
+    assert cache.stats()['invalidations'] == 1
+    assert cache.stats()['entries'] == 0
+
+
+def test_bucket_series_slice():
+    series = HistoricalBucketSeries.from_rows(rows=[
+        ('2021-09-06', 1, 1.0), ('2021-09-13', 1, 2.0), ('2021-09-20', 1, 3.0), ('2021-09-27', 1, 4.0)
+    ])
+
+    assert series.slice(start=date(2021, 9, 13), end=date(2021, 9, 26)) == [
+        ('2021-09-13', 1, 2.0), ('2021-09-20', 1, 3.0)
+    ]
+    assert series.slice(start=date(2021, 10, 4), end=date(2021, 10, 31)) == []
+
+
+def test_bucket_series_are_only_served_for_the_versions_they_were_read_with():
+    bucket_cache = HistoricalBucketCache(max_entries=2)
+    keys = [
+        HistoricalBucketKey(ticker_id=ticker_id, granularity=GetHistoricalDataGranularity.month)
+        for ticker_id in (1, 2, 3)
+    ]
+    series = HistoricalBucketSeries.from_rows(rows=[('2021-09-06', 1, 1.0)])
+    bucket_cache.put(key=keys[0], data_versions=(0, 1), series=series)
+
+    assert bucket_cache.get(key=keys[0], data_versions=(0, 1)) is series
+    assert bucket_cache.get(key=keys[0], data_versions=(0, 2)) is None
+
+    bucket_cache.put(key=keys[1], data_versions=(0, 1), series=series)
+    bucket_cache.put(key=keys[2], data_versions=(0, 1), series=series)
+    assert bucket_cache.get(key=keys[0], data_versions=(0, 1)) is None
+    assert bucket_cache.stats() == {'hits': 1, 'misses': 2, 'entries': 2}
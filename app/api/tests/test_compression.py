@@ -0,0 +1,202 @@
+import gzip
+import json
+from unittest import mock
+
+import pytest
+import zstandard
+from fastapi import FastAPI, Request, status
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.api import compression
+from app.api.cache import HistoricalCacheKey, HistoricalResponseCache
+from app.api.compression import CompressionMiddleware
+from app.api.config import API_HISTORICAL_ENDPOINT
+from app.api.db.models import Ticker
+from app.api.main import app
+from app.api.schemas import GetHistoricalDataOutputType
+
+BODY = 'date,close\n' + ''.join(f'2021-10-{day:02},{30000 + day}.0\n' for day in range(1, 32))
+
+
+@pytest.fixture
+def compression_client():
+    compression_app = FastAPI()
+    compression_app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @compression_app.get('/large')
+    def get_large():
+        return PlainTextResponse(content=BODY, headers={'ETag': '"abc"'})
+
+    @compression_app.get('/small')
+    def get_small():
+        return PlainTextResponse(content=BODY[:50])
+
+    @compression_app.get('/parquet')
+    def get_parquet():
+        return Response(content=BODY.encode(), media_type='application/vnd.apache.parquet')
+
+    @compression_app.get('/stream')
+    def get_stream():
+        return StreamingResponse(content=iter([BODY[:10], BODY[10:]]), media_type='text/csv')
+
+    return TestClient(compression_app)
+
+
+def decode(response) -> str:
+    # The test client decodes gzip and br itself, but not zstd
+    if response.headers.get('content-encoding') == compression.ZSTD_ENCODING:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(response.content).decode()
+    return response.text
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, None),
+    ('', None),
+    ('gzip', 'gzip'),
+    ('gzip, deflate, br', 'br'),
+    ('gzip, br, zstd', 'zstd'),
+    ('gzip;q=1.0, br;q=0.5, zstd;q=0.1', 'gzip'),
+    ('zstd;q=0, gzip', 'gzip'),
+    ('*', 'zstd'),
+    ('*;q=0', None),
+    ('identity', None),
+    ('deflate', None)
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert compression.negotiate_encoding(accept_encoding=accept_encoding) == expected
+
+
+@pytest.mark.parametrize('encoding', compression.SUPPORTED_ENCODINGS)
+def test_large_responses_are_compressed(compression_client, encoding):
+    response = compression_client.get(url='/large', headers={'Accept-Encoding': encoding})
+
+    assert response.headers['content-encoding'] == encoding
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.headers['etag'] == 'W/"abc"'
+    assert decode(response) == BODY
+
+
+@pytest.mark.parametrize('url', ['/small', '/parquet'])
+def test_small_and_incompressible_responses_are_not_compressed(compression_client, url):
+    response = compression_client.get(url=url, headers={'Accept-Encoding': 'gzip'})
+
+    assert 'content-encoding' not in response.headers
+    assert response.content == BODY.encode()[:len(response.content)]
+
+
+def test_responses_are_not_compressed_without_accept_encoding(compression_client):
+    response = compression_client.get(url='/large', headers={'Accept-Encoding': 'identity'})
+
+    assert 'content-encoding' not in response.headers
+    assert response.headers['etag'] == '"abc"'
+    assert response.text == BODY
+
+
+@pytest.mark.parametrize('encoding', compression.SUPPORTED_ENCODINGS)
+def test_streamed_responses_are_compressed_chunk_by_chunk(compression_client, encoding):
+    response = compression_client.get(url='/stream', headers={'Accept-Encoding': encoding})
+
+    assert response.headers['content-encoding'] == encoding
+    assert 'content-length' not in response.headers
+    assert decode(response) == BODY
+
+
+def test_cache_reuses_compressed_body():
+    cache = HistoricalResponseCache(max_bytes=100_000)
+    key = HistoricalCacheKey(
+        ticker_name='BTC-USD', start='2021-10-01', end='2021-10-31', data_format=GetHistoricalDataOutputType.csv_format
+    )
+    cache.put(
+        key=key, response=PlainTextResponse(content=BODY * 10), data_versions=(0, 1),
+        generation=cache.generation('BTC-USD')
+    )
+
+    with mock.patch('app.api.compression.compress', wraps=compression.compress) as mock_compress:
+        first_response = cache.get(key=key, data_versions=(0, 1), encoding=compression.GZIP_ENCODING)
+        second_response = cache.get(key=key, data_versions=(0, 1), encoding=compression.GZIP_ENCODING)
+
+    assert mock_compress.call_count == 1
+    assert first_response.body == second_response.body
+    assert first_response.headers['content-encoding'] == compression.GZIP_ENCODING
+    assert gzip.decompress(second_response.body) == (BODY * 10).encode()
+    assert cache.stats()['size_bytes'] == len(BODY * 10) + len(first_response.body)
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.create_historical", autospec=True)
+def test_add_historical_gzip_request_body(mock_create_historical, mock_retrieve_ticker):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_create_historical.return_value = 1
+    body = json.dumps({
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': '2021-10-05', 'low': 1, 'high': 3, 'open': 2, 'close': 100, 'volume': 10}
+        ]
+    }).encode()
+    client = TestClient(app)
+
+    response = client.post(url=API_HISTORICAL_ENDPOINT, data=gzip.compress(body), headers={
+        'Content-Type': 'application/json', 'Content-Encoding': 'gzip'
+    })
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['added_records'][0]['close'] == 100
+
+    corrupt_response = client.post(url=API_HISTORICAL_ENDPOINT, data=b'not gzip', headers={
+        'Content-Type': 'application/json', 'Content-Encoding': 'gzip'
+    })
+    assert corrupt_response.status_code == status.HTTP_400_BAD_REQUEST
+
+    unsupported_response = client.post(url=API_HISTORICAL_ENDPOINT, data=body, headers={
+        'Content-Type': 'application/json', 'Content-Encoding': 'compress'
+    })
+    assert unsupported_response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+@pytest.mark.parametrize(
+    'encoding', [compression.GZIP_ENCODING, compression.BROTLI_ENCODING, compression.ZSTD_ENCODING]
+)
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.create_historical", autospec=True)
+def test_decompressed_request_body_is_limited(mock_create_historical, mock_retrieve_ticker, encoding):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_create_historical.return_value = 1
+    body = json.dumps({
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': '2021-10-05', 'low': 1, 'high': 3, 'open': 2, 'close': 100, 'volume': 10}
+        ],
+        'padding': ' ' * 1024
+    }).encode()
+    client = TestClient(CompressionMiddleware(app, max_decompressed_size=len(body)))
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': encoding}
+
+    response = client.post(url=API_HISTORICAL_ENDPOINT, data=compression.compress(body, encoding), headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+
+    # A few KB which inflate to 16 MB
+    bomb = compression.compress(b' ' * (16 * 1024 * 1024), encoding)
+    assert len(bomb) < 64 * 1024
+    response = client.post(url=API_HISTORICAL_ENDPOINT, data=bomb, headers=headers)
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
+def test_decompressed_request_body_is_limited_for_streamed_bodies():
+    # The middleware runs inside the app's error handling here, like in the main app, and the body is streamed
+    streaming_app = FastAPI()
+    streaming_app.add_middleware(CompressionMiddleware, max_decompressed_size=1024)
+
+    @streaming_app.post('/stream')
+    async def post_stream(request: Request):
+        return {'size': sum([len(chunk) async for chunk in request.stream()])}
+
+    client = TestClient(streaming_app)
+    headers = {'Content-Encoding': 'gzip'}
+
+    response = client.post(url='/stream', data=gzip.compress(b' ' * 1024), headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {'size': 1024}
+
+    response = client.post(url='/stream', data=gzip.compress(b' ' * (1024 * 1024)), headers=headers)
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert response.text == 'The decompressed request body is larger than 1024 bytes.'
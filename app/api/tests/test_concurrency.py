@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pandas
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import InvalidRequestError
+
+from app.api.config import API_TICKERS_ENDPOINT, API_HISTORICAL_ENDPOINT
+from app.api.db.database import Base, create_db_engine, create_session_factories, get_db, get_read_only_db
+from app.api.db.models import Ticker, HistoricalData
+from app.api.main import app
+from app.etl import load
+
+NUM_TICKERS = 20
+NUM_DAYS = 20
+START = date(2021, 9, 1)
+
+
+@pytest.fixture
+def session_factories(tmp_path):
+    db_engine = create_db_engine(f'sqlite:///{tmp_path / "test.db"}')
+    Base.metadata.create_all(bind=db_engine)
+    yield create_session_factories(db_engine)
+    db_engine.dispose()
+
+
+@pytest.fixture
+def client(session_factories):
+    session_factory, read_only_session_factory = session_factories
+
+    async def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_read_only_db():
+        db = read_only_session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_only_db] = override_get_read_only_db
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def post_candle(client: TestClient, ticker_name: str, day: int):
+    candle_date = START + timedelta(days=day)
+    return client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': ticker_name,
+        'candlestick_records': [
+            {'date': candle_date.isoformat(), 'low': day, 'high': day, 'open': day, 'close': day + 1, 'volume': day}
+        ]
+    })
+
+
+def get_candles(client: TestClient, ticker_name: str):
+    return client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': ticker_name,
+        'start': START.isoformat(),
+        'end': (START + timedelta(days=NUM_DAYS)).isoformat(),
+        'data_format': 'json'
+    })
+
+
+def test_concurrent_requests_do_not_lose_or_corrupt_data(client, session_factories):
+    session_factory, _ = session_factories
+    ticker_names = [f'TICKER-{i}' for i in range(NUM_TICKERS)]
+
+    with ThreadPoolExecutor(max_workers=50) as executor:
+        ticker_responses = list(executor.map(
+            lambda name: client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': name}), ticker_names
+        ))
+        assert all(response.status_code == status.HTTP_200_OK for response in ticker_responses)
+
+        # Interleave writes with reads of the same tickers
+        futures = []
+        for day in range(NUM_DAYS):
+            for name in ticker_names:
+                futures.append(executor.submit(post_candle, client, name, day))
+                futures.append(executor.submit(client.get, API_TICKERS_ENDPOINT, params={'ticker_name': name}))
+        responses = [future.result() for future in futures]
+        assert all(response.status_code == status.HTTP_200_OK for response in responses)
+
+        read_responses = list(executor.map(lambda name: get_candles(client, name), ticker_names))
+
+    for response in read_responses:
+        assert response.status_code == status.HTTP_200_OK
+        records = response.json()
+        assert len(records) == NUM_DAYS
+        assert sorted(record['close'] for record in records) == [day + 1.0 for day in range(NUM_DAYS)]
+        assert all(record['close'] - record['open'] == 1.0 for record in records)
+
+    db = session_factory()
+    try:
+        assert db.query(Ticker).count() == NUM_TICKERS
+        assert db.query(HistoricalData).count() == NUM_TICKERS * NUM_DAYS
+    finally:
+        db.close()
+
+
+def test_concurrent_ingest_streams_are_stored_batch_by_batch(client, session_factories):
+    session_factory, _ = session_factories
+    ticker_names = [f'TICKER-{i}' for i in range(NUM_TICKERS)]
+    for name in ticker_names:
+        client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': name})
+    dates = [(START + timedelta(days=day)).isoformat() for day in range(NUM_DAYS)]
+
+    def ingest(name: str) -> dict:
+        chunks = (
+            pandas.DataFrame({
+                'date': dates[first_day:first_day + 5], 'low': 1.0, 'high': 2.0, 'open': 1.0, 'close': 2.0,
+                'volume': 1.0
+            })
+            for first_day in range(0, NUM_DAYS, 5)
+        )
+        # gzip-encoded bodies are decompressed by the CompressionMiddleware as they are read
+        return load.api_post_historical_stream(ticker=name, chunks=chunks, compress=True, session=client)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        totals = list(executor.map(ingest, ticker_names))
+
+    assert all(total['inserted_records'] == NUM_DAYS and total['chunks'] == NUM_DAYS // 5 for total in totals)
+    db = session_factory()
+    try:
+        assert db.query(HistoricalData).count() == NUM_TICKERS * NUM_DAYS
+    finally:
+        db.close()
+
+
+def test_read_only_session_rejects_writes(session_factories):
+    _, read_only_session_factory = session_factories
+    db = read_only_session_factory()
+    try:
+        db.add(Ticker(ticker='BTC-USD'))
+        with pytest.raises(InvalidRequestError, match='read-only'):
+            db.flush()
+        db.expunge_all()
+        with pytest.raises(InvalidRequestError, match='read-only'):
+            db.query(Ticker).delete()
+    finally:
+        db.close()
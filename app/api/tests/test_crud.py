@@ -0,0 +1,502 @@
+import logging
+from datetime import date, timedelta
+from unittest import mock
+
+import pandas
+import pyarrow
+import pytest
+from sqlalchemy import event, insert, text
+
+from app.api import apiutils, bulkimport
+from app.api.db import crud, migrate
+from app.api.db.database import Base, create_db_engine, create_session_factories, create_unique_index
+from app.api.db.models import DROPPED_INDEX_NAMES, HISTORICAL_TICKER_ID_DATE_INDEX, HistoricalData, Ticker
+from app.api.schemas import GetHistoricalDataGranularity, PostHistoricalDataConflictAction
+
+
+@pytest.fixture
+def db(tmp_path):
+    db_engine = create_db_engine(f'sqlite:///{tmp_path / "test.db"}')
+    Base.metadata.create_all(bind=db_engine)
+    session_factory, _ = create_session_factories(db_engine)
+    db = session_factory()
+    yield db
+    db.close()
+    db_engine.dispose()
+
+
+def generate_params(ticker_id: int, num_days: int, start: date = date(2021, 9, 1)):
+    for day in range(num_days):
+        yield {
+            'date': start + timedelta(days=day),
+            'ticker_id': ticker_id,
+            'low': day,
+            'high': day + 2,
+            'open': day + 1,
+            'close': day + 1.5,
+            'volume': 100.0 * day
+        }
+
+
+def test_create_historical_in_chunks(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+
+    num_inserted = crud.create_historical(db=db, records=generate_params(ticker_id=ticker.id, num_days=5), chunk_size=2)
+
+    assert num_inserted == 5
+    stored = db.query(HistoricalData).order_by(HistoricalData.date).all()
+    assert [record.date for record in stored] == [date(2021, 9, 1) + timedelta(days=day) for day in range(5)]
+    assert [float(record.close) for record in stored] == [1.5, 2.5, 3.5, 4.5, 5.5]
+
+
+def test_create_historical_is_a_single_transaction(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    records = list(generate_params(ticker_id=ticker.id, num_days=3)) + [{'date': 'not a date'}]
+
+    with pytest.raises(Exception):
+        crud.create_historical(db=db, records=records, chunk_size=2)
+    db.rollback()
+
+    assert db.query(HistoricalData).count() == 0
+
+
+def test_upsert_historical_updates_existing_records(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    crud.create_historical(db=db, records=generate_params(ticker_id=ticker.id, num_days=3))
+    records = [dict(record, close=100.0) for record in generate_params(ticker_id=ticker.id, num_days=5)]
+
+    result = crud.upsert_historical(
+        db=db, ticker_id=ticker.id, records=records, on_conflict=PostHistoricalDataConflictAction.update, chunk_size=2
+    )
+
+    assert result == (2, 3, 0)
+    assert db.query(HistoricalData).count() == 5
+    assert all(float(record.close) == 100.0 for record in db.query(HistoricalData))
+
+
+def test_upsert_historical_skips_existing_records(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    crud.create_historical(db=db, records=generate_params(ticker_id=ticker.id, num_days=3))
+    records = [dict(record, close=100.0) for record in generate_params(ticker_id=ticker.id, num_days=5)]
+
+    result = crud.upsert_historical(
+        db=db, ticker_id=ticker.id, records=records, on_conflict=PostHistoricalDataConflictAction.ignore, chunk_size=2
+    )
+
+    assert result == (2, 0, 3)
+    assert sorted(float(record.close) for record in db.query(HistoricalData)) == [1.5, 2.5, 3.5, 100.0, 100.0]
+
+
+@pytest.mark.parametrize('on_conflict, expected_result, expected_closes', [
+    (PostHistoricalDataConflictAction.update, (1, 1, 0), [40.0, 2.5, 3.5, 20.0]),
+    (PostHistoricalDataConflictAction.ignore, (1, 0, 1), [1.5, 2.5, 3.5, 20.0])
+])
+def test_upsert_historical_counts_repeated_dates_once(db, on_conflict, expected_result, expected_closes):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    crud.create_historical(db=db, records=generate_params(ticker_id=ticker.id, num_days=3))
+    existing_record, *_, new_record = generate_params(ticker_id=ticker.id, num_days=4)
+    records = [
+        dict(new_record, close=10.0), dict(new_record, close=20.0),
+        dict(existing_record, close=30.0), dict(existing_record, close=40.0)
+    ]
+
+    result = crud.upsert_historical(db=db, ticker_id=ticker.id, records=records, on_conflict=on_conflict)
+
+    # The last of the rows of a date is the one written
+    assert result == expected_result
+    assert [float(record.close) for record in db.query(HistoricalData).order_by(HistoricalData.date)] == expected_closes
+
+
+def test_retrieve_historical_by_date_range_and_ticker_id_is_ordered_by_date(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    crud.create_historical(db=db, records=reversed(list(generate_params(ticker_id=ticker.id, num_days=5))))
+
+    rows = crud.retrieve_historical_by_date_range_and_ticker_id(
+        db=db, start=date(2021, 9, 2), end=date(2021, 9, 4), ticker_id=ticker.id
+    )
+
+    assert [tuple(row) for row in rows] == [
+        ('2021-09-02', ticker.id, 1.0, 3.0, 2.0, 2.5, 100.0),
+        ('2021-09-03', ticker.id, 2.0, 4.0, 3.0, 3.5, 200.0),
+        ('2021-09-04', ticker.id, 3.0, 5.0, 4.0, 4.5, 300.0)
+    ]
+
+
+def test_retrieve_historical_with_pct_change_matches_pandas(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    other_ticker = crud.create_ticker(db=db, ticker_name='ETH-USD')
+    closes = [10000, 15000, 30000, 3000, 3300]
+    records = [
+        {**params, 'close': close} for params, close in zip(generate_params(ticker_id=ticker.id, num_days=5), closes)
+    ]
+    crud.create_historical(db=db, records=records + list(generate_params(ticker_id=other_ticker.id, num_days=5)))
+
+    rows = crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+        db=db, start=date(2021, 8, 31), end=date(2021, 9, 6), ticker_id=ticker.id
+    )
+    expected_df = apiutils.process_historical_records_to_df(
+        historical_data=crud.retrieve_historical_by_date_range_and_ticker_id(
+            db=db, start=date(2021, 8, 31), end=date(2021, 9, 6), ticker_id=ticker.id
+        )
+    )
+    apiutils.add_pct_change(df=expected_df, column_name=HistoricalData.close.name)
+
+    assert [row[-1] for row in rows] == pytest.approx([0.0, 50.0, 100.0, -90.0, 10.0])
+    assert [row[-1] for row in rows] == pytest.approx(expected_df[crud.PCT_CHANGE_COLUMN_NAME].tolist())
+
+
+def test_historical_range_query_uses_ticker_id_date_index(db):
+    statement = crud.build_historical_range_statement(start=date(2021, 9, 1), end=date(2021, 10, 31), ticker_id=1)
+    compiled = statement.compile(dialect=db.bind.dialect, compile_kwargs={'literal_binds': True})
+    query_plan = db.execute(text(f'EXPLAIN QUERY PLAN {compiled}')).all()
+    plan_details = ' '.join(row[-1] for row in query_plan)
+
+    assert 'USING INDEX ix_historical_ticker_id_date (ticker_id=? AND date>? AND date<?)' in plan_details
+    # The index already returns the rows in date order
+    assert 'TEMP B-TREE' not in plan_details
+
+
+def test_retrieve_ticker_by_name_does_not_query_a_fresh_registry(db):
+    crud.load_ticker_registry(db=db)
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    statements = []
+    event.listen(db.get_bind(), 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    found_ticker = crud.retrieve_ticker_by_name(db=db, ticker_name='BTC-USD')
+
+    assert (found_ticker.id, found_ticker.ticker) == (ticker.id, 'BTC-USD')
+    assert statements == []
+
+
+def test_retrieve_ticker_by_name_sees_writes_of_other_workers(db):
+    crud.create_ticker(db=db, ticker_name='BTC-USD')
+
+    # Another worker adds a ticker - this process' registry is not told about it
+    db.execute(insert(Ticker).values(id=10, ticker='ETH-USD'))
+    db.execute(crud.build_bump_data_version_statement(key=crud.TICKERS_DATA_VERSION_KEY))
+    db.commit()
+    assert crud.retrieve_ticker_by_name(db=db, ticker_name='ETH-USD').id == 10
+
+    # Another worker deletes all the tickers
+    db.query(Ticker).delete()
+    db.execute(crud.build_bump_data_version_statement(key=crud.TICKERS_DATA_VERSION_KEY))
+    db.commit()
+    assert crud.retrieve_ticker_by_name(db=db, ticker_name='BTC-USD', verify=True) is None
+
+
+def test_delete_all_ticker_records_clears_registry(db):
+    crud.create_ticker(db=db, ticker_name='BTC-USD')
+
+    crud.delete_all_ticker_records(db=db)
+
+    assert crud.retrieve_ticker_by_name(db=db, ticker_name='BTC-USD') is None
+    assert crud.retrieve_data_version(db=db, key=crud.TICKERS_DATA_VERSION_KEY) == 2
+
+
+def test_historical_data_versions_change_with_the_data(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    assert crud.retrieve_historical_data_versions(db=db, ticker_id=ticker.id) == ((0, 0), None)
+
+    crud.create_historical(db=db, records=generate_params(ticker_id=ticker.id, num_days=3))
+    versions, last_modified = crud.retrieve_historical_data_versions(db=db, ticker_id=ticker.id)
+    assert versions == (0, 1)
+    assert last_modified is not None
+
+    crud.upsert_historical(
+        db=db, ticker_id=ticker.id, records=generate_params(ticker_id=ticker.id, num_days=3),
+        on_conflict=PostHistoricalDataConflictAction.ignore
+    )
+    assert crud.retrieve_historical_data_versions(db=db, ticker_id=ticker.id)[0] == (0, 1)
+
+    crud.upsert_historical(
+        db=db, ticker_id=ticker.id, records=generate_params(ticker_id=ticker.id, num_days=3),
+        on_conflict=PostHistoricalDataConflictAction.update
+    )
+    assert crud.retrieve_historical_data_versions(db=db, ticker_id=ticker.id)[0] == (0, 2)
+
+    crud.delete_all_historical_records(db=db)
+    assert crud.retrieve_historical_data_versions(db=db, ticker_id=ticker.id)[0] == (1, 2)
+
+
+def test_retrieve_historical_with_pct_change_pages_match_the_whole_range(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    crud.create_historical(db=db, records=list(generate_params(ticker_id=ticker.id, num_days=7)))
+    start, end = date(2021, 8, 31), date(2021, 9, 30)
+    whole_range = crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+        db=db, start=start, end=end, ticker_id=ticker.id
+    )
+
+    pages, cursor_date = [], None
+    while True:
+        rows = crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+            db=db, start=max(start, cursor_date) if cursor_date else start, end=end, ticker_id=ticker.id,
+            limit=3 + (2 if cursor_date else 1)
+        )
+        page, next_cursor = apiutils.slice_historical_page(rows=rows, cursor_date=cursor_date, page_size=3)
+        pages.append(rows[page])
+        if not next_cursor:
+            break
+        cursor_date = apiutils.decode_cursor(cursor=next_cursor)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [tuple(row) for page in pages for row in page] == [tuple(row) for row in whole_range]
+
+
+def test_retrieve_historical_before_date_and_ticker_id(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    crud.create_historical(db=db, records=list(generate_params(ticker_id=ticker.id, num_days=7)))
+
+    rows = crud.retrieve_historical_before_date_and_ticker_id(
+        db=db, before=date(2021, 9, 6), ticker_id=ticker.id, limit=3
+    )
+
+    assert [row.date for row in rows] == ['2021-09-03', '2021-09-04', '2021-09-05']
+    assert crud.retrieve_historical_before_date_and_ticker_id(
+        db=db, before=date(2021, 9, 1), ticker_id=ticker.id, limit=3
+    ) == []
+
+
+def test_retrieve_historical_with_pct_change_by_ticker_ids_matches_single_ticker_queries(db):
+    tickers = [crud.create_ticker(db=db, ticker_name=ticker_name) for ticker_name in ('BTC-USD', 'ETH-USD', 'SOL-USD')]
+    crud.create_historical(db=db, records=[
+        {**params, 'close': params['close'] * (ticker.id + 1) ** day}
+        for ticker in tickers for day, params in enumerate(generate_params(ticker_id=ticker.id, num_days=5))
+    ])
+    start, end = date(2021, 9, 2), date(2021, 9, 30)
+    ticker_ids = [tickers[2].id, tickers[0].id]
+
+    rows = crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_ids(
+        db=db, start=start, end=end, ticker_ids=ticker_ids
+    )
+
+    assert [tuple(row) for row in rows] == [
+        tuple(row) for ticker_id in sorted(ticker_ids)
+        for row in crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+            db=db, start=start, end=end, ticker_id=ticker_id
+        )
+    ]
+
+
+def test_retrieve_tickers_by_names(db):
+    btc, eth = crud.create_ticker(db=db, ticker_name='BTC-USD'), crud.create_ticker(db=db, ticker_name='ETH-USD')
+
+    tickers = crud.retrieve_tickers_by_names(db=db, ticker_names=['ETH-USD', 'XRP-USD', 'BTC-USD'])
+
+    assert [(ticker.id, ticker.ticker) for ticker in tickers] == [(eth.id, 'ETH-USD'), (btc.id, 'BTC-USD')]
+
+
+@pytest.mark.parametrize('granularity, rule', [
+    (GetHistoricalDataGranularity.week, 'W-SUN'),
+    (GetHistoricalDataGranularity.month, 'MS'),
+    (GetHistoricalDataGranularity.year, 'YS')
+])
+def test_retrieve_historical_buckets_matches_pandas_resample(db, granularity, rule):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    # Every third day is missing, so that buckets start and end on days of the week other than their first and last
+    records = [
+        {**params, 'close': params['close'] * (-1) ** day + 1000}
+        for day, params in enumerate(generate_params(ticker_id=ticker.id, num_days=500)) if day % 3
+    ]
+    crud.create_historical(db=db, records=records)
+
+    rows = crud.retrieve_historical_buckets_with_pct_change_by_date_range_and_ticker_id(
+        db=db, start=date(2021, 1, 1), end=date(2023, 12, 31), ticker_id=ticker.id, granularity=granularity
+    )
+    expected_df = pandas.DataFrame.from_records(records).set_index('date')
+    expected_df.index = pandas.to_datetime(expected_df.index)
+    expected_df = expected_df.resample(rule).agg(
+        {'low': 'min', 'high': 'max', 'open': 'first', 'close': 'last', 'volume': 'sum'}
+    ).dropna()
+
+    assert [row[0] for row in rows] == [
+        apiutils.get_bucket_range(start=day.date(), end=day.date(), granularity=granularity)[0].isoformat()
+        for day in expected_df.index
+    ]
+    assert [row[2:7] for row in rows] == pytest.approx(list(expected_df.itertuples(index=False, name=None)))
+    assert [row[-1] for row in rows] == pytest.approx(
+        [0.0] + list(expected_df['close'].pct_change().iloc[1:] * 100)
+    )
+
+
+def test_retrieve_historical_extent_and_gaps_by_ticker_id(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    other_ticker = crud.create_ticker(db=db, ticker_name='ETH-USD')
+    assert tuple(crud.retrieve_historical_extent_by_ticker_id(db=db, ticker_id=ticker.id)) == (None, None, 0)
+
+    crud.create_historical(db=db, records=[
+        params for params in generate_params(ticker_id=ticker.id, num_days=10) if params['date'].day not in (3, 6, 7)
+    ] + list(generate_params(ticker_id=other_ticker.id, num_days=3, start=date(2021, 9, 6))))
+
+    extent = crud.retrieve_historical_extent_by_ticker_id(db=db, ticker_id=ticker.id)
+    gaps = crud.retrieve_historical_gaps_by_ticker_id(db=db, ticker_id=ticker.id)
+    assert tuple(extent) == ('2021-09-01', '2021-09-10', 7)
+    assert [tuple(gap) for gap in gaps] == [('2021-09-02', '2021-09-04'), ('2021-09-05', '2021-09-08')]
+    assert apiutils.format_historical_coverage(extent=extent, gaps=gaps)['gaps'] == [
+        {'start': '2021-09-03', 'end': '2021-09-03'}, {'start': '2021-09-06', 'end': '2021-09-07'}
+    ]
+    assert crud.retrieve_historical_gaps_by_ticker_id(db=db, ticker_id=other_ticker.id) == []
+
+
+def test_import_historical_creates_missing_tickers_and_upserts_in_one_transaction(db):
+    ticker = crud.create_ticker(db=db, ticker_name='BTC-USD')
+    crud.create_historical(db=db, records=generate_params(ticker_id=ticker.id, num_days=1))
+    table = pyarrow.table({
+        'ticker': ['BTC-USD', 'BTC-USD', 'ETH-USD'],
+        'date': pyarrow.array([date(2021, 9, 1), date(2021, 9, 2), date(2021, 9, 1)], type=pyarrow.date32()),
+        'low': [1.0, 1.0, 1.0], 'high': [3.0, 3.0, 3.0], 'open': [2.0, 2.0, 2.0], 'close': [2.1, 2.2, 2.3],
+        'volume': [10.0, 10.0, 10.0]
+    })
+
+    ticker_ids, num_created = crud.create_tickers(db=db, ticker_names=['BTC-USD', 'ETH-USD'])
+    counts = crud.import_historical(
+        db=db,
+        row_groups=bulkimport.build_import_row_groups(table=table, ticker_ids=ticker_ids, rows_per_statement=2),
+        ticker_ids=ticker_ids.values(),
+        on_conflict=PostHistoricalDataConflictAction.update,
+        statements_per_call=1
+    )
+
+    assert ticker_ids == {'BTC-USD': ticker.id, 'ETH-USD': ticker.id + 1}
+    assert num_created == 1
+    assert counts == (2, 1, 0)
+    stored = db.query(HistoricalData).order_by(HistoricalData.ticker_id, HistoricalData.date).all()
+    assert [(record.ticker_id, record.date, float(record.close)) for record in stored] == [
+        (ticker.id, date(2021, 9, 1), 2.1), (ticker.id, date(2021, 9, 2), 2.2), (ticker.id + 1, date(2021, 9, 1), 2.3)
+    ]
+
+    assert crud.create_tickers(db=db, ticker_names=['ETH-USD']) == ({'ETH-USD': ticker.id + 1}, 0)
+    counts = crud.import_historical(
+        db=db,
+        row_groups=bulkimport.build_import_row_groups(table=table, ticker_ids=ticker_ids),
+        ticker_ids=ticker_ids.values(),
+        on_conflict=PostHistoricalDataConflictAction.ignore
+    )
+    assert counts == (0, 0, 3)
+
+
+def test_import_historical_rolls_back_the_tickers_it_created(db):
+    ticker_ids, _ = crud.create_tickers(db=db, ticker_names=['BTC-USD'])
+
+    with pytest.raises(Exception):
+        crud.import_historical(
+            db=db,
+            row_groups=[('2021-09-01', ticker_ids['BTC-USD'], 1.0, 3.0, 2.0, 2.5, 10.0, 'extra')],
+            ticker_ids=ticker_ids.values(),
+            on_conflict=PostHistoricalDataConflictAction.update
+        )
+    db.rollback()
+
+    assert db.query(Ticker).count() == 0
+
+
+def test_drop_indexes_of_earlier_versions(tmp_path):
+    db_engine = create_db_engine(f'sqlite:///{tmp_path / "test.db"}')
+    Base.metadata.create_all(bind=db_engine)
+    with db_engine.begin() as connection:
+        connection.exec_driver_sql('CREATE INDEX ix_historical_date ON historical (date)')
+
+    create_unique_index(
+        db_engine=db_engine, index=HISTORICAL_TICKER_ID_DATE_INDEX, replaced_index_names=DROPPED_INDEX_NAMES
+    )
+
+    with db_engine.connect() as connection:
+        index_names = connection.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'historical'")
+        ).scalars().all()
+    assert 'ix_historical_ticker_id_date' in index_names
+    assert not set(index_names) & set(DROPPED_INDEX_NAMES)
+    db_engine.dispose()
+
+
+def create_legacy_historical_table(db_engine):
+    # The historical table as created by the first versions, without the (ticker_id, date) unique index
+    with db_engine.begin() as connection:
+        connection.exec_driver_sql(
+            'CREATE TABLE historical (id INTEGER NOT NULL PRIMARY KEY, date DATE, ticker_id INTEGER '
+            'REFERENCES tickers (id), low NUMERIC, high NUMERIC, open NUMERIC, close NUMERIC, volume NUMERIC)'
+        )
+        connection.exec_driver_sql('CREATE INDEX ix_historical_id ON historical (id)')
+        connection.exec_driver_sql('CREATE INDEX ix_historical_date ON historical (date)')
+
+
+def test_create_unique_index_on_legacy_table_with_duplicates(tmp_path):
+    db_engine = create_db_engine(f'sqlite:///{tmp_path / "test.db"}')
+    create_legacy_historical_table(db_engine=db_engine)
+    Base.metadata.create_all(bind=db_engine)
+    with db_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO historical (date, ticker_id, low, high, open, close, volume) VALUES "
+            "('2021-09-01', 1, 1, 3, 2, 2.5, 10), ('2021-09-01', 1, 1, 3, 2, 9.0, 10), "
+            "('2021-09-02', 1, 1, 3, 2, 2.5, 10), ('2021-09-01', 2, 1, 3, 2, 2.5, 10), "
+            "('2021-09-02', 1, 1, 3, 2, 7.0, 10)"
+        )
+
+    assert create_unique_index(
+        db_engine=db_engine, index=HISTORICAL_TICKER_ID_DATE_INDEX, replaced_index_names=DROPPED_INDEX_NAMES
+    ) == 2
+    assert create_unique_index(db_engine=db_engine, index=HISTORICAL_TICKER_ID_DATE_INDEX) == 0
+
+    with db_engine.connect() as connection:
+        index_names = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'historical'"
+        ).scalars().all()
+    assert index_names == ['ix_historical_ticker_id_date']
+
+    session_factory, _ = create_session_factories(db_engine)
+    db = session_factory()
+    rows = db.query(HistoricalData.ticker_id, HistoricalData.date, HistoricalData.close).order_by(
+        HistoricalData.ticker_id, HistoricalData.date
+    ).all()
+    assert [(ticker_id, day, float(close)) for ticker_id, day, close in rows] == [
+        (1, date(2021, 9, 1), 9.0), (1, date(2021, 9, 2), 7.0), (2, date(2021, 9, 1), 2.5)
+    ]
+    # Upserts need the unique index
+    result = crud.upsert_historical(
+        db=db,
+        ticker_id=1,
+        records=[dict(next(generate_params(ticker_id=1, num_days=1)), close=100.0)],
+        on_conflict=PostHistoricalDataConflictAction.update
+    )
+    assert result == (0, 1, 0)
+    assert db.query(HistoricalData).count() == 3
+    db.close()
+    db_engine.dispose()
+
+
+def test_migrate_reports_deleted_duplicates(tmp_path, caplog):
+    db_engine = create_db_engine(f'sqlite:///{tmp_path / "test.db"}')
+    create_legacy_historical_table(db_engine=db_engine)
+    with db_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO historical (date, ticker_id, low, high, open, close, volume) VALUES "
+            "('2021-09-01', 1, 1, 3, 2, 2.5, 10), ('2021-09-01', 1, 1, 3, 2, 9.0, 10)"
+        )
+    assert not migrate.is_migrated(db_engine=db_engine)
+
+    with caplog.at_level(logging.INFO, logger='logger'):
+        assert migrate.migrate(db_engine=db_engine) == 1
+        assert migrate.migrate(db_engine=db_engine) == 0
+
+    assert migrate.is_migrated(db_engine=db_engine)
+    assert 'deleted 1 duplicate historical rows' in caplog.text
+    db_engine.dispose()
+
+
+def test_replaced_indexes_are_kept_if_unique_index_is_not_created(tmp_path):
+    db_engine = create_db_engine(f'sqlite:///{tmp_path / "test.db"}')
+    create_legacy_historical_table(db_engine=db_engine)
+    Base.metadata.create_all(bind=db_engine)
+
+    with mock.patch('app.api.db.database._index_exists', autospec=True, return_value=False):
+        with pytest.raises(RuntimeError):
+            create_unique_index(
+                db_engine=db_engine, index=HISTORICAL_TICKER_ID_DATE_INDEX, replaced_index_names=DROPPED_INDEX_NAMES
+            )
+
+    # The whole migration has been rolled back
+    with db_engine.connect() as connection:
+        index_names = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'historical'"
+        ).scalars().all()
+    assert sorted(index_names) == sorted(DROPPED_INDEX_NAMES)
+    db_engine.dispose()
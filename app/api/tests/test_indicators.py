@@ -0,0 +1,94 @@
+import numpy
+import pandas
+import pytest
+
+from app.api import indicators
+from app.api.indicators import IndicatorSpec
+
+
+def build_rows(num_rows: int) -> list[tuple]:
+    close = 100 + numpy.cumsum(numpy.random.default_rng(seed=7).normal(size=num_rows))
+    return [
+        (f'day {day}', 1, close[day] - 1, close[day] + 2, close[day] - 0.5, close[day], 10.0 + day % 5)
+        for day in range(num_rows)
+    ]
+
+
+def naive_rsi(close: list[float], window: int) -> list[float]:
+    result, average_gain, average_loss = [numpy.nan], 0.0, 0.0
+    for index in range(1, len(close)):
+        change = close[index] - close[index - 1]
+        alpha = 1 / window if index > 1 else 1.0
+        average_gain = (1 - alpha) * average_gain + alpha * max(change, 0.0)
+        average_loss = (1 - alpha) * average_loss + alpha * max(-change, 0.0)
+        result.append(100 - 100 / (1 + average_gain / average_loss) if average_loss else 100.0)
+    return result
+
+
+def test_parse_indicators():
+    specs = indicators.parse_indicators(values=['sma_50,RSI', ' ema_5 ', 'bollinger,sma_50'])
+
+    assert specs == [
+        IndicatorSpec(name='sma', window=50), IndicatorSpec(name='rsi', window=14),
+        IndicatorSpec(name='ema', window=5), IndicatorSpec(name='bollinger', window=20)
+    ]
+    assert indicators.get_column_names(specs=specs) == [
+        'sma_50', 'rsi_14', 'ema_5', 'bollinger_20_lower', 'bollinger_20_middle', 'bollinger_20_upper'
+    ]
+    assert indicators.get_lookback(specs=specs) == 14 * indicators.INDICATOR_WARMUP_FACTOR
+
+
+@pytest.mark.parametrize('value', ['macd', 'sma_x', 'sma_1', f'ema_{indicators.INDICATOR_MAX_WINDOW + 1}'])
+def test_parse_indicators_rejects_invalid_indicators(value):
+    with pytest.raises(ValueError):
+        indicators.parse_indicators(values=[value])
+
+
+def test_indicators_match_naive_implementations():
+    rows = build_rows(num_rows=300)
+    df = pandas.DataFrame(rows, columns=['date', 'ticker_id', 'low', 'high', 'open', 'close', 'volume'])
+    typical_price = (df['high'] + df['low'] + df['close']) / 3
+
+    rows = indicators.add_indicators_to_rows(
+        rows=rows, warmup_rows=[], specs=indicators.parse_indicators(values=['sma_10,ema_10,rsi_14,vwap_10,bollinger'])
+    )
+    sma, ema, rsi, vwap, lower, middle, upper = (numpy.array(column, dtype=float) for column in list(zip(*rows))[7:])
+
+    numpy.testing.assert_allclose(sma, df['close'].rolling(10).mean())
+    numpy.testing.assert_allclose(ema, df['close'].ewm(span=10, adjust=False).mean())
+    numpy.testing.assert_allclose(rsi, naive_rsi(close=df['close'].tolist(), window=14))
+    numpy.testing.assert_allclose(
+        vwap, (typical_price * df['volume']).rolling(10).sum() / df['volume'].rolling(10).sum()
+    )
+    numpy.testing.assert_allclose(middle, df['close'].rolling(20).mean())
+    numpy.testing.assert_allclose(upper - middle, 2 * df['close'].rolling(20).std(ddof=0))
+    numpy.testing.assert_allclose(middle - lower, 2 * df['close'].rolling(20).std(ddof=0))
+    assert rows[0][7:9] == (None, rows[0][5])
+
+
+def test_indicators_with_warmup_rows_match_the_whole_series():
+    rows = build_rows(num_rows=400)
+    specs = indicators.parse_indicators(values=['sma_20,ema_20,rsi_14,vwap_20,bollinger_20'])
+    warmup_rows = rows[200 - indicators.get_lookback(specs=specs):200]
+
+    whole_series = indicators.add_indicators_to_rows(rows=rows, warmup_rows=[], specs=specs)[200:]
+    with_warmup = indicators.add_indicators_to_rows(rows=rows[200:], warmup_rows=warmup_rows, specs=specs)
+
+    numpy.testing.assert_allclose(numpy.array(with_warmup)[:, 7:].astype(float),
+                                  numpy.array(whole_series)[:, 7:].astype(float), rtol=1e-7)
+
+
+def test_add_indicators_to_df_matches_rows():
+    rows = build_rows(num_rows=50)
+    specs = indicators.parse_indicators(values=['sma_5,rsi_5'])
+    df = pandas.DataFrame(rows[10:], columns=['date', 'ticker_id', 'low', 'high', 'open', 'close', 'volume'])
+
+    indicators.add_indicators_to_df(df=df, warmup_rows=rows[:10], specs=specs)
+
+    expected = indicators.add_indicators_to_rows(rows=rows[10:], warmup_rows=rows[:10], specs=specs)
+    numpy.testing.assert_allclose(df[['sma_5', 'rsi_5']].to_numpy(), [row[7:] for row in expected])
+
+
+def test_rsi_of_a_series_which_only_rises_is_100():
+    assert indicators.rsi(close=numpy.arange(10.0), window=3)[1:].tolist() == [100.0] * 9
+    assert indicators.rsi(close=numpy.ones(3), window=3)[1:].tolist() == [50.0] * 2
@@ -0,0 +1,201 @@
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+
+from app.api.db import crud
+from app.api.db.database import Base, create_db_engine, create_session_factories
+from app.api.db.models import HistoricalData
+from app.api.jobqueue import HistoricalJobQueue
+from app.api.schemas import PostHistoricalDataConflictAction
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    db_engine = create_db_engine(f'sqlite:///{tmp_path / "test.db"}')
+    Base.metadata.create_all(bind=db_engine)
+    session_factory, _ = create_session_factories(db_engine)
+    db = session_factory()
+    crud.create_ticker(db=db, ticker_name='BTC-USD')
+    crud.create_ticker(db=db, ticker_name='ETH-USD')
+    db.close()
+    yield session_factory
+    db_engine.dispose()
+
+
+@pytest.fixture
+def write_gate(session_factory):
+    # The writer waits for the gate before opening each session, so that jobs can be queued behind a running one
+    gate = threading.Event()
+
+    def gated_session_factory():
+        gate.wait(timeout=10)
+        return session_factory()
+
+    yield gate, gated_session_factory
+    gate.set()
+
+
+def create_queue(session_factory, **kwargs) -> HistoricalJobQueue:
+    kwargs = {'max_jobs': 100, 'max_records': 1000, 'max_batch_records': 1000, 'max_finished': 100, **kwargs}
+    return HistoricalJobQueue(session_factory=session_factory, **kwargs)
+
+
+def generate_records(ticker_id: int, num_days: int, first_day: int = 0, close: float = 1.5) -> list[dict]:
+    return [
+        {
+            'date': date(2021, 9, 1) + timedelta(days=day),
+            'ticker_id': ticker_id,
+            'low': 1.0,
+            'high': 2.0,
+            'open': 1.0,
+            'close': close,
+            'volume': 100.0
+        }
+        for day in range(first_day, first_day + num_days)
+    ]
+
+
+def wait_until_running(queue: HistoricalJobQueue, job_id: str):
+    deadline = time.monotonic() + 10
+    while queue.get(job_id=job_id)['status'] == 'queued':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_queued_jobs_are_written_in_one_batch(session_factory, write_gate):
+    gate, gated_session_factory = write_gate
+    queue = create_queue(session_factory=gated_session_factory)
+    first = queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 2), on_conflict=None)
+    wait_until_running(queue=queue, job_id=first['job_id'])
+    queued = [
+        queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 2, first_day=2), on_conflict=None),
+        queue.submit(ticker_name='ETH-USD', ticker_id=2, records=generate_records(2, 3), on_conflict=None),
+        queue.submit(
+            ticker_name='BTC-USD',
+            ticker_id=1,
+            records=generate_records(1, 2, first_day=3, close=9.0),
+            on_conflict=PostHistoricalDataConflictAction.update
+        )
+    ]
+    assert first['status'] == 'queued' and first['jobs_ahead'] == 0
+    assert [job['jobs_ahead'] for job in queued] == [0, 1, 2]
+    assert queue.get(job_id=queued[2]['job_id'])['jobs_ahead'] == 2
+
+    gate.set()
+    assert queue.join(timeout=10)
+
+    statuses = [queue.get(job_id=job['job_id']) for job in [first] + queued]
+    assert [job['status'] for job in statuses] == ['succeeded'] * 4
+    assert [job['batch_jobs'] for job in statuses] == [1, 3, 3, 3]
+    assert [(job['inserted_records'], job['updated_records']) for job in statuses] == [(2, 0), (2, 0), (3, 0), (1, 1)]
+    assert queue.stats()['batches'] == 2
+    db = session_factory()
+    closes = [float(row.close) for row in db.query(HistoricalData).filter_by(ticker_id=1).order_by(HistoricalData.date)]
+    db.close()
+    assert closes == [1.5, 1.5, 1.5, 9.0, 9.0]
+
+
+def test_batches_are_bounded(session_factory, write_gate):
+    gate, gated_session_factory = write_gate
+    queue = create_queue(session_factory=gated_session_factory, max_batch_records=4)
+    jobs = [
+        queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 2, 2 * day), on_conflict=None)
+        for day in range(5)
+    ]
+
+    gate.set()
+    assert queue.join(timeout=10)
+
+    batch_jobs = [queue.get(job_id=job['job_id'])['batch_jobs'] for job in jobs]
+    # The first job may be taken before the others are queued - every other batch holds at most 4 records
+    assert all(size <= 2 for size in batch_jobs)
+    assert queue.stats()['batches'] >= 3
+
+
+def test_full_queue_rejects_jobs(session_factory, write_gate):
+    gate, gated_session_factory = write_gate
+    queue = create_queue(session_factory=gated_session_factory, max_jobs=2, max_records=5)
+    first = queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 5), on_conflict=None)
+    wait_until_running(queue=queue, job_id=first['job_id'])
+
+    # A job larger than max_records is rejected even when the queue is empty
+    assert queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 6, 5), on_conflict=None) is None
+    assert queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 5, 5), on_conflict=None)
+    assert queue.submit(ticker_name='ETH-USD', ticker_id=2, records=generate_records(2, 1), on_conflict=None) is None
+    queue.max_records = 100
+    assert queue.submit(ticker_name='ETH-USD', ticker_id=2, records=generate_records(2, 1), on_conflict=None)
+    assert queue.submit(ticker_name='ETH-USD', ticker_id=2, records=generate_records(2, 1, 1), on_conflict=None) is None
+    assert queue.stats() == {
+        'queued_jobs': 2, 'queued_records': 6, 'running_jobs': 1, 'finished_jobs': 0, 'rejected': 3, 'batches': 0,
+        'succeeded': 0, 'failed': 0
+    }
+
+    gate.set()
+    assert queue.join(timeout=10)
+    assert queue.submit(ticker_name='ETH-USD', ticker_id=2, records=generate_records(2, 1, 1), on_conflict=None)
+
+
+def test_failed_job_does_not_fail_its_batch(session_factory, write_gate):
+    gate, gated_session_factory = write_gate
+    queue = create_queue(session_factory=gated_session_factory)
+    first = queue.submit(ticker_name='ETH-USD', ticker_id=2, records=generate_records(2, 1), on_conflict=None)
+    wait_until_running(queue=queue, job_id=first['job_id'])
+    jobs = [
+        queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 3), on_conflict=None),
+        queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 2, 2), on_conflict=None),
+        queue.submit(ticker_name='ETH-USD', ticker_id=2, records=generate_records(2, 2, 1), on_conflict=None)
+    ]
+
+    gate.set()
+    assert queue.join(timeout=10)
+
+    statuses = [queue.get(job_id=job['job_id']) for job in jobs]
+    assert [job['status'] for job in statuses] == ['succeeded', 'failed', 'succeeded']
+    assert statuses[1]['error'] == 'Some of the BTC-USD records already exist - use on_conflict to update or skip them.'
+    assert statuses[1]['inserted_records'] == 0
+    assert queue.stats()['failed'] == 1
+    db = session_factory()
+    assert db.query(HistoricalData).filter_by(ticker_id=1).count() == 3
+    assert db.query(HistoricalData).filter_by(ticker_id=2).count() == 3
+    db.close()
+
+
+def test_oldest_finished_jobs_are_forgotten(session_factory):
+    queue = create_queue(session_factory=session_factory, max_finished=2)
+    jobs = []
+    for day in range(3):
+        jobs.append(queue.submit(
+            ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 1, day), on_conflict=None
+        ))
+        assert queue.join(timeout=10)
+
+    assert queue.get(job_id=jobs[0]['job_id']) is None
+    assert [queue.get(job_id=job['job_id'])['status'] for job in jobs[1:]] == ['succeeded', 'succeeded']
+    assert queue.get(job_id='unknown') is None
+
+
+def test_close_writes_the_queued_jobs(session_factory, write_gate):
+    gate, gated_session_factory = write_gate
+    queue = create_queue(session_factory=gated_session_factory)
+    job = queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 2), on_conflict=None)
+
+    gate.set()
+    queue.close(timeout=10)
+
+    assert queue.get(job_id=job['job_id'])['status'] == 'succeeded'
+    assert queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 1, 5), on_conflict=None) is None
+
+
+def test_open_accepts_jobs_again_after_close(session_factory):
+    queue = create_queue(session_factory=session_factory)
+    queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 1), on_conflict=None)
+    queue.close(timeout=10)
+
+    queue.open()
+    job = queue.submit(ticker_name='BTC-USD', ticker_id=1, records=generate_records(1, 1, 1), on_conflict=None)
+
+    assert queue.join(timeout=10)
+    assert queue.get(job_id=job['job_id'])['status'] == 'succeeded'
+    queue.close(timeout=10)
@@ -1,12 +1,18 @@
-from datetime import date
+import json
+from datetime import date, datetime
 from unittest import mock
 
 import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
-
-from app.api.config import API_TICKERS_ENDPOINT, API_HISTORICAL_ENDPOINT, API_CLEAR_ENDPOINT
-from app.api.db.models import Ticker, HistoricalData
+from sqlalchemy.exc import IntegrityError
+
+from app.api import apiutils
+from app.api.config import API_TICKERS_ENDPOINT, API_HISTORICAL_ENDPOINT, API_HISTORICAL_BATCH_ENDPOINT, \
+    API_HISTORICAL_STATS_ENDPOINT, API_HISTORICAL_LATEST_ENDPOINT, API_HISTORICAL_INGEST_ENDPOINT, API_CLEAR_ENDPOINT, \
+    API_CACHE_ENDPOINT, API_HISTORICAL_IMPORT_ENDPOINT, API_HISTORICAL_JOBS_ENDPOINT
+from app.api.db.models import Ticker
+from app.api.cache import historical_response_cache
 from app.api.main import app
 
 
@@ -15,6 +21,13 @@ def client():
     return TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def mock_retrieve_historical_data_versions():
+    with mock.patch("app.api.db.crud.retrieve_historical_data_versions", autospec=True) as mock_retrieve_versions:
+        mock_retrieve_versions.return_value = ((0, 1), datetime(2021, 10, 5, 12, 30))
+        yield mock_retrieve_versions
+
+
 @mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
 def test_get_ticker_exists(mock_retrieve_ticker, client):
     ticker = Ticker(id=1, ticker='BTC-USD')
@@ -33,20 +46,12 @@ def test_get_ticker_does_not_exists(mock_retrieve_ticker, client):
 
 
 @mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
-@mock.patch("app.api.db.crud.retrieve_historical_by_date_range_and_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
 def test_get_historical_exists_and_ticker_exists(mock_retrieve_historical, mock_retrieve_ticker, client):
     ticker = Ticker(id=1, ticker='BTC-USD')
     mock_retrieve_ticker.return_value = ticker
     mock_retrieve_historical.return_value = [
-        HistoricalData(
-            date=date(2021, 10, 5).isoformat(),
-            ticker_id=1,
-            low=25000.00,
-            high=35000.00,
-            open=27500.00,
-            close=32000.00,
-            volume=5000.00
-        )
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00, 0.0)
     ]
     start = date(2021, 9, 1)
     end = date(2021, 10, 31)
@@ -59,7 +64,7 @@ def test_get_historical_exists_and_ticker_exists(mock_retrieve_historical, mock_
 
 
 @mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
-@mock.patch("app.api.db.crud.retrieve_historical_by_date_range_and_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
 def test_get_historical_does_not_exists_and_ticker_exists(mock_retrieve_historical, mock_retrieve_ticker, client):
     ticker = Ticker(id=1, ticker='BTC-USD')
     mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
@@ -75,20 +80,12 @@ def test_get_historical_does_not_exists_and_ticker_exists(mock_retrieve_historic
 
 
 @mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
-@mock.patch("app.api.db.crud.retrieve_historical_by_date_range_and_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
 def test_get_historical_exists_and_ticker_does_not_exist(mock_retrieve_historical, mock_retrieve_ticker, client):
     ticker = Ticker(id=1, ticker='BTC-USD')
     mock_retrieve_ticker.return_value = None
     mock_retrieve_historical.return_value = [
-        HistoricalData(
-            date=date(2021, 10, 5).isoformat(),
-            ticker_id=1,
-            low=25000.00,
-            high=35000.00,
-            open=27500.00,
-            close=32000.00,
-            volume=5000.00
-        )
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00, 0.0)
     ]
     start = date(2021, 9, 1)
     end = date(2021, 10, 31)
@@ -177,3 +174,675 @@ def test_get_ticker_exists(mock_delete_historical, mock_delete_tickers, client):
     response = client.delete(url=API_CLEAR_ENDPOINT)
 
     assert response.status_code == status.HTTP_200_OK
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.create_historical", autospec=True)
+def test_add_historical_already_exists(mock_create_historical, mock_retrieve_ticker, client):
+    json_data = {
+        "ticker_name": 'BTC-USD',
+        "candlestick_records": [
+            {"date": "2022-02-02", "low": 10000, "high": 20000, "open": 140000, "close": 18000, "volume": 2234444}
+        ]
+    }
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_create_historical.side_effect = IntegrityError(statement=None, params=None, orig=Exception())
+    response = client.post(url=API_HISTORICAL_ENDPOINT, json=json_data)
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.upsert_historical", autospec=True)
+def test_add_historical_upsert(mock_upsert_historical, mock_retrieve_ticker, client):
+    json_data = {
+        "ticker_name": 'BTC-USD',
+        "candlestick_records": [
+            {"date": "2022-02-02", "low": 10000, "high": 20000, "open": 140000, "close": 18000, "volume": 2234444}
+        ]
+    }
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_upsert_historical.return_value = (0, 1, 0)
+    response = client.post(url=API_HISTORICAL_ENDPOINT, params={'on_conflict': 'update'}, json=json_data)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        'ticker_name': 'BTC-USD', 'inserted_records': 0, 'updated_records': 1, 'skipped_records': 0
+    }
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.jobqueue.historical_job_queue.submit", autospec=True)
+@mock.patch("app.api.db.crud.upsert_historical", autospec=True)
+def test_add_historical_in_background(mock_upsert_historical, mock_submit, mock_retrieve_ticker, client):
+    json_data = {
+        "ticker_name": 'BTC-USD',
+        "candlestick_records": [
+            {"date": "2022-02-02", "low": 10000, "high": 20000, "open": 140000, "close": 18000, "volume": 2234444}
+        ]
+    }
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_submit.return_value = {'job_id': 'abc', 'status': 'queued', 'records': 1, 'jobs_ahead': 0}
+    response = client.post(
+        url=API_HISTORICAL_ENDPOINT, params={'on_conflict': 'update', 'background': 'true'}, json=json_data
+    )
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json() == mock_submit.return_value
+    assert response.headers['location'] == f'{API_HISTORICAL_JOBS_ENDPOINT}?job_id=abc'
+    assert mock_submit.call_args.kwargs['ticker_id'] == 1
+    assert mock_submit.call_args.kwargs['on_conflict'] == 'update'
+    assert [record['date'] for record in mock_submit.call_args.kwargs['records']] == [date(2022, 2, 2)]
+    mock_upsert_historical.assert_not_called()
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.jobqueue.historical_job_queue.submit", autospec=True)
+def test_add_historical_in_background_and_queue_is_full(mock_submit, mock_retrieve_ticker, client):
+    json_data = {
+        "ticker_name": 'BTC-USD',
+        "candlestick_records": [
+            {"date": "2022-02-02", "low": 10000, "high": 20000, "open": 140000, "close": 18000, "volume": 2234444}
+        ]
+    }
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_submit.return_value = None
+    response = client.post(url=API_HISTORICAL_ENDPOINT, params={'background': 'true'}, json=json_data)
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers['retry-after'] == '1'
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.jobqueue.historical_job_queue.submit", autospec=True)
+@mock.patch("app.api.jobqueue.historical_job_queue.max_records", 1)
+def test_add_historical_in_background_more_records_than_the_queue_holds(mock_submit, mock_retrieve_ticker, client):
+    json_data = {
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': '2022-02-02', 'low': 10000, 'high': 20000, 'open': 14000, 'close': 18000, 'volume': 2234444},
+            {'date': '2022-02-03', 'low': 10000, 'high': 20000, 'open': 14000, 'close': 18000, 'volume': 2234444}
+        ]
+    }
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.post(url=API_HISTORICAL_ENDPOINT, params={'background': 'true'}, json=json_data)
+
+    assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert 'without background mode' in response.json()['detail']
+    mock_submit.assert_not_called()
+
+
+@mock.patch("app.api.jobqueue.historical_job_queue.get", autospec=True)
+def test_get_historical_job(mock_get, client):
+    mock_get.return_value = {'job_id': 'abc', 'status': 'succeeded', 'inserted_records': 1}
+    response = client.get(url=API_HISTORICAL_JOBS_ENDPOINT, params={'job_id': 'abc'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == mock_get.return_value
+
+    mock_get.return_value = None
+    response = client.get(url=API_HISTORICAL_JOBS_ENDPOINT, params={'job_id': 'abc'})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize('content_type, body', [
+    (
+        'application/x-ndjson',
+        '{"date": "2022-02-02", "low": 1, "high": 3, "open": 2, "close": 2, "volume": 10}\n'
+        '{"date": "2022-02-03", "low": 1, "high": 3, "open": 2, "close": 2, "volume": 10}\n'
+    ),
+    ('text/csv; charset=utf-8', 'date,low,high,open,close,volume\n2022-02-02,1,3,2,2,10\n2022-02-03,1,3,2,2,10\n')
+])
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.upsert_historical", autospec=True)
+def test_ingest_historical(mock_upsert_historical, mock_retrieve_ticker, content_type, body, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_upsert_historical.return_value = (1, 1, 0)
+    response = client.post(
+        url=API_HISTORICAL_INGEST_ENDPOINT, params={'ticker_name': 'BTC-USD'}, data=body,
+        headers={'Content-Type': content_type}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        'ticker_name': 'BTC-USD', 'received_records': 2, 'inserted_records': 1, 'updated_records': 1,
+        'skipped_records': 0, 'batches': 1
+    }
+    assert mock_upsert_historical.call_args.kwargs['records'] == [
+        {'date': date(2022, 2, day), 'ticker_id': 1, 'low': 1.0, 'high': 3.0, 'open': 2.0, 'close': 2.0, 'volume': 10.0}
+        for day in (2, 3)
+    ]
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.upsert_historical", autospec=True)
+def test_ingest_historical_invalid_line(mock_upsert_historical, mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.post(
+        url=API_HISTORICAL_INGEST_ENDPOINT, params={'ticker_name': 'BTC-USD'},
+        data='{"date": "2022-02-02", "low": 1, "high": 3, "open": 2, "close": 2, "volume": 10}\n{"date": "2022-02-03"}',
+        headers={'Content-Type': 'application/x-ndjson'}
+    )
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.json()['detail'].startswith('Invalid line 2')
+    mock_upsert_historical.assert_not_called()
+
+
+@pytest.mark.parametrize('line, expected_message', [
+    ('2022-02-03,1,3,2,nan,10', 'Invalid line 3: close is not a finite number'),
+    ('2022-02-03,1,3,2,2,-inf', 'Invalid line 3: volume is not a finite number'),
+    ('2022-02-03,1,3,0.5,2,10', 'Invalid line 3: open 0.5 is not between low 1.0 and high 3.0')
+])
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.upsert_historical", autospec=True)
+def test_ingest_historical_invalid_candle(mock_upsert_historical, mock_retrieve_ticker, line, expected_message, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.post(
+        url=API_HISTORICAL_INGEST_ENDPOINT, params={'ticker_name': 'BTC-USD'},
+        data=f'date,low,high,open,close,volume\n2022-02-02,1,3,2,2,10\n{line}\n',
+        headers={'Content-Type': 'text/csv'}
+    )
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.json()['detail'].startswith(expected_message)
+    mock_upsert_historical.assert_not_called()
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+def test_ingest_historical_ticker_does_not_exist(mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = None
+    response = client.post(
+        url=API_HISTORICAL_INGEST_ENDPOINT, params={'ticker_name': 'BTC-USD'}, data='',
+        headers={'Content-Type': 'text/csv'}
+    )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_ingest_historical_unsupported_media_type(client):
+    response = client.post(
+        url=API_HISTORICAL_INGEST_ENDPOINT, params={'ticker_name': 'BTC-USD'}, json={'ticker_name': 'BTC-USD'}
+    )
+
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+@mock.patch("app.api.db.crud.create_tickers", autospec=True)
+@mock.patch("app.api.db.crud.import_historical", autospec=True)
+def test_import_historical(mock_import_historical, mock_create_tickers, client):
+    mock_create_tickers.return_value = ({'BTC-USD': 1, 'ETH-USD': 2}, 1)
+    mock_import_historical.return_value = (2, 1, 0)
+    response = client.post(
+        url=API_HISTORICAL_IMPORT_ENDPOINT,
+        data='ticker,date,low,high,open,close,volume\nBTC-USD,2022-02-02,1,3,2,2,10\nBTC-USD,2022-02-03,1,3,2,2,10\n'
+             'ETH-USD,2022-02-02,1,3,2,2,10\n',
+        headers={'Content-Type': 'text/csv'}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        'tickers': 2, 'created_tickers': 1, 'received_records': 3, 'inserted_records': 2, 'updated_records': 1,
+        'skipped_records': 0
+    }
+    assert mock_create_tickers.call_args.kwargs['ticker_names'] == ['BTC-USD', 'ETH-USD']
+    assert list(mock_import_historical.call_args.kwargs['ticker_ids']) == [1, 2]
+
+
+@mock.patch("app.api.db.crud.create_tickers", autospec=True)
+def test_import_historical_invalid_file(mock_create_tickers, client):
+    response = client.post(
+        url=API_HISTORICAL_IMPORT_ENDPOINT, data='date,low,high,open,close,volume\n2022-02-02,1,3,2,2,10\n',
+        headers={'Content-Type': 'text/csv'}
+    )
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.json()['detail'] == 'Columns missing from the file: ticker - no historical data has been imported.'
+    mock_create_tickers.assert_not_called()
+
+
+def test_import_historical_unsupported_media_type(client):
+    response = client.post(url=API_HISTORICAL_IMPORT_ENDPOINT, json={'ticker_name': 'BTC-USD'})
+
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.stream_historical_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_stream(mock_stream_historical, mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_stream_historical.return_value = iter([
+        [(date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00)],
+        [(date(2021, 10, 6).isoformat(), 1, 26000.00, 36000.00, 28500.00, 48000.00, 6000.00)]
+    ])
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'json', 'stream': True
+    })
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line)['% change'] for line in response.text.splitlines()] == [0.0, 50.0]
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.stream_historical_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_stream_does_not_exist(mock_stream_historical, mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_stream_historical.return_value = iter([])
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'csv', 'stream': True
+    })
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_arrow(mock_retrieve_historical, mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_historical.return_value = [
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00, 0.0)
+    ]
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'arrow'
+    })
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'application/vnd.apache.arrow.stream'
+
+
+@mock.patch("app.api.main.HISTORICAL_PCT_CHANGE_IN_DATABASE", False)
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_pct_change_in_pandas(mock_retrieve_historical, mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_historical.return_value = [
+        ('2021-10-05', 1, 1.0, 3.0, 2.0, 100.0, 10.0),
+        ('2021-10-06', 1, 1.0, 3.0, 2.0, 150.0, 10.0)
+    ]
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'json'
+    })
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [record['% change'] for record in response.json()] == [0.0, 50.0]
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+def test_get_historical_stream_parquet_is_rejected(mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'parquet', 'stream': True
+    })
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.create_historical", autospec=True)
+def test_get_historical_is_cached_until_written(
+    mock_create_historical, mock_retrieve_historical, mock_retrieve_ticker, client
+):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_historical.return_value = [
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00, 0.0)
+    ]
+    mock_create_historical.return_value = 1
+    params = {'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'csv'}
+    initial_stats = client.get(url=API_CACHE_ENDPOINT).json()
+
+    first_response = client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+    second_response = client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+    assert second_response.text == first_response.text
+    assert second_response.headers['content-type'] == first_response.headers['content-type']
+    assert mock_retrieve_historical.call_count == 1
+
+    client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': '2021-12-01', 'low': 1, 'high': 3, 'open': 2, 'close': 100, 'volume': 10}
+        ]
+    })
+    client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+    assert mock_retrieve_historical.call_count == 1
+
+    client.post(url=API_HISTORICAL_ENDPOINT, json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': '2021-10-06', 'low': 1, 'high': 3, 'open': 2, 'close': 100, 'volume': 10}
+        ]
+    })
+    client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+    assert mock_retrieve_historical.call_count == 2
+
+    stats = client.get(url=API_CACHE_ENDPOINT).json()
+    assert stats['hits'] - initial_stats['hits'] == 2
+    assert stats['misses'] - initial_stats['misses'] == 2
+    assert stats['invalidations'] - initial_stats['invalidations'] == 1
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_is_not_cached_past_a_write_of_another_worker(
+    mock_retrieve_historical, mock_retrieve_ticker, mock_retrieve_historical_data_versions, client
+):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_historical.return_value = [
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00, 0.0)
+    ]
+    params = {'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'json'}
+    first_response = client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+    assert client.get(url=API_HISTORICAL_ENDPOINT, params=params).headers['etag'] == first_response.headers['etag']
+    assert mock_retrieve_historical.call_count == 1
+
+    # The cache of this worker is not invalidated by the write, only the data versions change
+    mock_retrieve_historical.return_value = [
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 33000.00, 5000.00, 0.0)
+    ]
+    mock_retrieve_historical_data_versions.return_value = ((0, 2), datetime(2021, 10, 6))
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+
+    assert mock_retrieve_historical.call_count == 2
+    assert response.json()[0]['close'] == 33000.00
+    assert response.headers['etag'] != first_response.headers['etag']
+    assert client.get(url=API_HISTORICAL_ENDPOINT, params=params).headers['etag'] == response.headers['etag']
+    assert mock_retrieve_historical.call_count == 2
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_not_modified(
+    mock_retrieve_historical, mock_retrieve_ticker, mock_retrieve_historical_data_versions, client
+):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_historical.return_value = [
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00, 0.0)
+    ]
+    params = {'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'json'}
+
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params=params)
+    etag = response.headers['etag']
+    assert response.headers['last-modified'] == 'Tue, 05 Oct 2021 12:30:00 GMT'
+
+    historical_response_cache.clear()
+    not_modified_response = client.get(url=API_HISTORICAL_ENDPOINT, params=params, headers={'If-None-Match': etag})
+    assert not_modified_response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert not_modified_response.headers['etag'] == etag
+    assert not_modified_response.content == b''
+    assert mock_retrieve_historical.call_count == 1
+
+    since_response = client.get(url=API_HISTORICAL_ENDPOINT, params=params, headers={
+        'If-Modified-Since': 'Tue, 05 Oct 2021 12:30:00 GMT'
+    })
+    assert since_response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    csv_response = client.get(
+        url=API_HISTORICAL_ENDPOINT, params={**params, 'data_format': 'csv'}, headers={'If-None-Match': etag}
+    )
+    assert csv_response.status_code == status.HTTP_200_OK
+
+    mock_retrieve_historical_data_versions.return_value = ((0, 2), datetime(2021, 10, 6))
+    modified_response = client.get(url=API_HISTORICAL_ENDPOINT, params=params, headers={'If-None-Match': etag})
+    assert modified_response.status_code == status.HTTP_200_OK
+    assert modified_response.headers['etag'] != etag
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+def test_get_ticker_not_modified(mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.get(url=API_TICKERS_ENDPOINT, params={'ticker_name': 'BTC-USD'})
+
+    not_modified_response = client.get(
+        url=API_TICKERS_ENDPOINT, params={'ticker_name': 'BTC-USD'}, headers={'If-None-Match': response.headers['etag']}
+    )
+
+    assert not_modified_response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.parametrize('pct_change_in_database', [True, False])
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_by_date_range_and_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_page(
+    mock_retrieve_historical_with_pct_change, mock_retrieve_historical, mock_retrieve_ticker, pct_change_in_database,
+    client
+):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    rows = [
+        ('2021-10-05', 1, 1.0, 3.0, 2.0, 100.0, 10.0),
+        ('2021-10-06', 1, 1.0, 3.0, 2.0, 150.0, 10.0),
+        ('2021-10-07', 1, 1.0, 3.0, 2.0, 300.0, 10.0),
+        ('2021-10-08', 1, 1.0, 3.0, 2.0, 150.0, 10.0)
+    ]
+    mock_retrieve_historical.return_value = rows
+    mock_retrieve_historical_with_pct_change.return_value = [
+        row + (pct_change,) for row, pct_change in zip(rows, (0.0, 50.0, 100.0, -50.0))
+    ]
+    with mock.patch("app.api.main.HISTORICAL_PCT_CHANGE_IN_DATABASE", pct_change_in_database):
+        response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+            'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'json',
+            'limit': 2, 'cursor': apiutils.encode_cursor(last_date='2021-10-05')
+        })
+    retrieve_historical = mock_retrieve_historical_with_pct_change if pct_change_in_database \
+        else mock_retrieve_historical
+
+    # The previous page ended on the 5th, which is read again only to seed the % change of the 6th
+    assert retrieve_historical.call_args.kwargs['start'] == date(2021, 10, 5)
+    assert retrieve_historical.call_args.kwargs['limit'] == 4
+    assert response.status_code == status.HTTP_200_OK
+    assert [(record['date'], record['% change']) for record in response.json()] == [
+        ('2021-10-06', 50.0), ('2021-10-07', 100.0)
+    ]
+    next_cursor = apiutils.encode_cursor(last_date='2021-10-07')
+    assert response.links['next']['url'].endswith(f'limit=2&cursor={next_cursor}')
+
+
+@pytest.mark.parametrize('params, expected_status_code', [
+    ({'data_format': 'csv', 'stream': True, 'limit': 10}, status.HTTP_400_BAD_REQUEST),
+    ({'data_format': 'json', 'cursor': 'not a cursor'}, status.HTTP_400_BAD_REQUEST),
+    ({'data_format': 'json', 'limit': 0}, status.HTTP_422_UNPROCESSABLE_ENTITY)
+])
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+def test_get_historical_page_is_rejected(mock_retrieve_ticker, params, expected_status_code, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', **params
+    })
+
+    assert response.status_code == expected_status_code
+
+
+@mock.patch("app.api.db.crud.retrieve_tickers_by_names", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_ids", autospec=True)
+def test_get_historical_batch(mock_retrieve_historical, mock_retrieve_tickers, client):
+    mock_retrieve_tickers.return_value = [Ticker(id=2, ticker='ETH-USD'), Ticker(id=1, ticker='BTC-USD')]
+    mock_retrieve_historical.return_value = [
+        ('2021-10-05', 1, 1.0, 3.0, 2.0, 100.0, 10.0, 0.0),
+        ('2021-10-05', 2, 1.0, 3.0, 2.0, 10.0, 10.0, 0.0)
+    ]
+    response = client.get(url=API_HISTORICAL_BATCH_ENDPOINT, params={
+        'ticker_names': ['ETH-USD', 'BTC-USD', 'ETH-USD'], 'start': '2021-09-01', 'end': '2021-10-31',
+        'data_format': 'json'
+    })
+
+    assert response.status_code == status.HTTP_200_OK
+    assert mock_retrieve_tickers.call_args.kwargs['ticker_names'] == ['ETH-USD', 'BTC-USD']
+    assert mock_retrieve_historical.call_args.kwargs['ticker_ids'] == [2, 1]
+    assert [(record['ticker'], record['close']) for record in response.json()] == [
+        ('BTC-USD', 100.0), ('ETH-USD', 10.0)
+    ]
+
+
+@mock.patch("app.api.db.crud.retrieve_tickers_by_names", autospec=True)
+def test_get_historical_batch_ticker_does_not_exist(mock_retrieve_tickers, client):
+    mock_retrieve_tickers.return_value = [Ticker(id=1, ticker='BTC-USD')]
+    response = client.get(url=API_HISTORICAL_BATCH_ENDPOINT, params={
+        'ticker_names': ['BTC-USD', 'XRP-USD'], 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'json'
+    })
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert 'XRP-USD' in response.json()['detail']
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_buckets_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_aggregated_ranges_share_the_bucket_series(mock_retrieve_buckets, mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_buckets.return_value = [
+        ('2021-08-01', 1, 1.0, 3.0, 2.0, 100.0, 10.0),
+        ('2021-09-01', 1, 1.0, 3.0, 2.0, 150.0, 10.0),
+        ('2021-10-01', 1, 1.0, 3.0, 2.0, 300.0, 10.0)
+    ]
+    responses = [
+        client.get(url=API_HISTORICAL_ENDPOINT, params={
+            'ticker_name': 'BTC-USD', 'start': start, 'end': '2021-10-31', 'data_format': 'json', 'granularity': 'month'
+        })
+        for start in ('2021-07-15', '2021-09-15')
+    ]
+
+    mock_retrieve_buckets.assert_called_once()
+    assert [[(record['date'], record['% change']) for record in response.json()] for response in responses] == [
+        [('2021-08-01', 0.0), ('2021-09-01', 50.0), ('2021-10-01', 100.0)],
+        [('2021-09-01', 0.0), ('2021-10-01', 100.0)]
+    ]
+
+
+@pytest.mark.parametrize('params', [
+    {'granularity': 'week', 'bucket_days': 7},
+    {'granularity': 'week', 'stream': True},
+    {'bucket_days': 7, 'limit': 10}
+])
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+def test_get_historical_aggregated_is_rejected(mock_retrieve_ticker, params, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'csv', **params
+    })
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.parametrize('pct_change_in_database', [True, False])
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_before_date_and_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_by_date_range_and_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_with_indicators(
+    mock_retrieve_historical_with_pct_change, mock_retrieve_historical, mock_retrieve_warmup, mock_retrieve_ticker,
+    pct_change_in_database, client
+):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_warmup.return_value = [('2021-10-04', 1, 1.0, 3.0, 2.0, 50.0, 10.0)]
+    rows = [
+        ('2021-10-05', 1, 1.0, 3.0, 2.0, 100.0, 10.0),
+        ('2021-10-06', 1, 1.0, 3.0, 2.0, 150.0, 10.0)
+    ]
+    mock_retrieve_historical.return_value = rows
+    mock_retrieve_historical_with_pct_change.return_value = [
+        row + (pct_change,) for row, pct_change in zip(rows, (100.0, 50.0))
+    ]
+    with mock.patch("app.api.main.HISTORICAL_PCT_CHANGE_IN_DATABASE", pct_change_in_database):
+        response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+            'ticker_name': 'BTC-USD', 'start': '2021-10-05', 'end': '2021-10-31', 'data_format': 'json',
+            'indicators': 'sma_2,sma_3'
+        })
+
+    # The SMA of 2 closes is warmed up with the close which precedes the start date
+    assert mock_retrieve_warmup.call_args.kwargs['before'] == date(2021, 10, 5)
+    assert mock_retrieve_warmup.call_args.kwargs['limit'] == 2
+    assert response.status_code == status.HTTP_200_OK
+    assert [(record['date'], record['sma_2'], record['sma_3']) for record in response.json()] == [
+        ('2021-10-05', 75.0, None), ('2021-10-06', 125.0, 100.0)
+    ]
+
+
+@pytest.mark.parametrize('params', [
+    {'indicators': 'macd'},
+    {'indicators': 'sma_1'},
+    {'indicators': 'sma', 'stream': True},
+    {'indicators': 'sma', 'granularity': 'week'}
+])
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+def test_get_historical_with_indicators_is_rejected(mock_retrieve_ticker, params, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    response = client.get(url=API_HISTORICAL_ENDPOINT, params={
+        'ticker_name': 'BTC-USD', 'start': '2021-09-01', 'end': '2021-10-31', 'data_format': 'csv', **params
+    })
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_by_date_range_and_ticker_id", autospec=True)
+def test_get_historical_stats_are_served_from_the_index(mock_retrieve_historical, mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_historical.return_value = [
+        ('2021-10-05', 1, 1.0, 3.0, 2.0, 100.0, 10.0),
+        ('2021-10-06', 1, 0.5, 4.0, 2.0, 150.0, 20.0),
+        ('2021-10-08', 1, 2.0, 5.0, 2.0, 200.0, 30.0)
+    ]
+    params = {'ticker_name': 'BTC-USD', 'start': '2021-10-06', 'end': '2021-10-31'}
+
+    response = client.get(url=API_HISTORICAL_STATS_ENDPOINT, params=params)
+    earlier_response = client.get(url=API_HISTORICAL_STATS_ENDPOINT, params={
+        **params, 'start': '2021-09-01', 'end': '2021-10-05'
+    })
+    missing_response = client.get(url=API_HISTORICAL_STATS_ENDPOINT, params={
+        **params, 'start': '2021-10-07', 'end': '2021-10-07'
+    })
+
+    # The index is built from the whole history once, then every range is answered from it
+    assert mock_retrieve_historical.call_count == 1
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        'ticker_name': 'BTC-USD', 'start': '2021-10-06', 'end': '2021-10-31', 'first_date': '2021-10-06',
+        'last_date': '2021-10-08', 'records': 2, 'open': 2.0, 'high': 5.0, 'low': 0.5, 'close': 200.0, 'volume': 50.0,
+        'average_close': 175.0, '% change': 9900.0
+    }
+    assert (earlier_response.json()['first_date'], earlier_response.json()['records']) == ('2021-10-05', 1)
+    assert missing_response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_extent_by_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_gaps_by_ticker_id", autospec=True)
+def test_get_historical_latest(mock_retrieve_gaps, mock_retrieve_extent, mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    mock_retrieve_extent.return_value = ('2021-09-01', '2021-10-31', 58)
+    mock_retrieve_gaps.return_value = [('2021-09-10', '2021-09-14')]
+
+    response = client.get(url=API_HISTORICAL_LATEST_ENDPOINT, params={'ticker_name': 'BTC-USD'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        'ticker_name': 'BTC-USD', 'first_date': '2021-09-01', 'last_date': '2021-10-31', 'records': 58,
+        'gaps': [{'start': '2021-09-11', 'end': '2021-09-13'}]
+    }
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_extent_by_ticker_id", autospec=True)
+@mock.patch("app.api.db.crud.retrieve_historical_gaps_by_ticker_id", autospec=True)
+def test_get_historical_latest_without_gaps_does_not_look_for_them(
+        mock_retrieve_gaps, mock_retrieve_extent, mock_retrieve_ticker, client
+):
+    mock_retrieve_ticker.return_value = Ticker(id=1, ticker='BTC-USD')
+    for extent in [('2021-09-01', '2021-10-31', 61), (None, None, 0)]:
+        mock_retrieve_extent.return_value = extent
+
+        response = client.get(url=API_HISTORICAL_LATEST_ENDPOINT, params={'ticker_name': 'BTC-USD'})
+
+        assert response.json()['last_date'] == extent[1]
+        assert response.json()['gaps'] == []
+    mock_retrieve_gaps.assert_not_called()
+
+
+@mock.patch("app.api.db.crud.retrieve_ticker_by_name", autospec=True)
+def test_get_historical_latest_of_missing_ticker(mock_retrieve_ticker, client):
+    mock_retrieve_ticker.return_value = None
+
+    response = client.get(url=API_HISTORICAL_LATEST_ENDPOINT, params={'ticker_name': 'BTC-USD'})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+
+import numpy
+import pytest
+
+from app.api.rangestats import HistoricalRangeStats, HistoricalRangeStatsIndex
+
+
+def build_rows(num_rows: int, start: date = date(2021, 1, 1)) -> list[tuple]:
+    rng = numpy.random.default_rng(seed=3)
+    # Every third day is missing, as if the market had been closed
+    days = [day for day in range(num_rows * 3 // 2) if day % 3 != 2][:num_rows]
+    return [
+        ((start + timedelta(days=day)).isoformat(), 1, *rng.uniform(1, 100, size=4).tolist(), float(rng.integers(100)))
+        for day in days
+    ]
+
+
+def naive_stats(rows: list[tuple], start: date, end: date) -> dict:
+    in_range = [row for row in rows if start.isoformat() <= row[0] <= end.isoformat()]
+    return {
+        'first_date': in_range[0][0],
+        'last_date': in_range[-1][0],
+        'records': len(in_range),
+        'open': in_range[0][4],
+        'high': max(row[3] for row in in_range),
+        'low': min(row[2] for row in in_range),
+        'close': in_range[-1][5],
+        'volume': pytest.approx(sum(row[6] for row in in_range)),
+        'average_close': pytest.approx(sum(row[5] for row in in_range) / len(in_range)),
+        '% change': pytest.approx((in_range[-1][5] / in_range[0][4] - 1) * 100)
+    }
+
+
+def test_range_stats_match_naive_aggregates():
+    rows = build_rows(num_rows=200)
+    stats = HistoricalRangeStats(rows=rows)
+    rng = numpy.random.default_rng(seed=5)
+
+    for _ in range(200):
+        start = date(2020, 12, 25) + timedelta(days=int(rng.integers(320)))
+        end = start + timedelta(days=int(rng.integers(320)))
+        if not any(start.isoformat() <= row[0] <= end.isoformat() for row in rows):
+            assert stats.query(start=start, end=end) is None
+            continue
+        assert stats.query(start=start, end=end) == naive_stats(rows=rows, start=start, end=end)
+
+
+def test_extended_range_stats_match_stats_built_at_once():
+    rows = build_rows(num_rows=100)
+    stats = HistoricalRangeStats(rows=rows[:37]).extend(rows=rows[37:38]).extend(rows=rows[38:])
+
+    start, end = date(2021, 1, 1), date(2021, 12, 31)
+    for offset in range(0, 150, 7):
+        range_start = start + timedelta(days=offset)
+        expected = HistoricalRangeStats(rows=rows).query(start=range_start, end=end)
+        # The prefix sums are only equal up to rounding, as they are summed in another order
+        assert stats.query(start=range_start, end=end) == {
+            key: pytest.approx(value) if isinstance(value, float) else value for key, value in expected.items()
+        }
+    with pytest.raises(ValueError):
+        stats.extend(rows=rows[-1:])
+
+
+def test_range_stats_index_appends_only_after_a_single_write():
+    rows = build_rows(num_rows=10)
+    index = HistoricalRangeStatsIndex(max_tickers=2)
+    index.put(ticker_id=1, data_versions=(0, 1), stats=HistoricalRangeStats(rows=rows[:5]))
+
+    assert index.append(ticker_id=1, data_versions=(0, 2), rows=rows[5:7])
+    assert len(index.get(ticker_id=1, data_versions=(0, 2))) == 7
+    # Another write happened in between - the index is dropped rather than extended
+    assert not index.append(ticker_id=1, data_versions=(0, 4), rows=rows[7:])
+    assert 1 not in index
+
+    index.put(ticker_id=1, data_versions=(0, 4), stats=HistoricalRangeStats(rows=rows[:5]))
+    # The rows are not later than the last row
+    assert not index.append(ticker_id=1, data_versions=(0, 5), rows=rows[:2])
+    assert index.get(ticker_id=1, data_versions=(0, 4)) is None
@@ -0,0 +1,45 @@
+from app.api.db.registry import TickerRegistry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_registry_is_fresh_for_the_check_interval():
+    clock = FakeClock()
+    registry = TickerRegistry(check_interval=1, clock=clock)
+    assert registry.lookup(ticker_name='BTC-USD') == (None, False)
+
+    registry.replace(version=1, tickers=[('BTC-USD', 1)])
+    assert registry.lookup(ticker_name='BTC-USD') == (1, True)
+
+    clock.now = 1.0
+    assert registry.lookup(ticker_name='BTC-USD') == (1, False)
+    assert registry.confirm(version=1)
+    assert registry.lookup(ticker_name='BTC-USD') == (1, True)
+    assert not registry.confirm(version=2)
+
+
+def test_add_only_applies_on_top_of_the_previous_version():
+    registry = TickerRegistry(check_interval=1, clock=FakeClock())
+    registry.replace(version=1, tickers=[('BTC-USD', 1)])
+
+    registry.add(ticker_name='ETH-USD', ticker_id=2, version=2)
+    assert registry.lookup(ticker_name='ETH-USD') == (2, True)
+
+    # Version 3 has been committed by another worker, so the registry cannot tell what else has changed
+    registry.add(ticker_name='SOL-USD', ticker_id=4, version=4)
+    assert registry.lookup(ticker_name='BTC-USD') == (1, False)
+
+
+def test_replace_does_not_go_back_to_an_older_version():
+    registry = TickerRegistry(check_interval=1, clock=FakeClock())
+    registry.clear(version=3)
+
+    registry.replace(version=2, tickers=[('BTC-USD', 1)])
+
+    assert registry.lookup(ticker_name='BTC-USD') == (None, True)
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from enum import Enum
+from typing import Callable, Optional
+
+import pyarrow
+import pyarrow.parquet
+import requests
+
+from app.etl.config import COINBASE_CACHE_COMPRESSION
+
+# Columns of a candle returned by the Coinbase API - the time is a UNIX timestamp
+CANDLE_SCHEMA = pyarrow.schema([
+    ('time', pyarrow.int64()),
+    ('low', pyarrow.float64()),
+    ('high', pyarrow.float64()),
+    ('open', pyarrow.float64()),
+    ('close', pyarrow.float64()),
+    ('volume', pyarrow.float64())
+])
+# Metadata key which tells whether all the candles of the window were final when it was fetched
+_COMPLETE_METADATA_KEY = b'complete'
+
+
+class CacheMode(str, Enum):
+    # Closed windows are read from the cache if stored, every other window is fetched (and stored if closed)
+    read_through = 'read-through'
+    # Every window is fetched and stored, overwriting what is stored
+    record = 'record'
+    # Every window is read from the cache, nothing is fetched
+    replay = 'replay'
+
+
+class CacheMissError(requests.RequestException):
+    """
+    Raised in replay mode for a window which is not stored - handled like a request which failed
+    """
+
+
+class CoinbaseResponseCache:
+    """
+    Thread-safe on-disk cache of the candles returned by the Coinbase API, one zstd-compressed Parquet file per
+    (ticker, granularity, window) named after the SHA-256 of that key. Windows whose candles were all final when they
+    were fetched (closed windows) never change, so they are never fetched again in read-through mode
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            mode: CacheMode = CacheMode.read_through,
+            clock: Callable[[], float] = time.time
+    ):
+        """
+        :param directory: Directory of the files, created if it does not exist
+        :param mode: How the cache is used, see CacheMode
+        :param clock: Current UNIX time, in seconds
+        """
+        self.directory = directory
+        self.mode = CacheMode(mode)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get_candles(
+            self,
+            ticker: str,
+            granularity: int,
+            window: tuple[datetime, datetime],
+            fetch: Callable[[], list[list]]
+    ) -> list[list]:
+        """
+        Given the key of a window of candles and a function which fetches them from the Coinbase API, get the candles
+        from the cache or from the function, depending on the mode
+
+        :param ticker: Cryptocurrency ticker (example BTC-USD)
+        :param granularity: Length of a candle in seconds
+        :param window: Tuple of (first candle start, last candle start), see extract.get_candle_windows
+        :param fetch: Function which fetches the candles of the window
+        :return: The candles - lists of [time, low, high, open, close, volume]
+        :raise: CacheMissError in replay mode if the window is not stored
+        """
+        path = self.get_path(ticker=ticker, granularity=granularity, window=window)
+        if self.mode != CacheMode.record:
+            stored = self._read(path=path)
+            # Windows which were still open when stored are only replayed - they may have changed since
+            if stored is not None and (self.mode == CacheMode.replay or stored[1]):
+                self._count(hits=1)
+                return stored[0]
+            if self.mode == CacheMode.replay:
+                self._count(misses=1)
+                raise CacheMissError(f'Window {window[0]} - {window[1]} of {ticker} ({granularity} s) is not cached')
+
+        self._count(misses=1)
+        # Read the time before fetching, so that a candle which closes during the request is not taken as final
+        complete = window[1].timestamp() + granularity <= self._clock()
+        candles = fetch()
+        if complete or self.mode == CacheMode.record:
+            self._write(path=path, candles=candles, complete=complete)
+        return candles
+
+    def get_path(self, ticker: str, granularity: int, window: tuple[datetime, datetime]) -> str:
+        """
+        Given the key of a window of candles, get the path of its file
+
+        :param ticker: Cryptocurrency ticker (example BTC-USD)
+        :param granularity: Length of a candle in seconds
+        :param window: Tuple of (first candle start, last candle start)
+        :return: The path
+        """
+        key = f'{ticker}|{granularity}|{int(window[0].timestamp())}|{int(window[1].timestamp())}'
+        return os.path.join(self.directory, f'{hashlib.sha256(key.encode()).hexdigest()}.parquet')
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the cache
+
+        :return: Dictionary with the number of hits, misses and writes
+        """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'writes': self._writes}
+
+    def _read(self, path: str) -> Optional[tuple[list[list], bool]]:
+        try:
+            table = pyarrow.parquet.read_table(path)
+        except FileNotFoundError:
+            return None
+        columns = [table.column(name).to_pylist() for name in CANDLE_SCHEMA.names]
+        complete = table.schema.metadata.get(_COMPLETE_METADATA_KEY) == b'true'
+        return [list(candle) for candle in zip(*columns)], complete
+
+    def _write(self, path: str, candles: list[list], complete: bool):
+        columns = list(zip(*candles)) if candles else [()] * len(CANDLE_SCHEMA)
+        table = pyarrow.table(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, CANDLE_SCHEMA)],
+            schema=CANDLE_SCHEMA.with_metadata({_COMPLETE_METADATA_KEY: b'true' if complete else b'false'})
+        )
+        # Written next to the file and renamed, so that concurrent readers never see a partial file
+        temporary_path = f'{path}.{threading.get_ident()}.tmp'
+        pyarrow.parquet.write_table(table, temporary_path, compression=COINBASE_CACHE_COMPRESSION)
+        os.replace(temporary_path, path)
+        self._count(writes=1)
+
+    def _count(self, hits: int = 0, misses: int = 0, writes: int = 0):
+        with self._lock:
+            self._hits += hits
+            self._misses += misses
+            self._writes += writes
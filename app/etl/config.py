@@ -1,4 +1,42 @@
 CUSTOM_API_BASE_URL = 'http://127.0.0.1:8000'
 CUSTOM_API_HISTORICAL_ENDPOINT = '/historical/'
+CUSTOM_API_HISTORICAL_LATEST_ENDPOINT = '/historical/latest/'
+CUSTOM_API_HISTORICAL_INGEST_ENDPOINT = '/historical/ingest/'
+CUSTOM_API_HISTORICAL_IMPORT_ENDPOINT = '/historical/import/'
 CUSTOM_API_TICKERS_ENDPOINT = '/tickers/'
 CUSTOM_API_CLEAR_ENDPOINT = '/clear/'
+# Compression level of gzip-encoded request bodies (1 fastest - 9 smallest)
+CUSTOM_API_REQUEST_GZIP_LEVEL = 6
+# Size (in bytes) of the chunks files are uploaded in
+CUSTOM_API_UPLOAD_CHUNK_SIZE = 1024 * 1024
+COINBASE_API_BASE_URL = 'https://api.exchange.coinbase.com'
+# Coinbase allows 10 requests per second (bursts of up to 15) per IP address to its public endpoints
+COINBASE_API_REQUESTS_PER_SECOND = 10
+COINBASE_API_BURST = 15
+# Candle granularities (in seconds) supported by the Coinbase API: 1 minute, 5 minutes, 15 minutes, 1 hour, 6 hours
+# and 1 day
+COINBASE_API_GRANULARITIES = (60, 300, 900, 3600, 21600, 86400)
+COINBASE_API_DAILY_GRANULARITY = 86400
+# Maximum number of candles the Coinbase API returns per request - longer ranges are split into windows of this size
+COINBASE_API_MAX_CANDLES = 300
+# Directory of the on-disk cache of the candles returned by the Coinbase API (see app/etl/cache.py), and the compression
+# of its Parquet files
+COINBASE_CACHE_DIR = '.coinbase_cache'
+COINBASE_CACHE_COMPRESSION = 'zstd'
+# Tickers extracted when none are given on the command line
+ETL_DEFAULT_TICKERS = ['BTC-USD']
+# Number of tickers extracted and loaded concurrently (and of pooled keep-alive connections per host)
+ETL_MAX_WORKERS = 8
+# Number of candles transformed (and loaded) at a time
+ETL_TRANSFORM_CHUNK_SIZE = 100_000
+# Connect and read timeouts (in seconds) of the HTTP requests
+HTTP_TIMEOUT = (3.05, 30)
+# Number of times a request is retried after a connection error, a timeout, a 429 or a 5xx response
+HTTP_MAX_RETRIES = 5
+# Retries wait backoff factor * 2 ** retry seconds (retry starting from 0, so 0.5, 1, 2...), capped to HTTP_MAX_BACKOFF,
+# unless the response says how long to wait with a Retry-After header
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_MAX_BACKOFF = 30
+HTTP_RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+# Maximum number of characters of the body of an error response which are logged
+HTTP_MAX_LOGGED_ERROR_CHARS = 1000
@@ -1,24 +1,170 @@
-from datetime import date
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Iterator, Optional, Sequence
 
 import requests
 
-from app.etl import logger
+from app.etl import httpclient, logger
+from app.etl.cache import CoinbaseResponseCache
+from app.etl.config import COINBASE_API_BASE_URL, COINBASE_API_BURST, COINBASE_API_DAILY_GRANULARITY, \
+    COINBASE_API_GRANULARITIES, COINBASE_API_MAX_CANDLES, COINBASE_API_REQUESTS_PER_SECOND, ETL_MAX_WORKERS, \
+    HTTP_MAX_LOGGED_ERROR_CHARS
+from app.etl.ratelimit import TokenBucket
 
+# Shared by all the threads of the process, as the limits of Coinbase apply per IP address
+coinbase_rate_limiter = TokenBucket(rate=COINBASE_API_REQUESTS_PER_SECOND, capacity=COINBASE_API_BURST)
+_SECONDS_PER_DAY = int(timedelta(days=1).total_seconds())
 
-def coinbase_api_get_historical(ticker: str, start: date, end: date) -> requests.Response:
+
+def _to_timestamp(moment: date) -> int:
+    # Dates are midnight UTC, as are naive datetimes
+    if not isinstance(moment, datetime):
+        moment = datetime(moment.year, moment.month, moment.day)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def _to_datetime(timestamp: int) -> datetime:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def _map_in_order(function: Callable, items: Sequence, max_workers: int) -> Iterator:
+    # Like ThreadPoolExecutor.map, but only one item more than max_workers is submitted ahead of the one being
+    # consumed, so that the results which are not consumed yet do not pile up in memory
+    if max_workers <= 1 or len(items) <= 1:
+        yield from map(function, items)
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(function, item))
+                if len(pending) > max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # The items which have not started yet are not fetched if the caller stops early or a request fails
+            for future in pending:
+                future.cancel()
+
+
+def get_candle_windows(start: date, end: date, granularity: int) -> list[tuple[datetime, datetime]]:
+    """
+    Given a range and a candle granularity, split the range into windows of up to COINBASE_API_MAX_CANDLES candles,
+    which the Coinbase API returns in one response
+
+    :param start: The start, a date (midnight UTC) or a datetime (UTC if naive)
+    :param end: The end - a date includes the whole day, a datetime includes the candle starting at it
+    :param granularity: Length of a candle in seconds, one of COINBASE_API_GRANULARITIES
+    :return: Tuples of (first candle start, last candle start) of consecutive windows, in order
+    :raise: ValueError if the granularity is not supported
+    """
+    if granularity not in COINBASE_API_GRANULARITIES:
+        raise ValueError(f'Unsupported granularity {granularity} - expected one of {COINBASE_API_GRANULARITIES}')
+    first = _to_timestamp(moment=start) // granularity * granularity
+    # Exclusive end of the range
+    stop = _to_timestamp(moment=end) + (granularity if isinstance(end, datetime) else _SECONDS_PER_DAY)
+    span = COINBASE_API_MAX_CANDLES * granularity
+    return [
+        (_to_datetime(timestamp=window_start), _to_datetime(timestamp=min(window_start + span, stop) - granularity))
+        for window_start in range(first, stop, span)
+    ]
+
+
+def coinbase_api_get_historical(
+        ticker: str,
+        start: date,
+        end: date,
+        granularity: int = COINBASE_API_DAILY_GRANULARITY,
+        session: Optional[requests.Session] = None,
+        rate_limiter: Optional[TokenBucket] = coinbase_rate_limiter,
+        base_url: str = COINBASE_API_BASE_URL
+) -> requests.Response:
     """
     Given a cryptocurrency ticker and date range, send a GET request to the Coinbase API to retrieve historical
-    timeseries data and return the response
+    timeseries data and return the response - rate limited, and retried after errors, 429 and 5xx responses. The API
+    returns at most COINBASE_API_MAX_CANDLES candles, see coinbase_api_get_candles for longer ranges
 
     :param ticker: Cryptocurrency ticker (example BTC-USD)
-    :param start: The start date
-    :param end: The end date
-    :return: GET request Response from Coinbase API
+    :param start: The start date (or datetime)
+    :param end: The end date (or datetime)
+    :param granularity: Length of a candle in seconds, one of COINBASE_API_GRANULARITIES
+    :param session: Session whose pooled connections are reused, None to open a new connection
+    :param rate_limiter: Rate limiter of the Coinbase API, None to send the request right away
+    :param base_url: Base URL of the Coinbase API
+    :return: GET request Response from Coinbase API - its body is not parsed, so that the caller can check its status
+    code first
     """
-    url = f'https://api.exchange.coinbase.com/products/{ticker}/candles'
+    url = f'{base_url}/products/{ticker}/candles'
     headers = {"Accept": "application/json"}
-    response = requests.request(method="GET", url=url, headers=headers, params={
-        'start': start, 'end': end, 'granularity': '1d'
-    })
-    logger.log_api_response(status_code=response.status_code, source=url, response_data=response.json())
+    response = httpclient.request_with_retries(
+        session=session or requests, method='GET', url=url, rate_limiter=rate_limiter, headers=headers,
+        params={'start': start.isoformat(), 'end': end.isoformat(), 'granularity': granularity}
+    )
+    # The body of an error response may not be JSON (example an HTML page of a proxy), so it is never parsed here
+    logger.log_api_response(
+        status_code=response.status_code, source=url,
+        response_data=response.text if response.ok else response.text[:HTTP_MAX_LOGGED_ERROR_CHARS]
+    )
     return response
+
+
+def coinbase_api_get_candles(
+        ticker: str,
+        start: date,
+        end: date,
+        granularity: int = COINBASE_API_DAILY_GRANULARITY,
+        session: Optional[requests.Session] = None,
+        rate_limiter: Optional[TokenBucket] = coinbase_rate_limiter,
+        base_url: str = COINBASE_API_BASE_URL,
+        max_workers: int = ETL_MAX_WORKERS,
+        cache: Optional[CoinbaseResponseCache] = None
+) -> Iterator[list]:
+    """
+    Given a cryptocurrency ticker and a range of any length, retrieve its candles from the Coinbase API - the range is
+    split into windows of up to COINBASE_API_MAX_CANDLES candles (see get_candle_windows) which are requested
+    concurrently, and their candles are stitched together and yielded a window at a time, in order, so that only the
+    windows in flight are held in memory
+
+    :param ticker: Cryptocurrency ticker (example BTC-USD)
+    :param start: The start, a date (midnight UTC) or a datetime (UTC if naive)
+    :param end: The end - a date includes the whole day, a datetime includes the candle starting at it
+    :param granularity: Length of a candle in seconds, one of COINBASE_API_GRANULARITIES
+    :param session: Session whose pooled connections are reused, None to open a new connection per request
+    :param rate_limiter: Rate limiter of the Coinbase API, None to send the requests right away
+    :param base_url: Base URL of the Coinbase API
+    :param max_workers: Maximum number of windows requested concurrently
+    :param cache: Cache the windows are read from and written to, depending on its mode - None to always request them
+    :return: Iterator over the candles - lists of [time, low, high, open, close, volume] - within the range, ordered
+    by time, without duplicates
+    :raise: ValueError if the granularity is not supported, requests.HTTPError if a window cannot be retrieved,
+    cache.CacheMissError if it is not cached in replay mode - when the iterator reaches it
+    """
+    windows = get_candle_windows(start=start, end=end, granularity=granularity)
+    if not windows:
+        return
+
+    def get_window(window: tuple[datetime, datetime]) -> list[list]:
+        def fetch_window() -> list[list]:
+            response = coinbase_api_get_historical(
+                ticker=ticker, start=window[0], end=window[1], granularity=granularity, session=session,
+                rate_limiter=rate_limiter, base_url=base_url
+            )
+            response.raise_for_status()
+            return response.json()
+
+        if cache is None:
+            return fetch_window()
+        return cache.get_candles(ticker=ticker, granularity=granularity, window=window, fetch=fetch_window)
+
+    # The ends of a window are inclusive, so the API may return a candle of a neighbouring window (or outside the range)
+    last, stop = _to_timestamp(moment=windows[0][0]) - 1, _to_timestamp(moment=windows[-1][1]) + granularity
+    for window_candles in _map_in_order(function=get_window, items=windows, max_workers=max_workers):
+        candles = {candle[0]: candle for candle in window_candles if last < candle[0] < stop}
+        for timestamp in sorted(candles):
+            yield candles[timestamp]
+        if candles:
+            last = max(candles)
@@ -0,0 +1,85 @@
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.etl import logger
+from app.etl.config import ETL_MAX_WORKERS, HTTP_BACKOFF_FACTOR, HTTP_MAX_BACKOFF, HTTP_MAX_RETRIES, \
+    HTTP_RETRY_STATUS_CODES, HTTP_TIMEOUT
+from app.etl.ratelimit import TokenBucket
+
+
+def create_session(pool_size: int = ETL_MAX_WORKERS) -> requests.Session:
+    """
+    Create an HTTP session which keeps connections alive and reuses them across requests (and threads) - one pool of
+    up to pool_size connections per host
+
+    :param pool_size: Maximum number of connections kept per host, at least the number of threads sharing the session
+    :return: The session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_retry_delay(response: Optional[requests.Response], retry: int) -> float:
+    """
+    Given the response which is to be retried (None after a connection error or timeout) and the number of the retry,
+    get how long to wait before sending the request again
+
+    :param response: The response, None if there is none
+    :param retry: Number of the retry, starting from 0
+    :return: The Retry-After header of the response (in seconds) if there is one, otherwise an exponential backoff
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), HTTP_MAX_BACKOFF)
+        except ValueError:
+            # An HTTP date rather than a number of seconds
+            pass
+    return min(HTTP_BACKOFF_FACTOR * 2 ** retry, HTTP_MAX_BACKOFF)
+
+
+def request_with_retries(
+        session: requests.Session,
+        method: str,
+        url: str,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_retries: int = HTTP_MAX_RETRIES,
+        **kwargs
+) -> requests.Response:
+    """
+    Send an HTTP request with a timeout, retrying it with backoff after a connection error, a timeout or a response
+    with one of HTTP_RETRY_STATUS_CODES (example 429 Too Many Requests) - every attempt takes a token from the rate
+    limiter first
+
+    :param session: The session the request is sent with (or the requests module, to open a new connection)
+    :param method: The HTTP method
+    :param url: The URL
+    :param rate_limiter: The rate limiter of the API, None if the API is not rate limited
+    :param max_retries: Maximum number of retries
+    :param kwargs: Other arguments of requests.Session.request (example params)
+    :return: The response - of the last attempt if all of them are to be retried
+    :raise: requests.ConnectionError or requests.Timeout if the last attempt fails with one
+    """
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    for retry in range(max_retries + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            response = session.request(method=method, url=url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            if retry == max_retries:
+                raise
+            response, reason = None, repr(error)
+        else:
+            if response.status_code not in HTTP_RETRY_STATUS_CODES or retry == max_retries:
+                return response
+            reason = f'status code {response.status_code}'
+        delay = get_retry_delay(response=response, retry=retry)
+        logger.logger.warning(f'Retrying {method} {url} in {delay:.2f} seconds after {reason}')
+        time.sleep(delay)
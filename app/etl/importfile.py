@@ -0,0 +1,51 @@
+import argparse
+from typing import Optional
+
+import requests
+
+from app.etl import httpclient, load, logger
+
+
+def run(paths: list[str], ticker: Optional[str] = None, on_conflict: str = 'update') -> dict[str, bool]:
+    """
+    Given the paths of CSV or Parquet files of historical data, import them into the custom API one after the other
+    (see load.api_post_historical_file) over a keep-alive connection
+
+    :param paths: The paths of the files
+    :param ticker: The ticker of the rows of files which have no ticker column
+    :param on_conflict: What the API should do with dates which are already stored: either update or ignore
+    :return: Dictionary which tells for every file whether it has been imported
+    """
+    results = {}
+    with httpclient.create_session(pool_size=1) as session:
+        for path in paths:
+            try:
+                counts = load.api_post_historical_file(
+                    path=path, ticker=ticker, on_conflict=on_conflict, session=session
+                )
+            except (ValueError, OSError, requests.RequestException) as error:
+                logger.logger.error(f'The import of {path} failed: {error!r}')
+                results[path] = False
+            else:
+                logger.logger.info(f'Imported {path}: {counts}')
+                results[path] = True
+    logger.logger.info(f'Imported {sum(results.values())} of {len(paths)} files.')
+    return results
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description='Import CSV or Parquet files of historical data into the API.')
+    parser.add_argument('paths', nargs='+', help='Files to import (.csv, .csv.gz or .parquet)')
+    parser.add_argument('--ticker', help='Ticker of the rows of files which have no ticker column')
+    parser.add_argument(
+        '--on-conflict', choices=['update', 'ignore'], default='update',
+        help='Update (default) or keep the dates which are already stored'
+    )
+    args = parser.parse_args(argv)
+    results = run(paths=args.paths, ticker=args.ticker, on_conflict=args.on_conflict)
+    if not all(results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,38 @@
+import gzip
+import io
+import json
+import os
 from datetime import date
+from typing import BinaryIO, Iterable, Iterator, Optional
 
 import pandas
+import pyarrow
+import pyarrow.parquet
 import requests
 
-from app.etl import logger
-from app.etl.config import CUSTOM_API_BASE_URL, CUSTOM_API_HISTORICAL_ENDPOINT, CUSTOM_API_TICKERS_ENDPOINT
+from app.etl import httpclient, logger
+from app.etl.config import CUSTOM_API_BASE_URL, CUSTOM_API_HISTORICAL_ENDPOINT, CUSTOM_API_HISTORICAL_IMPORT_ENDPOINT, \
+    CUSTOM_API_HISTORICAL_INGEST_ENDPOINT, CUSTOM_API_HISTORICAL_LATEST_ENDPOINT, CUSTOM_API_TICKERS_ENDPOINT, \
+    CUSTOM_API_REQUEST_GZIP_LEVEL, CUSTOM_API_UPLOAD_CHUNK_SIZE, HTTP_MAX_RETRIES
 
+# Media types of the bodies of POST /historical/ingest/
+INGEST_MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+# Columns of the rows of POST /historical/ingest/
+INGEST_COLUMN_NAMES = ['date', 'low', 'high', 'open', 'close', 'volume']
+# Counts returned by POST /historical/ingest/, summed over the chunks
+INGEST_COUNT_NAMES = ['received_records', 'inserted_records', 'updated_records', 'skipped_records', 'batches']
+# Media types of the files of POST /historical/import/ by file extension - a further .gz extension is sent as is, with
+# gzip Content-Encoding
+IMPORT_MEDIA_TYPES = {'.csv': 'text/csv', '.parquet': 'application/vnd.apache.parquet'}
 
-def api_get_historical(ticker: str, start: date, end: date, data_format: str):
+
+def api_get_historical(
+        ticker: str,
+        start: date,
+        end: date,
+        data_format: str,
+        session: Optional[requests.Session] = None
+):
     """
     Given a cryptocurrency ticker, date range and expected data output format, send a GET request to the custom API to
     retrieve historical data
@@ -15,40 +40,255 @@ def api_get_historical(ticker: str, start: date, end: date, data_format: str):
     :param ticker: Cryptocurrency ticker (example BTC-USD)
     :param start: The start date
     :param end: The end date
-    :param data_format: The data format that we expect: can be either json or csv
+    :param data_format: The data format that we expect: json, csv, arrow or parquet
+    :param session: Session whose pooled connections are reused, None to open a new connection
     """
     url = f"{CUSTOM_API_BASE_URL}{CUSTOM_API_HISTORICAL_ENDPOINT}"
-    response = requests.request(method='GET', url=url, params={
+    response = (session or requests).request(method='GET', url=url, params={
         'ticker_name': ticker, 'start': start.isoformat(), 'end': end.isoformat(), 'data_format': data_format,
     })
     if data_format == 'json' or response.status_code != 200:
         logger.log_api_response(status_code=response.status_code, source=url, response_data=response.json())
-    else:
+    elif data_format == 'csv':
         logger.log_api_response(status_code=response.status_code, source=url, response_data=response.text)
+    else:
+        logger.log_api_response(
+            status_code=response.status_code, source=url, response_data=f'{len(response.content)} bytes of {data_format}'
+        )
+
+
+def api_get_historical_latest(ticker: str, session: Optional[requests.Session] = None) -> Optional[dict]:
+    """
+    Given a cryptocurrency ticker, send a GET request to the custom API to retrieve which dates of its historical data
+    are stored
+
+    :param ticker: Cryptocurrency ticker (example BTC-USD)
+    :param session: Session whose pooled connections are reused, None to open a new connection
+    :return: Dictionary with the first and last stored dates (None if there is no historical data), the number of
+    candlesticks and the gaps between the first and last dates - None if the ticker does not exist
+    :raise: requests.HTTPError if the request fails for another reason
+    """
+    url = f"{CUSTOM_API_BASE_URL}{CUSTOM_API_HISTORICAL_LATEST_ENDPOINT}"
+    response = (session or requests).request(method='GET', url=url, params={'ticker_name': ticker})
+    logger.log_api_response(status_code=response.status_code, source=url, response_data=response.json())
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def decode_historical_data(content: bytes, data_format: str) -> pandas.DataFrame:
+    """
+    Given the body of a successful GET historical data response and its data format, decode it into a pandas.DataFrame
+
+    :param content: The raw response body
+    :param data_format: The data format of the body: json, csv, arrow or parquet
+    :return: pandas.DataFrame with one row per candlestick
+    """
+    if data_format == 'json':
+        return pandas.DataFrame.from_records(json.loads(content))
+    if data_format == 'csv':
+        return pandas.read_csv(io.BytesIO(content), index_col=0)
+    if data_format == 'arrow':
+        return pyarrow.ipc.open_stream(content).read_pandas()
+    return pyarrow.parquet.read_table(pyarrow.BufferReader(content)).to_pandas()
+
+
+def api_get_historical_df(ticker: str, start: date, end: date, data_format: str = 'arrow') -> pandas.DataFrame:
+    """
+    Given a cryptocurrency ticker, date range and data format, send a GET request to the custom API to retrieve
+    historical data and decode it into a pandas.DataFrame - the arrow and parquet formats avoid parsing text entirely
+
+    :param ticker: Cryptocurrency ticker (example BTC-USD)
+    :param start: The start date
+    :param end: The end date
+    :param data_format: The data format to request: json, csv, arrow or parquet
+    :return: pandas.DataFrame with one row per candlestick
+    :raise: requests.HTTPError if the API does not respond with status code 200
+    """
+    url = f"{CUSTOM_API_BASE_URL}{CUSTOM_API_HISTORICAL_ENDPOINT}"
+    response = requests.request(method='GET', url=url, params={
+        'ticker_name': ticker, 'start': start.isoformat(), 'end': end.isoformat(), 'data_format': data_format,
+    })
+    response.raise_for_status()
+    return decode_historical_data(content=response.content, data_format=data_format)
 
 
-def api_post_ticker(ticker: str):
+def api_post_ticker(ticker: str, session: Optional[requests.Session] = None):
     """
     Given a cryptocurrency ticker, send a POST request to the custom API to add the ticker to the records of existing
     tickers
 
     :param ticker: Cryptocurrency ticker (example BTC-USD)
+    :param session: Session whose pooled connections are reused, None to open a new connection
     """
     url = f"{CUSTOM_API_BASE_URL}{CUSTOM_API_TICKERS_ENDPOINT}"
-    response = requests.request(method='POST', url=url, json={'ticker_name': ticker})
+    response = (session or requests).request(method='POST', url=url, json={'ticker_name': ticker})
     logger.log_api_response(status_code=response.status_code, source=url, response_data=response.json())
 
 
-def api_post_historical(ticker: str, df: pandas.DataFrame):
+def api_post_historical(
+        ticker: str,
+        df: pandas.DataFrame,
+        on_conflict: str = 'update',
+        compress: bool = False,
+        session: Optional[requests.Session] = None
+):
     """
     Given a cryptocurrency ticker and timeseries data associated with it, send a POST request to the custom API to
     write this historical data to the database
 
     :param ticker: Cryptocurrency ticker (example BTC-USD)
     :param df: Timeseries data associated with ticker
+    :param on_conflict: What the API should do with dates which are already stored: either update or ignore - by
+    default re-running the ETL overwrites the stored candles instead of duplicating them
+    :param compress: Send the request body gzip-encoded (JSON compresses roughly 10x)
+    :param session: Session whose pooled connections are reused, None to open a new connection
     """
     url = f"{CUSTOM_API_BASE_URL}{CUSTOM_API_HISTORICAL_ENDPOINT}"
-    response = requests.request(
-        method='POST', url=url, json={'ticker_name': ticker, 'candlestick_records': df.to_dict(orient='records')}
+    body = json.dumps({'ticker_name': ticker, 'candlestick_records': df.to_dict(orient='records')}).encode()
+    headers = {'Content-Type': 'application/json'}
+    if compress:
+        body = gzip.compress(body, compresslevel=CUSTOM_API_REQUEST_GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    response = (session or requests).request(
+        method='POST', url=url, params={'on_conflict': on_conflict}, data=body, headers=headers
     )
     logger.log_api_response(status_code=response.status_code, source=url, response_data=response.json())
+
+
+def encode_ingest_chunk(df: pandas.DataFrame, data_format: str = 'ndjson') -> bytes:
+    """
+    Given transformed timeseries data, encode it as the body of a POST /historical/ingest/ request
+
+    :param df: Timeseries data with (at least) the INGEST_COLUMN_NAMES columns, dates as ISO strings
+    :param data_format: Either ndjson (several times faster to encode) or csv
+    :return: The body
+    """
+    if data_format == 'csv':
+        return df.to_csv(columns=INGEST_COLUMN_NAMES, index=False).encode()
+    # 15 decimals (the most pandas writes) is more than the precision of any price or volume of the Coinbase API
+    return df[INGEST_COLUMN_NAMES].to_json(orient='records', lines=True, double_precision=15).encode()
+
+
+def api_post_historical_stream(
+        ticker: str,
+        chunks: Iterable[pandas.DataFrame],
+        data_format: str = 'ndjson',
+        on_conflict: str = 'update',
+        compress: bool = False,
+        session: Optional[requests.Session] = None,
+        max_retries: int = HTTP_MAX_RETRIES
+) -> dict:
+    """
+    Given a cryptocurrency ticker and chunks of timeseries data associated with it (example from
+    transform.transform_coinbase_chunks), send them to the custom API's streaming ingest endpoint one chunk per request
+    over the keep-alive connection of the session - only one chunk is encoded and held in memory at a time, and the API
+    stores the rows in batches as they arrive instead of parsing the whole body first
+
+    A chunk is acknowledged by the response to its request, and never sent again. A chunk whose request fails (a
+    connection error, a timeout or a 429/5xx response) is sent again with backoff, resuming after the last acknowledged
+    chunk - the batches of it which the API had stored by then are upserted again, which changes nothing
+
+    :param ticker: Cryptocurrency ticker (example BTC-USD)
+    :param chunks: Timeseries data associated with ticker, with (at least) the INGEST_COLUMN_NAMES columns
+    :param data_format: Format the chunks are sent in: either ndjson or csv
+    :param on_conflict: What the API should do with dates which are already stored: either update or ignore
+    :param compress: Send the request bodies gzip-encoded
+    :param session: Session whose pooled connections are reused, None to open a new connection per chunk
+    :param max_retries: Maximum number of retries of a chunk
+    :return: Dictionary with the INGEST_COUNT_NAMES counts summed over the acknowledged chunks, and their number
+    :raise: requests.RequestException if a chunk cannot be sent - the chunks before it are stored
+    """
+    url = f"{CUSTOM_API_BASE_URL}{CUSTOM_API_HISTORICAL_INGEST_ENDPOINT}"
+    headers = {'Content-Type': INGEST_MEDIA_TYPES[data_format]}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    totals = dict.fromkeys(INGEST_COUNT_NAMES, 0)
+    totals['chunks'] = 0
+    for df in chunks:
+        body = encode_ingest_chunk(df=df, data_format=data_format)
+        if compress:
+            body = gzip.compress(body, compresslevel=CUSTOM_API_REQUEST_GZIP_LEVEL)
+        try:
+            response = httpclient.request_with_retries(
+                session=session or requests, method='POST', url=url, max_retries=max_retries,
+                params={'ticker_name': ticker, 'on_conflict': on_conflict}, data=body, headers=headers
+            )
+            logger.log_api_response(status_code=response.status_code, source=url, response_data=response.text)
+            response.raise_for_status()
+            counts = response.json()
+        except requests.RequestException:
+            logger.logger.error(
+                f'Ingesting {ticker} failed after {totals["chunks"]} acknowledged chunks '
+                f'({totals["received_records"]} records).'
+            )
+            raise
+        for count_name in INGEST_COUNT_NAMES:
+            totals[count_name] += counts[count_name]
+        totals['chunks'] += 1
+    return totals
+
+
+def get_import_headers(path: str) -> dict:
+    """
+    Given the path of a file of historical data, get the headers of the POST /historical/import/ request which sends it
+
+    :param path: The path - example btc-usd.csv, prices.parquet or prices.csv.gz
+    :return: Dictionary with the Content-Type (and Content-Encoding for gzip-compressed files) headers
+    :raise: ValueError if the file is neither CSV nor Parquet
+    """
+    root, extension = os.path.splitext(path.lower())
+    headers = {}
+    if extension == '.gz':
+        headers['Content-Encoding'] = 'gzip'
+        extension = os.path.splitext(root)[1]
+    if extension not in IMPORT_MEDIA_TYPES:
+        raise ValueError(f'{path} is neither a {" nor a ".join(IMPORT_MEDIA_TYPES)} file')
+    headers['Content-Type'] = IMPORT_MEDIA_TYPES[extension]
+    return headers
+
+
+def read_file_chunks(source: BinaryIO, chunk_size: int = CUSTOM_API_UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Given an open file, read it chunk by chunk - as a generator, which requests sends as a chunked request body
+
+    :param source: The file
+    :param chunk_size: Maximum size of a chunk in bytes
+    :return: Iterator over the chunks
+    """
+    while chunk := source.read(chunk_size):
+        yield chunk
+
+
+def api_post_historical_file(
+        path: str,
+        ticker: Optional[str] = None,
+        on_conflict: str = 'update',
+        session: Optional[requests.Session] = None
+) -> dict:
+    """
+    Given the path of a CSV or Parquet file of historical data (with a ticker column, or of a single ticker), send it
+    to the custom API's bulk import endpoint - streamed from disk as the request body, without being parsed here. The
+    API imports either the whole file or nothing, so a failed import can simply be sent again
+
+    :param path: The path of the file, whose extension tells its format (see get_import_headers)
+    :param ticker: The ticker of the rows of a file which has no ticker column, None if every row has a ticker
+    :param on_conflict: What the API should do with dates which are already stored: either update or ignore
+    :param session: Session whose pooled connections are reused, None to open a new connection
+    :return: Dictionary with the number of tickers and created tickers and the number of received, inserted, updated
+    and skipped records
+    :raise: ValueError if the file is neither CSV nor Parquet, requests.RequestException if the import fails
+    """
+    url = f"{CUSTOM_API_BASE_URL}{CUSTOM_API_HISTORICAL_IMPORT_ENDPOINT}"
+    headers = get_import_headers(path=path)
+    params = {'on_conflict': on_conflict}
+    if ticker is not None:
+        params['ticker_name'] = ticker
+    with open(path, 'rb') as source:
+        response = (session or requests).request(
+            method='POST', url=url, params=params, data=read_file_chunks(source=source), headers=headers
+        )
+    logger.log_api_response(status_code=response.status_code, source=url, response_data=response.text)
+    response.raise_for_status()
+    return response.json()
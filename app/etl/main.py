@@ -1,33 +1,207 @@
-from datetime import date
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from itertools import chain
+from typing import Optional
 
-import pandas
+import requests
 
-from app.etl import extract
+from app.etl import extract, httpclient
+from app.etl.cache import CacheMode, CoinbaseResponseCache
 from app.etl import load
+from app.etl import logger
 from app.etl import transform
+from app.etl.config import COINBASE_API_DAILY_GRANULARITY, COINBASE_CACHE_DIR, ETL_DEFAULT_TICKERS, ETL_MAX_WORKERS
 
 
-def run():
-    # Retrieve historical data from Coinbase API
-    start = date(2021, 9, 1)
-    end = date(2021, 10, 31)
-    ticker = 'BTC-USD'
-    response = extract.coinbase_api_get_historical(ticker=ticker, start=start, end=end)
+def get_missing_ranges(start: date, end: date, coverage: Optional[dict]) -> list[tuple[date, date]]:
+    """
+    Given a date range and which dates of the historical data of a ticker are stored, get the date ranges within it
+    which are not stored - before the first stored date, in the gaps and after the last stored date (the high-water
+    mark)
 
-    if response.status_code == 200:
-        # Send retrieved data to the custom API sa that it is written to the database
-        historical_df = pandas.DataFrame(
-            data=response.json(),
-            columns=['date', 'low', 'high', 'open', 'close', 'volume']
+    :param start: The start date
+    :param end: The end date
+    :param coverage: The stored dates, as returned by load.api_get_historical_latest - None if the ticker does not exist
+    :return: Tuples of (start date, end date) of the missing ranges, in order
+    """
+    if not coverage or not coverage['records']:
+        return [(start, end)] if start <= end else []
+    first_date, last_date = date.fromisoformat(coverage['first_date']), date.fromisoformat(coverage['last_date'])
+    candidates = [
+        (date.min, first_date - timedelta(days=1)),
+        *((date.fromisoformat(gap['start']), date.fromisoformat(gap['end'])) for gap in coverage['gaps']),
+        (last_date + timedelta(days=1), date.max)
+    ]
+    ranges = [(max(range_start, start), min(range_end, end)) for range_start, range_end in candidates]
+    return [(range_start, range_end) for range_start, range_end in ranges if range_start <= range_end]
+
+
+def check_granularity(granularity: int):
+    """
+    Given a candle granularity, check that its candles can be loaded through the custom API - which stores one candle
+    per ticker and date, so only daily candles can be loaded (the extract and transform stages support the intraday
+    granularities of the Coinbase API too)
+
+    :param granularity: Length of a candle in seconds
+    :raise: ValueError if the granularity is not daily
+    """
+    if granularity != COINBASE_API_DAILY_GRANULARITY:
+        raise ValueError(
+            f'Unsupported granularity {granularity} - the API only stores daily ({COINBASE_API_DAILY_GRANULARITY}) '
+            f'candles'
+        )
+
+
+def run_ticker(
+        ticker: str,
+        start: date,
+        end: date,
+        session: requests.Session,
+        max_workers: int = 1,
+        incremental: bool = False,
+        cache: Optional[CoinbaseResponseCache] = None,
+        granularity: int = COINBASE_API_DAILY_GRANULARITY
+) -> bool:
+    """
+    Given a cryptocurrency ticker and a date range, extract its historical data from the Coinbase API, transform it
+    and load it through the custom API
+
+    :param ticker: Cryptocurrency ticker (example BTC-USD)
+    :param start: The start date
+    :param end: The end date
+    :param session: Session shared by the workers, whose pooled connections are reused
+    :param max_workers: Number of windows of the date range extracted concurrently
+    :param incremental: Only extract and load the dates of the range which the custom API does not store yet - after
+    its latest stored date and in the gaps of the stored dates
+    :param cache: Cache of the Coinbase API responses, None to always request them
+    :param granularity: Length of a candle in seconds - only daily candles can be loaded (see check_granularity)
+    :return: True if the historical data has been loaded (or was already stored), False if there is none
+    :raise: ValueError if the granularity is not daily, requests.RequestException if the historical data cannot be
+    extracted or loaded
+    """
+    check_granularity(granularity=granularity)
+    coverage, ranges = None, [(start, end)]
+    if incremental:
+        coverage = load.api_get_historical_latest(ticker=ticker, session=session)
+        ranges = get_missing_ranges(start=start, end=end, coverage=coverage)
+        if not ranges:
+            logger.logger.info(f'{ticker} is up-to-date until {end}.')
+            return True
+
+    # Retrieve historical data from Coinbase API, in windows of up to 300 days which are requested as they are consumed
+    candles = chain.from_iterable(
+        extract.coinbase_api_get_candles(
+            ticker=ticker, start=range_start, end=range_end, granularity=granularity, session=session,
+            max_workers=max_workers, cache=cache
+        )
+        for range_start, range_end in ranges
+    )
+
+    # Stream the retrieved data to the custom API so that it is written to the database, a chunk at a time
+    chunks = transform.transform_coinbase_chunks(
+        chunks=transform.candles_to_chunks(candles=candles), granularity=granularity
+    )
+    first_chunk = next(chunks, None)
+    if first_chunk is not None:
+        if coverage is None:
+            load.api_post_ticker(ticker=ticker, session=session)
+        load.api_post_historical_stream(
+            ticker=ticker, chunks=chain([first_chunk], chunks), compress=True, session=session
         )
-        transform.transform_coinbase_data(historical_df=historical_df)
-        load.api_post_ticker(ticker=ticker)
-        load.api_post_historical(ticker=ticker, df=historical_df)
+        if not incremental:
+            # Attempt to get the historical data through the API in both json and csv formats
+            load.api_get_historical(ticker=ticker, start=start, end=end, data_format='json', session=session)
+            load.api_get_historical(ticker=ticker, start=start, end=end, data_format='csv', session=session)
+        return True
+    return False
+
+
+def run(
+        tickers: Optional[list[str]] = None,
+        start: date = date(2021, 9, 1),
+        end: date = date(2021, 10, 31),
+        max_workers: int = ETL_MAX_WORKERS,
+        incremental: bool = False,
+        cache: Optional[CoinbaseResponseCache] = None,
+        granularity: int = COINBASE_API_DAILY_GRANULARITY
+) -> dict[str, bool]:
+    """
+    Given cryptocurrency tickers and a date range, run the ETL for every ticker - up to max_workers tickers at a time,
+    over a pool of keep-alive connections, within the rate limits of the Coinbase API. When there are fewer tickers
+    than workers, the windows of the date range of every ticker are extracted concurrently by the spare workers
+
+    :param tickers: Cryptocurrency tickers, ETL_DEFAULT_TICKERS if None
+    :param start: The start date
+    :param end: The end date
+    :param max_workers: Number of tickers processed concurrently
+    :param incremental: Only extract and load the dates which the custom API does not store yet (see run_ticker)
+    :param cache: Cache of the Coinbase API responses, None to always request them
+    :param granularity: Length of a candle in seconds - only daily candles can be loaded (see check_granularity)
+    :return: Dictionary which tells for every ticker whether its historical data has been loaded
+    :raise: ValueError if the granularity is not daily
+    """
+    check_granularity(granularity=granularity)
+    tickers = list(dict.fromkeys(tickers or ETL_DEFAULT_TICKERS))
+    window_workers = max(1, max_workers // len(tickers))
+    results = {}
+    with httpclient.create_session(pool_size=max_workers) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            ticker: executor.submit(
+                run_ticker, ticker=ticker, start=start, end=end, session=session, max_workers=window_workers,
+                incremental=incremental, cache=cache, granularity=granularity
+            )
+            for ticker in tickers
+        }
+        for ticker, future in futures.items():
+            try:
+                results[ticker] = future.result()
+            except requests.RequestException as error:
+                logger.logger.error(f'The ETL of {ticker} failed: {error!r}')
+                results[ticker] = False
+    logger.logger.info(f'Loaded {sum(results.values())} of {len(tickers)} tickers.')
+    return results
+
+
+def parse_tickers_file(path: str) -> list[str]:
+    """
+    Given the path of a file which lists tickers, one per line (blank lines and # comments are ignored), read them
+
+    :param path: The path of the file
+    :return: The tickers
+    """
+    with open(path) as tickers_file:
+        return [line.split('#')[0].strip() for line in tickers_file if line.split('#')[0].strip()]
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description='Load the historical data of tickers from Coinbase into the API.')
+    parser.add_argument('tickers', nargs='*', help=f'Tickers to load (default {" ".join(ETL_DEFAULT_TICKERS)})')
+    parser.add_argument('--tickers-file', help='File which lists tickers to load, one per line')
+    parser.add_argument('--start', type=date.fromisoformat, default=date(2021, 9, 1), help='Start date (ISO)')
+    parser.add_argument(
+        '--end', type=date.fromisoformat, help='End date (ISO, default 2021-10-31 - yesterday with --incremental)'
+    )
+    parser.add_argument('--workers', type=int, default=ETL_MAX_WORKERS, help='Tickers processed concurrently')
+    parser.add_argument('--incremental', action='store_true', help='Only load the dates which are not stored yet')
+    parser.add_argument(
+        '--cache', choices=[mode.value for mode in CacheMode],
+        help='Cache the Coinbase API responses on disk: read-through, record or replay (offline)'
+    )
+    parser.add_argument('--cache-dir', default=COINBASE_CACHE_DIR, help='Directory of the cached responses')
+    args = parser.parse_args(argv)
 
-        # Attempt to get the historical data through the API in both json and csv formats
-        load.api_get_historical(ticker=ticker, start=start, end=end, data_format='json')
-        load.api_get_historical(ticker=ticker, start=start, end=end, data_format='csv')
+    # Incremental runs stop at the last complete daily candle, as the candle of today still changes
+    end = args.end or (
+        datetime.now(tz=timezone.utc).date() - timedelta(days=1) if args.incremental else date(2021, 10, 31)
+    )
+    tickers = args.tickers + (parse_tickers_file(path=args.tickers_file) if args.tickers_file else [])
+    cache = CoinbaseResponseCache(directory=args.cache_dir, mode=CacheMode(args.cache)) if args.cache else None
+    run(
+        tickers=tickers, start=args.start, end=end, max_workers=args.workers, incremental=args.incremental, cache=cache
+    )
 
 
 if __name__ == "__main__":
-    run()
+    main()
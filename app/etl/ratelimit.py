@@ -0,0 +1,51 @@
+import threading
+import time
+from typing import Callable
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter: tokens are added at a steady rate up to a capacity (the burst size) and
+    every request takes one, waiting for it if the bucket is empty
+
+    A request which has to wait reserves its token before sleeping (the bucket goes below zero), so that concurrent
+    requests queue up behind each other in order rather than all waking up when the next token is added
+    """
+
+    def __init__(
+            self,
+            rate: float,
+            capacity: float,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        :param rate: Number of tokens added per second
+        :param capacity: Maximum number of tokens - the bucket starts full
+        :param clock: Monotonic clock, in seconds
+        :param sleep: Function which waits for a number of seconds
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated_at = clock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Take tokens from the bucket, waiting until they are available
+
+        :param tokens: Number of tokens
+        :return: Number of seconds waited
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
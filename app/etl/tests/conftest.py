@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+
+class StubCoinbaseServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the candles endpoint of the Coinbase API, which answers after a latency, can answer the first
+    requests with errors and counts the requests and the connections it has been sent. Like the API, it returns the
+    candles from start to end (both inclusive), newest first, and rejects requests for more than 300 candles
+    """
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(('127.0.0.1', 0), StubCoinbaseHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = set()
+        # Status codes (example 429) of the responses to the first requests, after which candles are sent
+        self.error_status_codes = []
+        # Raw body of those error responses (example an HTML page), None for a JSON message
+        self.error_body = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+def _to_timestamp(value: str) -> int:
+    moment = datetime.fromisoformat(value)
+    return int((moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).timestamp())
+
+
+class StubCoinbaseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        with self.server.lock:
+            self.server.requests.append((url.path, parse_qs(url.query)))
+            self.server.connections.add(self.client_address)
+            error_status_code = self.server.error_status_codes.pop(0) if self.server.error_status_codes else None
+        time.sleep(self.server.latency)
+        if error_status_code:
+            self._send(
+                status_code=error_status_code, body={'message': 'error'}, headers={'Retry-After': '0'},
+                content=self.server.error_body
+            )
+            return
+        query = parse_qs(url.query)
+        granularity = int(query['granularity'][0])
+        start, end = (_to_timestamp(value=query[name][0]) for name in ['start', 'end'])
+        timestamps = range(end // granularity * granularity, start - 1, -granularity)
+        if len(timestamps) > 300:
+            self._send(status_code=400, body={'message': 'Count of aggregations requested exceeds 300'})
+            return
+        # Candles: [time, low, high, open, close, volume]
+        self._send(status_code=200, body=[[timestamp, 1.0, 3.0, 2.0, 2.5, 100.0] for timestamp in timestamps])
+
+    def _send(self, status_code: int, body, headers: dict = None, content: bytes = None):
+        content_type = 'text/html' if content is not None else 'application/json'
+        content = content if content is not None else json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_coinbase_server():
+    server = StubCoinbaseServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
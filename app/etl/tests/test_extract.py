@@ -0,0 +1,180 @@
+import functools
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+import requests
+
+from app.etl import extract, httpclient, main
+from app.etl.config import HTTP_MAX_LOGGED_ERROR_CHARS
+from app.etl.ratelimit import TokenBucket
+
+
+def test_coinbase_api_get_historical_retries_after_429_and_5xx(stub_coinbase_server):
+    stub_coinbase_server.error_status_codes = [429, 503]
+
+    response = extract.coinbase_api_get_historical(
+        ticker='BTC-USD', start=date(2021, 10, 5), end=date(2021, 10, 5), session=httpclient.create_session(),
+        rate_limiter=None, base_url=stub_coinbase_server.base_url
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [[1633392000, 1.0, 3.0, 2.0, 2.5, 100.0]]
+    assert [path for path, _ in stub_coinbase_server.requests] == ['/products/BTC-USD/candles'] * 3
+
+
+def test_coinbase_api_get_candles_handles_error_responses_which_are_not_json(stub_coinbase_server):
+    stub_coinbase_server.error_body = b'<html><body>' + b'Bad gateway ' * 1000 + b'</body></html>'
+    stub_coinbase_server.error_status_codes = [502]
+    get_candles = functools.partial(
+        extract.coinbase_api_get_candles, ticker='BTC-USD', start=date(2021, 10, 5), end=date(2021, 10, 5),
+        session=httpclient.create_session(), rate_limiter=None, base_url=stub_coinbase_server.base_url
+    )
+
+    # Retried like any other 502
+    assert len(list(get_candles())) == 1
+
+    stub_coinbase_server.error_status_codes = [404]
+    with mock.patch('app.etl.logger.log_api_response', autospec=True) as mock_log_api_response:
+        with pytest.raises(requests.HTTPError):
+            list(get_candles())
+
+    assert mock_log_api_response.call_args.kwargs['status_code'] == 404
+    assert len(mock_log_api_response.call_args.kwargs['response_data']) == HTTP_MAX_LOGGED_ERROR_CHARS
+
+
+def test_get_candle_windows_splits_range_into_windows_of_300_candles():
+    windows = extract.get_candle_windows(start=date(2020, 1, 1), end=date(2021, 12, 31), granularity=86400)
+
+    assert windows == [
+        (datetime(2020, 1, 1, tzinfo=timezone.utc), datetime(2020, 10, 26, tzinfo=timezone.utc)),
+        (datetime(2020, 10, 27, tzinfo=timezone.utc), datetime(2021, 8, 22, tzinfo=timezone.utc)),
+        (datetime(2021, 8, 23, tzinfo=timezone.utc), datetime(2021, 12, 31, tzinfo=timezone.utc))
+    ]
+
+
+def test_get_candle_windows_of_intraday_range():
+    windows = extract.get_candle_windows(
+        start=datetime(2021, 10, 5, 0, 30), end=datetime(2021, 10, 5, 12, 0), granularity=60
+    )
+
+    assert len(windows) == 3
+    assert windows[0][0] == datetime(2021, 10, 5, 0, 30, tzinfo=timezone.utc)
+    assert windows[1][0] - windows[0][1] == windows[2][0] - windows[1][1] == timedelta(minutes=1)
+    assert windows[-1][1] == datetime(2021, 10, 5, 12, 0, tzinfo=timezone.utc)
+
+
+def test_get_candle_windows_raises_for_unsupported_granularity():
+    with pytest.raises(ValueError):
+        extract.get_candle_windows(start=date(2021, 10, 5), end=date(2021, 10, 5), granularity=120)
+
+
+@pytest.mark.parametrize('start, end, granularity, expected_candles, expected_requests', [
+    (date(2021, 10, 5), date(2021, 10, 5), 86400, 1, 1),
+    (date(2019, 1, 1), date(2021, 12, 31), 86400, 1096, 4),
+    (date(2021, 10, 5), date(2021, 10, 6), 60, 2880, 10),
+    (date(2021, 10, 1), date(2021, 10, 31), 3600, 744, 3)
+])
+def test_coinbase_api_get_candles_stitches_windows(
+        stub_coinbase_server, start, end, granularity, expected_candles, expected_requests
+):
+    candles = list(extract.coinbase_api_get_candles(
+        ticker='BTC-USD', start=start, end=end, granularity=granularity, session=httpclient.create_session(),
+        rate_limiter=None, base_url=stub_coinbase_server.base_url
+    ))
+
+    timestamps = [candle[0] for candle in candles]
+    assert len(candles) == expected_candles
+    assert timestamps == list(range(timestamps[0], timestamps[-1] + 1, granularity))
+    assert timestamps[0] == extract.get_candle_windows(start=start, end=end, granularity=granularity)[0][0].timestamp()
+    assert len(stub_coinbase_server.requests) == expected_requests
+    assert {query['granularity'][0] for _, query in stub_coinbase_server.requests} == {str(granularity)}
+
+
+@pytest.mark.parametrize('max_workers, expected_requests', [(1, 1), (2, 3)])
+def test_coinbase_api_get_candles_requests_windows_as_they_are_consumed(
+        stub_coinbase_server, max_workers, expected_requests
+):
+    # 10 windows, of which only the first one is consumed - at most one more than max_workers are requested ahead
+    candles = extract.coinbase_api_get_candles(
+        ticker='BTC-USD', start=date(2014, 1, 1), end=date(2021, 12, 31), session=httpclient.create_session(),
+        rate_limiter=None, base_url=stub_coinbase_server.base_url, max_workers=max_workers
+    )
+
+    first_candle = next(candles)
+    candles.close()
+
+    assert first_candle[0] == datetime(2014, 1, 1, tzinfo=timezone.utc).timestamp()
+    assert len(stub_coinbase_server.requests) <= expected_requests
+
+
+def test_coinbase_api_get_candles_raises_if_a_window_fails(stub_coinbase_server):
+    stub_coinbase_server.error_status_codes = [404]
+
+    with pytest.raises(requests.HTTPError):
+        list(extract.coinbase_api_get_candles(
+            ticker='BTC-USD', start=date(2021, 1, 1), end=date(2021, 12, 31), session=httpclient.create_session(),
+            rate_limiter=None, base_url=stub_coinbase_server.base_url, max_workers=1
+        ))
+
+
+def test_request_with_retries_gives_up_after_max_retries(stub_coinbase_server):
+    stub_coinbase_server.error_status_codes = [500] * 3
+
+    response = httpclient.request_with_retries(
+        session=httpclient.create_session(), method='GET', url=f'{stub_coinbase_server.base_url}/products/X/candles',
+        max_retries=2
+    )
+
+    assert response.status_code == 500
+    assert len(stub_coinbase_server.requests) == 3
+
+
+def test_request_with_retries_raises_after_connection_errors():
+    session = mock.create_autospec(requests.Session, instance=True)
+    session.request.side_effect = requests.ConnectionError()
+
+    with mock.patch('app.etl.httpclient.time.sleep') as mock_sleep, pytest.raises(requests.ConnectionError):
+        httpclient.request_with_retries(session=session, method='GET', url='http://localhost', max_retries=3)
+
+    assert session.request.call_count == 4
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [0.5, 1.0, 2.0]
+
+
+@pytest.mark.parametrize('headers, retry, expected_delay', [
+    ({'Retry-After': '3'}, 0, 3.0),
+    ({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 2, 2.0),
+    ({}, 10, httpclient.HTTP_MAX_BACKOFF)
+])
+def test_get_retry_delay(headers, retry, expected_delay):
+    response = requests.Response()
+    response.headers.update(headers)
+
+    assert httpclient.get_retry_delay(response=response, retry=retry) == expected_delay
+
+
+@mock.patch('app.etl.main.load', autospec=True)
+def test_run_extracts_tickers_concurrently_over_pooled_connections(mock_load, stub_coinbase_server):
+    stub_coinbase_server.latency = 0.05
+    tickers = [f'T{index}-USD' for index in range(16)]
+
+    get_candles = extract.coinbase_api_get_candles
+    with mock.patch('app.etl.extract.coinbase_api_get_candles', side_effect=lambda **kwargs: get_candles(
+        **kwargs, rate_limiter=TokenBucket(rate=1000, capacity=16), base_url=stub_coinbase_server.base_url
+    )):
+        results = main.run(tickers=tickers, start=date(2021, 10, 5), end=date(2021, 10, 5), max_workers=8)
+
+    assert results == {ticker: True for ticker in tickers}
+    assert sorted(path for path, _ in stub_coinbase_server.requests) == sorted(
+        f'/products/{ticker}/candles' for ticker in tickers
+    )
+    # The 8 workers reuse their keep-alive connections rather than opening one per ticker
+    assert len(stub_coinbase_server.connections) <= 8
+    assert mock_load.api_post_historical_stream.call_count == len(tickers)
+
+
+def test_parse_tickers_file(tmp_path):
+    tickers_file = tmp_path / 'tickers.txt'
+    tickers_file.write_text('BTC-USD\n\n# Ether\nETH-USD  # second\n')
+
+    assert main.parse_tickers_file(path=str(tickers_file)) == ['BTC-USD', 'ETH-USD']
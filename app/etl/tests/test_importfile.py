@@ -0,0 +1,22 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from app.etl import importfile
+
+
+@mock.patch('app.etl.importfile.load.api_post_historical_file', autospec=True)
+def test_main_imports_every_file_and_fails_if_one_does(mock_post_historical_file):
+    mock_post_historical_file.side_effect = [{'received_records': 3}, requests.HTTPError('422 Client Error')]
+
+    with pytest.raises(SystemExit) as exit_info:
+        importfile.main(['prices.csv', 'prices.parquet', '--ticker', 'BTC-USD', '--on-conflict', 'ignore'])
+
+    assert exit_info.value.code == 1
+    assert [call.kwargs['path'] for call in mock_post_historical_file.call_args_list] == \
+        ['prices.csv', 'prices.parquet']
+    assert all(
+        call.kwargs['ticker'] == 'BTC-USD' and call.kwargs['on_conflict'] == 'ignore'
+        for call in mock_post_historical_file.call_args_list
+    )
@@ -0,0 +1,141 @@
+import json
+from datetime import date
+from unittest import mock
+
+import pandas
+import pytest
+import requests
+
+from app.api import apiutils
+from app.api.db.models import HistoricalData
+from app.api.schemas import GetHistoricalDataOutputType
+from app.etl import load
+
+
+@pytest.fixture()
+def historical_df():
+    rows = [
+        (date(2021, 10, 5).isoformat(), 1, 25000.00, 35000.00, 27500.00, 32000.00, 5000.00),
+        (date(2021, 10, 6).isoformat(), 1, 26000.00, 36000.00, 28500.00, 33000.00, 6000.00)
+    ]
+    df = apiutils.process_historical_records_to_df(historical_data=rows)
+    apiutils.add_pct_change(df=df, column_name=HistoricalData.close.name)
+    return df
+
+
+@pytest.mark.parametrize('data_format', list(GetHistoricalDataOutputType))
+def test_decode_historical_data(historical_df, data_format):
+    response = apiutils.build_historical_response(df=historical_df, data_format=data_format)
+
+    result_df = load.decode_historical_data(content=response.body, data_format=data_format.value)
+    result_df[HistoricalData.date.name] = result_df[HistoricalData.date.name].astype(str)
+
+    pandas.testing.assert_frame_equal(historical_df, result_df)
+
+
+def _ingest_response(status_code: int, received_records: int = 0) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps({
+        'ticker_name': 'BTC-USD', 'received_records': received_records, 'inserted_records': received_records,
+        'updated_records': 0, 'skipped_records': 0, 'batches': 1
+    }).encode()
+    return response
+
+
+def _ingest_chunks() -> list[pandas.DataFrame]:
+    return [
+        pandas.DataFrame({
+            'date': [f'2021-10-{day:02}' for day in days], 'low': 1.0, 'high': 3.0, 'open': 2.0, 'close': 2.5,
+            'volume': 100.0
+        })
+        for days in ([1, 2], [3, 4], [5])
+    ]
+
+
+@mock.patch('app.etl.httpclient.time.sleep', autospec=True)
+def test_api_post_historical_stream_resumes_from_last_acknowledged_chunk(mock_sleep):
+    session = mock.Mock(spec=requests.Session)
+    session.request.side_effect = [
+        _ingest_response(status_code=200, received_records=2),
+        requests.ConnectionError('Connection reset by peer'),
+        _ingest_response(status_code=503),
+        _ingest_response(status_code=200, received_records=2),
+        _ingest_response(status_code=200, received_records=1)
+    ]
+
+    totals = load.api_post_historical_stream(ticker='BTC-USD', chunks=_ingest_chunks(), session=session)
+
+    assert totals == {
+        'received_records': 5, 'inserted_records': 5, 'updated_records': 0, 'skipped_records': 0, 'batches': 3,
+        'chunks': 3
+    }
+    bodies = [call.kwargs['data'] for call in session.request.call_args_list]
+    # The first chunk is acknowledged so it is never sent again, the second one is sent until it is
+    assert [body.count(b'\n') for body in bodies] == [2, 2, 2, 2, 1]
+    assert bodies[1] == bodies[2] == bodies[3] != bodies[0]
+    assert json.loads(bodies[4].splitlines()[0]) == {
+        'date': '2021-10-05', 'low': 1.0, 'high': 3.0, 'open': 2.0, 'close': 2.5, 'volume': 100.0
+    }
+    assert mock_sleep.call_count == 2
+
+
+def test_api_post_historical_stream_stops_at_chunk_which_fails():
+    session = mock.Mock(spec=requests.Session)
+    session.request.side_effect = [
+        _ingest_response(status_code=200, received_records=2), _ingest_response(status_code=422)
+    ]
+
+    with pytest.raises(requests.HTTPError):
+        load.api_post_historical_stream(ticker='BTC-USD', chunks=_ingest_chunks(), session=session)
+    assert session.request.call_count == 2
+
+
+@pytest.mark.parametrize('data_format', ['ndjson', 'csv'])
+def test_encode_ingest_chunk_round_trips_prices(data_format):
+    df = pandas.DataFrame({
+        'date': ['2021-10-05'], 'low': [0.000012345678], 'high': [61234.56789012], 'open': [0.12345678], 'close': [2.0],
+        'volume': [123456789.123456], '% change': [1.5]
+    })
+
+    body = load.encode_ingest_chunk(df=df, data_format=data_format).decode()
+
+    if data_format == 'csv':
+        header, values = body.splitlines()
+        record = dict(zip(header.split(','), values.split(',')))
+    else:
+        record = json.loads(body)
+    assert list(record) == load.INGEST_COLUMN_NAMES
+    assert [float(record[column_name]) for column_name in load.INGEST_COLUMN_NAMES[1:]] == \
+        df[load.INGEST_COLUMN_NAMES[1:]].iloc[0].tolist()
+
+
+@pytest.mark.parametrize('path, headers', [
+    ('prices.csv', {'Content-Type': 'text/csv'}),
+    ('data/Prices.CSV.gz', {'Content-Encoding': 'gzip', 'Content-Type': 'text/csv'}),
+    ('prices.parquet', {'Content-Type': 'application/vnd.apache.parquet'})
+])
+def test_get_import_headers(path, headers):
+    assert load.get_import_headers(path=path) == headers
+
+
+def test_get_import_headers_unsupported_file():
+    with pytest.raises(ValueError):
+        load.get_import_headers(path='prices.json')
+
+
+def test_api_post_historical_file_streams_the_file(tmp_path):
+    path = tmp_path / 'prices.csv'
+    path.write_bytes(b'date,low,high,open,close,volume\n' * 3)
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'{"received_records": 3}'
+    session = mock.Mock(spec=requests.Session)
+    bodies = []
+    session.request.side_effect = lambda **kwargs: bodies.append(b''.join(kwargs['data'])) or response
+
+    counts = load.api_post_historical_file(path=str(path), ticker='BTC-USD', session=session)
+
+    assert counts == {'received_records': 3}
+    assert bodies == [path.read_bytes()]
+    assert session.request.call_args.kwargs['params'] == {'on_conflict': 'update', 'ticker_name': 'BTC-USD'}
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from app.etl.ratelimit import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        with self.lock:
+            self.now += seconds
+
+
+def test_token_bucket_allows_a_burst_then_the_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=3, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(5)]
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3:] == [0.1, 0.1]
+    assert clock.now == 0.2
+
+
+def test_token_bucket_refills_up_to_its_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.now += 60
+
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.1]
+
+
+def test_token_bucket_queues_concurrent_requests():
+    waits = []
+    # The clock stands still, as if all the requests arrived at once
+    bucket = TokenBucket(rate=10, capacity=1, clock=lambda: 0.0, sleep=lambda seconds: None)
+
+    threads = [threading.Thread(target=lambda: waits.append(bucket.acquire())) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every request which waits reserves its own token, so they are spread out at the rate rather than all sent when
+    # the next token is added
+    assert sorted(waits) == pytest.approx([0.1 * index for index in range(20)])
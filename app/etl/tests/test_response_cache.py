@@ -0,0 +1,85 @@
+import os
+from datetime import date, datetime, timezone
+
+import pytest
+
+from app.etl import extract, httpclient
+from app.etl.cache import CacheMissError, CacheMode, CoinbaseResponseCache
+
+# The candles from 2021-01-01 to 2021-12-31 are requested in 2 windows, all of whose candles are final at NOW
+START, END, NOW = date(2021, 1, 1), date(2021, 12, 31), datetime(2022, 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+def get_candles(server, cache, end=END):
+    return list(extract.coinbase_api_get_candles(
+        ticker='BTC-USD', start=START, end=end, session=httpclient.create_session(), rate_limiter=None,
+        base_url=server.base_url, cache=cache
+    ))
+
+
+def test_read_through_never_fetches_closed_windows_twice(stub_coinbase_server, tmp_path):
+    cache = CoinbaseResponseCache(directory=str(tmp_path), clock=lambda: NOW)
+
+    candles = get_candles(server=stub_coinbase_server, cache=cache)
+    cached_candles = get_candles(server=stub_coinbase_server, cache=cache)
+
+    assert len(candles) == 365
+    assert cached_candles == candles
+    assert len(stub_coinbase_server.requests) == 2
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'writes': 2}
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        os.path.basename(cache.get_path(ticker='BTC-USD', granularity=86400, window=window))
+        for window in extract.get_candle_windows(start=START, end=END, granularity=86400)
+    )
+
+
+def test_read_through_fetches_open_windows_again(stub_coinbase_server, tmp_path):
+    # The last candle is still open - the first window is closed, the second one is not
+    cache = CoinbaseResponseCache(directory=str(tmp_path), clock=lambda: NOW - 3600)
+
+    get_candles(server=stub_coinbase_server, cache=cache)
+    get_candles(server=stub_coinbase_server, cache=cache)
+
+    assert len(stub_coinbase_server.requests) == 3
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'writes': 1}
+
+
+def test_record_then_replay_offline(stub_coinbase_server, tmp_path):
+    record_cache = CoinbaseResponseCache(directory=str(tmp_path), mode=CacheMode.record, clock=lambda: NOW - 3600)
+    candles = get_candles(server=stub_coinbase_server, cache=record_cache)
+    assert record_cache.stats()['writes'] == 2
+
+    stub_coinbase_server.shutdown()
+    replay_cache = CoinbaseResponseCache(directory=str(tmp_path), mode=CacheMode.replay, clock=lambda: NOW)
+
+    assert get_candles(server=stub_coinbase_server, cache=replay_cache) == candles
+    assert replay_cache.stats() == {'hits': 2, 'misses': 0, 'writes': 0}
+    with pytest.raises(CacheMissError):
+        get_candles(server=stub_coinbase_server, cache=replay_cache, end=date(2022, 1, 31))
+
+
+def test_open_windows_recorded_are_fetched_again_in_read_through_mode(tmp_path):
+    window = (datetime(2021, 12, 31, tzinfo=timezone.utc), datetime(2021, 12, 31, tzinfo=timezone.utc))
+    CoinbaseResponseCache(directory=str(tmp_path), mode=CacheMode.record, clock=lambda: NOW - 3600).get_candles(
+        ticker='BTC-USD', granularity=86400, window=window,
+        fetch=lambda: [[1640908800, 1.0, 2.0, 1.0, 1.5, 10.0]]
+    )
+    cache = CoinbaseResponseCache(directory=str(tmp_path), clock=lambda: NOW)
+
+    candles = cache.get_candles(
+        ticker='BTC-USD', granularity=86400, window=window,
+        fetch=lambda: [[1640908800, 1.0, 3.0, 1.0, 2.5, 20.0]]
+    )
+
+    assert candles == [[1640908800, 1.0, 3.0, 1.0, 2.5, 20.0]]
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'writes': 1}
+
+
+def test_empty_windows_are_cached(tmp_path):
+    cache = CoinbaseResponseCache(directory=str(tmp_path), clock=lambda: NOW)
+    window = (datetime(2010, 1, 1, tzinfo=timezone.utc), datetime(2010, 10, 27, tzinfo=timezone.utc))
+
+    for _ in range(2):
+        assert cache.get_candles(ticker='BTC-USD', granularity=86400, window=window, fetch=lambda: []) == []
+
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'writes': 1}
@@ -0,0 +1,107 @@
+from datetime import date
+from unittest import mock
+
+import pytest
+
+from app.etl import extract, main
+from app.etl.ratelimit import TokenBucket
+
+
+@pytest.fixture
+def mock_load():
+    with mock.patch('app.etl.main.load', autospec=True) as mock_load:
+        # The chunks are transformed as they are streamed, so they are consumed like the loader would
+        mock_load.loaded_records = []
+        mock_load.api_post_historical_stream.side_effect = lambda chunks, **kwargs: mock_load.loaded_records.append(
+            sum(len(chunk) for chunk in chunks)
+        )
+        yield mock_load
+
+
+@pytest.fixture
+def stub_extract(stub_coinbase_server):
+    get_candles = extract.coinbase_api_get_candles
+    with mock.patch('app.etl.extract.coinbase_api_get_candles', side_effect=lambda **kwargs: get_candles(
+        **kwargs, rate_limiter=TokenBucket(rate=1000, capacity=16), base_url=stub_coinbase_server.base_url
+    )):
+        yield stub_coinbase_server
+
+
+@pytest.mark.parametrize('coverage, expected_ranges', [
+    (None, [(date(2021, 9, 1), date(2021, 10, 31))]),
+    (
+        {'first_date': None, 'last_date': None, 'records': 0, 'gaps': []},
+        [(date(2021, 9, 1), date(2021, 10, 31))]
+    ),
+    ({'first_date': '2021-09-01', 'last_date': '2021-10-31', 'records': 61, 'gaps': []}, []),
+    (
+        {'first_date': '2021-09-01', 'last_date': '2021-10-29', 'records': 59, 'gaps': []},
+        [(date(2021, 10, 30), date(2021, 10, 31))]
+    ),
+    (
+        {
+            'first_date': '2021-08-01', 'last_date': '2021-10-20', 'records': 70, 'gaps': [
+                {'start': '2021-08-10', 'end': '2021-08-12'}, {'start': '2021-09-05', 'end': '2021-09-10'}
+            ]
+        },
+        [(date(2021, 9, 5), date(2021, 9, 10)), (date(2021, 10, 21), date(2021, 10, 31))]
+    ),
+    (
+        {'first_date': '2021-10-01', 'last_date': '2021-11-20', 'records': 51, 'gaps': []},
+        [(date(2021, 9, 1), date(2021, 9, 30))]
+    )
+])
+def test_get_missing_ranges(coverage, expected_ranges):
+    assert main.get_missing_ranges(
+        start=date(2021, 9, 1), end=date(2021, 10, 31), coverage=coverage
+    ) == expected_ranges
+
+
+@pytest.mark.parametrize('granularity', [60, 3600, 21600])
+def test_run_rejects_intraday_granularities(mock_load, stub_extract, granularity):
+    with pytest.raises(ValueError):
+        main.run(tickers=['BTC-USD'], start=date(2021, 9, 1), end=date(2021, 9, 2), granularity=granularity)
+
+    assert stub_extract.requests == []
+    mock_load.api_post_historical_stream.assert_not_called()
+
+
+def test_run_incremental_extracts_and_loads_only_missing_dates(mock_load, stub_extract):
+    mock_load.api_get_historical_latest.return_value = {
+        'first_date': '2021-09-01', 'last_date': '2021-10-28', 'records': 56,
+        'gaps': [{'start': '2021-09-10', 'end': '2021-09-11'}]
+    }
+
+    results = main.run(tickers=['BTC-USD'], start=date(2021, 9, 1), end=date(2021, 10, 31), incremental=True)
+
+    assert results == {'BTC-USD': True}
+    assert [
+        (query['start'][0][:10], query['end'][0][:10]) for _, query in stub_extract.requests
+    ] == [('2021-09-10', '2021-09-11'), ('2021-10-29', '2021-10-31')]
+    assert mock_load.loaded_records == [5]
+    # The ticker is already stored, and the loaded data is not read back
+    mock_load.api_post_ticker.assert_not_called()
+    mock_load.api_get_historical.assert_not_called()
+
+
+def test_run_incremental_of_up_to_date_ticker_only_asks_for_its_latest_date(mock_load, stub_extract):
+    mock_load.api_get_historical_latest.return_value = {
+        'first_date': '2021-09-01', 'last_date': '2021-10-31', 'records': 61, 'gaps': []
+    }
+
+    results = main.run(tickers=['BTC-USD'], start=date(2021, 9, 1), end=date(2021, 10, 31), incremental=True)
+
+    assert results == {'BTC-USD': True}
+    assert stub_extract.requests == []
+    mock_load.api_get_historical_latest.assert_called_once()
+    mock_load.api_post_historical_stream.assert_not_called()
+
+
+def test_run_incremental_of_new_ticker_loads_whole_range(mock_load, stub_extract):
+    mock_load.api_get_historical_latest.return_value = None
+
+    results = main.run(tickers=['BTC-USD'], start=date(2021, 9, 1), end=date(2021, 10, 31), incremental=True)
+
+    assert results == {'BTC-USD': True}
+    assert mock_load.loaded_records == [61]
+    mock_load.api_post_ticker.assert_called_once()
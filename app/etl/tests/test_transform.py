@@ -1,5 +1,7 @@
-from datetime import date
+import time
+from datetime import date, timedelta
 
+import numpy
 import pandas
 
 from app.etl import transform
@@ -27,3 +29,63 @@ def test_transform_coinbase_data():
     expected_df = pandas.DataFrame(data=expected_data, columns=input_columns)
     transform.transform_coinbase_data(historical_df=result_df)
     pandas.testing.assert_frame_equal(expected_df, result_df)
+
+
+def test_transform_coinbase_data_drops_invalid_and_duplicate_candles_and_sorts():
+    historical_df = pandas.DataFrame(data=[
+        [1641427200, 2, 4, 3, 3, 10],
+        [1641340800, 1.0, 3.0, 2.0, 2.5, 10.0],
+        [1641513600, 5.0, 4.0, 4.5, 4.5, 10.0],
+        [1641600000, 1.0, 3.0, 2.0, 2.5, -1.0],
+        [1641686400, 1.0, 3.0, 2.0, None, 10.0],
+        [1641427200, 2.0, 4.0, 3.0, 3.5, 20.0]
+    ], columns=transform.CANDLE_COLUMN_NAMES)
+
+    last_timestamp = transform.transform_coinbase_data(historical_df=historical_df)
+
+    assert last_timestamp == 1641427200
+    assert historical_df.values.tolist() == [
+        ['2022-01-05', 1.0, 3.0, 2.0, 2.5, 10.0],
+        ['2022-01-06', 2.0, 4.0, 3.0, 3.5, 20.0]
+    ]
+    assert list(historical_df.index) == [0, 1]
+    assert all(dtype == float for dtype in historical_df.dtypes[1:])
+
+
+def test_transform_coinbase_data_converts_timestamps_in_utc(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/Los_Angeles')
+    time.tzset()
+    try:
+        historical_df = pandas.DataFrame(
+            data=[[1641340800, 1.0, 3.0, 2.0, 2.5, 10.0], [1641340860, 1.0, 3.0, 2.0, 2.5, 10.0]],
+            columns=transform.CANDLE_COLUMN_NAMES
+        )
+        intraday_df = historical_df.copy()
+
+        transform.transform_coinbase_data(historical_df=historical_df)
+        transform.transform_coinbase_data(historical_df=intraday_df, granularity=60)
+
+        assert list(historical_df['date']) == ['2022-01-05', '2022-01-05']
+        assert list(intraday_df['date']) == ['2022-01-05T00:00:00', '2022-01-05T00:01:00']
+        assert list(transform.format_timestamps(timestamps=numpy.array([1641340799]))) == ['2022-01-04']
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
+
+
+def test_transform_coinbase_chunks_drops_candles_repeated_across_chunks():
+    candles = [[1641340800 + 86400 * day, 1.0, 3.0, 2.0, 2.5, 10.0] for day in range(10)]
+
+    # Chunks of days 0-3, 4-5 twice and 6-9, then of days 0-2, 0-2 again and 3-5
+    chunks = list(transform.transform_coinbase_chunks(
+        chunks=transform.candles_to_chunks(candles=candles[:6] + candles[4:], chunk_size=4)
+    ))
+    repeated_chunks = list(transform.transform_coinbase_chunks(
+        chunks=transform.candles_to_chunks(candles=candles[:3] + candles[:6], chunk_size=3)
+    ))
+
+    assert [len(chunk) for chunk in chunks] == [4, 2, 4]
+    assert [len(chunk) for chunk in repeated_chunks] == [3, 3]
+    assert [day for chunk in chunks for day in chunk['date']] == [
+        (date(2022, 1, 5) + timedelta(days=day)).isoformat() for day in range(10)
+    ]
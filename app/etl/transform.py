@@ -1,13 +1,124 @@
-from datetime import date
+from itertools import islice
+from typing import Iterable, Iterator, Optional
 
+import numpy
 import pandas
+import pyarrow
+import pyarrow.compute
 
+from app.etl import logger
+from app.etl.config import COINBASE_API_DAILY_GRANULARITY, ETL_TRANSFORM_CHUNK_SIZE
 
-def transform_coinbase_data(historical_df: pandas.DataFrame):
+# Columns of the candles returned by the Coinbase API - the date is a UNIX timestamp until it is transformed
+CANDLE_COLUMN_NAMES = ['date', 'low', 'high', 'open', 'close', 'volume']
+
+
+def candles_to_chunks(
+        candles: Iterable[list],
+        chunk_size: int = ETL_TRANSFORM_CHUNK_SIZE
+) -> Iterator[pandas.DataFrame]:
+    """
+    Given candles returned by the Coinbase API, build pandas.DataFrames of up to chunk_size of them at a time
+
+    :param candles: The candles - lists of [time, low, high, open, close, volume]
+    :param chunk_size: Maximum number of candles per pandas.DataFrame
+    :return: Iterator over the pandas.DataFrames, with the CANDLE_COLUMN_NAMES columns
+    """
+    candles = iter(candles)
+    while chunk := list(islice(candles, chunk_size)):
+        yield pandas.DataFrame(data=chunk, columns=CANDLE_COLUMN_NAMES)
+
+
+def format_timestamps(timestamps: numpy.ndarray, granularity: int = COINBASE_API_DAILY_GRANULARITY) -> numpy.ndarray:
+    """
+    Given UNIX timestamps, convert them to ISO dates in UTC - or to ISO datetimes for intraday granularities
+
+    :param timestamps: The timestamps, in seconds
+    :param granularity: Length of a candle in seconds
+    :return: Object array of the ISO strings
+    """
+    # Arrow casts to strings in C++, several times faster than numpy's datetime64 to str conversion
+    if granularity % COINBASE_API_DAILY_GRANULARITY == 0:
+        strings = pyarrow.array(timestamps.astype('datetime64[s]').astype('datetime64[D]')).cast(pyarrow.string())
+    else:
+        strings = pyarrow.compute.replace_substring(
+            pyarrow.array(timestamps.astype('datetime64[s]')).cast(pyarrow.string()), ' ', 'T', max_replacements=1
+        )
+    return strings.to_numpy(zero_copy_only=False)
+
+
+def get_invalid_candles(historical_df: pandas.DataFrame) -> numpy.ndarray:
     """
-    Given a pandas.DataFrame containing timeseries data, convert the timestamps to dates of ISO format and sort by date
+    Given a pandas.DataFrame of candles, find the ones which are incomplete or break the OHLC invariants - the low is
+    the lowest price, the high the highest and the volume is not negative
+
+    :param historical_df: The candles, with the CANDLE_COLUMN_NAMES columns
+    :return: Boolean array which is True for the invalid candles
+    """
+    low, high, open_, close, volume = (
+        historical_df[column_name].to_numpy(dtype=float) for column_name in CANDLE_COLUMN_NAMES[1:]
+    )
+    # Comparisons with NaN are False, so incomplete candles are invalid too
+    valid = (low <= open_) & (low <= close) & (open_ <= high) & (close <= high) & (volume >= 0)
+    return ~valid | historical_df['date'].isna().to_numpy()
+
+
+def transform_coinbase_data(
+        historical_df: pandas.DataFrame,
+        granularity: int = COINBASE_API_DAILY_GRANULARITY
+) -> Optional[int]:
+    """
+    Given a pandas.DataFrame containing timeseries data, drop the invalid candles (see get_invalid_candles) and the
+    duplicates (keeping the last one), sort by date and convert the timestamps to dates of ISO format in UTC - all with
+    vectorized operations
 
     :param historical_df: Timeseries data retrieved from Coinbase API
+    :param granularity: Length of a candle in seconds - intraday timestamps are converted to ISO datetimes
+    :return: The timestamp of the last candle, None if there are no candles left
+    """
+    invalid = get_invalid_candles(historical_df=historical_df)
+    if invalid.any():
+        logger.logger.warning(f'Dropping {int(invalid.sum())} invalid candles.')
+        historical_df.drop(index=historical_df.index[invalid], inplace=True)
+    for column_name in CANDLE_COLUMN_NAMES[1:]:
+        # Whole prices and volumes are parsed from json as integers
+        if historical_df[column_name].dtype != numpy.float64:
+            historical_df[column_name] = historical_df[column_name].astype(numpy.float64)
+    historical_df['date'] = historical_df['date'].astype(numpy.int64)
+
+    # The candles of the Coinbase API are stitched in order already, only other sources need sorting - stable, so that
+    # the last of duplicate candles stays the last one
+    if historical_df['date'].is_monotonic_increasing:
+        historical_df.reset_index(drop=True, inplace=True)
+    else:
+        historical_df.sort_values(by='date', inplace=True, ignore_index=True, kind='stable')
+    timestamps = historical_df['date'].to_numpy()
+    duplicates = numpy.flatnonzero(timestamps[:-1] == timestamps[1:])
+    if len(duplicates):
+        historical_df.drop(index=duplicates, inplace=True)
+        historical_df.reset_index(drop=True, inplace=True)
+        timestamps = historical_df['date'].to_numpy()
+    historical_df['date'] = format_timestamps(timestamps=timestamps, granularity=granularity)
+    return int(timestamps[-1]) if len(timestamps) else None
+
+
+def transform_coinbase_chunks(
+        chunks: Iterable[pandas.DataFrame],
+        granularity: int = COINBASE_API_DAILY_GRANULARITY
+) -> Iterator[pandas.DataFrame]:
+    """
+    Given chunks of candles ordered by time (example from candles_to_chunks), transform them one at a time (see
+    transform_coinbase_data) - so that any number of candles streams through without being held in memory at once
+
+    :param chunks: pandas.DataFrames of candles, with the CANDLE_COLUMN_NAMES columns
+    :param granularity: Length of a candle in seconds - intraday timestamps are converted to ISO datetimes
+    :return: Iterator over the transformed chunks, without empty ones nor the candles of a previous chunk repeated
     """
-    historical_df['date'] = historical_df['date'].map(lambda x: date.fromtimestamp(x).isoformat())
-    historical_df.sort_values(by='date', inplace=True, ignore_index=True)
+    last_timestamp = None
+    for chunk in chunks:
+        if last_timestamp is not None:
+            chunk = chunk[chunk['date'].to_numpy() > last_timestamp].copy()
+        chunk_last_timestamp = transform_coinbase_data(historical_df=chunk, granularity=granularity)
+        if chunk_last_timestamp is not None:
+            last_timestamp = chunk_last_timestamp
+            yield chunk
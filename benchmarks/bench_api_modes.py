@@ -0,0 +1,99 @@
+"""
+Compare the throughput (requests per second) and p99 latency of GET /historical/ served by the sync and the async
+request paths at different numbers of concurrent clients.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_api_modes.py
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy
+import requests
+
+CONCURRENCY_LEVELS = [1, 50, 500]
+REQUESTS_PER_LEVEL = 1000
+NUM_DAYS = 365
+HOST = '127.0.0.1'
+PORTS = {'sync': 8101, 'async': 8102}
+
+
+def start_server(mode: str, db_path: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        API_ASYNC_MODE='true' if mode == 'async' else 'false',
+        SQLALCHEMY_DATABASE_URL=f'sqlite:///{db_path}',
+        DB_POOL_SIZE='50',
+        DB_MAX_OVERFLOW='50'
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.api.main:app', '--host', HOST, '--port', str(PORTS[mode]),
+         '--log-level', 'warning'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            requests.get(f'http://{HOST}:{PORTS[mode]}/openapi.json', timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f'The {mode} server did not start.')
+
+
+def seed(base_url: str):
+    start = date(2020, 1, 1)
+    requests.post(f'{base_url}/tickers/', json={'ticker_name': 'BTC-USD'})
+    requests.post(f'{base_url}/historical/', json={
+        'ticker_name': 'BTC-USD',
+        'candlestick_records': [
+            {'date': (start + timedelta(days=i)).isoformat(), 'low': i, 'high': i + 2, 'open': i + 1,
+             'close': i + 1.5, 'volume': 1000 + i}
+            for i in range(NUM_DAYS)
+        ]
+    })
+
+
+def run_level(base_url: str, concurrency: int) -> tuple[float, float]:
+    params = {'ticker_name': 'BTC-USD', 'start': '2020-01-01', 'end': '2020-03-31', 'data_format': 'json'}
+    requests_per_client = max(REQUESTS_PER_LEVEL // concurrency, 1)
+
+    def client(_) -> list[float]:
+        latencies = []
+        with requests.Session() as session:
+            for _ in range(requests_per_client):
+                request_start = time.perf_counter()
+                session.get(f'{base_url}/historical/', params=params).raise_for_status()
+                latencies.append(time.perf_counter() - request_start)
+        return latencies
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = [latency for result in executor.map(client, range(concurrency)) for latency in result]
+    elapsed = time.perf_counter() - wall_start
+    return len(latencies) / elapsed, float(numpy.percentile(latencies, 99)) * 1000
+
+
+def main():
+    print(f'{"mode":<8}{"clients":>8}{"req/s":>12}{"p99 (ms)":>12}')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in PORTS:
+            server = start_server(mode=mode, db_path=os.path.join(tmp_dir, f'{mode}.db'))
+            try:
+                base_url = f'http://{HOST}:{PORTS[mode]}'
+                seed(base_url=base_url)
+                for concurrency in CONCURRENCY_LEVELS:
+                    rps, p99 = run_level(base_url=base_url, concurrency=concurrency)
+                    print(f'{mode:<8}{concurrency:>8}{rps:>12.1f}{p99:>12.1f}')
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare fetching the historical data of many tickers over the same date range with one GET /historical/ request per
+ticker against a single GET /historical/batch/ request, end to end through the API on a temporary database.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_batch.py [comma separated numbers of tickers, default 10,50,200] [days, default 365]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+from app.api import main
+from app.api.cache import historical_response_cache
+from app.api.config import API_HISTORICAL_BATCH_ENDPOINT, API_HISTORICAL_ENDPOINT
+from app.api.db.database import Base, create_db_engine, create_session_factories, get_db, get_read_only_db
+from app.api.db.registry import ticker_registry
+
+REPEATS = 3
+FIRST_DATE = date(2020, 1, 1)
+
+
+def populate(db_engine, num_tickers: int, num_days: int):
+    connection = db_engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.executemany(
+        'INSERT INTO tickers (id, ticker) VALUES (?, ?)',
+        ((ticker_id, f'T{ticker_id}-USD') for ticker_id in range(1, num_tickers + 1))
+    )
+    cursor.executemany(
+        'INSERT INTO historical (date, ticker_id, low, high, open, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (
+            ((FIRST_DATE + timedelta(days=day)).isoformat(), ticker_id, 1.0 + day, 3.0 + day, 2.0 + day, 2.5 + day, 1.0)
+            for ticker_id in range(1, num_tickers + 1) for day in range(num_days)
+        )
+    )
+    connection.commit()
+    connection.close()
+
+
+def best_time_ms(function) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        # Every request has to go to the database
+        historical_response_cache.clear()
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings) * 1000
+
+
+def main_():
+    sizes = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10, 50, 200]
+    num_days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    params = {'start': FIRST_DATE.isoformat(), 'end': (FIRST_DATE + timedelta(days=num_days)).isoformat(),
+              'data_format': 'json'}
+    print(f'{num_days} days per ticker')
+    print(f'{"tickers":>8}{"one per ticker (ms)":>22}{"batch (ms)":>14}{"speedup":>10}')
+    for num_tickers in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_engine = create_db_engine(f'sqlite:///{os.path.join(tmp_dir, "bench.db")}')
+            Base.metadata.create_all(bind=db_engine)
+            populate(db_engine=db_engine, num_tickers=num_tickers, num_days=num_days)
+            session_factory, read_only_session_factory = create_session_factories(db_engine)
+            # The tickers are inserted without bumping their data version, the registry of the previous run is stale
+            ticker_registry.reset()
+
+            def override(factory):
+                def get_session():
+                    db = factory()
+                    try:
+                        yield db
+                    finally:
+                        db.close()
+                return get_session
+
+            main.app.dependency_overrides[get_db] = override(session_factory)
+            main.app.dependency_overrides[get_read_only_db] = override(read_only_session_factory)
+            client = TestClient(main.app)
+            ticker_names = [f'T{ticker_id}-USD' for ticker_id in range(1, num_tickers + 1)]
+            try:
+                single_ms = best_time_ms(lambda: [
+                    client.get(url=API_HISTORICAL_ENDPOINT, params={**params, 'ticker_name': ticker_name})
+                    for ticker_name in ticker_names
+                ])
+                batch_ms = best_time_ms(lambda: client.get(
+                    url=API_HISTORICAL_BATCH_ENDPOINT, params={**params, 'ticker_names': ticker_names}
+                ))
+            finally:
+                main.app.dependency_overrides.clear()
+                db_engine.dispose()
+        print(f'{num_tickers:>8}{single_ms:>22.1f}{batch_ms:>14.1f}{single_ms / batch_ms:>10.1f}')
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,94 @@
+"""
+Compare serving weekly and monthly candles for a long date range: the daily rows (which clients would resample
+themselves), aggregating them in SQL for every request, and slicing a whole bucketed series kept in memory. Reports
+the best latency from the database to the encoded json body and the size of that body.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_buckets.py [number of days, default 3650]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from app.api import apiutils
+from app.api.cache import HistoricalBucketSeries
+from app.api.db import crud
+from app.api.db.database import Base, create_db_engine, create_session_factories
+from app.api.schemas import GetHistoricalDataGranularity, GetHistoricalDataOutputType
+
+REPEATS = 5
+FIRST_DATE = date(2010, 1, 4)
+
+
+def populate(db_engine, num_days: int):
+    connection = db_engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.execute('INSERT INTO tickers (id, ticker) VALUES (1, ?)', ('BTC-USD',))
+    cursor.executemany(
+        'INSERT INTO historical (date, ticker_id, low, high, open, close, volume) VALUES (?, 1, ?, ?, ?, ?, ?)',
+        (
+            ((FIRST_DATE + timedelta(days=day)).isoformat(), 1.0 + day, 3.0 + day, 2.0 + day, 2.5 + day, 100.0)
+            for day in range(num_days)
+        )
+    )
+    connection.commit()
+    connection.close()
+
+
+def encode(rows) -> bytes:
+    return apiutils.build_historical_rows_response(rows=rows, data_format=GetHistoricalDataOutputType.json_format).body
+
+
+def best_time_ms(function) -> tuple[float, int]:
+    timings = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        body = function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings) * 1000, len(body)
+
+
+def main():
+    num_days = int(sys.argv[1]) if len(sys.argv) > 1 else 3650
+    start, end = FIRST_DATE, FIRST_DATE + timedelta(days=num_days)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_engine = create_db_engine(f'sqlite:///{os.path.join(tmp_dir, "bench.db")}')
+        Base.metadata.create_all(bind=db_engine)
+        populate(db_engine=db_engine, num_days=num_days)
+        session_factory, _ = create_session_factories(db_engine)
+        db = session_factory()
+        try:
+            print(f'{num_days} days')
+            print(f'{"granularity":<12}{"path":<10}{"latency (ms)":>14}{"body (KB)":>12}')
+            daily_ms, daily_size = best_time_ms(lambda: encode(
+                crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+                    db=db, start=start, end=end, ticker_id=1
+                )
+            ))
+            print(f'{"day":<12}{"rows":<10}{daily_ms:>14.1f}{daily_size / 1e3:>12.1f}')
+            for granularity in (GetHistoricalDataGranularity.week, GetHistoricalDataGranularity.month):
+                bucket_start, bucket_end = apiutils.get_bucket_range(start=start, end=end, granularity=granularity)
+                sql_ms, sql_size = best_time_ms(lambda: encode(
+                    crud.retrieve_historical_buckets_with_pct_change_by_date_range_and_ticker_id(
+                        db=db, start=bucket_start, end=bucket_end, ticker_id=1, granularity=granularity
+                    )
+                ))
+                series = HistoricalBucketSeries.from_rows(
+                    rows=crud.retrieve_historical_buckets_by_date_range_and_ticker_id(
+                        db=db, start=date.min, end=date.max, ticker_id=1, granularity=granularity
+                    )
+                )
+                cached_ms, _ = best_time_ms(lambda: encode(apiutils.add_pct_change_to_rows(
+                    rows=series.slice(start=bucket_start, end=bucket_end), previous_close=None
+                )[0]))
+                print(f'{granularity.value:<12}{"sql":<10}{sql_ms:>14.1f}{sql_size / 1e3:>12.1f}')
+                print(f'{granularity.value:<12}{"cached":<10}{cached_ms:>14.1f}{sql_size / 1e3:>12.1f}')
+        finally:
+            db.close()
+            db_engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
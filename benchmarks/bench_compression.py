@@ -0,0 +1,61 @@
+"""
+Compare the response size and the compression time of every supported content encoding for the json and csv outputs of
+GET /historical/, against serving a compressed body which the response cache already holds.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_compression.py [number of rows, default 3650]
+"""
+import sys
+import time
+from datetime import date, timedelta
+
+from app.api import apiutils, compression
+from app.api.cache import HistoricalCacheKey, HistoricalResponseCache
+from app.api.schemas import GetHistoricalDataOutputType
+
+REPEATS = 20
+
+
+def build_rows(num_rows: int) -> list[tuple]:
+    rows = [
+        ((date(2000, 1, 1) + timedelta(days=day)).isoformat(), 1, 1.0 + day, 3.0 + day, 2.0 + day, 2.5 + day, 100.0)
+        for day in range(num_rows)
+    ]
+    return apiutils.add_pct_change_to_rows(rows=rows, previous_close=None)[0]
+
+
+def best_time_ms(function) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings) * 1000
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 3650
+    rows = build_rows(num_rows=num_rows)
+    print(f'{num_rows} rows')
+    print(f'{"format":<8}{"encoding":<10}{"size (KB)":>12}{"ratio":>8}{"compress (ms)":>16}{"cached (ms)":>14}')
+    for data_format in (GetHistoricalDataOutputType.json_format, GetHistoricalDataOutputType.csv_format):
+        response = apiutils.build_historical_rows_response(rows=rows, data_format=data_format)
+        body = response.body
+        print(f'{data_format.value:<8}{"identity":<10}{len(body) / 1e3:>12.1f}{1:>8.1f}')
+
+        cache = HistoricalResponseCache(max_bytes=len(body) * 10)
+        key = HistoricalCacheKey(ticker_name='BTC-USD', start=None, end=None, data_format=data_format)
+        cache.put(key=key, response=response, data_versions=(0, 1), generation=cache.generation('BTC-USD'))
+        for encoding in compression.SUPPORTED_ENCODINGS:
+            compressed_body = compression.compress(body=body, encoding=encoding)
+            compress_ms = best_time_ms(lambda: compression.compress(body=body, encoding=encoding))
+            cache.get(key=key, data_versions=(0, 1), encoding=encoding)
+            cached_ms = best_time_ms(lambda: cache.get(key=key, data_versions=(0, 1), encoding=encoding))
+            print(
+                f'{data_format.value:<8}{encoding:<10}{len(compressed_body) / 1e3:>12.1f}'
+                f'{len(body) / len(compressed_body):>8.1f}{compress_ms:>16.2f}{cached_ms:>14.3f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
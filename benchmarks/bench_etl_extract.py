@@ -0,0 +1,75 @@
+"""
+Compare extracting the historical data of many tickers one after the other, with a new connection per request, and
+concurrently over a pool of keep-alive connections, against a local stand-in for the Coinbase candles endpoint which
+answers after a fixed latency. The rate limiter is left out of both, as at the 10 requests per second of the Coinbase
+API it bounds the concurrent extraction of 100 tickers to about 10 seconds, however many workers there are.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_etl_extract.py [number of tickers, default 100] [latency in ms, default 50]
+"""
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.etl import extract, httpclient
+from app.etl.config import ETL_MAX_WORKERS
+
+START, END = date(2021, 9, 1), date(2021, 10, 31)
+
+
+class CandlesHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        content = json.dumps([[1633392000, 1.0, 3.0, 2.0, 2.5, 100.0]]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def extract_sequentially(tickers: list[str], base_url: str):
+    for ticker in tickers:
+        extract.coinbase_api_get_historical(ticker=ticker, start=START, end=END, rate_limiter=None, base_url=base_url)
+
+
+def extract_concurrently(tickers: list[str], base_url: str):
+    with httpclient.create_session() as session, ThreadPoolExecutor(max_workers=ETL_MAX_WORKERS) as executor:
+        list(executor.map(lambda ticker: extract.coinbase_api_get_historical(
+            ticker=ticker, start=START, end=END, session=session, rate_limiter=None, base_url=base_url
+        ), tickers))
+
+
+def main():
+    num_tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CandlesHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    tickers = [f'T{index}-USD' for index in range(num_tickers)]
+
+    print(f'{num_tickers} tickers, {latency * 1000:.0f} ms latency, {ETL_MAX_WORKERS} workers')
+    timings = {}
+    for name, function in [('sequential', extract_sequentially), ('concurrent', extract_concurrently)]:
+        start = time.perf_counter()
+        function(tickers=tickers, base_url=base_url)
+        timings[name] = time.perf_counter() - start
+        print(f'{name:>12}: {timings[name]:.2f} s')
+    print(f'     speedup: {timings["sequential"] / timings["concurrent"]:.1f}x')
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
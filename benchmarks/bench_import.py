@@ -0,0 +1,121 @@
+"""
+Compare loading a multi-ticker historical dataset through the streaming ingest endpoint (POST /historical/ingest/, one
+CSV request per ticker - validated row by row and upserted in batches of executemany calls) against importing it as
+one file (POST /historical/import/ - read into columns with pyarrow and upserted with multi-row statements in a single
+transaction), as CSV and as Parquet. The requests are sent in-process to the app with a fresh SQLite database each.
+Reports the time and the rows per second of every path, and of the stages of the import.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_import.py [number of rows, default 1000000] [number of tickers, default 100]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+import pandas
+from fastapi.testclient import TestClient
+
+from app.api import bulkimport
+from app.api.db import crud
+from app.api.db.database import Base, create_db_engine, create_session_factories, get_db
+from app.api.db.registry import ticker_registry
+from app.api.main import app
+from app.api.schemas import GetHistoricalDataOutputType, PostHistoricalDataConflictAction
+from app.etl import load
+
+
+def generate_df(num_rows: int, num_tickers: int) -> pandas.DataFrame:
+    days = numpy.tile(numpy.arange(num_rows // num_tickers), num_tickers)
+    open_ = 30000 + numpy.sin(days / 30.0) * 1000
+    close = open_ + numpy.cos(days / 3.0) * 100
+    return pandas.DataFrame({
+        'ticker': numpy.repeat([f'T{ticker}-USD' for ticker in range(num_tickers)], num_rows // num_tickers),
+        'date': (numpy.datetime64('1000-01-01') + days).astype(str),
+        'low': numpy.minimum(open_, close) - 5,
+        'high': numpy.maximum(open_, close) + 5,
+        'open': open_,
+        'close': close,
+        'volume': numpy.abs(numpy.sin(days / 7.0)) * 100
+    })
+
+
+def create_session_factory(directory: str):
+    db_engine = create_db_engine(f'sqlite:///{os.path.join(directory, "bench.db")}')
+    Base.metadata.create_all(bind=db_engine)
+    return create_session_factories(db_engine)[0]
+
+
+def create_client(directory: str) -> TestClient:
+    session_factory = create_session_factory(directory=directory)
+
+    async def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    # The registry is process-wide, and every run has a database of its own
+    ticker_registry.reset()
+    return TestClient(app)
+
+
+def run_ingest(directory: str, df: pandas.DataFrame):
+    client = create_client(directory=directory)
+    for ticker, ticker_df in df.groupby('ticker', sort=False):
+        load.api_post_ticker(ticker=ticker, session=client)
+        load.api_post_historical_stream(ticker=ticker, chunks=[ticker_df], data_format='csv', session=client)
+
+
+def run_import(directory: str, df: pandas.DataFrame, path: str):
+    client = create_client(directory=directory)
+    counts = load.api_post_historical_file(path=path, session=client)
+    assert counts['inserted_records'] == len(df)
+
+
+def run_import_stages(directory: str, path: str):
+    db = create_session_factory(directory=directory)()
+    start = time.perf_counter()
+    with open(path, 'rb') as source:
+        table = bulkimport.read_historical_import(source=source, data_format=GetHistoricalDataOutputType.parquet_format)
+    read = time.perf_counter()
+    ticker_ids, _ = crud.create_tickers(db=db, ticker_names=bulkimport.get_ticker_names(table=table))
+    crud.import_historical(
+        db=db, row_groups=bulkimport.build_import_row_groups(table=table, ticker_ids=ticker_ids),
+        ticker_ids=ticker_ids.values(), on_conflict=PostHistoricalDataConflictAction.update
+    )
+    end = time.perf_counter()
+    db.close()
+    print(f'{"parquet stages":>15}: read {read - start:.2f} s, upsert {end - read:.2f} s')
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    num_tickers = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    df = generate_df(num_rows=num_rows, num_tickers=num_tickers)
+    print(f'{len(df)} rows of {num_tickers} tickers')
+    with tempfile.TemporaryDirectory() as files_directory:
+        csv_path, parquet_path = (os.path.join(files_directory, name) for name in ('prices.csv', 'prices.parquet'))
+        df.to_csv(csv_path, index=False)
+        df.to_parquet(parquet_path)
+        runs = [
+            ('ingest csv', lambda directory: run_ingest(directory=directory, df=df)),
+            ('import csv', lambda directory: run_import(directory=directory, df=df, path=csv_path)),
+            ('import parquet', lambda directory: run_import(directory=directory, df=df, path=parquet_path))
+        ]
+        for name, function in runs:
+            with tempfile.TemporaryDirectory() as directory:
+                start = time.perf_counter()
+                function(directory)
+                elapsed = time.perf_counter() - start
+            app.dependency_overrides.clear()
+            print(f'{name:>15}: {elapsed:7.2f} s, {len(df) / elapsed:9.0f} rows/s')
+        with tempfile.TemporaryDirectory() as directory:
+            run_import_stages(directory=directory, path=parquet_path)
+
+
+if __name__ == '__main__':
+    main()
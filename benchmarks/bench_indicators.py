@@ -0,0 +1,105 @@
+"""
+Compare the time the vectorized technical indicators take over a long series of candlesticks against plain Python
+loops computing the same values.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_indicators.py [number of rows, default 3650]
+"""
+import math
+import sys
+import time
+
+import numpy
+
+from app.api import indicators
+
+REPEATS = 5
+WINDOW = 20
+
+
+def build_rows(num_rows: int) -> list[tuple]:
+    close = 100 + numpy.cumsum(numpy.random.default_rng(seed=1).normal(size=num_rows))
+    return [
+        (day, 1, close[day] - 1, close[day] + 1, close[day], close[day], 100.0 + day % 10) for day in range(num_rows)
+    ]
+
+
+def loop_sma(close: list[float], window: int) -> list[float]:
+    return [sum(close[index - window + 1:index + 1]) / window if index >= window - 1 else None
+            for index in range(len(close))]
+
+
+def loop_ema(close: list[float], window: int) -> list[float]:
+    alpha, result = 2 / (window + 1), [close[0]]
+    for value in close[1:]:
+        result.append(alpha * value + (1 - alpha) * result[-1])
+    return result
+
+
+def loop_rsi(close: list[float], window: int) -> list[float]:
+    result, average_gain, average_loss = [None], 0.0, 0.0
+    for index in range(1, len(close)):
+        change = close[index] - close[index - 1]
+        alpha = 1 / window if index > 1 else 1.0
+        average_gain = (1 - alpha) * average_gain + alpha * max(change, 0.0)
+        average_loss = (1 - alpha) * average_loss + alpha * max(-change, 0.0)
+        result.append(100 - 100 / (1 + average_gain / average_loss) if average_loss else 100.0)
+    return result
+
+
+def loop_vwap(rows: list[tuple], window: int) -> list[float]:
+    result = []
+    for index in range(len(rows)):
+        window_rows = rows[max(0, index - window + 1):index + 1]
+        traded_value = sum((row[2] + row[3] + row[5]) / 3 * row[6] for row in window_rows)
+        traded_volume = sum(row[6] for row in window_rows)
+        result.append(traded_value / traded_volume if index >= window - 1 else None)
+    return result
+
+
+def loop_bollinger_bands(close: list[float], window: int) -> list[tuple]:
+    result = []
+    for index in range(len(close)):
+        if index < window - 1:
+            result.append((None, None, None))
+            continue
+        values = close[index - window + 1:index + 1]
+        mean = sum(values) / window
+        deviation = math.sqrt(sum((value - mean) ** 2 for value in values) / window)
+        result.append((mean - 2 * deviation, mean, mean + 2 * deviation))
+    return result
+
+
+def loop_indicators(rows: list[tuple]):
+    close = [row[5] for row in rows]
+    return (
+        loop_sma(close=close, window=WINDOW), loop_ema(close=close, window=WINDOW), loop_rsi(close=close, window=14),
+        loop_vwap(rows=rows, window=WINDOW), loop_bollinger_bands(close=close, window=WINDOW)
+    )
+
+
+def best_time_ms(function) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings) * 1000
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 3650
+    rows = build_rows(num_rows=num_rows)
+    specs = indicators.parse_indicators(values=[f'sma_{WINDOW},ema_{WINDOW},rsi_14,vwap_{WINDOW},bollinger_{WINDOW}'])
+    print(f'{num_rows} rows, sma/ema/vwap/bollinger over {WINDOW} rows, rsi over 14 rows')
+    loop_ms = best_time_ms(lambda: loop_indicators(rows=rows))
+    vectorized_ms = best_time_ms(lambda: indicators.add_indicators_to_rows(rows=rows, warmup_rows=[], specs=specs))
+    print(f'{"python loops":<28}{loop_ms:>10.2f} ms')
+    values = numpy.array([row[2:7] for row in rows], dtype=float)
+    kernels_ms = best_time_ms(lambda: indicators.compute_indicators(values=values, specs=specs))
+    print(f'{"add_indicators_to_rows":<28}{vectorized_ms:>10.2f} ms{loop_ms / vectorized_ms:>8.1f}x')
+    print(f'{"compute_indicators (arrays)":<28}{kernels_ms:>10.2f} ms{loop_ms / kernels_ms:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
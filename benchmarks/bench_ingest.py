@@ -0,0 +1,100 @@
+"""
+Compare loading daily candles of one ticker through the custom API as one JSON body (POST /historical/, parsed and
+validated as a whole by pydantic) against streaming them as NDJSON chunks of ETL_TRANSFORM_CHUNK_SIZE candles
+(POST /historical/ingest/, parsed, validated and committed in batches as the body arrives). The requests are sent
+in-process to the app with a fresh SQLite database each. Reports the time and the peak memory (tracemalloc) of the
+client and the API together.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_ingest.py [number of candles, default 500000]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+import numpy
+import pandas
+from fastapi.testclient import TestClient
+
+from app.api.config import API_TICKERS_ENDPOINT
+from app.api.db.database import Base, create_db_engine, create_session_factories, get_db
+from app.api.db.registry import ticker_registry
+from app.api.main import app
+from app.etl import load
+from app.etl.config import ETL_TRANSFORM_CHUNK_SIZE
+
+TICKER = 'BTC-USD'
+FIRST_DATE = date(1000, 1, 1)
+
+
+def generate_df(first: int, num_candles: int) -> pandas.DataFrame:
+    days = numpy.arange(first, first + num_candles)
+    open_ = 30000 + numpy.sin(days / 30.0) * 1000
+    close = open_ + numpy.cos(days / 3.0) * 100
+    return pandas.DataFrame({
+        'date': (numpy.datetime64(FIRST_DATE) + days).astype(str),
+        'low': numpy.minimum(open_, close) - 5,
+        'high': numpy.maximum(open_, close) + 5,
+        'open': open_,
+        'close': close,
+        'volume': numpy.abs(numpy.sin(days / 7.0)) * 100
+    })
+
+
+def create_client(directory: str) -> TestClient:
+    db_engine = create_db_engine(f'sqlite:///{os.path.join(directory, "bench.db")}')
+    Base.metadata.create_all(bind=db_engine)
+    session_factory, _ = create_session_factories(db_engine)
+
+    async def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    # The registry is process-wide, and every run has a database of its own
+    ticker_registry.reset()
+    client = TestClient(app)
+    client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': TICKER})
+    return client
+
+
+def run_json_body(client: TestClient, num_candles: int):
+    load.api_post_historical(ticker=TICKER, df=generate_df(first=0, num_candles=num_candles), session=client)
+
+
+def run_ingest_stream(client: TestClient, num_candles: int):
+    chunks = (
+        generate_df(first=first, num_candles=min(ETL_TRANSFORM_CHUNK_SIZE, num_candles - first))
+        for first in range(0, num_candles, ETL_TRANSFORM_CHUNK_SIZE)
+    )
+    totals = load.api_post_historical_stream(ticker=TICKER, chunks=chunks, session=client)
+    assert totals['inserted_records'] == num_candles
+
+
+def main():
+    num_candles = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    print(f'{num_candles} candles')
+    for name, function in [('json body', run_json_body), ('ingest stream', run_ingest_stream)]:
+        with tempfile.TemporaryDirectory() as directory:
+            client = create_client(directory=directory)
+            start = time.perf_counter()
+            function(client=client, num_candles=num_candles)
+            elapsed = time.perf_counter() - start
+        with tempfile.TemporaryDirectory() as directory:
+            client = create_client(directory=directory)
+            tracemalloc.start()
+            function(client=client, num_candles=num_candles)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        app.dependency_overrides.clear()
+        print(f'{name:>14}: {elapsed:7.2f} s, peak memory {peak / 2 ** 20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare many concurrent clients each posting a few daily candles with POST /historical/ (every request commits its
+own transaction before responding) against the same requests in background mode (POST /historical/?background=true,
+queued and written by the background writer in coalesced batches of up to HISTORICAL_JOB_BATCH_MAX_RECORDS candles).
+The requests are sent in-process to the app with a fresh SQLite database each. Reports the time until every candle is
+committed, the mean response time and the number of transactions of the background writer.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_jobs.py [number of requests, default 2000] [candles per request, default 10]
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from app.api import main
+from app.api.config import API_HISTORICAL_ENDPOINT, API_TICKERS_ENDPOINT, HISTORICAL_JOB_BATCH_LINGER, \
+    HISTORICAL_JOB_BATCH_MAX_RECORDS, HISTORICAL_JOB_MAX_FINISHED
+from app.api.db.database import Base, create_db_engine, create_session_factories, get_db
+from app.api.db.registry import ticker_registry
+from app.api.jobqueue import HistoricalJobQueue
+
+TICKER = 'BTC-USD'
+FIRST_DATE = date(1000, 1, 1)
+NUM_CLIENTS = 32
+
+
+def build_body(request: int, num_candles: int) -> dict:
+    first = request * num_candles
+    return {
+        'ticker_name': TICKER,
+        'candlestick_records': [
+            {
+                'date': (FIRST_DATE + timedelta(days=day)).isoformat(),
+                'low': 1.0, 'high': 3.0, 'open': 2.0, 'close': 2.5, 'volume': 10.0
+            }
+            for day in range(first, first + num_candles)
+        ]
+    }
+
+
+def run(directory: str, num_requests: int, num_candles: int, background: bool) -> tuple[float, float, dict]:
+    db_engine = create_db_engine(f'sqlite:///{os.path.join(directory, "bench.db")}')
+    Base.metadata.create_all(bind=db_engine)
+    session_factory, _ = create_session_factories(db_engine)
+
+    async def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[get_db] = override_get_db
+    ticker_registry.reset()
+    client = TestClient(main.app)
+    client.post(url=API_TICKERS_ENDPOINT, json={'ticker_name': TICKER})
+    bodies = [build_body(request=request, num_candles=num_candles) for request in range(num_requests)]
+    queue = HistoricalJobQueue(
+        session_factory=session_factory,
+        max_jobs=num_requests,
+        max_records=num_requests * num_candles,
+        max_batch_records=HISTORICAL_JOB_BATCH_MAX_RECORDS,
+        max_finished=HISTORICAL_JOB_MAX_FINISHED,
+        batch_linger=HISTORICAL_JOB_BATCH_LINGER
+    )
+
+    def post(body: dict) -> float:
+        start = time.perf_counter()
+        response = client.post(url=API_HISTORICAL_ENDPOINT, params={'background': background}, json=body)
+        assert response.status_code == (202 if background else 200), response.text
+        return time.perf_counter() - start
+
+    with mock.patch.object(main, 'historical_job_queue', queue):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=NUM_CLIENTS) as executor:
+            response_times = list(executor.map(post, bodies))
+        queue.join()
+        elapsed = time.perf_counter() - start
+    queue.close()
+    main.app.dependency_overrides.clear()
+    db_engine.dispose()
+    return elapsed, sum(response_times) / len(response_times), queue.stats()
+
+
+def main_():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    num_candles = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(f'{num_requests} requests of {num_candles} candles, {NUM_CLIENTS} clients')
+    for name, background in [('synchronous', False), ('background', True)]:
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed, mean_response_time, stats = run(
+                directory=directory, num_requests=num_requests, num_candles=num_candles, background=background
+            )
+        transactions = stats['batches'] if background else num_requests
+        print(
+            f'{name:>12}: {elapsed:7.2f} s, {num_requests * num_candles / elapsed:9.0f} candles/s, mean response '
+            f'{mean_response_time * 1000:7.1f} ms, {transactions} transactions'
+        )
+
+
+if __name__ == '__main__':
+    main_()
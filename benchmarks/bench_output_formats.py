@@ -0,0 +1,55 @@
+"""
+Compare the payload size and the encode/decode time of the GET /historical/ output formats (json, csv, arrow, parquet):
+encoding as done by the API, decoding into a pandas.DataFrame as done by the ETL client helper.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_output_formats.py [number of rows, default 1M]
+"""
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy
+
+from app.api import apiutils
+from app.api.db.models import HistoricalData
+from app.api.schemas import GetHistoricalDataOutputType
+from app.etl import load
+
+
+def build_df(num_rows: int):
+    rng = numpy.random.default_rng(seed=0)
+    close = 30000 + rng.standard_normal(num_rows).cumsum()
+    first_date = date(1, 1, 1)
+    rows = zip(
+        ((first_date + timedelta(days=day)).isoformat() for day in range(num_rows)),
+        [1] * num_rows,
+        (close - 10).tolist(),
+        (close + 10).tolist(),
+        (close - 1).tolist(),
+        close.tolist(),
+        rng.uniform(1000, 5000, num_rows).tolist()
+    )
+    df = apiutils.process_historical_records_to_df(historical_data=rows)
+    apiutils.add_pct_change(df=df, column_name=HistoricalData.close.name)
+    return df
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    df = build_df(num_rows=num_rows)
+    print(f'{num_rows} rows')
+    print(f'{"format":<10}{"size (MB)":>12}{"encode (ms)":>14}{"decode (ms)":>14}')
+    for data_format in GetHistoricalDataOutputType:
+        encode_start = time.perf_counter()
+        body = apiutils.build_historical_response(df=df, data_format=data_format).body
+        encode_ms = (time.perf_counter() - encode_start) * 1000
+
+        decode_start = time.perf_counter()
+        load.decode_historical_data(content=body, data_format=data_format.value)
+        decode_ms = (time.perf_counter() - decode_start) * 1000
+        print(f'{data_format.value:<10}{len(body) / 1e6:>12.2f}{encode_ms:>14.1f}{decode_ms:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
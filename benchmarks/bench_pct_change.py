@@ -0,0 +1,90 @@
+"""
+Compare the two ways GET /historical/ computes the % change column, end to end from the database to the encoded json
+body: pandas (rows -> DataFrame -> pct_change) against the LAG window function in SQL (rows encoded directly).
+Reports the best latency and the peak Python memory (tracemalloc) of each path.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_pct_change.py [comma separated numbers of rows, default 1000,100000,1000000]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from app.api import apiutils
+from app.api.db import crud
+from app.api.db.database import Base, create_db_engine, create_session_factories
+from app.api.db.models import HistoricalData
+from app.api.schemas import GetHistoricalDataOutputType
+
+REPEATS = 3
+FIRST_DATE = date(1, 1, 1)
+
+
+def populate(db_engine, num_rows: int):
+    connection = db_engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.execute('INSERT INTO tickers (id, ticker) VALUES (1, ?)', ('BTC-USD',))
+    cursor.executemany(
+        'INSERT INTO historical (date, ticker_id, low, high, open, close, volume) VALUES (?, 1, ?, ?, ?, ?, ?)',
+        (
+            ((FIRST_DATE + timedelta(days=day)).isoformat(), 1.0 + day, 3.0 + day, 2.0 + day, 2.5 + day, 100.0)
+            for day in range(num_rows)
+        )
+    )
+    connection.commit()
+    connection.close()
+
+
+def pandas_path(db, end: date) -> bytes:
+    rows = crud.retrieve_historical_by_date_range_and_ticker_id(db=db, start=FIRST_DATE, end=end, ticker_id=1)
+    df = apiutils.process_historical_records_to_df(historical_data=rows)
+    apiutils.add_pct_change(df=df, column_name=HistoricalData.close.name)
+    return apiutils.build_historical_response(df=df, data_format=GetHistoricalDataOutputType.json_format).body
+
+
+def sql_path(db, end: date) -> bytes:
+    rows = crud.retrieve_historical_with_pct_change_by_date_range_and_ticker_id(
+        db=db, start=FIRST_DATE, end=end, ticker_id=1
+    )
+    return apiutils.build_historical_rows_response(rows=rows, data_format=GetHistoricalDataOutputType.json_format).body
+
+
+def measure(path, db, end: date) -> tuple[float, float]:
+    timings = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        path(db, end)
+        timings.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    path(db, end)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings) * 1000, peak / 1e6
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1000, 100_000, 1_000_000]
+    print(f'{"rows":>10}{"pandas (ms)":>14}{"pandas (MB)":>14}{"sql (ms)":>12}{"sql (MB)":>12}')
+    for num_rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_engine = create_db_engine(f'sqlite:///{os.path.join(tmp_dir, "bench.db")}')
+            Base.metadata.create_all(bind=db_engine)
+            populate(db_engine=db_engine, num_rows=num_rows)
+            session_factory, _ = create_session_factories(db_engine)
+            db = session_factory()
+            end = FIRST_DATE + timedelta(days=num_rows)
+            try:
+                pandas_ms, pandas_mb = measure(pandas_path, db, end)
+                sql_ms, sql_mb = measure(sql_path, db, end)
+            finally:
+                db.close()
+                db_engine.dispose()
+        print(f'{num_rows:>10}{pandas_ms:>14.1f}{pandas_mb:>14.1f}{sql_ms:>12.1f}{sql_mb:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Time the historical data range read used by GET /historical/ on a large table: the previous ORM path (full
+HistoricalData objects re-encoded with jsonable_encoder, unordered) against the column-only path ordered by date
+through the (ticker_id, date) index.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_range_query.py [number of rows, default 10M]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import pandas
+from fastapi.encoders import jsonable_encoder
+
+from app.api import apiutils
+from app.api.db import crud
+from app.api.db.database import Base, create_db_engine, create_session_factories
+from app.api.db.models import HistoricalData
+
+NUM_DAYS = 10000
+RANGES_IN_DAYS = [30, 365, 3650]
+REPEATS = 5
+FIRST_DATE = date(1995, 1, 1)
+
+
+def populate(db_engine, num_rows: int):
+    num_tickers = max(num_rows // NUM_DAYS, 1)
+    dates = [(FIRST_DATE + timedelta(days=day)).isoformat() for day in range(NUM_DAYS)]
+    connection = db_engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.executemany('INSERT INTO tickers (id, ticker) VALUES (?, ?)', [(i, f'T{i}') for i in range(num_tickers)])
+    for ticker_id in range(num_tickers):
+        cursor.executemany(
+            'INSERT INTO historical (date, ticker_id, low, high, open, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(day, ticker_id, 1.0 + i, 3.0 + i, 2.0 + i, 2.5 + i, 100.0 + i) for i, day in enumerate(dates)]
+        )
+    connection.commit()
+    connection.close()
+    return num_tickers
+
+
+def orm_read(db, start: date, end: date, ticker_id: int) -> pandas.DataFrame:
+    historical_data = db.query(HistoricalData).filter(HistoricalData.date >= start). \
+        filter(HistoricalData.date <= end). \
+        filter(HistoricalData.ticker_id == ticker_id)
+    records = [jsonable_encoder(record) for record in historical_data]
+    return pandas.DataFrame.from_records(data=records, columns=apiutils.HISTORICAL_DATA_COLUMN_NAMES)
+
+
+def column_read(db, start: date, end: date, ticker_id: int) -> pandas.DataFrame:
+    rows = crud.retrieve_historical_by_date_range_and_ticker_id(db=db, start=start, end=end, ticker_id=ticker_id)
+    return apiutils.process_historical_records_to_df(historical_data=rows)
+
+
+def best_time(read, db, start: date, end: date, ticker_id: int) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        db.expunge_all()
+        timing_start = time.perf_counter()
+        read(db, start, end, ticker_id)
+        timings.append(time.perf_counter() - timing_start)
+    return min(timings) * 1000
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_engine = create_db_engine(f'sqlite:///{os.path.join(tmp_dir, "bench.db")}')
+        Base.metadata.create_all(bind=db_engine)
+        populate_start = time.perf_counter()
+        num_tickers = populate(db_engine=db_engine, num_rows=num_rows)
+        print(f'Populated {num_tickers * NUM_DAYS} rows in {time.perf_counter() - populate_start:.1f}s')
+
+        session_factory, _ = create_session_factories(db_engine)
+        db = session_factory()
+        ticker_id = num_tickers // 2
+        print(f'{"days":>6}{"orm (ms)":>12}{"columns (ms)":>14}')
+        for range_in_days in RANGES_IN_DAYS:
+            start = FIRST_DATE + timedelta(days=1000)
+            end = start + timedelta(days=range_in_days - 1)
+            orm_ms = best_time(orm_read, db, start, end, ticker_id)
+            column_ms = best_time(column_read, db, start, end, ticker_id)
+            print(f'{range_in_days:>6}{orm_ms:>12.2f}{column_ms:>14.2f}')
+        db.close()
+        db_engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Compare answering the aggregates of a date range (total volume, min low, max high, average close, % change) by reading
+the rows of the range from the database, with SQL aggregate functions, and from the in-memory range statistics index,
+for ranges of increasing length. Also reports the time to build the index and to extend it with one candlestick.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_rangestats.py [number of days, default 3650]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import Float, func, select
+
+from app.api.db import crud
+from app.api.db.database import Base, create_db_engine, create_session_factories
+from app.api.db.models import HistoricalData
+from app.api.rangestats import HistoricalRangeStats
+
+REPEATS = 20
+FIRST_DATE = date(2000, 1, 3)
+
+
+def populate(db_engine, num_days: int):
+    connection = db_engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.execute('INSERT INTO tickers (id, ticker) VALUES (1, ?)', ('BTC-USD',))
+    cursor.executemany(
+        'INSERT INTO historical (date, ticker_id, low, high, open, close, volume) VALUES (?, 1, ?, ?, ?, ?, ?)',
+        (
+            ((FIRST_DATE + timedelta(days=day)).isoformat(), 1.0 + day % 97, 3.0 + day % 89, 2.0, 2.5 + day % 7, 100.0)
+            for day in range(num_days)
+        )
+    )
+    connection.commit()
+    connection.close()
+
+
+def aggregate_rows(rows: list) -> tuple:
+    return (
+        sum(row.volume for row in rows), min(row.low for row in rows), max(row.high for row in rows),
+        sum(row.close for row in rows) / len(rows), (rows[-1].close / rows[0].open - 1) * 100
+    )
+
+
+def best_time_ms(function) -> float:
+    timings = []
+    for _ in range(REPEATS):
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings) * 1000
+
+
+def main():
+    num_days = int(sys.argv[1]) if len(sys.argv) > 1 else 3650
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_engine = create_db_engine(f'sqlite:///{os.path.join(tmp_dir, "bench.db")}')
+        Base.metadata.create_all(bind=db_engine)
+        populate(db_engine=db_engine, num_days=num_days)
+        session_factory, _ = create_session_factories(db_engine)
+        db = session_factory()
+
+        all_rows = crud.retrieve_historical_by_date_range_and_ticker_id(
+            db=db, start=date.min, end=date.max, ticker_id=1
+        )
+        build_ms = best_time_ms(lambda: HistoricalRangeStats(rows=all_rows))
+        stats = HistoricalRangeStats(rows=all_rows[:-1])
+        extend_ms = best_time_ms(lambda: stats.extend(rows=all_rows[-1:]))
+        stats = HistoricalRangeStats(rows=all_rows)
+        print(f'{num_days} days: index built in {build_ms:.2f} ms, extended by one candlestick in {extend_ms:.3f} ms')
+        print(f'{"range (days)":<14}{"rows (ms)":>12}{"SQL aggregates (ms)":>22}{"index (ms)":>12}')
+
+        for range_days in (30, 365, num_days):
+            start = FIRST_DATE + timedelta(days=num_days - range_days)
+            end = FIRST_DATE + timedelta(days=num_days - 1)
+            aggregate_statement = select(
+                func.sum(HistoricalData.volume, type_=Float), func.min(HistoricalData.low, type_=Float),
+                func.max(HistoricalData.high, type_=Float), func.avg(HistoricalData.close, type_=Float)
+            ).where(HistoricalData.ticker_id == 1, HistoricalData.date >= start, HistoricalData.date <= end)
+            rows_ms = best_time_ms(lambda: aggregate_rows(rows=crud.retrieve_historical_by_date_range_and_ticker_id(
+                db=db, start=start, end=end, ticker_id=1
+            )))
+            sql_ms = best_time_ms(lambda: db.execute(aggregate_statement).one())
+            index_ms = best_time_ms(lambda: stats.query(start=start, end=end))
+            print(f'{range_days:<14}{rows_ms:>12.2f}{sql_ms:>22.2f}{index_ms:>12.3f}')
+        db.close()
+        db_engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare the transform stage of the ETL before and after vectorization, on minute candles: the per-row
+date.fromtimestamp lambda followed by a full sort of the whole pandas.DataFrame, against transform_coinbase_data
+(vectorized UTC conversion, deduplication, OHLC validation, sort only if needed) over the whole pandas.DataFrame and
+over chunks of ETL_TRANSFORM_CHUNK_SIZE candles. Reports the time and the peak memory (tracemalloc) of each.
+
+Usage (from the root of the project, with PYTHONPATH set to it):
+    python3 benchmarks/bench_transform.py [number of candles, default 10000000]
+"""
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+import numpy
+import pandas
+
+from app.etl import transform
+from app.etl.config import ETL_TRANSFORM_CHUNK_SIZE
+
+FIRST_TIMESTAMP = 1609459200
+
+
+def generate_df(first: int, num_candles: int) -> pandas.DataFrame:
+    timestamps = FIRST_TIMESTAMP + 60 * numpy.arange(first, first + num_candles, dtype=numpy.int64)
+    open_ = 30000 + numpy.sin(timestamps / 3600.0) * 1000
+    close = open_ + numpy.cos(timestamps / 60.0) * 10
+    return pandas.DataFrame({
+        'date': timestamps,
+        'low': numpy.minimum(open_, close) - 5,
+        'high': numpy.maximum(open_, close) + 5,
+        'open': open_,
+        'close': close,
+        'volume': numpy.abs(numpy.sin(timestamps / 7.0)) * 100
+    })
+
+
+def transform_per_row(historical_df: pandas.DataFrame):
+    # The transform before vectorization
+    historical_df['date'] = historical_df['date'].map(lambda x: date.fromtimestamp(x).isoformat())
+    historical_df.sort_values(by='date', inplace=True, ignore_index=True)
+
+
+def run_per_row(num_candles: int) -> int:
+    historical_df = generate_df(first=0, num_candles=num_candles)
+    transform_per_row(historical_df=historical_df)
+    return len(historical_df)
+
+
+def run_vectorized(num_candles: int) -> int:
+    historical_df = generate_df(first=0, num_candles=num_candles)
+    transform.transform_coinbase_data(historical_df=historical_df, granularity=60)
+    return len(historical_df)
+
+
+def run_chunked(num_candles: int) -> int:
+    chunks = (
+        generate_df(first=first, num_candles=min(ETL_TRANSFORM_CHUNK_SIZE, num_candles - first))
+        for first in range(0, num_candles, ETL_TRANSFORM_CHUNK_SIZE)
+    )
+    return sum(len(chunk) for chunk in transform.transform_coinbase_chunks(chunks=chunks, granularity=60))
+
+
+def main():
+    num_candles = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    print(f'{num_candles} candles')
+    for name, function in [('per row', run_per_row), ('vectorized', run_vectorized), ('chunked', run_chunked)]:
+        start = time.perf_counter()
+        assert function(num_candles=num_candles) == num_candles
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        function(num_candles=num_candles)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{name:>12}: {elapsed:7.2f} s, peak memory {peak / 2 ** 20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()